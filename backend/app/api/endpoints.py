@@ -1,5 +1,7 @@
 
-from fastapi import APIRouter, Depends, HTTPException, Body, Request
+from fastapi import APIRouter, Depends, HTTPException, Body, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 import logging
 import smtplib
 from email.message import EmailMessage
@@ -11,15 +13,32 @@ from app.schemas.agent import AgentRequest, AgentResponse, AnalyzeSceneRequest
 from app.services.agent_service import agent_service
 from app.services.billing_service import billing_service
 from app.services.llm_service import llm_service
+from app.services.llm_response_cache import llm_response_cache
+from app.services.singleflight import llm_singleflight, image_singleflight
+from app.services.token_estimator import token_estimator
 from app.services.payment_service import payment_service
 from app.db.init_db import check_and_migrate_tables  # EMERGENCY FIX IMPORT
 import os
 
 
 from app.services.media_service import MediaGenerationService
+from app.services.http_transport import http_transport
+from app.services.task_poller import task_poller
+from app.services.provider_health import provider_health
+from app.services.ref_image_cache import ref_image_cache
+from app.services.media_store import media_store, MediaTooLarge
+from app.services.generation_cache import generation_cache
+from app.services.image_preprocess import image_preprocessor
+from app.services.outbound_governor import outbound_governor
+from app.services.settings_cache import settings_resolution_cache
+from app.services.image_job_store import image_job_store
+from app.services.generation_resume import generation_resumer
+from app.services.task_callbacks import task_callbacks
+from app.services.job_queue import job_queue, FINISHED_STATUSES
+from app.services.progress_bus import progress_bus
 from app.services.video_service import create_montage
 from app.api.deps import get_current_user  # Import dependency
-from typing import List, Optional, Dict, Any, Union, Tuple
+from typing import List, Optional, Dict, Any, Union, Tuple, Callable
 from pydantic import BaseModel
 import bcrypt
 import re
@@ -41,7 +60,6 @@ import time
 import html
 from pathlib import Path
 from collections import deque
-import threading
 import asyncio
 
 # Import limiter from main app state or create a local reference if needed
@@ -67,71 +85,6 @@ router = APIRouter()
 media_service = MediaGenerationService()
 logger = logging.getLogger("api_logger")
 
-IMAGE_JOB_STORE: Dict[str, Dict[str, Any]] = {}
-IMAGE_JOB_LOCK = threading.Lock()
-IMAGE_JOB_TTL_SECONDS = max(300, int(os.getenv("IMAGE_JOB_TTL_SECONDS", "3600")))
-IMAGE_JOB_MAX_ITEMS = max(100, int(os.getenv("IMAGE_JOB_MAX_ITEMS", "500")))
-IMAGE_SUBMIT_IDEMPOTENCY_STORE: Dict[str, Dict[str, Any]] = {}
-IMAGE_SUBMIT_IDEMPOTENCY_TTL_SECONDS = max(30, int(os.getenv("IMAGE_SUBMIT_IDEMPOTENCY_TTL_SECONDS", "120")))
-IMAGE_JOB_FILE_DIR = os.path.join(settings.UPLOAD_DIR, "_image_jobs")
-
-
-def _image_job_file_path(job_id: str) -> str:
-    safe_job_id = re.sub(r"[^a-zA-Z0-9_-]", "", str(job_id or "").strip())
-    return os.path.join(IMAGE_JOB_FILE_DIR, f"{safe_job_id}.json")
-
-
-def _write_image_job_file(job_id: str, payload: Dict[str, Any]) -> None:
-    try:
-        os.makedirs(IMAGE_JOB_FILE_DIR, exist_ok=True)
-        path = _image_job_file_path(job_id)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False)
-    except Exception as e:
-        logger.warning("failed to persist image job file job_id=%s err=%s", job_id, e)
-
-
-def _read_image_job_file(job_id: str) -> Optional[Dict[str, Any]]:
-    try:
-        path = _image_job_file_path(job_id)
-        if not os.path.exists(path):
-            return None
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, dict):
-            data["job_id"] = data.get("job_id") or str(job_id)
-            return data
-    except Exception as e:
-        logger.warning("failed to read image job file job_id=%s err=%s", job_id, e)
-    return None
-
-
-def _build_image_idempotency_store_key(user_id: int, idempotency_key: str) -> str:
-    return f"{int(user_id)}::{idempotency_key.strip()}"
-
-
-def _prune_image_submit_idempotency_locked(now: Optional[datetime] = None) -> None:
-    now_dt = now or datetime.utcnow()
-    expired_keys: List[str] = []
-
-    for store_key, record in IMAGE_SUBMIT_IDEMPOTENCY_STORE.items():
-        created_at = _parse_iso_datetime(record.get("created_at"))
-        if not created_at:
-            expired_keys.append(store_key)
-            continue
-
-        if (now_dt - created_at).total_seconds() > IMAGE_SUBMIT_IDEMPOTENCY_TTL_SECONDS:
-            expired_keys.append(store_key)
-            continue
-
-        job_id = str(record.get("job_id") or "").strip()
-        if not job_id or job_id not in IMAGE_JOB_STORE:
-            expired_keys.append(store_key)
-
-    for store_key in expired_keys:
-        IMAGE_SUBMIT_IDEMPOTENCY_STORE.pop(store_key, None)
-
-
 def _is_shot_submit_debug_enabled() -> bool:
     return str(os.getenv("SHOT_SUBMIT_DEBUG", "0")).strip().lower() in {"1", "true", "yes", "on"}
 
@@ -173,24 +126,6 @@ def _log_shot_submit_debug(kind: str, req: Any, refs: Any = None, extra: Optiona
         logger.warning("[ShotSubmitDebug] failed to log payload: %s", exc)
 
 
-def _parse_iso_datetime(value: Any) -> Optional[datetime]:
-    raw = str(value or "").strip()
-    if not raw:
-        return None
-    try:
-        return datetime.fromisoformat(raw)
-    except Exception:
-        return None
-
-
-def _job_sort_key(item: Dict[str, Any]) -> datetime:
-    for field in ("created_at", "started_at", "finished_at"):
-        parsed = _parse_iso_datetime(item.get(field))
-        if parsed:
-            return parsed
-    return datetime.utcnow()
-
-
 def _compact_job_result(result: Any) -> Any:
     if not isinstance(result, dict):
         return result
@@ -212,71 +147,6 @@ def _compact_job_result(result: Any) -> Any:
     return compact or {"url": result.get("url")}
 
 
-def _prune_image_jobs_locked() -> None:
-    now = datetime.utcnow()
-    expired_ids = []
-
-    for job_id, job in IMAGE_JOB_STORE.items():
-        status = str(job.get("status") or "").lower()
-        if status not in {"succeeded", "failed", "canceled", "cancelled", "error"}:
-            continue
-
-        finished_at = _parse_iso_datetime(job.get("finished_at")) or _job_sort_key(job)
-        age_seconds = (now - finished_at).total_seconds()
-        if age_seconds > IMAGE_JOB_TTL_SECONDS:
-            expired_ids.append(job_id)
-
-    for job_id in expired_ids:
-        IMAGE_JOB_STORE.pop(job_id, None)
-
-    if len(IMAGE_JOB_STORE) <= IMAGE_JOB_MAX_ITEMS:
-        return
-
-    ordered = sorted(IMAGE_JOB_STORE.items(), key=lambda pair: _job_sort_key(pair[1]))
-    overflow_count = len(IMAGE_JOB_STORE) - IMAGE_JOB_MAX_ITEMS
-    for job_id, _ in ordered[:overflow_count]:
-        IMAGE_JOB_STORE.pop(job_id, None)
-
-    _prune_image_submit_idempotency_locked(now)
-
-
-def _snapshot_image_job_stats() -> Dict[str, Any]:
-    with IMAGE_JOB_LOCK:
-        _prune_image_jobs_locked()
-        jobs = list(IMAGE_JOB_STORE.values())
-
-    status_counts: Dict[str, int] = {}
-    created_times: List[datetime] = []
-    approx_bytes = 0
-
-    for job in jobs:
-        status = str(job.get("status") or "unknown").lower()
-        status_counts[status] = status_counts.get(status, 0) + 1
-
-        created_at = _parse_iso_datetime(job.get("created_at"))
-        if created_at:
-            created_times.append(created_at)
-
-        try:
-            approx_bytes += len(json.dumps(job, ensure_ascii=False, default=str))
-        except Exception:
-            approx_bytes += 0
-
-    oldest_created_at = min(created_times).isoformat() if created_times else None
-    newest_created_at = max(created_times).isoformat() if created_times else None
-
-    return {
-        "store_items": len(jobs),
-        "status_counts": status_counts,
-        "oldest_created_at": oldest_created_at,
-        "newest_created_at": newest_created_at,
-        "approx_store_bytes": approx_bytes,
-        "approx_store_mb": round(approx_bytes / (1024 * 1024), 3),
-        "ttl_seconds": IMAGE_JOB_TTL_SECONDS,
-        "max_items": IMAGE_JOB_MAX_ITEMS,
-    }
-
-
 def _vendor_failed_message(provider: Optional[str], reason: Any) -> str:
     vendor = str(provider or "").strip() or "unknown"
     detail = str(reason or "unknown error").strip()
@@ -531,6 +401,76 @@ async def get_prompt_content(filename: str, current_user: User = Depends(get_cur
     with open(prompt_path, "r", encoding="utf-8") as f:
         return {"content": f.read()}
 
+# --- Streaming (SSE) ---
+_SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def _sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _stream_llm_endpoint(request: Request, run, response_model=None) -> StreamingResponse:
+    """Runs an LLM-backed endpoint body with provider streaming on and relays it as SSE.
+
+    Events: ``start`` (one per LLM call; retries and continuations start again), ``delta``
+    (``{"text"}``), ``end`` (``finish_reason``/``usage``), then exactly one ``result`` with
+    the same payload the non-streaming route returns, or ``error`` (``status_code``/``detail``).
+    The deltas are a preview; ``result`` is authoritative. ``run(db)`` gets its own session,
+    since the request-scoped one may be closed before the stream finishes.
+    """
+    async def _events():
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def _body():
+            db = SessionLocal()
+            try:
+                with llm_service.stream_to(queue.put_nowait):
+                    result = await run(db)
+                if response_model is not None:
+                    result = response_model.model_validate(result)
+                return jsonable_encoder(result)
+            finally:
+                db.close()
+
+        def _relay(item: Dict[str, Any]) -> str:
+            item = dict(item)
+            return _sse_event(item.pop("type", "delta"), item)
+
+        task = asyncio.create_task(_body())
+        try:
+            while True:
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait({getter, task}, timeout=_SSE_KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield _relay(getter.result())
+                    continue
+                getter.cancel()
+                if task in done:
+                    while not queue.empty():
+                        yield _relay(queue.get_nowait())
+                    try:
+                        yield _sse_event("result", task.result())
+                    except HTTPException as e:
+                        yield _sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+                    except Exception as e:
+                        logger.exception("streamed endpoint failed")
+                        yield _sse_event("error", {"status_code": 500, "detail": str(e)})
+                    return
+                if await request.is_disconnected():
+                    logger.info("SSE client disconnected; cancelling generation")
+                    return
+                yield ": keepalive\n\n"
+        finally:
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/analyze_scene", response_model=Dict[str, Any])
 async def analyze_scene(request: AnalyzeSceneRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)): # user auth optional depending on reqs, kept for safety
     """
@@ -935,7 +875,9 @@ async def analyze_scene(request: AnalyzeSceneRequest, current_user: User = Depen
         model = (config or {}).get("model")
         reservation_tx = None
         if billing_service.is_token_pricing(db, "analysis", provider, model):
-            est = billing_service.estimate_input_output_tokens_from_messages(messages, output_ratio=1.5)
+            est = billing_service.estimate_input_output_tokens_from_messages(
+                messages, output_ratio=1.5, provider=provider, model=model, task_type="analysis", item="scene_analysis",
+            )
             debug_meta.update({
                 "est_input_tokens": est.get("input_tokens", 0),
                 "est_output_tokens": est.get("output_tokens", 0),
@@ -943,8 +885,8 @@ async def analyze_scene(request: AnalyzeSceneRequest, current_user: User = Depen
             })
             reserve_details = {
                 "item": "scene_analysis",
-                "estimation_method": "prompt_tokens_ratio",
-                "estimated_output_ratio": 1.5,
+                "estimation_method": est.get("estimation_method"),
+                "estimated_output_ratio": est.get("output_ratio"),
                 "system_prompt_len": len(system_instruction or ""),
                 "user_prompt_len": len(user_content or ""),
                 "input_tokens": est.get("input_tokens", 0),
@@ -1237,6 +1179,17 @@ async def analyze_scene(request: AnalyzeSceneRequest, current_user: User = Depen
              pass # Fail safe
         raise HTTPException(status_code=500, detail=prefixed_detail)
 
+@router.post("/analyze_scene/stream")
+async def analyze_scene_stream(request: AnalyzeSceneRequest, http_request: Request, current_user: User = Depends(get_current_user)):
+    """SSE variant of ``analyze_scene``: streams tokens, then the analysis dict as ``result``."""
+    user_id = current_user.id
+
+    async def _run(db: Session):
+        user = db.query(User).filter(User.id == user_id).first()
+        return await analyze_scene(request, current_user=user, db=db)
+
+    return _stream_llm_endpoint(http_request, _run)
+
 # --- Tools ---
 class TranslateRequest(BaseModel):
     q: str
@@ -1304,7 +1257,11 @@ async def translate_text(
         if billing_service.is_token_pricing(db, "llm_chat", provider, model):
             est = billing_service.estimate_input_output_tokens_from_messages(
                 [{"role": "user", "content": text}],
-                output_ratio=1.0
+                output_ratio=1.0,
+                provider=provider,
+                model=model,
+                task_type="llm_chat",
+                item="translate",
             )
             reserve_details = {
                 "item": "translate",
@@ -1312,8 +1269,8 @@ async def translate_text(
                 "from_lang": from_lang,
                 "to_lang": to_lang,
                 "chars": len(text),
-                "estimation_method": "prompt_tokens_ratio",
-                "estimated_output_ratio": 1.0,
+                "estimation_method": est.get("estimation_method"),
+                "estimated_output_ratio": est.get("output_ratio"),
                 "input_tokens": est.get("input_tokens", 0),
                 "output_tokens": est.get("output_tokens", 0),
                 "total_tokens": est.get("total_tokens", 0),
@@ -1354,7 +1311,10 @@ async def translate_text(
     )
     
     try:
-        llm_resp = await llm_service.generate_content(user_prompt, system_prompt, llm_config)
+        llm_resp = await llm_service.generate_content(
+            user_prompt, system_prompt, llm_config, cache_ttl=settings.LLM_RESPONSE_CACHE_TTL_SECONDS,
+            user_id=current_user.id,
+        )
         dst = llm_service.sanitize_text_output(str(llm_resp.get("content") or "").strip())
         usage = llm_resp.get("usage") or {}
 
@@ -1364,6 +1324,16 @@ async def translate_text(
         if not dst:
             raise HTTPException(status_code=502, detail=f"Translation returned empty result (request_id={request_id})")
 
+        if llm_resp.get("cached") or llm_resp.get("coalesced"):
+            # Served from the response cache or an identical in-flight call: nothing new to charge.
+            reuse = "cache" if llm_resp.get("cached") else "coalesced"
+            if reservation_tx:
+                billing_service.cancel_reservation(db, reservation_tx.id, f"served from LLM response {reuse}")
+            logger.info(
+                f"[translate:{request_id}] {reuse} hit user_id={current_user.id} from={from_lang} to={to_lang} chars={len(text)} translated_chars={len(dst)}"
+            )
+            return {"translated_text": dst, "request_id": request_id, "cached": True}
+
         if not usage:
             usage = billing_service.estimate_input_output_tokens_from_messages(
                 [
@@ -1372,6 +1342,8 @@ async def translate_text(
                     {"role": "assistant", "content": dst},
                 ],
                 output_ratio=1.0,
+                provider=provider,
+                model=model,
             )
 
         prompt_tokens = int(usage.get("prompt_tokens", usage.get("input_tokens", 0)) or 0)
@@ -1502,6 +1474,8 @@ class RefinePromptRequest(BaseModel):
     original_prompt: str
     instruction: str
     type: str = "image"
+    # Ask for a fresh sample instead of a recently cached refinement.
+    bypass_cache: Optional[bool] = False
 
 @router.post("/tools/refine_prompt")
 async def refine_prompt(
@@ -1514,15 +1488,9 @@ async def refine_prompt(
     if not config or not config.get("api_key"):
         raise HTTPException(status_code=400, detail="Active LLM Settings not found. Please configure and activate an LLM provider.")
         
-    api_key = config.get("api_key")
-    base_url = config.get("base_url")
     model = config.get("model")
-    
-    # Auto-adjust URL to Chat Completions
-    url = base_url
-    if not url.endswith("/chat/completions"):
-        if url.endswith("/"): url += "chat/completions"
-        elif "chat/completions" not in url: url += "/chat/completions"
+    # Creative rewrite: sampled at 0.7, and interactive, so give up after 60s.
+    config = {**config, "config": {**(config.get("config") or {}), "temperature": 0.7, "__read_timeout": 60}}
 
     # 2. Build Prompt
     sys_prompt = "You are an expert storyboard artist."
@@ -1535,30 +1503,18 @@ async def refine_prompt(
     
     user_content = f"Original Prompt: {req.original_prompt}\nModification Request: {req.instruction}\nRefined Prompt:"
     
-    # 3. Call LLM
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": user_content}
-        ],
-        "temperature": 0.7
-    }
-    
+    # 3. Call LLM (a repeat of the same refinement within a few minutes reuses the reply
+    # unless the caller asks for a new one)
+    cache_ttl = None if req.bypass_cache else (settings.REFINE_PROMPT_CACHE_TTL_SECONDS or None)
     try:
-        def _post():
-            return requests.post(url, json=payload, headers=headers, timeout=60)
-        
-        response = await asyncio.to_thread(_post)
-        if response.status_code != 200:
-             raise HTTPException(status_code=500, detail=f"LLM Error {response.status_code}: {response.text}")
-             
-        data = response.json()
-        content = data["choices"][0]["message"]["content"].strip()
+        llm_resp = await llm_service.generate_content(
+            user_content, sys_prompt, config, cache_ttl=cache_ttl,
+            user_id=current_user.id,
+        )
+        content = str(llm_resp.get("content") or "").strip()
+        if content.lower().startswith("error:"):
+             raise HTTPException(status_code=500, detail=f"LLM Error: {content[:300]}")
+
         content = llm_service.sanitize_text_output(content)
         # Clean quotes/markdown if any
         if content.startswith('"') and content.endswith('"'):
@@ -1610,11 +1566,13 @@ async def process_agent_command(
             messages_est.append({"role": msg.get("role", "user"), "content": msg.get("content", "")})
         messages_est.append({"role": "user", "content": request.query})
 
-        est = billing_service.estimate_input_output_tokens_from_messages(messages_est, output_ratio=1.5)
+        est = billing_service.estimate_input_output_tokens_from_messages(
+            messages_est, output_ratio=1.5, provider=provider, model=model, task_type="llm_chat", item="agent_intent",
+        )
         reserve_details = {
             "item": "agent_intent",
-            "estimation_method": "prompt_tokens_ratio",
-            "estimated_output_ratio": 1.5,
+            "estimation_method": est.get("estimation_method"),
+            "estimated_output_ratio": est.get("output_ratio"),
             "query_len": len(request.query or ""),
             "input_tokens": est.get("input_tokens", 0),
             "output_tokens": est.get("output_tokens", 0),
@@ -1947,6 +1905,8 @@ async def generate_markdown_with_retry(
     llm_config: Optional[Dict[str, Any]],
     strict_markdown: bool = True,
     require_h1: bool = True,
+    user_id: Optional[int] = None,
+    project_id: Optional[int] = None,
 ) -> str:
     def _is_prohibited_marker(text: str) -> bool:
         if not text:
@@ -1968,7 +1928,7 @@ async def generate_markdown_with_retry(
         )
 
     async def _call_once(tag: str, up: str, sp: str) -> Tuple[str, str, Dict[str, Any]]:
-        resp = await llm_service.generate_content(up, sp, llm_config)
+        resp = await llm_service.generate_content(up, sp, llm_config, user_id=user_id, project_id=project_id)
         raw = str(resp.get("content") or "")
         cleaned = sanitize_llm_markdown_output(raw)
         finish_reason = str(resp.get("finish_reason") or "")
@@ -2274,6 +2234,8 @@ async def generate_project_story_dna_global(
         llm_config=llm_config,
         strict_markdown=(req.strict_markdown is not False),
         require_h1=True,
+        user_id=current_user.id,
+        project_id=project.id,
     )
     if not generated_md:
         raise HTTPException(status_code=500, detail="LLM returned empty content")
@@ -2315,6 +2277,24 @@ async def generate_project_story_dna_global(
     return project
 
 
+@router.post("/projects/{project_id}/story_generator/global/stream")
+async def generate_project_story_dna_global_stream(
+    project_id: int,
+    req: "StoryGeneratorRequest",
+    request: Request,
+    current_user: User = Depends(get_current_user),
+):
+    """SSE variant of ``generate_project_story_dna_global``: streams tokens, then the project as ``result``."""
+    user_id = current_user.id
+
+    async def _run(db: Session):
+        user = db.query(User).filter(User.id == user_id).first()
+        return await generate_project_story_dna_global(project_id, req, db=db, current_user=user)
+
+    return _stream_llm_endpoint(request, _run, ProjectOut)
+
+
+
 @router.put("/projects/{project_id}/story_generator/global/input", response_model=ProjectOut)
 def save_project_story_generator_global_input(
     project_id: int,
@@ -2685,7 +2665,7 @@ async def analyze_project_novel_to_story_generator_fields(
     except Exception:
         sys_prompt = sys_prompt_template
 
-    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config)
+    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config, user_id=current_user.id, project_id=project.id)
     raw = (resp.get("content") or "").strip()
     if not raw:
         raise HTTPException(status_code=500, detail="LLM returned empty content")
@@ -2919,7 +2899,8 @@ def delete_project(
             p = _to_upload_path(u)
             if p and os.path.exists(p) and os.path.isfile(p):
                 try:
-                    os.remove(p)
+                    # Drops the shared media blob too once no other alias is left.
+                    media_store.delete_file(p)
                 except Exception as fe:
                     logger.warning(f"[delete_project] Failed to delete file {p}: {fe}")
     except Exception as e:
@@ -2975,6 +2956,7 @@ class ProjectEpisodeScriptsGenerateRequest(BaseModel):
     retry_failed_only: bool = False
     extra_notes: Optional[str] = None
     strict_markdown: bool = True
+    concurrency: Optional[int] = None  # episodes generated in parallel (capped by EPISODE_SCRIPT_MAX_CONCURRENCY)
 
 @router.get("/projects/{project_id}/episodes", response_model=List[EpisodeOut])
 def read_episodes(
@@ -3274,7 +3256,7 @@ async def generate_project_character_profile(
     model = llm_config.get("model") if llm_config else None
     billing_service.check_balance(db, current_user.id, "llm_chat", provider, model)
 
-    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config)
+    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config, user_id=current_user.id, project_id=project.id)
     description_md = (resp.get("content") or "").strip()
     if not description_md:
         raise HTTPException(status_code=500, detail="LLM returned empty content")
@@ -3407,9 +3389,50 @@ def _persist_episode_scene_generation_status(db: Session, episode: Episode, stat
     episode.episode_info = info
     db.add(episode)
     db.commit()
+    progress_bus.publish(f"episode:{episode.id}", "scene_generation", status_payload)
+
+
+def _settle_lost_job_status(status_payload: Dict[str, Any]) -> bool:
+    """Closes a "running" status whose background job ended without the handler reporting back
+    (canceled while queued, or out of attempts after its worker died). True when changed."""
+    job_id = status_payload.get("job_id")
+    if not bool(status_payload.get("running")) or not job_id:
+        return False
+    job = job_queue.get(str(job_id))
+    if job is not None and job["status"] not in FINISHED_STATUSES:
+        return False
+    job_status = (job or {}).get("status") or "missing"
+    now_iso = datetime.utcnow().isoformat()
+    status_payload["running"] = False
+    if "status" in status_payload:
+        status_payload["status"] = "stopped" if job_status == "canceled" else "failed"
+    if job_status == "canceled":
+        status_payload["stopped_by_user"] = True
+        status_payload["message"] = "Stopped by user request"
+    else:
+        status_payload["message"] = f"Background job {job_status}: {(job or {}).get('error') or 'no result reported'}"
+    status_payload["updated_at"] = now_iso
+    status_payload["finished_at"] = now_iso
+    return True
+
+
+async def _closing_loop_clients(coro):
+    """Awaits ``coro`` and then closes the HTTP clients of the job's own ``asyncio.run`` loop."""
+    try:
+        return await coro
+    finally:
+        await http_transport.close_loop_clients()
 
 
-def _run_episode_scene_generation_job(episode_id: int, req_payload: Dict[str, Any], user_id: int) -> None:
+def _run_episode_scene_generation_job(
+    episode_id: int,
+    req_payload: Dict[str, Any],
+    user_id: int,
+    job_id: Optional[str] = None,
+) -> None:
+    """Generates the episode's scenes and records the episode in ``done_episode_ids`` with the
+    result; when the queue runs the same job again the stored result is reused instead of
+    calling (and billing) the LLM a second time."""
     db = SessionLocal()
     try:
         episode = db.query(Episode).filter(Episode.id == episode_id).first()
@@ -3418,6 +3441,14 @@ def _run_episode_scene_generation_job(episode_id: int, req_payload: Dict[str, An
             return
 
         latest = _read_episode_scene_generation_status(episode)
+        if job_id and latest.get("job_id") == job_id and episode_id in (latest.get("done_episode_ids") or []):
+            latest["running"] = False
+            latest["status"] = "completed"
+            latest["message"] = "Scene generation completed"
+            latest["updated_at"] = datetime.utcnow().isoformat()
+            latest["finished_at"] = latest.get("finished_at") or latest["updated_at"]
+            _persist_episode_scene_generation_status(db, episode, latest)
+            return
         if bool(latest.get("stop_requested")):
             latest["running"] = False
             latest["status"] = "stopped"
@@ -3428,14 +3459,14 @@ def _run_episode_scene_generation_job(episode_id: int, req_payload: Dict[str, An
             return
 
         req = ScriptScenesGenerateRequest(**(req_payload or {}))
-        result = asyncio.run(
+        result = asyncio.run(_closing_loop_clients(
             generate_episode_scenes_from_story(
                 episode_id=episode_id,
                 req=req,
                 db=db,
                 current_user=user,
             )
-        )
+        ))
 
         episode = db.query(Episode).filter(Episode.id == episode_id).first()
         if episode:
@@ -3445,26 +3476,42 @@ def _run_episode_scene_generation_job(episode_id: int, req_payload: Dict[str, An
             status_payload["message"] = "Scene generation completed"
             status_payload["scenes_created"] = int((result or {}).get("scenes_created") or 0)
             status_payload["result"] = result
+            status_payload["done_episode_ids"] = [episode_id]
             status_payload["updated_at"] = datetime.utcnow().isoformat()
             status_payload["finished_at"] = status_payload["updated_at"]
             _persist_episode_scene_generation_status(db, episode, status_payload)
     except Exception as e:
+        retrying = job_queue.will_retry()
         try:
+            db.rollback()
             episode = db.query(Episode).filter(Episode.id == episode_id).first()
             if episode:
                 status_payload = _read_episode_scene_generation_status(episode)
-                status_payload["running"] = False
-                status_payload["status"] = "failed"
-                status_payload["message"] = str(e)
+                status_payload["running"] = retrying
+                status_payload["status"] = "running" if retrying else "failed"
+                status_payload["message"] = f"Retrying after error: {str(e)}" if retrying else str(e)
                 status_payload["updated_at"] = datetime.utcnow().isoformat()
-                status_payload["finished_at"] = status_payload["updated_at"]
+                if not retrying:
+                    status_payload["finished_at"] = status_payload["updated_at"]
                 _persist_episode_scene_generation_status(db, episode, status_payload)
         except Exception:
             pass
+        if retrying:
+            raise
     finally:
         db.close()
 
 
+def _episode_scene_generation_job(job: Dict[str, Any]) -> None:
+    payload = job["payload"]
+    _run_episode_scene_generation_job(
+        int(payload["episode_id"]), payload.get("request") or {}, int(job["user_id"]), job_id=job["id"]
+    )
+
+
+job_queue.register("episode_scene_generation", _episode_scene_generation_job)
+
+
 @router.get("/episodes/{episode_id}/character_profiles", response_model=List[Dict[str, Any]])
 def get_episode_character_profiles(
     episode_id: int,
@@ -3544,7 +3591,7 @@ async def generate_episode_character_profile(
     model = llm_config.get("model") if llm_config else None
     billing_service.check_balance(db, current_user.id, "llm_chat", provider, model)
 
-    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config)
+    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config, user_id=current_user.id, project_id=episode.project_id)
     description_md = (resp.get("content") or "").strip()
     if not description_md:
         raise HTTPException(status_code=500, detail="LLM returned empty content")
@@ -3680,6 +3727,8 @@ async def generate_episode_story_dna(
         llm_config=llm_config,
         strict_markdown=(req.strict_markdown is not False),
         require_h1=True,
+        user_id=current_user.id,
+        project_id=project.id,
     )
     if not generated_md:
         raise HTTPException(status_code=500, detail="LLM returned empty content")
@@ -3715,6 +3764,23 @@ async def generate_episode_story_dna(
     return episode
 
 
+@router.post("/episodes/{episode_id}/story_generator/stream")
+async def generate_episode_story_dna_stream(
+    episode_id: int,
+    req: "StoryGeneratorRequest",
+    request: Request,
+    current_user: User = Depends(get_current_user),
+):
+    """SSE variant of ``generate_episode_story_dna``: streams tokens, then the episode as ``result``."""
+    user_id = current_user.id
+
+    async def _run(db: Session):
+        user = db.query(User).filter(User.id == user_id).first()
+        return await generate_episode_story_dna(episode_id, req, db=db, current_user=user)
+
+    return _stream_llm_endpoint(request, _run, EpisodeOut)
+
+
 @router.put("/episodes/{episode_id}/story_generator/input", response_model=EpisodeOut)
 def save_episode_story_generator_input(
     episode_id: int,
@@ -3813,7 +3879,7 @@ async def generate_episode_scenes_from_story(
     model = llm_config.get("model") if llm_config else None
     billing_service.check_balance(db, current_user.id, "llm_chat", provider, model)
 
-    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config)
+    resp = await llm_service.generate_content(user_prompt, sys_prompt, llm_config, user_id=current_user.id, project_id=project.id)
     raw = (resp.get("content") or "").strip()
     if not raw:
         raise HTTPException(status_code=500, detail="LLM returned empty content")
@@ -3897,6 +3963,8 @@ def start_episode_scenes_generation_job(
     _require_project_access(db, episode.project_id, current_user)
 
     latest = _read_episode_scene_generation_status(episode)
+    if _settle_lost_job_status(latest):
+        _persist_episode_scene_generation_status(db, episode, latest)
     if bool(latest.get("running")):
         raise HTTPException(status_code=409, detail="Scene generation is already running")
 
@@ -3910,20 +3978,24 @@ def start_episode_scenes_generation_job(
         "request": req.model_dump(),
         "scenes_created": 0,
         "result": None,
+        "done_episode_ids": [],
         "stop_requested": False,
         "stop_requested_at": None,
         "started_at": now_iso,
         "updated_at": now_iso,
         "finished_at": None,
+        "job_id": uuid.uuid4().hex,
     }
     _persist_episode_scene_generation_status(db, episode, status_payload)
 
-    worker = threading.Thread(
-        target=_run_episode_scene_generation_job,
-        args=(episode_id, req.model_dump(), current_user.id),
-        daemon=True,
+    job_queue.enqueue(
+        "episode_scene_generation",
+        current_user.id,
+        {"episode_id": episode_id, "request": req.model_dump()},
+        subject=f"episode:{episode_id}",
+        priority=10,
+        job_id=status_payload["job_id"],
     )
-    worker.start()
     return status_payload
 
 
@@ -3937,7 +4009,10 @@ def get_episode_scenes_generation_job_status(
     if not episode:
         raise HTTPException(status_code=404, detail="Episode not found")
     _require_project_access(db, episode.project_id, current_user)
-    return _read_episode_scene_generation_status(episode)
+    status_payload = _read_episode_scene_generation_status(episode)
+    if _settle_lost_job_status(status_payload):
+        _persist_episode_scene_generation_status(db, episode, status_payload)
+    return status_payload
 
 
 @router.post("/episodes/{episode_id}/script_generator/scenes/stop", response_model=Dict[str, Any])
@@ -3961,6 +4036,9 @@ def stop_episode_scenes_generation_job(
     status_payload["stop_requested_at"] = now_iso
     status_payload["updated_at"] = now_iso
     status_payload["message"] = "Stop requested"
+    if job_queue.cancel_queued("episode_scene_generation", f"episode:{episode_id}"):
+        # Never started, so there is no worker left to acknowledge the stop.
+        _settle_lost_job_status(status_payload)
     _persist_episode_scene_generation_status(db, episode, status_payload)
     return status_payload
 
@@ -4016,11 +4094,24 @@ async def generate_project_episode_scripts_from_global_framework(
 
     gi = dict(project.global_info or {})
     status_key = "episode_script_generation_status"
+    published_results = 0  # run_status["results"] entries already pushed as item events
 
     def _persist_run_status(status_payload: Dict[str, Any]) -> None:
+        nonlocal published_results
         try:
+            db.expire_all()
             latest_project = db.query(Project).filter(Project.id == project_id).first()
             latest_gi = dict((latest_project.global_info if latest_project else {}) or {})
+            latest_status = latest_gi.get(status_key)
+            if (
+                isinstance(latest_status, dict)
+                and latest_status.get("stop_requested")
+                and latest_status.get("started_at") == status_payload.get("started_at")
+                and not status_payload.get("stop_requested")
+            ):
+                # A stop that arrived while episodes were generating must not be overwritten.
+                status_payload["stop_requested"] = True
+                status_payload["stop_requested_at"] = latest_status.get("stop_requested_at")
             latest_gi[status_key] = status_payload
             if latest_project:
                 latest_project.global_info = latest_gi
@@ -4028,9 +4119,17 @@ async def generate_project_episode_scripts_from_global_framework(
                 db.commit()
         except Exception as e:
             logger.warning(f"[generate_episode_scripts] failed to persist run status: {e}")
+            return
+        topic = f"project:{project_id}"
+        finished = status_payload.get("results") or []
+        for item in finished[published_results:]:
+            progress_bus.publish_item(topic, "episode_scripts", item)
+        published_results = len(finished)
+        progress_bus.publish(topic, "episode_scripts", status_payload)
 
     def _read_run_status() -> Dict[str, Any]:
         try:
+            db.expire_all()
             latest_project = db.query(Project).filter(Project.id == project_id).first()
             latest_gi = dict((latest_project.global_info if latest_project else {}) or {})
             latest_status = latest_gi.get(status_key)
@@ -4255,46 +4354,73 @@ async def generate_project_episode_scripts_from_global_framework(
         except Exception as e:
             logger.warning(f"[generate_episode_scripts] failed to write {action} system log: {e}")
 
-    for idx, ep in episodes_with_index:
-        if _is_stop_requested():
-            stopped_at = datetime.utcnow().isoformat()
-            run_status["stop_requested"] = True
-            if not run_status.get("stop_requested_at"):
-                run_status["stop_requested_at"] = stopped_at
-            run_status["stopped_by_user"] = True
-            run_status["stopped_at_episode_number"] = idx
-            run_status["stop_acknowledged_at"] = stopped_at
-            run_status["message"] = "Stopped by user request"
-
-            remaining = [(n, ep_rest) for n, ep_rest in episodes_with_index if n >= idx]
-            for j, ep_rest in remaining:
-                results.append({
-                    "episode_id": ep_rest.id,
-                    "episode_number": j,
-                    "episode_title": ep_rest.title,
-                    "generated": False,
-                    "skipped": True,
-                    "reason": "stopped by user request",
-                })
-                run_status["processed"] = int(run_status.get("processed") or 0) + 1
-                run_status["skipped"] = int(run_status.get("skipped") or 0) + 1
-                run_status["results"].append({
-                    "episode_id": ep_rest.id,
-                    "episode_number": j,
-                    "episode_title": ep_rest.title,
-                    "status": "skipped",
+    concurrency = max(1, min(int(req.concurrency or 1), int(settings.EPISODE_SCRIPT_MAX_CONCURRENCY)))
+    gate = asyncio.Semaphore(concurrency)
+    in_progress: List[int] = []
+    halted: Dict[str, Any] = {}
+    fatal: List[HTTPException] = []
+    run_status["concurrency"] = concurrency
+    run_status["in_progress"] = []
+
+    def _skip_halted(idx: int, ep: Episode) -> None:
+        reason = "stopped by user request" if halted.get("reason") == "stop" else "aborted due to provider moderation block"
+        if halted.get("reason") == "fatal":
+            reason = "aborted after an earlier episode failed the request"
+        results.append({
+            "episode_id": ep.id,
+            "episode_number": idx,
+            "episode_title": ep.title,
+            "generated": False,
+            "skipped": True,
+            "reason": reason,
+        })
+        run_status["processed"] = int(run_status.get("processed") or 0) + 1
+        run_status["skipped"] = int(run_status.get("skipped") or 0) + 1
+        run_status["updated_at"] = datetime.utcnow().isoformat()
+        run_status["results"].append({
+            "episode_id": ep.id,
+            "episode_number": idx,
+            "episode_title": ep.title,
+            "status": "skipped",
+            "reason": reason,
+        })
+        _persist_run_status(run_status)
+
+    async def _run_episode(idx: int, ep: Episode) -> None:
+        # Episodes run concurrently on this loop and share ``db``; every block below that
+        # touches the session runs between awaits, so no two episodes interleave on it.
+        async with gate:
+            if not halted and _is_stop_requested():
+                stopped_at = datetime.utcnow().isoformat()
+                halted["reason"] = "stop"
+                run_status["stop_requested"] = True
+                if not run_status.get("stop_requested_at"):
+                    run_status["stop_requested_at"] = stopped_at
+                run_status["stopped_by_user"] = True
+                run_status["stopped_at_episode_number"] = idx
+                run_status["stop_acknowledged_at"] = stopped_at
+                run_status["message"] = "Stopped by user request"
+                _safe_log_episode("GENERATE_EPISODE_SCRIPTS_ABORTED", {
+                    "project_id": project_id,
+                    "stopped_at_episode_number": idx,
                     "reason": "stopped by user request",
                 })
-
-            run_status["updated_at"] = stopped_at
-            _persist_run_status(run_status)
-            _safe_log_episode("GENERATE_EPISODE_SCRIPTS_ABORTED", {
-                "project_id": project_id,
-                "stopped_at_episode_number": idx,
-                "reason": "stopped by user request",
-            })
-            break
-
+            if halted:
+                _skip_halted(idx, ep)
+                return
+            in_progress.append(idx)
+            run_status["in_progress"] = sorted(in_progress)
+            try:
+                await _generate_episode(idx, ep)
+            except HTTPException as e:
+                # e.g. 402 from the balance check: let running episodes finish, skip the rest
+                fatal.append(e)
+                halted.setdefault("reason", "fatal")
+            finally:
+                in_progress.remove(idx)
+                run_status["in_progress"] = sorted(in_progress)
+
+    async def _generate_episode(idx: int, ep: Episode) -> None:
         should_write = True
         if not req.retry_failed_only and not req.overwrite_existing and (ep.script_content or "").strip():
             should_write = False
@@ -4329,7 +4455,7 @@ async def generate_project_episode_scripts_from_global_framework(
                 "reason": "script_content already exists",
             })
             _persist_run_status(run_status)
-            continue
+            return
 
         # Balance check per call (may raise 402)
         billing_service.check_balance(db, current_user.id, "llm_chat", provider, model)
@@ -4378,6 +4504,8 @@ async def generate_project_episode_scripts_from_global_framework(
                 llm_config=llm_config,
                 strict_markdown=(req.strict_markdown is not False),
                 require_h1=True,
+                user_id=current_user.id,
+                project_id=project_id,
             )
             if not content:
                 raise RuntimeError("LLM returned empty content")
@@ -4458,37 +4586,31 @@ async def generate_project_episode_scripts_from_global_framework(
             })
             _persist_run_status(run_status)
 
-            if "PROHIBITED_CONTENT" in str(e):
+            if "PROHIBITED_CONTENT" in str(e) and not halted:
                 logger.warning(
                     f"[generate_episode_scripts] ABORT remaining episodes due to provider moderation block at episode_number={idx}"
                 )
+                halted["reason"] = "moderation"
                 _safe_log_episode("GENERATE_EPISODE_SCRIPTS_ABORTED", {
                     "project_id": project_id,
                     "stopped_at_episode_number": idx,
                     "reason": "provider moderation block (PROHIBITED_CONTENT)",
                 })
-                remaining = [(n, ep_rest) for n, ep_rest in episodes_with_index if n > idx]
-                for j, ep_rest in remaining:
-                    results.append({
-                        "episode_id": ep_rest.id,
-                        "episode_number": j,
-                        "episode_title": ep_rest.title,
-                        "generated": False,
-                        "skipped": True,
-                        "reason": "aborted due to provider moderation block",
-                    })
-                    run_status["processed"] = int(run_status.get("processed") or 0) + 1
-                    run_status["skipped"] = int(run_status.get("skipped") or 0) + 1
-                    run_status["results"].append({
-                        "episode_id": ep_rest.id,
-                        "episode_number": j,
-                        "episode_title": ep_rest.title,
-                        "status": "skipped",
-                        "reason": "aborted due to provider moderation block",
-                    })
-                run_status["updated_at"] = datetime.utcnow().isoformat()
-                _persist_run_status(run_status)
-                break
+
+    # Episodes start in order; with concurrency > 1 up to that many LLM calls overlap and
+    # each script is committed as soon as it is ready.
+    await asyncio.gather(*(_run_episode(idx, ep) for idx, ep in episodes_with_index))
+    results.sort(key=lambda r: int(r.get("episode_number") or 0))
+    errors.sort(key=lambda r: int(r.get("episode_number") or 0))
+    run_status["results"].sort(key=lambda r: int(r.get("episode_number") or 0))
+    run_status["in_progress"] = []
+    if fatal:
+        run_status["running"] = False
+        run_status["finished_at"] = datetime.utcnow().isoformat()
+        run_status["updated_at"] = run_status["finished_at"]
+        run_status["message"] = f"Aborted: {fatal[0].detail}"
+        _persist_run_status(run_status)
+        raise fatal[0]
 
     duration_ms = int((datetime.utcnow() - started_at).total_seconds() * 1000)
     logger.info(
@@ -4557,12 +4679,15 @@ def get_project_episode_scripts_generation_status(
     current_user: User = Depends(get_current_user),
 ):
     project = _require_project_access(db, project_id, current_user)
+    return _read_project_episode_scripts_status(project)
 
+
+def _read_project_episode_scripts_status(project: Project) -> Dict[str, Any]:
     gi = dict(project.global_info or {})
     status_payload = gi.get("episode_script_generation_status") if isinstance(gi, dict) else None
     if not isinstance(status_payload, dict):
         return {
-            "project_id": project_id,
+            "project_id": project.id,
             "running": False,
             "processed": 0,
             "generated": 0,
@@ -4586,7 +4711,8 @@ def stop_project_episode_scripts_generation(
 
     gi = dict(project.global_info or {})
     status_key = "episode_script_generation_status"
-    status_payload = gi.get(status_key) if isinstance(gi.get(status_key), dict) else None
+    # Copy: mutating the loaded dict in place would leave the JSON column looking unchanged.
+    status_payload = dict(gi.get(status_key)) if isinstance(gi.get(status_key), dict) else None
     now_iso = datetime.utcnow().isoformat()
 
     if not isinstance(status_payload, dict):
@@ -4605,6 +4731,7 @@ def stop_project_episode_scripts_generation(
         project.global_info = gi
         db.add(project)
         db.commit()
+        progress_bus.publish(f"project:{project_id}", "episode_scripts", status_payload)
         return {
             "success": True,
             "project_id": project_id,
@@ -4620,6 +4747,7 @@ def stop_project_episode_scripts_generation(
     project.global_info = gi
     db.add(project)
     db.commit()
+    progress_bus.publish(f"project:{project_id}", "episode_scripts", status_payload)
 
     try:
         log_action(
@@ -5208,6 +5336,48 @@ class AnalysisContent(BaseModel):
     content: Union[Dict[str, Any], List[Any]]
 
 
+class _EpisodeBatchStatus:
+    """Status payload of a batch runner that lives in ``episode.episode_info``.
+
+    ``read``/``persist`` are the batch's own ``_read_*_status``/``_persist_*_status`` pair.
+    ``latest()`` re-reads the payload, ``report(**fields)`` merges fields into it and persists,
+    and ``stop_requested()`` latches ``stopped`` once a stop is seen (or the episode is gone).
+    Calls run between awaits on the runner's loop, so read-modify-write never interleaves.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        episode_id: int,
+        read: Callable[[Episode], Dict[str, Any]],
+        persist: Callable[[Session, Episode, Dict[str, Any]], None],
+    ):
+        self.db = db
+        self.episode_id = episode_id
+        self.read = read
+        self.persist = persist
+        self.stopped = False
+
+    def latest(self) -> Tuple[Optional[Episode], Dict[str, Any]]:
+        self.db.expire_all()
+        current = self.db.query(Episode).filter(Episode.id == self.episode_id).first()
+        return current, (self.read(current) if current else {})
+
+    def report(self, **fields) -> None:
+        current, latest = self.latest()
+        if current is None:
+            return
+        latest.update(fields)
+        latest["updated_at"] = datetime.utcnow().isoformat()
+        self.persist(self.db, current, latest)
+
+    def stop_requested(self) -> bool:
+        if not self.stopped:
+            current, latest = self.latest()
+            self.stopped = current is None or bool(latest.get("stop_requested"))
+        return self.stopped
+
+
 class SceneAiShotsBatchStartRequest(BaseModel):
     scene_ids: Optional[List[int]] = None
 
@@ -5242,112 +5412,182 @@ def _persist_scene_ai_shots_batch_status(db: Session, episode: Episode, status_p
     episode.episode_info = info
     db.add(episode)
     db.commit()
+    progress_bus.publish(f"episode:{episode.id}", "ai_shots_batch", status_payload)
 
 
-def _run_scene_ai_shots_batch_job(episode_id: int, scene_ids: List[int], user_id: int) -> None:
-    db = SessionLocal()
-    try:
-        episode = db.query(Episode).filter(Episode.id == episode_id).first()
-        user = db.query(User).filter(User.id == user_id).first()
-        if not episode or not user:
-            return
-
-        scene_label_map: Dict[int, str] = {}
-        for sid in scene_ids:
-            sc = db.query(Scene).filter(Scene.id == sid, Scene.episode_id == episode_id).first()
-            if sc:
-                scene_label_map[sid] = str(sc.scene_no or sc.scene_name or f"#{sid}")
-
-        total = len(scene_ids)
-        completed = 0
-        success = 0
-        failed = 0
-        errors: List[str] = []
-
-        for sid in scene_ids:
-            episode = db.query(Episode).filter(Episode.id == episode_id).first()
-            if not episode:
-                break
-            latest = _read_scene_ai_shots_batch_status(episode)
-            if bool(latest.get("stop_requested")):
-                latest["running"] = False
-                latest["completed"] = completed
-                latest["success"] = success
-                latest["failed"] = failed
-                latest["errors"] = errors
-                latest["finished_at"] = datetime.utcnow().isoformat()
-                latest["stopped_by_user"] = True
-                latest["message"] = "Stopped by user request"
-                _persist_scene_ai_shots_batch_status(db, episode, latest)
-                return
+async def _run_scene_ai_shots_batch(
+    db: Session,
+    episode_id: int,
+    scene_ids: List[int],
+    user_id: int,
+    job_id: Optional[str] = None,
+) -> None:
+    """Breaks scenes down into shots concurrently (at most ``SCENE_AI_SHOTS_BATCH_CONCURRENCY``
+    LLM calls in flight, each scene on its own session) and applies the results in
+    ``scene_ids`` order, so shot rows are created in scene order whatever finishes first.
+    ``db`` is only used for the status payload. The concurrent scenes bill the same user
+    from separate sessions, which relies on ``billing_service`` reserving, cancelling and
+    settling credits with single conditional UPDATEs rather than read-modify-write.
+
+    Scenes whose shots were applied are recorded as ``done_scene_ids``; when the queue runs
+    the same job again they are skipped rather than sent to the LLM again."""
+    episode = db.query(Episode).filter(Episode.id == episode_id).first()
+    if not episode or not db.query(User.id).filter(User.id == user_id).first():
+        return
 
+    total = len(scene_ids)
+    done_scene_ids: List[int] = []
+    if job_id:
+        previous_status = _read_scene_ai_shots_batch_status(episode)
+        if previous_status.get("job_id") == job_id:
+            already_done = {int(x) for x in previous_status.get("done_scene_ids") or []}
+            done_scene_ids = [sid for sid in scene_ids if sid in already_done]
+            scene_ids = [sid for sid in scene_ids if sid not in already_done]
+
+    scene_label_map: Dict[int, str] = {}
+    for sid in scene_ids:
+        sc = db.query(Scene).filter(Scene.id == sid, Scene.episode_id == episode_id).first()
+        if sc:
+            scene_label_map[sid] = str(sc.scene_no or sc.scene_name or f"#{sid}")
+
+    progress = {"completed": len(done_scene_ids), "success": len(done_scene_ids), "failed": 0}
+    errors: List[str] = []
+    in_flight: List[int] = []
+    outcomes: Dict[int, Tuple[str, Any]] = {}
+    next_index = 0
+    parallelism = max(1, int(settings.SCENE_AI_SHOTS_BATCH_CONCURRENCY))
+    gate = asyncio.Semaphore(parallelism)
+    status = _EpisodeBatchStatus(db, episode_id, _read_scene_ai_shots_batch_status, _persist_scene_ai_shots_batch_status)
+
+    def _apply_ready() -> None:
+        nonlocal next_index
+        while next_index in outcomes:
+            kind, value = outcomes.pop(next_index)
+            sid = scene_ids[next_index]
             scene_label = scene_label_map.get(sid) or f"#{sid}"
-            latest["current_scene_id"] = sid
-            latest["current_scene_label"] = scene_label
-            latest["message"] = f"Processing scene {scene_label}..."
-            latest["updated_at"] = datetime.utcnow().isoformat()
-            _persist_scene_ai_shots_batch_status(db, episode, latest)
-
+            next_index += 1
+            if kind == "skipped":
+                continue
             try:
-                generated = asyncio.run(ai_generate_shots(scene_id=sid, req=None, db=db, current_user=user))
-                generated_rows = generated.get("content") if isinstance(generated, dict) else []
-                if not isinstance(generated_rows, list) or len(generated_rows) == 0:
-                    raise RuntimeError("No parsed rows returned")
-
-                apply_scene_ai_result(
-                    scene_id=sid,
-                    data=AnalysisContent(content=generated_rows),
-                    db=db,
-                    current_user=user,
-                )
-                success += 1
+                if kind == "error":
+                    raise value
+                with SessionLocal() as apply_db:
+                    apply_user = apply_db.query(User).filter(User.id == user_id).first()
+                    apply_scene_ai_result(
+                        scene_id=sid,
+                        data=AnalysisContent(content=value),
+                        db=apply_db,
+                        current_user=apply_user,
+                    )
+                progress["success"] += 1
+                done_scene_ids.append(sid)
+                error = None
             except Exception as e:
-                failed += 1
-                errors.append(f"{scene_label}: {str(e)}")
+                progress["failed"] += 1
+                error = str(e)
+                errors.append(f"{scene_label}: {error}")
+            progress["completed"] += 1
+            progress_bus.publish_item(f"episode:{episode_id}", "ai_shots_batch", {
+                "scene_id": sid,
+                "scene_label": scene_label,
+                "ok": error is None,
+                "error": error,
+            })
+            status.report(
+                **progress,
+                errors=list(errors),
+                running_scene_ids=list(in_flight),
+                done_scene_ids=list(done_scene_ids),
+                message=f"Progress {progress['completed']}/{total}",
+            )
 
-            completed += 1
-            episode = db.query(Episode).filter(Episode.id == episode_id).first()
-            if not episode:
-                break
-            latest = _read_scene_ai_shots_batch_status(episode)
-            latest["completed"] = completed
-            latest["success"] = success
-            latest["failed"] = failed
-            latest["errors"] = errors
-            latest["updated_at"] = datetime.utcnow().isoformat()
-            latest["message"] = f"Progress {completed}/{total}"
-            _persist_scene_ai_shots_batch_status(db, episode, latest)
+    async def _run_scene(index: int, sid: int) -> None:
+        scene_label = scene_label_map.get(sid) or f"#{sid}"
+        try:
+            async with gate:
+                if status.stop_requested():
+                    outcomes[index] = ("skipped", None)
+                    return
+                in_flight.append(sid)
+                try:
+                    status.report(
+                        current_scene_id=sid,
+                        current_scene_label=scene_label,
+                        running_scene_ids=list(in_flight),
+                        message=f"Processing scene {scene_label}...",
+                    )
+                    with SessionLocal() as scene_db:
+                        scene_user = scene_db.query(User).filter(User.id == user_id).first()
+                        generated = await ai_generate_shots(scene_id=sid, req=None, db=scene_db, current_user=scene_user)
+                finally:
+                    in_flight.remove(sid)
+            generated_rows = generated.get("content") if isinstance(generated, dict) else []
+            if not isinstance(generated_rows, list) or len(generated_rows) == 0:
+                raise RuntimeError("No parsed rows returned")
+            outcomes[index] = ("rows", generated_rows)
+        except Exception as e:
+            outcomes[index] = ("error", e)
+        finally:
+            _apply_ready()
 
-        episode = db.query(Episode).filter(Episode.id == episode_id).first()
-        if episode:
-            final_status = _read_scene_ai_shots_batch_status(episode)
-            final_status["running"] = False
-            final_status["completed"] = completed
-            final_status["success"] = success
-            final_status["failed"] = failed
-            final_status["errors"] = errors
-            final_status["finished_at"] = datetime.utcnow().isoformat()
-            final_status["updated_at"] = final_status["finished_at"]
-            final_status["stopped_by_user"] = bool(final_status.get("stop_requested"))
-            final_status["message"] = f"Batch done: success {success}, failed {failed}"
-            _persist_scene_ai_shots_batch_status(db, episode, final_status)
+    if done_scene_ids:
+        status.report(**progress, errors=[], message=f"Resuming: {len(done_scene_ids)}/{total} scenes already done")
+    status.report(parallelism=parallelism)
+    await asyncio.gather(*(_run_scene(index, sid) for index, sid in enumerate(scene_ids)))
+
+    current, final_status = status.latest()
+    if current is None:
+        return
+    final_status.update(progress)
+    final_status["running"] = False
+    final_status["errors"] = errors
+    final_status["running_scene_ids"] = []
+    final_status["finished_at"] = datetime.utcnow().isoformat()
+    final_status["updated_at"] = final_status["finished_at"]
+    final_status["stopped_by_user"] = bool(final_status.get("stop_requested"))
+    if status.stopped:
+        final_status["message"] = "Stopped by user request"
+    else:
+        final_status["message"] = f"Batch done: success {progress['success']}, failed {progress['failed']}"
+    _persist_scene_ai_shots_batch_status(db, current, final_status)
+
+
+def _run_scene_ai_shots_batch_job(episode_id: int, scene_ids: List[int], user_id: int, job_id: Optional[str] = None) -> None:
+    db = SessionLocal()
+    try:
+        asyncio.run(_closing_loop_clients(_run_scene_ai_shots_batch(db, episode_id, scene_ids, user_id, job_id=job_id)))
     except Exception as e:
+        retrying = job_queue.will_retry()
         try:
+            db.rollback()
             episode = db.query(Episode).filter(Episode.id == episode_id).first()
             if episode:
                 failed_status = _read_scene_ai_shots_batch_status(episode)
-                failed_status["running"] = False
-                failed_status["finished_at"] = datetime.utcnow().isoformat()
-                failed_status["updated_at"] = failed_status["finished_at"]
-                failed_status["message"] = f"Batch failed: {str(e)}"
+                failed_status["running"] = retrying
+                failed_status["updated_at"] = datetime.utcnow().isoformat()
+                if not retrying:
+                    failed_status["finished_at"] = failed_status["updated_at"]
+                failed_status["message"] = f"Retrying after error: {str(e)}" if retrying else f"Batch failed: {str(e)}"
                 failed_status["errors"] = list(failed_status.get("errors") or []) + [str(e)]
                 _persist_scene_ai_shots_batch_status(db, episode, failed_status)
         except Exception:
             pass
+        if retrying:
+            raise
     finally:
         db.close()
 
 
+def _scene_ai_shots_batch_job(job: Dict[str, Any]) -> None:
+    payload = job["payload"]
+    _run_scene_ai_shots_batch_job(
+        int(payload["episode_id"]), [int(x) for x in payload.get("scene_ids") or []], int(job["user_id"]), job_id=job["id"]
+    )
+
+
+job_queue.register("scene_ai_shots_batch", _scene_ai_shots_batch_job)
+
+
 @router.post("/episodes/{episode_id}/scenes/ai_shots/batch/start", response_model=Dict[str, Any])
 def start_scene_ai_shots_batch(
     episode_id: int,
@@ -5361,6 +5601,8 @@ def start_scene_ai_shots_batch(
     _require_project_access(db, episode.project_id, current_user)
 
     latest_status = _read_scene_ai_shots_batch_status(episode)
+    if _settle_lost_job_status(latest_status):
+        _persist_scene_ai_shots_batch_status(db, episode, latest_status)
     if bool(latest_status.get("running")):
         raise HTTPException(status_code=409, detail="Scene AI shots batch is already running")
 
@@ -5385,6 +5627,8 @@ def start_scene_ai_shots_batch(
         "failed": 0,
         "current_scene_id": None,
         "current_scene_label": "",
+        "running_scene_ids": [],
+        "done_scene_ids": [],
         "message": "Batch task started",
         "errors": [],
         "stop_requested": False,
@@ -5393,15 +5637,18 @@ def start_scene_ai_shots_batch(
         "started_at": now_iso,
         "updated_at": now_iso,
         "finished_at": None,
+        "job_id": uuid.uuid4().hex,
     }
     _persist_scene_ai_shots_batch_status(db, episode, status_payload)
 
-    worker = threading.Thread(
-        target=_run_scene_ai_shots_batch_job,
-        args=(episode_id, scene_ids, current_user.id),
-        daemon=True,
+    job_queue.enqueue(
+        "scene_ai_shots_batch",
+        current_user.id,
+        {"episode_id": episode_id, "scene_ids": scene_ids},
+        subject=f"episode:{episode_id}",
+        priority=5,
+        job_id=status_payload["job_id"],
     )
-    worker.start()
 
     return status_payload
 
@@ -5416,7 +5663,10 @@ def get_scene_ai_shots_batch_status(
     if not episode:
         raise HTTPException(status_code=404, detail="Episode not found")
     _require_project_access(db, episode.project_id, current_user)
-    return _read_scene_ai_shots_batch_status(episode)
+    status_payload = _read_scene_ai_shots_batch_status(episode)
+    if _settle_lost_job_status(status_payload):
+        _persist_scene_ai_shots_batch_status(db, episode, status_payload)
+    return status_payload
 
 
 @router.post("/episodes/{episode_id}/scenes/ai_shots/batch/stop", response_model=Dict[str, Any])
@@ -5440,6 +5690,9 @@ def stop_scene_ai_shots_batch(
     status_payload["stop_requested_at"] = now_iso
     status_payload["updated_at"] = now_iso
     status_payload["message"] = "Stop requested"
+    if job_queue.cancel_queued("scene_ai_shots_batch", f"episode:{episode_id}"):
+        # Never started, so there is no worker left to acknowledge the stop.
+        _settle_lost_job_status(status_payload)
     _persist_scene_ai_shots_batch_status(db, episode, status_payload)
     return status_payload
 
@@ -5512,11 +5765,13 @@ async def ai_generate_shots(
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_input},
             ]
-            est = billing_service.estimate_input_output_tokens_from_messages(messages_est, output_ratio=1.5)
+            est = billing_service.estimate_input_output_tokens_from_messages(
+                messages_est, output_ratio=1.5, provider=provider, model=model, task_type="llm_chat", item="generate_shots",
+            )
             reserve_details = {
                 "item": "generate_shots",
-                "estimation_method": "prompt_tokens_ratio",
-                "estimated_output_ratio": 1.5,
+                "estimation_method": est.get("estimation_method"),
+                "estimated_output_ratio": est.get("output_ratio"),
                 "system_prompt_len": len(system_prompt or ""),
                 "user_prompt_len": len(user_input or ""),
                 "input_tokens": est.get("input_tokens", 0),
@@ -5532,7 +5787,7 @@ async def ai_generate_shots(
             # Ensure we have at least a default task type if provider is missing (though check_balance handles None)
             billing_service.check_balance(db, current_user.id, "llm_chat", provider, model)
 
-        response_dict = await llm_service.generate_content(user_input, system_prompt, llm_config)
+        response_dict = await llm_service.generate_content(user_input, system_prompt, llm_config, user_id=current_user.id, project_id=project.id)
         response_content_raw = response_dict.get("content", "")
         usage = response_dict.get("usage", {})
 
@@ -6370,7 +6625,7 @@ async def generate_sora_character(
             {"role": "system", "content": "sora-create-character"},
             {"role": "user", "content": prompt},
         ]
-        est = billing_service.estimate_input_output_tokens_from_messages(est_messages, output_ratio=1.5)
+        est = billing_service.estimate_input_output_tokens_from_messages(est_messages, output_ratio=1.5, provider=provider, model=model)
 
         estimated_image_tokens = 1000 * image_count
         estimated_video_tokens = 2000 * video_count
@@ -6430,7 +6685,9 @@ async def generate_sora_character(
             system_prompt="sora-create-character", # Special flag for the service to recognize?
             config=llm_config,
             image_urls=[req.main_image_url] + req.ref_image_urls if req.main_image_url else req.ref_image_urls,
-            video_urls=req.ref_video_urls
+            video_urls=req.ref_video_urls,
+            user_id=current_user.id,
+            project_id=entity.project_id,
         )
         
         # 5. Handle Result
@@ -6928,6 +7185,7 @@ def login_access_token(request: Request, form_data: OAuth2PasswordRequestForm =
     try:
         _seed_default_system_settings_for_user(db, user.id)
         db.commit()
+        settings_resolution_cache.invalidate_user(user.id)
     except Exception as e:
         db.rollback()
         logger.warning("Failed to seed default API settings on login | user_id=%s error=%s", user.id, e)
@@ -6965,6 +7223,7 @@ def login_json(request: Request, login_data: LoginRequest, db: Session = Depends
     try:
         _seed_default_system_settings_for_user(db, user.id)
         db.commit()
+        settings_resolution_cache.invalidate_user(user.id)
     except Exception as e:
         db.rollback()
         logger.warning("Failed to seed default API settings on login | user_id=%s error=%s", user.id, e)
@@ -7725,15 +7984,7 @@ async def upload_asset(
     allowed_image_ext = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
     allowed_video_ext = {'.mp4', '.mov', '.avi', '.webm'}
 
-    # Ensure upload directory
-    upload_dir = settings.UPLOAD_DIR
-    
-    # Store by user
-    user_upload_dir = os.path.join(upload_dir, str(current_user.id))
-    if not os.path.exists(user_upload_dir):
-        os.makedirs(user_upload_dir)
-    
-    # Generate unique filename
+    # Validate extension / content type
     ext = (os.path.splitext(file.filename or "")[1] or "").lower()
     if ext not in (allowed_image_ext | allowed_video_ext):
         raise HTTPException(status_code=400, detail="Unsupported file extension")
@@ -7744,42 +7995,30 @@ async def upload_asset(
     if ext in allowed_image_ext and not content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File content type does not match image extension")
 
-    filename = f"{uuid.uuid4()}{ext}"
-    file_path = os.path.join(user_upload_dir, filename)
-
     # Auto-detect type
     if ext in allowed_video_ext:
         type = 'video'
     elif ext in allowed_image_ext:
         type = 'image'
 
-    bytes_written = 0
+    # Stored once per content digest; the per-user file is a link to the shared blob.
     try:
-        with open(file_path, "wb") as buffer:
-            while True:
-                chunk = file.file.read(1024 * 1024)
-                if not chunk:
-                    break
-                bytes_written += len(chunk)
-                if bytes_written > max_upload_bytes:
-                    raise HTTPException(status_code=413, detail=f"File too large (max {settings.MAX_ASSET_UPLOAD_MB}MB)")
-                buffer.write(chunk)
-    except HTTPException:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        raise
-    except Exception:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        raise
-
-    if bytes_written <= 0:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        stored = await asyncio.to_thread(
+            media_store.ingest_stream,
+            file.file,
+            ext,
+            current_user.id,
+            prefix="upload",
+            max_bytes=max_upload_bytes,
+        )
+    except MediaTooLarge:
+        raise HTTPException(status_code=413, detail=f"File too large (max {settings.MAX_ASSET_UPLOAD_MB}MB)")
+    except ValueError:
         raise HTTPException(status_code=400, detail="Empty file")
+    file_path = stored["path"]
         
     # Extract Metadata
-    meta_info = {'source': 'file_upload'}
+    meta_info = {'source': 'file_upload', 'content_digest': stored["digest"]}
     if project_id: meta_info['project_id'] = project_id
     if entity_id: meta_info['entity_id'] = entity_id
     if shot_id: meta_info['shot_id'] = shot_id
@@ -7797,10 +8036,8 @@ async def upload_asset(
     except Exception as e:
         print(f"Metadata extraction failed: {e}")
 
-    # Construct URL (assuming /uploads is mounted)
-    # Get base URL from request ideally, but relative works for frontend
-    base_url = settings.RENDER_EXTERNAL_URL.rstrip('/') if settings.RENDER_EXTERNAL_URL else ""
-    url = f"{base_url}/uploads/{current_user.id}/{filename}"
+    # Per-user alias URL (served by the /uploads mount)
+    url = stored["url"]
     
     asset = Asset(
         user_id=current_user.id,
@@ -7844,7 +8081,7 @@ def delete_asset(
                 rel_path = parts[1] # user_id/filename
                 file_path = os.path.join(settings.UPLOAD_DIR, rel_path)
                 if os.path.exists(file_path):
-                    os.remove(file_path)
+                    media_store.delete_file(file_path)
     except Exception as e:
         print(f"Error deleting file for asset {asset_id}: {e}")
 
@@ -7873,7 +8110,7 @@ def batch_delete_assets(
                     rel_path = parts[1]
                     file_path = os.path.join(settings.UPLOAD_DIR, rel_path)
                     if os.path.exists(file_path):
-                        os.remove(file_path)
+                        media_store.delete_file(file_path)
         except Exception as e:
             print(f"Error deleting file for asset {asset.id}: {e}")
         
@@ -8418,8 +8655,6 @@ def get_runtime_stats(current_user: User = Depends(get_current_user)):
     if not current_user.is_superuser:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    image_job_stats = _snapshot_image_job_stats()
-
     return {
         "service": "aistory-backend",
         "pid": os.getpid(),
@@ -8429,7 +8664,26 @@ def get_runtime_stats(current_user: User = Depends(get_current_user)):
             "instance_id": os.getenv("RENDER_INSTANCE_ID", ""),
             "git_commit": os.getenv("RENDER_GIT_COMMIT", ""),
         },
-        "image_jobs": image_job_stats,
+        "image_jobs": image_job_store.snapshot_stats(),
+        "upstream_tasks": generation_resumer.snapshot_stats(),
+        "background_jobs": job_queue.snapshot_stats(),
+        "progress_push": progress_bus.snapshot_stats(),
+        "http_pools": http_transport.snapshot_stats(),
+        "upstream_polling": task_poller.snapshot_stats(),
+        "task_callbacks": task_callbacks.snapshot_stats(),
+        "provider_health": provider_health.snapshot(),
+        "ref_image_cache": ref_image_cache.snapshot_stats(),
+        "media_store": media_store.snapshot_stats(),
+        "generation_cache": generation_cache.snapshot_stats(),
+        "image_preprocess": image_preprocessor.snapshot_stats(),
+        "outbound_governor": outbound_governor.snapshot_stats(),
+        "settings_cache": settings_resolution_cache.snapshot_stats(),
+        "llm_response_cache": llm_response_cache.snapshot_stats(),
+        "token_estimator": token_estimator.snapshot_stats(),
+        "singleflight": {
+            "llm": llm_singleflight.snapshot_stats(),
+            "image": image_singleflight.snapshot_stats(),
+        },
     }
 
 
@@ -9100,6 +9354,10 @@ class GenerationRequest(BaseModel):
     subject_type: Optional[str] = None
     entity_type: Optional[str] = None
     asset_type: Optional[str] = None
+    # Race the next fallback provider once the primary passes its p90 latency (None = server default).
+    hedge: Optional[bool] = None
+    # Skip the exact-match generation cache and always call the provider.
+    bypass_cache: Optional[bool] = False
 
 class VideoGenerationRequest(BaseModel):
     prompt: str
@@ -9116,6 +9374,7 @@ class VideoGenerationRequest(BaseModel):
     subject_name: Optional[str] = None
     asset_type: Optional[str] = None
     keyframes: Optional[List[str]] = None
+    bypass_cache: Optional[bool] = False
 
 
 class ShotMediaBatchStartRequest(BaseModel):
@@ -9534,7 +9793,7 @@ async def generate_image_endpoint(
     db: Session = Depends(get_db)
 ):
     try:
-        return await asyncio.wait_for(_run_generate_image(req, current_user, db), timeout=55)
+        return await _run_generate_image(req, current_user, db, timeout=55)
     except asyncio.TimeoutError:
         raise HTTPException(
             status_code=504,
@@ -9542,7 +9801,20 @@ async def generate_image_endpoint(
         )
 
 
-async def _run_generate_image(req: GenerationRequest, current_user: User, db: Session):
+async def _run_generate_image(
+    req: GenerationRequest,
+    current_user: User,
+    db: Session,
+    image_job_id: Optional[str] = None,
+    timeout: Optional[float] = None,
+):
+    # Upstream task ids are recorded while this runs, so a restart resumes instead of resubmitting.
+    # The timeout lives in track() so it can tell a timed-out request from a shutdown.
+    async with generation_resumer.track("image", current_user.id, req.model_dump(), timeout=timeout, image_job_id=image_job_id):
+        return await _generate_image_and_finalize(req, current_user, db)
+
+
+async def _generate_image_and_finalize(req: GenerationRequest, current_user: User, db: Session):
     # Billing Check
     cost = billing_service.estimate_cost(db, "image_gen", req.provider, req.model)
     billing_service.check_can_proceed(current_user, cost)
@@ -9619,6 +9891,9 @@ async def _run_generate_image(req: GenerationRequest, current_user: User, db: Se
             user_credits=(current_user.credits or 0),
             filename_base=_build_generation_filename_base(req, db),
             asset_type=req.asset_type,
+            hedge=req.hedge if req.hedge is not None else settings.ROUTER_HEDGE_DEFAULT_ENABLED,
+            project_id=req.project_id,
+            bypass_cache=bool(req.bypass_cache),
         )
         result_meta = result.get("metadata") if isinstance(result, dict) else {}
         if not isinstance(result_meta, dict):
@@ -9654,8 +9929,27 @@ async def _run_generate_image(req: GenerationRequest, current_user: User, db: Se
             media_type="image",
         )
 
-        # Billing Deduct
-        billing_service.deduct_credits(db, current_user.id, "image_gen", req.provider, req.model, {"item": "image"})
+        if not generation_resumer.begin_finalize_current():
+            logger.info(f"[GenerateImage] Generation taken over by another worker, it binds and charges | user_id={current_user.id}")
+            return result
+
+        # Billing Deduct (cache hits and coalesced duplicates reuse an already paid result)
+        if (result_meta.get("generation_cache") or {}).get("hit"):
+            logger.info(f"[GenerateImage] Served from generation cache, no charge | user_id={current_user.id}")
+        elif (result_meta.get("singleflight") or {}).get("shared"):
+            logger.info(f"[GenerateImage] Shared an identical in-flight generation, no charge | user_id={current_user.id}")
+        else:
+            billing_service.deduct_credits(db, current_user.id, "image_gen", req.provider, req.model, {"item": "image"})
+        hedge_info = (result_meta.get("smart_routing") or {}).get("hedge") or {}
+        if hedge_info.get("winner") and hedge_info.get("loser_submitted"):
+            billing_service.log_hedge_overhead(
+                db,
+                current_user.id,
+                "image_gen",
+                hedge_info.get("loser_provider"),
+                hedge_info.get("loser_model"),
+                {"item": "image", "hedge_winner": hedge_info.get("winner"), "hedge_delay_ms": hedge_info.get("delay_ms")},
+            )
         
         # Register Asset
         if result.get("url"):
@@ -9671,16 +9965,24 @@ async def _run_generate_image(req: GenerationRequest, current_user: User, db: Se
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
+def _image_job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job.get("job_id"),
+        "status": job.get("status"),
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "error": job.get("error"),
+        "result": job.get("result"),
+    }
+
+
 def _set_image_job(job_id: str, **fields) -> None:
-    with IMAGE_JOB_LOCK:
-        _prune_image_jobs_locked()
-        current = IMAGE_JOB_STORE.get(job_id, {})
-        if "result" in fields:
-            fields["result"] = _compact_job_result(fields.get("result"))
-        current.update(fields)
-        current["job_id"] = job_id
-        IMAGE_JOB_STORE[job_id] = current
-        _write_image_job_file(job_id, current)
+    if "result" in fields:
+        fields["result"] = _compact_job_result(fields.get("result"))
+    job = image_job_store.update(job_id, **fields)
+    if job is not None:
+        progress_bus.publish(f"image_job:{job_id}", "image_job", _image_job_view(job))
 
 
 async def _run_generate_image_job(job_id: str, user_id: int, req_payload: Dict[str, Any]) -> None:
@@ -9698,7 +10000,7 @@ async def _run_generate_image_job(job_id: str, user_id: int, req_payload: Dict[s
 
         req_obj = GenerationRequest(**req_payload)
         _set_image_job(job_id, status="running", started_at=datetime.utcnow().isoformat())
-        result = await _run_generate_image(req_obj, user, db)
+        result = await _run_generate_image(req_obj, user, db, image_job_id=job_id)
         _set_image_job(
             job_id,
             status="succeeded",
@@ -9731,47 +10033,25 @@ async def submit_generate_image_endpoint(
     current_user: User = Depends(get_current_user),
 ):
     idempotency_key = str(request.headers.get("X-Idempotency-Key") or "").strip()
+    req_payload = req.model_dump()
 
-    if idempotency_key:
-        with IMAGE_JOB_LOCK:
-            _prune_image_jobs_locked()
-            store_key = _build_image_idempotency_store_key(current_user.id, idempotency_key)
-            mapped = IMAGE_SUBMIT_IDEMPOTENCY_STORE.get(store_key) or {}
-            existing_job_id = str(mapped.get("job_id") or "").strip()
-            if existing_job_id:
-                existing_job = dict(IMAGE_JOB_STORE.get(existing_job_id) or {})
-                if existing_job:
-                    return {
-                        "job_id": existing_job_id,
-                        "status": existing_job.get("status") or "queued",
-                        "created_at": existing_job.get("created_at") or datetime.utcnow().isoformat(),
-                        "deduplicated": True,
-                    }
-
-    job_id = uuid.uuid4().hex
-    now = datetime.utcnow().isoformat()
-    _set_image_job(
-        job_id,
-        status="queued",
-        user_id=current_user.id,
+    job, created = image_job_store.create(
+        uuid.uuid4().hex,
+        current_user.id,
         username=current_user.username,
-        created_at=now,
-        started_at=None,
-        finished_at=None,
-        result=None,
-        error=None,
+        request=req_payload,
+        idempotency_key=idempotency_key or None,
     )
+    if not created:
+        return {
+            "job_id": job["job_id"],
+            "status": job.get("status") or "queued",
+            "created_at": job.get("created_at") or datetime.utcnow().isoformat(),
+            "deduplicated": True,
+        }
 
-    if idempotency_key:
-        with IMAGE_JOB_LOCK:
-            store_key = _build_image_idempotency_store_key(current_user.id, idempotency_key)
-            IMAGE_SUBMIT_IDEMPOTENCY_STORE[store_key] = {
-                "job_id": job_id,
-                "created_at": now,
-            }
-
-    asyncio.create_task(_run_generate_image_job(job_id, current_user.id, req.model_dump()))
-    return {"job_id": job_id, "status": "queued", "created_at": now}
+    asyncio.create_task(_run_generate_image_job(job["job_id"], current_user.id, req_payload))
+    return {"job_id": job["job_id"], "status": "queued", "created_at": job["created_at"]}
 
 
 @router.get("/generate/image/jobs/{job_id}")
@@ -9779,22 +10059,7 @@ def get_generate_image_job_status(
     job_id: str,
     current_user: User = Depends(get_current_user),
 ):
-    with IMAGE_JOB_LOCK:
-        job = dict(IMAGE_JOB_STORE.get(job_id) or {})
-
-    if not job:
-        file_job = _read_image_job_file(job_id)
-        if file_job:
-            with IMAGE_JOB_LOCK:
-                IMAGE_JOB_STORE[job_id] = dict(file_job)
-            job = dict(file_job)
-            logger.info(
-                "[ImageJob] recovered from shared file store | job_id=%s status=%s user_id=%s",
-                job_id,
-                job.get("status"),
-                job.get("user_id"),
-            )
-
+    job = image_job_store.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
@@ -9802,15 +10067,142 @@ def get_generate_image_job_status(
     if not current_user.is_superuser and owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    return {
-        "job_id": job.get("job_id"),
-        "status": job.get("status"),
-        "created_at": job.get("created_at"),
-        "started_at": job.get("started_at"),
-        "finished_at": job.get("finished_at"),
-        "error": job.get("error"),
-        "result": job.get("result"),
-    }
+    return _image_job_view(job)
+
+
+# --- Progress push (SSE / WebSocket) ---
+# Clients subscribe to ``episode:<id>``, ``project:<id>`` or ``image_job:<id>`` instead of
+# polling the status endpoints above; each event carries the same payload those return.
+
+def _load_episode_progress(key: str) -> Dict[str, Dict[str, Any]]:
+    with SessionLocal() as db:
+        episode = db.query(Episode).filter(Episode.id == int(key)).first()
+        if not episode:
+            return {}
+        channels: Dict[str, Dict[str, Any]] = {}
+        for channel, read, persist in (
+            ("scene_generation", _read_episode_scene_generation_status, _persist_episode_scene_generation_status),
+            ("ai_shots_batch", _read_scene_ai_shots_batch_status, _persist_scene_ai_shots_batch_status),
+            ("shot_media_batch", _read_shot_media_batch_status, _persist_shot_media_batch_status),
+        ):
+            status_payload = read(episode)
+            if _settle_lost_job_status(status_payload):
+                persist(db, episode, status_payload)
+            channels[channel] = status_payload
+        return channels
+
+
+def _load_project_progress(key: str) -> Dict[str, Dict[str, Any]]:
+    with SessionLocal() as db:
+        project = db.query(Project).filter(Project.id == int(key)).first()
+        return {"episode_scripts": _read_project_episode_scripts_status(project)} if project else {}
+
+
+def _load_image_job_progress(key: str) -> Dict[str, Dict[str, Any]]:
+    job = image_job_store.get(key)
+    return {"image_job": _image_job_view(job)} if job else {}
+
+
+progress_bus.register_loader("episode", _load_episode_progress)
+progress_bus.register_loader("project", _load_project_progress)
+progress_bus.register_loader("image_job", _load_image_job_progress)
+
+
+def _open_progress_topics(authorization: Optional[str], token: Optional[str], topics: str) -> List[str]:
+    """Authenticates a progress stream and checks access to every topic it asks for."""
+    # EventSource and browser WebSockets cannot set headers, so the token may come as ?token=.
+    if str(authorization or "").lower().startswith("bearer "):
+        token = str(authorization)[7:].strip()
+    requested = list(dict.fromkeys(t.strip() for t in str(topics or "").split(",") if t.strip()))
+    if not requested:
+        raise HTTPException(status_code=400, detail="topics is required")
+    if len(requested) > int(settings.PROGRESS_MAX_TOPICS):
+        raise HTTPException(status_code=400, detail=f"At most {settings.PROGRESS_MAX_TOPICS} topics per stream")
+
+    with SessionLocal() as db:
+        current_user = get_current_user(token=str(token or ""), db=db)
+        for topic in requested:
+            prefix, _, key = topic.partition(":")
+            if prefix == "image_job":
+                job = image_job_store.get(key)
+                if not job:
+                    raise HTTPException(status_code=404, detail=f"Job not found: {key}")
+                if not current_user.is_superuser and job.get("user_id") != current_user.id:
+                    raise HTTPException(status_code=403, detail="Not authorized")
+                continue
+            if prefix not in ("episode", "project") or not key.isdigit():
+                raise HTTPException(status_code=400, detail=f"Unknown topic: {topic}")
+            if prefix == "episode":
+                episode = db.query(Episode).filter(Episode.id == int(key)).first()
+                if not episode:
+                    raise HTTPException(status_code=404, detail="Episode not found")
+                _require_project_access(db, episode.project_id, current_user)
+            else:
+                _require_project_access(db, int(key), current_user)
+    return requested
+
+
+async def _prime_progress(topics: List[str]) -> None:
+    # Subscribed already, so the current state of every channel is pushed as the first events.
+    for topic in topics:
+        await asyncio.to_thread(progress_bus.refresh, topic)
+
+
+@router.get("/progress/stream")
+async def stream_progress(request: Request, topics: str, token: Optional[str] = None):
+    """Server-sent progress for batch jobs and image jobs.
+
+    ``topics`` is a comma-separated list of ``episode:<id>``, ``project:<id>`` and
+    ``image_job:<id>``. Each ``status`` event carries ``channel`` (``scene_generation``,
+    ``ai_shots_batch``, ``shot_media_batch``, ``episode_scripts``, ``image_job``), the full
+    status payload as ``data`` and ``eta_seconds``; ``item`` events report one finished shot,
+    scene or episode. The current state of every channel is sent first.
+    """
+    topic_list = await asyncio.to_thread(_open_progress_topics, request.headers.get("Authorization"), token, topics)
+
+    async def _events():
+        sub = progress_bus.subscribe(topic_list)
+        try:
+            await _prime_progress(topic_list)
+            while True:
+                event = await sub.get(timeout=_SSE_KEEPALIVE_SECONDS)
+                if event is not None:
+                    yield _sse_event(event["type"], event)
+                    continue
+                if await request.is_disconnected():
+                    return
+                yield ": keepalive\n\n"
+        finally:
+            sub.close()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/progress/ws")
+async def progress_websocket(websocket: WebSocket, topics: str = "", token: Optional[str] = None):
+    """WebSocket twin of ``/progress/stream``: the same events as JSON messages, plus a
+    ``keepalive`` message when idle. Auth or access failures close with ``4000 + HTTP status``."""
+    await websocket.accept()
+    try:
+        topic_list = await asyncio.to_thread(_open_progress_topics, websocket.headers.get("Authorization"), token, topics)
+    except HTTPException as e:
+        await websocket.close(code=4000 + e.status_code, reason=str(e.detail)[:120])
+        return
+
+    sub = progress_bus.subscribe(topic_list)
+    try:
+        await _prime_progress(topic_list)
+        while True:
+            event = await sub.get(timeout=_SSE_KEEPALIVE_SECONDS)
+            await websocket.send_json(event if event is not None else {"type": "keepalive", "ts": time.time()})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sub.close()
 
 
 # --- User Management ---
@@ -10007,6 +10399,11 @@ async def generate_video_endpoint(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    async with generation_resumer.track("video", current_user.id, req.model_dump()):
+        return await _run_generate_video(req, current_user, db)
+
+
+async def _run_generate_video(req: VideoGenerationRequest, current_user: User, db: Session):
     # Billing
     cost = billing_service.estimate_cost(db, "video_gen", req.provider, req.model)
     billing_service.check_can_proceed(current_user, cost)
@@ -10073,6 +10470,8 @@ async def generate_video_endpoint(
             user_id=current_user.id,
             user_credits=(current_user.credits or 0),
             filename_base=_build_generation_filename_base(req, db),
+            project_id=req.project_id,
+            bypass_cache=bool(req.bypass_cache),
         )
         if "error" in result:
              detail = result["error"]
@@ -10093,13 +10492,20 @@ async def generate_video_endpoint(
             media_type="video",
         )
 
+        if not generation_resumer.begin_finalize_current():
+            logger.info(f"[GenerateVideo] Generation taken over by another worker, it binds and charges | user_id={current_user.id}")
+            return result
+
         # Register Asset
         if result.get("url"):
             _register_asset_helper(db, current_user.id, result["url"], req, result.get("metadata"))
             _bind_generated_media_to_shot(db, current_user, req, result.get("url"))
             
-        # Billing Deduct
-        billing_service.deduct_credits(db, current_user.id, "video_gen", req.provider, req.model, {"duration": req.duration})
+        # Billing Deduct (cache hits reuse an already paid result)
+        if ((result.get("metadata") or {}).get("generation_cache") or {}).get("hit"):
+            logger.info(f"[GenerateVideo] Served from generation cache, no charge | user_id={current_user.id}")
+        else:
+            billing_service.deduct_credits(db, current_user.id, "video_gen", req.provider, req.model, {"duration": req.duration})
 
         return result
     except HTTPException:
@@ -10111,6 +10517,79 @@ async def generate_video_endpoint(
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
 
+@router.post("/callbacks/tasks/{provider}/{nonce}/{token}")
+async def upstream_task_callback(provider: str, nonce: str, token: str, request: Request):
+    """Completion callback from a generation provider; the per-submit path token authenticates it.
+
+    Only the task id and status are used, to poll that task now; the result is read from
+    the provider's task API, never from this body.
+    """
+    provider = str(provider or "").strip().lower()
+    if not task_callbacks.verify(provider, nonce, token):
+        task_callbacks.reject()
+        raise HTTPException(status_code=403, detail="Invalid callback token")
+    try:
+        payload = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+
+    task_id, outcome = media_service.task_callback_outcome(provider, payload)
+    if not task_id:
+        logger.warning(f"[TaskCallback] Unrecognised payload | provider={provider} body={str(payload)[:300]}")
+        raise HTTPException(status_code=400, detail="Unrecognised callback payload")
+    accepted = await asyncio.to_thread(task_callbacks.deliver, provider, task_id, outcome.get("status"))
+    return {"ok": True, "task_id": task_id, "accepted": accepted}
+
+
+async def _resume_generation(record: Dict[str, Any]) -> str:
+    """Finishes a generation whose worker died after submitting it upstream.
+
+    Mirrors the tail of the image/video endpoints: store the media, register the asset,
+    bind it to the shot, charge, and settle the async image job when there is one.
+    """
+    context = record.get("context") or {}
+    req = context.get("request") or {}
+    image_job_id = context.get("image_job_id")
+    is_video = record.get("kind") == "video"
+    action = "video_gen" if is_video else "image_gen"
+
+    result = await media_service.resume_upstream_task(record)
+    if result.get("superseded"):
+        return "superseded"
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == context.get("user_id")).first()
+        if result.get("error") or not user:
+            detail = result.get("error") or "User not found"
+            if result.get("details"):
+                detail = f"{detail}: {result['details']}"
+            logger.error(f"[ResumeGeneration] Failed | record={record.get('id')} task_id={record.get('task_id')} detail={detail}")
+            if user:
+                billing_service.log_failed_transaction(db, user.id, action, req.get("provider"), req.get("model"), detail)
+            if image_job_id:
+                _set_image_job(image_job_id, status="failed", finished_at=datetime.utcnow().isoformat(), error=detail)
+            generation_resumer.finish(record["id"], "failed", detail[:500])
+            return "failed"
+
+        _register_asset_helper(db, user.id, result["url"], req, result.get("metadata"))
+        _bind_generated_media_to_shot(db, user, req, result["url"])
+        if is_video:
+            billing_service.deduct_credits(db, user.id, action, req.get("provider"), req.get("model"), {"duration": req.get("duration")})
+        else:
+            billing_service.deduct_credits(db, user.id, action, req.get("provider"), req.get("model"), {"item": "image"})
+        if image_job_id:
+            _set_image_job(image_job_id, status="succeeded", finished_at=datetime.utcnow().isoformat(), result=result, error=None)
+        logger.info(f"[ResumeGeneration] Completed | record={record.get('id')} task_id={record.get('task_id')} user_id={user.id} url={result['url']}")
+        generation_resumer.finish(record["id"], "completed")
+        return "completed"
+    finally:
+        db.close()
+
+
+generation_resumer.set_handler(_resume_generation)
+
+
 SHOT_MEDIA_BATCH_STATUS_KEY = "shot_media_batch_status"
 
 
@@ -10141,6 +10620,7 @@ def _persist_shot_media_batch_status(db: Session, episode: Episode, status_paylo
     episode.episode_info = info
     db.add(episode)
     db.commit()
+    progress_bus.publish(f"episode:{episode.id}", "shot_media_batch", status_payload)
 
 
 def _parse_shot_tech(shot: Shot) -> Dict[str, Any]:
@@ -10251,245 +10731,377 @@ def _find_previous_shot_end_frame_url(db: Session, episode_id: int, shot_id: int
     return prev_end or None
 
 
-def _run_shot_media_batch_job(episode_id: int, request_payload: Dict[str, Any], user_id: int) -> None:
-    db = SessionLocal()
-    try:
-        episode = db.query(Episode).filter(Episode.id == episode_id).first()
-        user = db.query(User).filter(User.id == user_id).first()
-        if not episode or not user:
-            return
+class _ShotMediaBatchStopped(Exception):
+    pass
 
-        episode_info = episode.episode_info if isinstance(episode.episode_info, dict) else {}
-        e_global_info = episode_info.get("e_global_info", {}) if isinstance(episode_info, dict) else {}
-        global_style = str((e_global_info or {}).get("Global_Style") or "").strip()
-        entity_lookup = _build_project_entity_lookup(db, int(episode.project_id))
 
-        mode = str((request_payload or {}).get("mode") or "keyframes").strip().lower()
-        overwrite_existing = bool((request_payload or {}).get("overwrite_existing"))
-        requested_shot_ids = [int(x) for x in ((request_payload or {}).get("shot_ids") or []) if x]
+def _shot_media_needs(shot: Shot, overwrite_existing: bool) -> Tuple[bool, bool]:
+    """(start frame, end frame) generations a batch would run for ``shot``."""
+    tech = _parse_shot_tech(shot)
+    need_start = overwrite_existing or not str(shot.image_url or "").strip()
+    need_end = overwrite_existing or not str(tech.get("end_frame_url") or "").strip()
+    return (
+        need_start and bool(str(shot.start_frame or shot.video_content or "").strip()),
+        need_end and bool(str(shot.end_frame or "").strip()),
+    )
 
-        shots_query = db.query(Shot).filter(Shot.episode_id == episode_id).order_by(Shot.id.asc())
-        if requested_shot_ids:
-            shots_query = shots_query.filter(Shot.id.in_(requested_shot_ids))
-        target_shots = shots_query.all()
 
-        total = len(target_shots)
-        completed = 0
-        success = 0
-        failed = 0
-        errors: List[str] = []
+def _shot_media_batch_plan(db: Session, episode_id: int, target_shots: List[Shot], overwrite_existing: bool) -> Dict[int, int]:
+    """Continuity edges of a shot media batch: shot id -> id of the shot whose end frame it waits for.
 
-        for shot in target_shots:
-            episode = db.query(Episode).filter(Episode.id == episode_id).first()
-            if not episode:
-                break
-            latest = _read_shot_media_batch_status(episode)
-            if bool(latest.get("stop_requested")):
-                latest["running"] = False
-                latest["completed"] = completed
-                latest["success"] = success
-                latest["failed"] = failed
-                latest["errors"] = errors
-                latest["stopped_by_user"] = True
-                latest["message"] = "Stopped by user request"
-                latest["finished_at"] = datetime.utcnow().isoformat()
-                latest["updated_at"] = latest["finished_at"]
-                _persist_shot_media_batch_status(db, episode, latest)
-                return
+    An auto-referenced start frame (no saved ``ref_image_urls``) is seeded with the previous
+    shot's end frame (``_find_previous_shot_end_frame_url``), so it waits when that shot is in
+    the batch and is about to (re)generate its end frame. Every other shot is independent.
+    """
+    previous: Dict[int, int] = {}
+    prev_id = None
+    for (sid,) in db.query(Shot.id).filter(Shot.episode_id == episode_id).order_by(Shot.id.asc()):
+        if prev_id is not None:
+            previous[int(sid)] = prev_id
+        prev_id = int(sid)
+
+    by_id = {int(s.id): s for s in target_shots}
+    dependencies: Dict[int, int] = {}
+    for shot in target_shots:
+        prev = by_id.get(previous.get(int(shot.id)))
+        if prev is None or isinstance(_parse_shot_tech(shot).get("ref_image_urls"), list):
+            continue
+        if _shot_media_needs(shot, overwrite_existing)[0] and _shot_media_needs(prev, overwrite_existing)[1]:
+            dependencies[int(shot.id)] = int(prev.id)
+    return dependencies
+
+
+async def _shot_media_start_frame(
+    db: Session,
+    user: User,
+    episode: Episode,
+    shot: Shot,
+    entity_lookup: Dict[str, Dict[str, Any]],
+    global_style: str,
+) -> None:
+    tech = _parse_shot_tech(shot)
+    start_prompt_raw = str(shot.start_frame or shot.video_content or "").strip()
+    start_prompt = _inject_shot_prompt_anchors(start_prompt_raw, entity_lookup, global_style)
+    auto_matches = _collect_prompt_entity_ref_images(start_prompt_raw, entity_lookup)
+    start_refs: List[str] = []
+    if isinstance(tech.get("ref_image_urls"), list):
+        saved_refs = [str(x).strip() for x in tech.get("ref_image_urls") or [] if str(x).strip()]
+        deleted_refs = {str(x).strip() for x in tech.get("deleted_ref_urls") or [] if str(x).strip()}
+        new_auto = [url for url in auto_matches if url not in saved_refs and url not in deleted_refs]
+        start_refs = saved_refs + new_auto
+    else:
+        start_refs = list(auto_matches)
+        prev_end = _find_previous_shot_end_frame_url(db, int(episode.id), int(shot.id))
+        if prev_end and prev_end not in start_refs:
+            start_refs.insert(0, prev_end)
+
+    start_refs = [x for x in dict.fromkeys([str(x).strip() for x in start_refs if str(x).strip()]) if x]
+    start_req = GenerationRequest(
+        prompt=start_prompt,
+        ref_image_url=start_refs if start_refs else None,
+        project_id=episode.project_id,
+        shot_id=shot.id,
+        shot_number=shot.shot_id,
+        shot_name=shot.shot_name,
+        asset_type="start_frame",
+    )
+    await generate_image_endpoint(req=start_req, current_user=user, db=db)
+
+
+async def _shot_media_end_frame(
+    db: Session,
+    user: User,
+    episode: Episode,
+    shot: Shot,
+    entity_lookup: Dict[str, Dict[str, Any]],
+    global_style: str,
+) -> None:
+    tech = _parse_shot_tech(shot)
+    end_prompt_raw = str(shot.end_frame or "").strip()
+    end_prompt = _inject_shot_prompt_anchors(end_prompt_raw, entity_lookup, global_style)
+    refs: List[str] = []
+    if isinstance(tech.get("end_ref_image_urls"), list):
+        refs.extend([str(x).strip() for x in tech.get("end_ref_image_urls") or [] if str(x).strip()])
+    else:
+        refs.extend(_collect_prompt_entity_ref_images(end_prompt_raw, entity_lookup))
+
+    deleted_refs = {str(x).strip() for x in tech.get("deleted_ref_urls") or [] if str(x).strip()}
+    start_image = str(shot.image_url or "").strip()
+    if start_image and start_image not in refs and start_image not in deleted_refs:
+        refs.insert(0, start_image)
+
+    refs = [x for x in dict.fromkeys([str(x).strip() for x in refs if str(x).strip()]) if x]
+    end_req = GenerationRequest(
+        prompt=end_prompt,
+        ref_image_url=refs if refs else None,
+        project_id=episode.project_id,
+        shot_id=shot.id,
+        shot_number=shot.shot_id,
+        shot_name=shot.shot_name,
+        asset_type="end_frame",
+    )
+    await generate_image_endpoint(req=end_req, current_user=user, db=db)
 
-            shot_label = str(shot.shot_id or shot.shot_name or f"#{shot.id}")
-            latest["current_shot_id"] = shot.id
-            latest["current_shot_label"] = shot_label
-            latest["message"] = f"Processing shot {shot_label}..."
-            latest["updated_at"] = datetime.utcnow().isoformat()
-            _persist_shot_media_batch_status(db, episode, latest)
 
-            shot_ok = True
+async def _shot_media_video(
+    db: Session,
+    user: User,
+    episode: Episode,
+    shot: Shot,
+    entity_lookup: Dict[str, Dict[str, Any]],
+    global_style: str,
+) -> None:
+    tech = _parse_shot_tech(shot)
+    end_frame_url = str(tech.get("end_frame_url") or "").strip()
+    video_prompt_raw = str(shot.video_content or shot.prompt or "").strip() or "Video motion"
+    video_prompt = _inject_shot_prompt_anchors(video_prompt_raw, entity_lookup, global_style)
+
+    def _resolve_video_mode(payload: Dict[str, Any]) -> str:
+        if payload.get("video_mode_unified"):
+            return str(payload.get("video_mode_unified"))
+        if str(payload.get("video_ref_submit_mode") or "") == "refs_video":
+            return "refs_video"
+        return str(payload.get("video_gen_mode") or "start")
+
+    video_mode = _resolve_video_mode(tech)
+    video_ref_submit_mode = "refs_video" if video_mode == "refs_video" else "auto"
+
+    refs: List[str] = []
+    if video_ref_submit_mode == "refs_video":
+        if isinstance(tech.get("video_ref_image_urls"), list):
+            refs.extend([str(x).strip() for x in tech.get("video_ref_image_urls") or [] if str(x).strip()])
+    elif isinstance(tech.get("video_ref_image_urls"), list):
+        refs.extend([str(x).strip() for x in tech.get("video_ref_image_urls") or [] if str(x).strip()])
+    else:
+        shot_mode = str(tech.get("video_gen_mode") or "").strip().lower()
+        if not shot_mode:
+            end_prompt_len = len(str(shot.end_frame or "").strip())
+            shot_mode = "start_end" if end_frame_url and end_prompt_len >= 3 else "start"
+
+        if shot_mode != "end" and str(shot.image_url or "").strip():
+            refs.append(str(shot.image_url).strip())
+
+        keyframes = tech.get("keyframes")
+        if isinstance(keyframes, list):
+            refs.extend([str(x).strip() for x in keyframes if str(x).strip()])
+
+        if shot_mode == "start_end" and end_frame_url:
+            refs.append(end_frame_url)
+
+    refs = [x for x in dict.fromkeys([str(x).strip() for x in refs if str(x).strip()]) if x]
+
+    final_start_ref = None
+    final_end_ref = None
+    if video_ref_submit_mode == "refs_video":
+        final_start_ref = refs[0] if refs else None
+    elif refs:
+        final_start_ref = refs[0]
+        if len(refs) > 1:
+            final_end_ref = refs[-1]
+
+    duration_val = 5.0
+    try:
+        duration_val = float(str(shot.duration or 5).strip() or 5)
+    except Exception:
+        duration_val = 5.0
+
+    video_req = VideoGenerationRequest(
+        prompt=video_prompt,
+        ref_image_url=final_start_ref,
+        last_frame_url=final_end_ref,
+        duration=duration_val,
+        project_id=episode.project_id,
+        shot_id=shot.id,
+        shot_number=shot.shot_id,
+        shot_name=shot.shot_name,
+        asset_type="video",
+    )
+    await generate_video_endpoint(req=video_req, current_user=user, db=db)
+
+
+async def _run_shot_media_batch(
+    db: Session,
+    episode_id: int,
+    request_payload: Dict[str, Any],
+    user_id: int,
+    job_id: Optional[str] = None,
+) -> None:
+    """Runs a shot media batch as a DAG: shots start as soon as their continuity dependency
+    (see ``_shot_media_batch_plan``) has its end frame, with at most
+    ``SHOT_MEDIA_BATCH_CONCURRENCY`` generations in flight. Each generation step uses its own
+    session; ``db`` is only used for the status payload.
+
+    Finished shots are recorded in the status as ``done_shot_ids``; when the queue runs the
+    same job again (retry, or recovery after a worker died) they are skipped, so nothing is
+    generated or charged twice even with ``overwrite_existing``."""
+    episode = db.query(Episode).filter(Episode.id == episode_id).first()
+    if not episode or not db.query(User.id).filter(User.id == user_id).first():
+        return
+
+    episode_info = episode.episode_info if isinstance(episode.episode_info, dict) else {}
+    e_global_info = episode_info.get("e_global_info", {}) if isinstance(episode_info, dict) else {}
+    global_style = str((e_global_info or {}).get("Global_Style") or "").strip()
+    entity_lookup = _build_project_entity_lookup(db, int(episode.project_id))
+
+    mode = str((request_payload or {}).get("mode") or "keyframes").strip().lower()
+    overwrite_existing = bool((request_payload or {}).get("overwrite_existing"))
+    requested_shot_ids = [int(x) for x in ((request_payload or {}).get("shot_ids") or []) if x]
+
+    shots_query = db.query(Shot).filter(Shot.episode_id == episode_id).order_by(Shot.id.asc())
+    if requested_shot_ids:
+        shots_query = shots_query.filter(Shot.id.in_(requested_shot_ids))
+    target_shots = shots_query.all()
+    total = len(target_shots)
+
+    done_shot_ids: List[int] = []
+    if job_id:
+        previous_status = _read_shot_media_batch_status(episode)
+        if previous_status.get("job_id") == job_id:
+            already_done = {int(x) for x in previous_status.get("done_shot_ids") or []}
+            done_shot_ids = [int(s.id) for s in target_shots if int(s.id) in already_done]
+            target_shots = [s for s in target_shots if int(s.id) not in already_done]
+
+    dependencies = _shot_media_batch_plan(db, episode_id, target_shots, overwrite_existing)
+    plan: List[Tuple[int, str, List[Any]]] = []
+    for shot in target_shots:
+        need_start, need_end = _shot_media_needs(shot, overwrite_existing)
+        need_video = mode == "videos" and (overwrite_existing or not str(shot.video_url or "").strip())
+        steps = [step for step, needed in (
+            (_shot_media_start_frame, need_start),
+            (_shot_media_end_frame, need_end),
+            (_shot_media_video, need_video),
+        ) if needed]
+        plan.append((int(shot.id), str(shot.shot_id or shot.shot_name or f"#{shot.id}"), steps))
+
+    progress = {"completed": len(done_shot_ids), "success": len(done_shot_ids), "failed": 0}
+    errors: List[str] = []
+    in_flight: List[int] = []
+    shot_media: Dict[int, Dict[str, Any]] = {}
+    end_ready = {shot_id: asyncio.Event() for shot_id, _, _ in plan}
+    parallelism = max(1, int(settings.SHOT_MEDIA_BATCH_CONCURRENCY))
+    gate = asyncio.Semaphore(parallelism)
+    status = _EpisodeBatchStatus(db, episode_id, _read_shot_media_batch_status, _persist_shot_media_batch_status)
+
+    async def _step(shot_id: int, shot_label: str, generate) -> None:
+        async with gate:
+            if status.stop_requested():
+                raise _ShotMediaBatchStopped()
+            in_flight.append(shot_id)
             try:
-                tech = _parse_shot_tech(shot)
-                end_frame_url = str(tech.get("end_frame_url") or "").strip()
-
-                need_start = overwrite_existing or not str(shot.image_url or "").strip()
-                need_end = overwrite_existing or not end_frame_url
-
-                if need_start:
-                    start_prompt_raw = str(shot.start_frame or shot.video_content or "").strip()
-                    if start_prompt_raw:
-                        start_prompt = _inject_shot_prompt_anchors(start_prompt_raw, entity_lookup, global_style)
-                        auto_matches = _collect_prompt_entity_ref_images(start_prompt_raw, entity_lookup)
-                        start_refs: List[str] = []
-                        if isinstance(tech.get("ref_image_urls"), list):
-                            saved_refs = [str(x).strip() for x in tech.get("ref_image_urls") or [] if str(x).strip()]
-                            deleted_refs = {str(x).strip() for x in tech.get("deleted_ref_urls") or [] if str(x).strip()}
-                            new_auto = [url for url in auto_matches if url not in saved_refs and url not in deleted_refs]
-                            start_refs = saved_refs + new_auto
-                        else:
-                            start_refs = list(auto_matches)
-                            prev_end = _find_previous_shot_end_frame_url(db, episode_id, int(shot.id))
-                            if prev_end and prev_end not in start_refs:
-                                start_refs.insert(0, prev_end)
-
-                        start_refs = [x for x in dict.fromkeys([str(x).strip() for x in start_refs if str(x).strip()]) if x]
-                        start_req = GenerationRequest(
-                            prompt=start_prompt,
-                            ref_image_url=start_refs if start_refs else None,
-                            project_id=episode.project_id,
-                            shot_id=shot.id,
-                            shot_number=shot.shot_id,
-                            shot_name=shot.shot_name,
-                            asset_type="start_frame",
-                        )
-                        asyncio.run(generate_image_endpoint(req=start_req, current_user=user, db=db))
-                        shot = db.query(Shot).filter(Shot.id == shot.id).first() or shot
-
-                if need_end:
-                    end_prompt_raw = str(shot.end_frame or "").strip()
-                    if end_prompt_raw:
-                        end_prompt = _inject_shot_prompt_anchors(end_prompt_raw, entity_lookup, global_style)
-                        refs: List[str] = []
-                        if isinstance(tech.get("end_ref_image_urls"), list):
-                            refs.extend([str(x).strip() for x in tech.get("end_ref_image_urls") or [] if str(x).strip()])
-                        else:
-                            refs.extend(_collect_prompt_entity_ref_images(end_prompt_raw, entity_lookup))
-
-                        deleted_refs = {str(x).strip() for x in tech.get("deleted_ref_urls") or [] if str(x).strip()}
-                        start_image = str(shot.image_url or "").strip()
-                        if start_image and start_image not in refs and start_image not in deleted_refs:
-                            refs.insert(0, start_image)
-
-                        refs = [x for x in dict.fromkeys([str(x).strip() for x in refs if str(x).strip()]) if x]
-                        end_req = GenerationRequest(
-                            prompt=end_prompt,
-                            ref_image_url=refs if refs else None,
-                            project_id=episode.project_id,
-                            shot_id=shot.id,
-                            shot_number=shot.shot_id,
-                            shot_name=shot.shot_name,
-                            asset_type="end_frame",
-                        )
-                        asyncio.run(generate_image_endpoint(req=end_req, current_user=user, db=db))
-                        shot = db.query(Shot).filter(Shot.id == shot.id).first() or shot
-                        tech = _parse_shot_tech(shot)
-                        end_frame_url = str(tech.get("end_frame_url") or "").strip()
-
-                if mode == "videos":
-                    need_video = overwrite_existing or not str(shot.video_url or "").strip()
-                    if need_video:
-                        video_prompt_raw = str(shot.video_content or shot.prompt or "").strip() or "Video motion"
-                        video_prompt = _inject_shot_prompt_anchors(video_prompt_raw, entity_lookup, global_style)
-
-                        def _resolve_video_mode(payload: Dict[str, Any]) -> str:
-                            if payload.get("video_mode_unified"):
-                                return str(payload.get("video_mode_unified"))
-                            if str(payload.get("video_ref_submit_mode") or "") == "refs_video":
-                                return "refs_video"
-                            return str(payload.get("video_gen_mode") or "start")
-
-                        video_mode = _resolve_video_mode(tech)
-                        video_ref_submit_mode = "refs_video" if video_mode == "refs_video" else "auto"
-
-                        refs: List[str] = []
-                        if video_ref_submit_mode == "refs_video":
-                            if isinstance(tech.get("video_ref_image_urls"), list):
-                                refs.extend([str(x).strip() for x in tech.get("video_ref_image_urls") or [] if str(x).strip()])
-                        elif isinstance(tech.get("video_ref_image_urls"), list):
-                            refs.extend([str(x).strip() for x in tech.get("video_ref_image_urls") or [] if str(x).strip()])
-                        else:
-                            shot_mode = str(tech.get("video_gen_mode") or "").strip().lower()
-                            if not shot_mode:
-                                end_prompt_len = len(str(shot.end_frame or "").strip())
-                                shot_mode = "start_end" if end_frame_url and end_prompt_len >= 3 else "start"
-
-                            if shot_mode != "end" and str(shot.image_url or "").strip():
-                                refs.append(str(shot.image_url).strip())
-
-                            keyframes = tech.get("keyframes")
-                            if isinstance(keyframes, list):
-                                refs.extend([str(x).strip() for x in keyframes if str(x).strip()])
-
-                            if shot_mode == "start_end" and end_frame_url:
-                                refs.append(end_frame_url)
-
-                        refs = [x for x in dict.fromkeys([str(x).strip() for x in refs if str(x).strip()]) if x]
-
-                        final_start_ref = None
-                        final_end_ref = None
-                        if video_ref_submit_mode == "refs_video":
-                            final_start_ref = refs[0] if refs else None
-                        elif refs:
-                            final_start_ref = refs[0]
-                            if len(refs) > 1:
-                                final_end_ref = refs[-1]
-
-                        duration_val = 5.0
-                        try:
-                            duration_val = float(str(shot.duration or 5).strip() or 5)
-                        except Exception:
-                            duration_val = 5.0
-
-                        video_req = VideoGenerationRequest(
-                            prompt=video_prompt,
-                            ref_image_url=final_start_ref,
-                            last_frame_url=final_end_ref,
-                            duration=duration_val,
-                            project_id=episode.project_id,
-                            shot_id=shot.id,
-                            shot_number=shot.shot_id,
-                            shot_name=shot.shot_name,
-                            asset_type="video",
-                        )
-                        asyncio.run(generate_video_endpoint(req=video_req, current_user=user, db=db))
+                status.report(
+                    current_shot_id=shot_id,
+                    current_shot_label=shot_label,
+                    running_shot_ids=list(in_flight),
+                    message=f"Processing shot {shot_label}...",
+                )
+                with SessionLocal() as step_db:
+                    step_user = step_db.query(User).filter(User.id == user_id).first()
+                    step_episode = step_db.query(Episode).filter(Episode.id == episode_id).first()
+                    step_shot = step_db.query(Shot).filter(Shot.id == shot_id).first()
+                    if not step_user or not step_episode or not step_shot:
+                        raise RuntimeError("Shot no longer exists")
+                    await generate(step_db, step_user, step_episode, step_shot, entity_lookup, global_style)
+                    shot_media[shot_id] = {"image_url": step_shot.image_url, "video_url": step_shot.video_url}
+            finally:
+                in_flight.remove(shot_id)
+
+    async def _run_shot(shot_id: int, shot_label: str, steps: List[Any]) -> None:
+        shot_ok = True
+        error = None
+        try:
+            dependency = dependencies.get(shot_id)
+            if dependency is not None:
+                await end_ready[dependency].wait()
+            for generate in steps:
+                await _step(shot_id, shot_label, generate)
+                if generate is _shot_media_end_frame:
+                    # Dependents only need this frame; they need not wait for the video.
+                    end_ready[shot_id].set()
+            progress["success"] += 1
+            done_shot_ids.append(shot_id)
+        except _ShotMediaBatchStopped:
+            return
+        except Exception as e:
+            shot_ok = False
+            progress["failed"] += 1
+            error = str(e)
+            errors.append(f"{shot_label}: {error}")
+        finally:
+            end_ready[shot_id].set()
+
+        progress["completed"] += 1
+        progress_bus.publish_item(f"episode:{episode_id}", "shot_media_batch", {
+            "shot_id": shot_id,
+            "shot_label": shot_label,
+            "ok": shot_ok,
+            "error": error,
+            **shot_media.get(shot_id, {}),
+        })
+        completed = progress["completed"]
+        status.report(
+            **progress,
+            errors=list(errors),
+            running_shot_ids=list(in_flight),
+            done_shot_ids=list(done_shot_ids),
+            message=f"Progress {completed}/{total}" if shot_ok else f"Progress {completed}/{total} (with errors)",
+        )
 
-                success += 1
-            except Exception as e:
-                shot_ok = False
-                failed += 1
-                errors.append(f"{shot_label}: {str(e)}")
+    if done_shot_ids:
+        status.report(**progress, errors=[], message=f"Resuming: {len(done_shot_ids)}/{total} shots already done")
+    status.report(dependencies=len(dependencies), parallelism=parallelism)
+    await asyncio.gather(*(_run_shot(shot_id, shot_label, steps) for shot_id, shot_label, steps in plan))
 
-            completed += 1
-            episode = db.query(Episode).filter(Episode.id == episode_id).first()
-            if not episode:
-                break
-            latest = _read_shot_media_batch_status(episode)
-            latest["completed"] = completed
-            latest["success"] = success
-            latest["failed"] = failed
-            latest["errors"] = errors
-            latest["updated_at"] = datetime.utcnow().isoformat()
-            latest["message"] = (
-                f"Progress {completed}/{total}" if shot_ok else f"Progress {completed}/{total} (with errors)"
-            )
-            _persist_shot_media_batch_status(db, episode, latest)
+    current, final_status = status.latest()
+    if current is None:
+        return
+    final_status.update(progress)
+    final_status["running"] = False
+    final_status["errors"] = errors
+    final_status["running_shot_ids"] = []
+    final_status["updated_at"] = datetime.utcnow().isoformat()
+    final_status["finished_at"] = final_status["updated_at"]
+    if status.stopped:
+        final_status["stopped_by_user"] = True
+        final_status["message"] = "Stopped by user request"
+    else:
+        final_status["message"] = f"Batch done: success {progress['success']}, failed {progress['failed']}"
+    _persist_shot_media_batch_status(db, current, final_status)
 
-        episode = db.query(Episode).filter(Episode.id == episode_id).first()
-        if episode:
-            final_status = _read_shot_media_batch_status(episode)
-            final_status["running"] = False
-            final_status["completed"] = completed
-            final_status["success"] = success
-            final_status["failed"] = failed
-            final_status["errors"] = errors
-            final_status["updated_at"] = datetime.utcnow().isoformat()
-            final_status["finished_at"] = final_status["updated_at"]
-            final_status["message"] = f"Batch done: success {success}, failed {failed}"
-            _persist_shot_media_batch_status(db, episode, final_status)
+
+def _run_shot_media_batch_job(episode_id: int, request_payload: Dict[str, Any], user_id: int, job_id: Optional[str] = None) -> None:
+    db = SessionLocal()
+    try:
+        asyncio.run(_closing_loop_clients(_run_shot_media_batch(db, episode_id, request_payload, user_id, job_id=job_id)))
     except Exception as e:
+        retrying = job_queue.will_retry()
         try:
+            db.rollback()
             episode = db.query(Episode).filter(Episode.id == episode_id).first()
             if episode:
                 status_payload = _read_shot_media_batch_status(episode)
-                status_payload["running"] = False
+                status_payload["running"] = retrying
                 status_payload["updated_at"] = datetime.utcnow().isoformat()
-                status_payload["finished_at"] = status_payload["updated_at"]
-                status_payload["message"] = f"Batch failed: {str(e)}"
+                if not retrying:
+                    status_payload["finished_at"] = status_payload["updated_at"]
+                status_payload["message"] = f"Retrying after error: {str(e)}" if retrying else f"Batch failed: {str(e)}"
                 status_payload["errors"] = list(status_payload.get("errors") or []) + [str(e)]
                 _persist_shot_media_batch_status(db, episode, status_payload)
         except Exception:
             pass
+        if retrying:
+            raise
     finally:
         db.close()
 
 
+def _shot_media_batch_job(job: Dict[str, Any]) -> None:
+    payload = job["payload"]
+    _run_shot_media_batch_job(int(payload["episode_id"]), payload.get("request") or {}, int(job["user_id"]), job_id=job["id"])
+
+
+job_queue.register("shot_media_batch", _shot_media_batch_job)
+
+
 @router.post("/episodes/{episode_id}/shots/batch-media/start", response_model=Dict[str, Any])
 def start_shot_media_batch_job(
     episode_id: int,
@@ -10507,6 +11119,8 @@ def start_shot_media_batch_job(
         raise HTTPException(status_code=400, detail="mode must be 'keyframes' or 'videos'")
 
     latest = _read_shot_media_batch_status(episode)
+    if _settle_lost_job_status(latest):
+        _persist_shot_media_batch_status(db, episode, latest)
     if bool(latest.get("running")):
         raise HTTPException(status_code=409, detail="Shot media batch task is already running")
 
@@ -10532,6 +11146,8 @@ def start_shot_media_batch_job(
         "failed": 0,
         "current_shot_id": None,
         "current_shot_label": "",
+        "running_shot_ids": [],
+        "done_shot_ids": [],
         "message": "Batch task started",
         "errors": [],
         "stop_requested": False,
@@ -10540,15 +11156,17 @@ def start_shot_media_batch_job(
         "started_at": now_iso,
         "updated_at": now_iso,
         "finished_at": None,
+        "job_id": uuid.uuid4().hex,
     }
     _persist_shot_media_batch_status(db, episode, status_payload)
 
-    worker = threading.Thread(
-        target=_run_shot_media_batch_job,
-        args=(episode_id, req.model_dump(), current_user.id),
-        daemon=True,
+    job_queue.enqueue(
+        "shot_media_batch",
+        current_user.id,
+        {"episode_id": episode_id, "request": req.model_dump()},
+        subject=f"episode:{episode_id}",
+        job_id=status_payload["job_id"],
     )
-    worker.start()
     return status_payload
 
 
@@ -10562,7 +11180,10 @@ def get_shot_media_batch_job_status(
     if not episode:
         raise HTTPException(status_code=404, detail="Episode not found")
     _require_project_access(db, episode.project_id, current_user)
-    return _read_shot_media_batch_status(episode)
+    status_payload = _read_shot_media_batch_status(episode)
+    if _settle_lost_job_status(status_payload):
+        _persist_shot_media_batch_status(db, episode, status_payload)
+    return status_payload
 
 
 @router.post("/episodes/{episode_id}/shots/batch-media/stop", response_model=Dict[str, Any])
@@ -10586,6 +11207,9 @@ def stop_shot_media_batch_job(
     status_payload["stop_requested_at"] = now_iso
     status_payload["updated_at"] = now_iso
     status_payload["message"] = "Stop requested"
+    if job_queue.cancel_queued("shot_media_batch", f"episode:{episode_id}"):
+        # Never started, so there is no worker left to acknowledge the stop.
+        _settle_lost_job_status(status_payload)
     _persist_shot_media_batch_status(db, episode, status_payload)
     return status_payload
 
@@ -10746,7 +11370,7 @@ async def analyze_asset_image(
                     ],
                 }
             ]
-            est = billing_service.estimate_input_output_tokens_from_messages(est_messages, output_ratio=1.5)
+            est = billing_service.estimate_input_output_tokens_from_messages(est_messages, output_ratio=1.5, provider=api_setting.provider, model=api_setting.model)
             estimated_image_tokens = 1000
             est_input = int(est.get("input_tokens", 0) or 0) + estimated_image_tokens
             est_output = int((est_input * 3 + 1) // 2) if est_input > 0 else 0
@@ -11079,7 +11703,7 @@ Output MUST be a valid JSON object matching this structure EXACTLY:
         logger.info("Sending request to LLM...")
 
         if billing_service.is_token_pricing(db, "analysis_character", api_setting.provider, api_setting.model):
-            est = billing_service.estimate_input_output_tokens_from_messages(messages, output_ratio=1.5)
+            est = billing_service.estimate_input_output_tokens_from_messages(messages, output_ratio=1.5, provider=api_setting.provider, model=api_setting.model)
             estimated_image_tokens = 1000
             est_input = int(est.get("input_tokens", 0) or 0) + estimated_image_tokens
             est_output = int((est_input * 3 + 1) // 2) if est_input > 0 else 0
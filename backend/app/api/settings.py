@@ -19,6 +19,7 @@ from app.schemas.settings import (
     SystemAPISettingImportRequest,
 )
 from app.api.deps import get_current_user
+from app.services.settings_cache import settings_resolution_cache
 from typing import List, Dict, Tuple
 
 router = APIRouter()
@@ -58,10 +59,11 @@ def _can_manage_system_settings(user: User) -> bool:
     return bool(user.is_superuser)
 
 
-def _ensure_default_system_selection_for_user(db: Session, user_id: int) -> None:
+def _ensure_default_system_selection_for_user(db: Session, user_id: int) -> bool:
+    """Seeds system selections for a user without settings; returns True when rows were added."""
     existing_count = db.query(APISetting).filter(APISetting.user_id == user_id).count()
     if existing_count > 0:
-        return
+        return False
 
     active_system_rows = db.query(SystemAPISetting).filter(
         SystemAPISetting.is_active == True,
@@ -69,7 +71,7 @@ def _ensure_default_system_selection_for_user(db: Session, user_id: int) -> None
     ).order_by(SystemAPISetting.category.asc(), SystemAPISetting.id.desc()).all()
 
     if not active_system_rows:
-        return
+        return False
 
     selected_by_category: Dict[str, SystemAPISetting] = {}
     for row in active_system_rows:
@@ -95,6 +97,7 @@ def _ensure_default_system_selection_for_user(db: Session, user_id: int) -> None
         ))
 
     db.flush()
+    return bool(selected_by_category)
 
 
 def _sync_provider_shared_key(db: Session, user_id: int, provider: str, current_setting_id: int, incoming_api_key: str = None) -> str:
@@ -231,8 +234,10 @@ def get_settings(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    _ensure_default_system_selection_for_user(db, current_user.id)
+    seeded = _ensure_default_system_selection_for_user(db, current_user.id)
     db.commit()
+    if seeded:
+        settings_resolution_cache.invalidate_user(current_user.id)
     settings = db.query(APISetting).filter(APISetting.user_id == current_user.id).all()
     return settings
 
@@ -310,6 +315,7 @@ def update_setting(
     db_setting.api_key = effective_key
 
     db.commit()
+    settings_resolution_cache.invalidate_user(current_user.id)
     db.refresh(db_setting)
     return db_setting
 
@@ -322,8 +328,10 @@ def get_system_settings(
     if not _can_use_system_settings(current_user):
         return []
 
-    _ensure_default_system_selection_for_user(db, current_user.id)
+    seeded = _ensure_default_system_selection_for_user(db, current_user.id)
     db.commit()
+    if seeded:
+        settings_resolution_cache.invalidate_user(current_user.id)
 
     system_settings = db.query(
         SystemAPISetting.id,
@@ -518,6 +526,7 @@ def select_system_setting(
         db.add(selected)
 
     db.commit()
+    settings_resolution_cache.invalidate_user(current_user.id)
     db.refresh(selected)
     return selected
 
@@ -581,6 +590,7 @@ def create_system_setting_for_manage(
         ).update({"is_active": False})
 
     db.commit()
+    settings_resolution_cache.invalidate_system()
     db.refresh(new_setting)
     return new_setting
 
@@ -622,6 +632,7 @@ def update_system_setting_for_manage(
     target.api_key = effective_key
 
     db.commit()
+    settings_resolution_cache.invalidate_system()
     db.refresh(target)
     return target
 
@@ -735,6 +746,7 @@ def import_system_settings_for_manage(
         ).update({"is_active": False}, synchronize_session=False)
 
     db.commit()
+    settings_resolution_cache.invalidate_system()
     return {
         "ok": True,
         "created": created,
@@ -760,6 +772,7 @@ def delete_system_setting_for_manage(
 
     db.delete(target)
     db.commit()
+    settings_resolution_cache.invalidate_system()
     return {"ok": True}
 
 @router.delete("/settings/{setting_id}")
@@ -774,6 +787,7 @@ def delete_setting(
         
     db.delete(setting)
     db.commit()
+    settings_resolution_cache.invalidate_user(current_user.id)
     return {"ok": True}
 
 @router.get("/settings/defaults")
@@ -40,6 +40,110 @@ class Settings(BaseSettings):
     CORS_ALLOW_ORIGIN_REGEX: str = os.getenv("CORS_ALLOW_ORIGIN_REGEX", r"^https://.*\.onrender\.com$")
     MAX_ASSET_UPLOAD_MB: int = int(os.getenv("MAX_ASSET_UPLOAD_MB", "100"))
     MAX_AVATAR_UPLOAD_MB: int = int(os.getenv("MAX_AVATAR_UPLOAD_MB", "5"))
+    MEDIA_CAS_ORPHAN_GRACE_SECONDS: int = int(os.getenv("MEDIA_CAS_ORPHAN_GRACE_SECONDS", "3600")) # media blobs with no alias left are swept after this long
+
+    # Outbound HTTP (provider) connection pools
+    HTTP_POOL_MAX_CONNECTIONS: int = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+    HTTP_POOL_MAX_KEEPALIVE: int = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "60"))
+    HTTP_POOL_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_POOL_CONNECT_TIMEOUT", "15"))
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "1") not in {"0", "false", "False"}
+    HTTP_ROUTE_MEMORY_SECONDS: int = int(os.getenv("HTTP_ROUTE_MEMORY_SECONDS", "600"))  # how long a host's working route (proxy/direct) is reused before re-trying the proxy
+
+    # Upstream task polling (shared poll scheduler)
+    POLLER_MIN_INTERVAL_SECONDS: float = float(os.getenv("POLLER_MIN_INTERVAL_SECONDS", "2"))
+    POLLER_MAX_INTERVAL_SECONDS: float = float(os.getenv("POLLER_MAX_INTERVAL_SECONDS", "15"))
+    POLLER_BACKOFF_FACTOR: float = float(os.getenv("POLLER_BACKOFF_FACTOR", "1.5"))
+    POLLER_MAX_CONCURRENT_CHECKS: int = int(os.getenv("POLLER_MAX_CONCURRENT_CHECKS", "32"))
+
+    # Smart routing health tracking / circuit breakers
+    ROUTER_EWMA_ALPHA: float = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+    ROUTER_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("ROUTER_CIRCUIT_FAILURE_THRESHOLD", "3"))
+    ROUTER_MIN_SAMPLES: int = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+    ROUTER_MIN_SUCCESS_RATE: float = float(os.getenv("ROUTER_MIN_SUCCESS_RATE", "0.4"))
+    ROUTER_CIRCUIT_COOLDOWN_SECONDS: float = float(os.getenv("ROUTER_CIRCUIT_COOLDOWN_SECONDS", "60"))
+    ROUTER_CIRCUIT_MAX_COOLDOWN_SECONDS: float = float(os.getenv("ROUTER_CIRCUIT_MAX_COOLDOWN_SECONDS", "600"))
+    ROUTER_CIRCUIT_HALF_OPEN_PROBES: int = int(os.getenv("ROUTER_CIRCUIT_HALF_OPEN_PROBES", "1")) # attempts let through at once to test a half-open circuit
+    ROUTER_LATENCY_WINDOW: int = int(os.getenv("ROUTER_LATENCY_WINDOW", "100"))
+
+    # Hedged image generation (fire the next fallback once the primary passes its p90)
+    ROUTER_HEDGE_DEFAULT_ENABLED: bool = os.getenv("ROUTER_HEDGE_DEFAULT_ENABLED", "0") not in {"0", "false", "False"}
+    ROUTER_HEDGE_QUANTILE: float = float(os.getenv("ROUTER_HEDGE_QUANTILE", "0.9"))
+    ROUTER_HEDGE_MIN_SAMPLES: int = int(os.getenv("ROUTER_HEDGE_MIN_SAMPLES", "10"))
+    ROUTER_HEDGE_MIN_DELAY_SECONDS: float = float(os.getenv("ROUTER_HEDGE_MIN_DELAY_SECONDS", "3"))
+
+    # Reference image payload cache (base64 encodings keyed by content digest)
+    REF_IMAGE_CACHE_MAX_BYTES: int = int(os.getenv("REF_IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    REF_IMAGE_CACHE_URL_TTL_SECONDS: float = float(os.getenv("REF_IMAGE_CACHE_URL_TTL_SECONDS", "600"))
+    REF_IMAGE_PREFETCH_CONCURRENCY: int = int(os.getenv("REF_IMAGE_PREFETCH_CONCURRENCY", "8"))
+
+    # Reference image preprocessing (Pillow work in a process pool)
+    IMAGE_PREPROCESS_WORKERS: int = int(os.getenv("IMAGE_PREPROCESS_WORKERS", "2")) # 0 = inline
+    IMAGE_PREPROCESS_CACHE_MAX_BYTES: int = int(os.getenv("IMAGE_PREPROCESS_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+    IMAGE_PREPROCESS_JPEG_QUALITY: int = int(os.getenv("IMAGE_PREPROCESS_JPEG_QUALITY", "90"))
+    IMAGE_REF_MAX_EDGE: int = int(os.getenv("IMAGE_REF_MAX_EDGE", "2048")) # default for providers without a known limit
+
+    # Outbound governor (per provider/model/api key concurrency + token buckets)
+    GOVERNOR_ENABLED: bool = os.getenv("GOVERNOR_ENABLED", "1") not in {"0", "false", "False"}
+    GOVERNOR_DEFAULT_MAX_CONCURRENCY: int = int(os.getenv("GOVERNOR_DEFAULT_MAX_CONCURRENCY", "8")) # 0 = unlimited; single calls only, media generations are capped only via GOVERNOR_LIMITS
+    GOVERNOR_DEFAULT_RATE_PER_SECOND: float = float(os.getenv("GOVERNOR_DEFAULT_RATE_PER_SECOND", "2")) # 0 = unlimited
+    GOVERNOR_DEFAULT_BURST: float = float(os.getenv("GOVERNOR_DEFAULT_BURST", "4"))
+    GOVERNOR_LIMITS: str = os.getenv("GOVERNOR_LIMITS", "") # JSON, e.g. {"grsai": {"max_concurrency": 4}, "doubao:model-id": {"rate_per_second": 1}}
+
+    # Resolved API settings cache (invalidated by settings writes; TTL covers other workers)
+    SETTINGS_CACHE_TTL_SECONDS: float = float(os.getenv("SETTINGS_CACHE_TTL_SECONDS", "30")) # 0 = disabled
+
+    # Text-LLM reply cache for call sites that opt in (translate, refine_prompt)
+    LLM_RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", "5000")) # 0 = disabled
+    LLM_RESPONSE_CACHE_MAX_ENTRY_CHARS: int = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRY_CHARS", "20000"))
+    LLM_RESPONSE_CACHE_TTL_SECONDS: int = int(os.getenv("LLM_RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    REFINE_PROMPT_CACHE_TTL_SECONDS: int = int(os.getenv("REFINE_PROMPT_CACHE_TTL_SECONDS", "300")) # refine replies are sampled (temperature 0.7); 0 = never cached
+
+    # Coalesce identical in-flight generate_content / generate_image calls (double clicks, client retries)
+    SINGLEFLIGHT_ENABLED: bool = os.getenv("SINGLEFLIGHT_ENABLED", "1") not in {"0", "false", "False"}
+
+    # Token estimates for credit reservations; the file is produced offline by calibrate_token_estimator.py
+    TOKEN_CALIBRATION_PATH: str = os.getenv("TOKEN_CALIBRATION_PATH", str(BASE_DIR / "app" / "core" / "token_calibration.json"))
+
+    # Async image jobs (/generate/image/submit), stored in the image_jobs table
+    IMAGE_JOB_TTL_SECONDS: int = int(os.getenv("IMAGE_JOB_TTL_SECONDS", "3600")) # finished jobs kept this long (min 300)
+    IMAGE_SUBMIT_IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IMAGE_SUBMIT_IDEMPOTENCY_TTL_SECONDS", "120")) # min 30
+
+    # Resumable generations (submitted upstream task ids persisted so another worker can finish them)
+    RESUME_ENABLED: bool = os.getenv("RESUME_ENABLED", "1") not in {"0", "false", "False"}
+    RESUME_LEASE_SECONDS: float = float(os.getenv("RESUME_LEASE_SECONDS", "90")) # orphaned after this long without a heartbeat
+    RESUME_MAX_AGE_SECONDS: float = float(os.getenv("RESUME_MAX_AGE_SECONDS", str(6 * 3600))) # older tasks are abandoned, not resumed
+    RESUME_MAX_ATTEMPTS: int = int(os.getenv("RESUME_MAX_ATTEMPTS", "3"))
+
+    # Provider completion callbacks (polling stays on as a slow safety net)
+    TASK_CALLBACK_BASE_URL: str = os.getenv("TASK_CALLBACK_BASE_URL", os.getenv("RENDER_EXTERNAL_URL", "")) # public URL of this API; empty = callbacks off
+    TASK_CALLBACK_SAFETY_POLL_SECONDS: float = float(os.getenv("TASK_CALLBACK_SAFETY_POLL_SECONDS", "30"))
+    TASK_CALLBACK_INBOX_POLL_SECONDS: float = float(os.getenv("TASK_CALLBACK_INBOX_POLL_SECONDS", "5")) # how often waiters look for a callback stored by another worker
+    TASK_CALLBACK_RETENTION_SECONDS: int = int(os.getenv("TASK_CALLBACK_RETENTION_SECONDS", "86400"))
+
+    # Background jobs (batch generation), stored in the background_jobs table
+    JOB_WORKER_MODE: str = os.getenv("JOB_WORKER_MODE", "inprocess") # inprocess | external (run `python -m app.worker`)
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "4")) # worker threads per process
+    JOB_PER_USER_CONCURRENCY: int = int(os.getenv("JOB_PER_USER_CONCURRENCY", "2")) # running jobs per user across all workers; 0 = no cap
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_BACKOFF_SECONDS: float = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30")) # doubles per attempt
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", "90")) # a running job is recovered after this long without a heartbeat
+    JOB_POLL_SECONDS: float = float(os.getenv("JOB_POLL_SECONDS", "2"))
+    JOB_SHUTDOWN_GRACE_SECONDS: float = float(os.getenv("JOB_SHUTDOWN_GRACE_SECONDS", "20")) # API shutdown waits this long for running jobs; keep under the host's kill timeout
+    JOB_RETENTION_SECONDS: int = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600))) # finished jobs kept this long
+    SHOT_MEDIA_BATCH_CONCURRENCY: int = int(os.getenv("SHOT_MEDIA_BATCH_CONCURRENCY", "4")) # generations in flight per shot media batch
+    SCENE_AI_SHOTS_BATCH_CONCURRENCY: int = int(os.getenv("SCENE_AI_SHOTS_BATCH_CONCURRENCY", "4")) # LLM calls in flight per scene AI-shots batch
+    EPISODE_SCRIPT_MAX_CONCURRENCY: int = int(os.getenv("EPISODE_SCRIPT_MAX_CONCURRENCY", "6")) # cap on the concurrency a project episode-scripts run may ask for
+
+    # Progress push (/progress/stream SSE and /progress/ws) for batch status and image jobs
+    PROGRESS_REFRESH_SECONDS: float = float(os.getenv("PROGRESS_REFRESH_SECONDS", "3")) # re-read watched topics this often to catch other processes' writes; 0 = off
+    PROGRESS_SUBSCRIBER_QUEUE: int = int(os.getenv("PROGRESS_SUBSCRIBER_QUEUE", "256")) # events buffered per connection before the oldest are dropped
+    PROGRESS_MAX_TOPICS: int = int(os.getenv("PROGRESS_MAX_TOPICS", "20")) # topics one connection may subscribe to
+
+    # Exact-match generation result cache (opt-in)
+    GENERATION_CACHE_ENABLED: bool = os.getenv("GENERATION_CACHE_ENABLED", "0") not in {"0", "false", "False"}
+    GENERATION_CACHE_TTL_SECONDS: int = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    GENERATION_CACHE_SCOPE: str = os.getenv("GENERATION_CACHE_SCOPE", "project") # project | user
 
     # Email (Password Reset)
     SMTP_HOST: str = os.getenv("SMTP_HOST", "")
@@ -2,7 +2,8 @@
 import logging
 import bcrypt
 import os
-from sqlalchemy import text, inspect
+import json
+from sqlalchemy import text, inspect, cast, String
 from app.db.session import engine, SessionLocal
 from app.models.all_models import PricingRule, APISetting, User, SystemAPISetting
 
@@ -488,6 +489,29 @@ def cleanup_api_settings_active_conflicts(db):
         logger.info("API settings cleanup: no duplicate active rows found.")
 
 
+def repair_invalid_api_setting_configs(db):
+    """
+    Reset api_settings/system_api_settings rows whose config column is not a JSON object.
+    Runtime settings resolution assumes dict configs; this used to run on every
+    generation/LLM call and now runs once at startup. Safe to run repeatedly.
+    """
+    def _is_valid(raw) -> bool:
+        if raw is None or not str(raw).strip():
+            return True
+        try:
+            return isinstance(json.loads(raw), dict)
+        except Exception:
+            return False
+
+    for model, table in ((APISetting, "api_settings"), (SystemAPISetting, "system_api_settings")):
+        rows = db.query(model.id, cast(model.config, String).label("config_raw")).all()
+        bad_ids = [row.id for row in rows if not _is_valid(row.config_raw)]
+        if bad_ids:
+            db.query(model).filter(model.id.in_(bad_ids)).update({model.config: {}}, synchronize_session=False)
+            db.commit()
+            logger.warning("Repaired invalid %s.config rows | ids=%s", table, bad_ids)
+
+
 def normalize_grsai_user_api_settings(db):
     """Normalize legacy grsai rows in user-scoped api_settings."""
 
@@ -711,6 +735,7 @@ def init_initial_data():
     db = SessionLocal()
     try:
         init_pricing_rules(db)
+        repair_invalid_api_setting_configs(db)
         if _should_manage_api_settings_on_init():
             init_api_settings(db)
             cleanup_api_settings_active_conflicts(db)
@@ -1,4 +1,5 @@
 
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
@@ -11,6 +12,12 @@ from app.db.session import engine
 from app.models.all_models import Base
 from app.core.logging import LoggingMiddleware, logger, configure_uvicorn_logging_noise_reduction
 from app.db.init_db import check_and_migrate_tables, create_default_superuser, init_initial_data
+from app.services.http_transport import http_transport
+from app.services.generation_cache import generation_cache
+from app.services.image_preprocess import image_preprocessor
+from app.services.generation_resume import generation_resumer
+from app.services.job_queue import job_queue
+from app.services.progress_bus import progress_bus
 from fastapi import Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
@@ -30,7 +37,21 @@ limiter = Limiter(key_func=get_remote_address)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     configure_uvicorn_logging_noise_reduction()
+    if generation_cache.enabled:
+        try:
+            generation_cache.purge_expired()
+        except Exception as e:
+            logger.warning(f"Generation cache purge skipped: {e}")
+    generation_resumer.start()
+    if job_queue.in_process:
+        job_queue.start()
     yield
+    # Waiting out the shutdown grace period polls; keep it off the event loop.
+    await asyncio.to_thread(job_queue.stop)
+    progress_bus.stop()
+    await generation_resumer.stop()
+    await http_transport.aclose()
+    image_preprocessor.shutdown()
 
 
 app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, JSON, Boolean, Float
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, JSON, Boolean, Float, UniqueConstraint
 from sqlalchemy.orm import relationship
 from app.db.session import Base
 import datetime
@@ -312,3 +312,102 @@ class PaymentOrder(Base):
     paid_at = Column(String, nullable=True)
     
     user = relationship("User")
+
+class GenerationCacheEntry(Base):
+    __tablename__ = "generation_cache"
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String, unique=True, index=True) # sha256 of scope + normalized request
+    scope = Column(String, index=True) # "user:<id>" or "project:<id>"
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    project_id = Column(Integer, nullable=True)
+
+    category = Column(String) # Image, Video
+    provider = Column(String, nullable=True)
+    model = Column(String, nullable=True)
+    content_digest = Column(String, index=True) # media_store blob
+    content_ext = Column(String)
+    meta_info = Column(JSON, default={})
+    hit_count = Column(Integer, default=0)
+
+    created_at = Column(String, default=lambda: datetime.datetime.utcnow().isoformat())
+    expires_at = Column(Float, index=True) # epoch seconds
+
+
+class ImageJob(Base):
+    __tablename__ = "image_jobs"
+    # One live reservation per (user, X-Idempotency-Key); NULL keys never collide.
+    __table_args__ = (UniqueConstraint("user_id", "idempotency_key", name="uq_image_jobs_user_idempotency"),)
+
+    job_id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    username = Column(String, nullable=True)
+    status = Column(String, index=True) # queued, running, succeeded, failed
+    idempotency_key = Column(String, nullable=True)
+    idempotency_expires_at = Column(Float, nullable=True) # epoch seconds
+
+    request = Column(JSON, nullable=True) # GenerationRequest payload
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(String, index=True)
+    started_at = Column(String, nullable=True)
+    finished_at = Column(String, nullable=True)
+    expires_at = Column(Float, nullable=True, index=True) # epoch seconds, set once the job finishes
+
+
+class UpstreamTask(Base):
+    __tablename__ = "upstream_tasks"
+    id = Column(String, primary_key=True)
+    generation_id = Column(String, index=True) # groups the attempts (fallbacks, hedges) of one request
+    kind = Column(String) # image, video
+    provider = Column(String)
+    task_id = Column(String, index=True)
+    status = Column(String, index=True) # polling, upstream_done, finalizing, completed, failed, abandoned, superseded
+
+    poll = Column(JSON, default={}) # protocol + poll URL; the API key is referenced by sha256 only
+    context = Column(JSON, default={}) # user_id, request payload, filename_base, image_job_id
+    result_url = Column(String, nullable=True) # upstream media URL once the task finished
+    error = Column(Text, nullable=True)
+
+    owner = Column(String, nullable=True) # worker holding the lease
+    lease_expires_at = Column(Float, index=True) # epoch seconds
+    resume_attempts = Column(Integer, default=0)
+    deadline = Column(Float) # epoch seconds the original poll would have given up
+    created_at = Column(Float, index=True)
+    updated_at = Column(Float)
+
+
+class UpstreamCallback(Base):
+    __tablename__ = "upstream_callbacks"
+    __table_args__ = (UniqueConstraint("provider", "task_id", name="uq_upstream_callbacks_provider_task"),)
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String) # task poller provider key (doubao, vidu, wanxiang)
+    task_id = Column(String)
+    status = Column(String) # done, failed
+    outcome = Column(JSON, default={}) # {"status"} only; results are always confirmed by polling
+    received_at = Column(Float, index=True) # epoch seconds
+
+
+class BackgroundJob(Base):
+    __tablename__ = "background_jobs"
+    id = Column(String, primary_key=True)
+    kind = Column(String, index=True) # registered handler, e.g. shot_media_batch
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    subject = Column(String, nullable=True, index=True) # what the job works on, e.g. episode:12
+    priority = Column(Integer, default=0) # higher runs first
+    status = Column(String, index=True) # queued, running, succeeded, failed, canceled
+
+    payload = Column(JSON, default={})
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=1)
+    run_after = Column(Float, index=True) # epoch seconds; retries are pushed back here
+
+    owner = Column(String, nullable=True) # worker holding the lease
+    lease_expires_at = Column(Float, index=True) # epoch seconds
+    created_at = Column(Float, index=True)
+    started_at = Column(Float, nullable=True)
+    finished_at = Column(Float, nullable=True)
+    updated_at = Column(Float)
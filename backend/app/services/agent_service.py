@@ -1,10 +1,8 @@
 
-import requests
 import re
 import urllib3
 import time
 import base64
-import json
 import hashlib
 import hmac
 import asyncio
@@ -20,8 +18,8 @@ from app.db.session import SessionLocal
 from app.models.all_models import APISetting, SystemAPISetting, Entity, User
 from app.core.config import settings
 from app.services.billing_service import billing_service
+from app.services.settings_cache import settings_resolution_cache
 from sqlalchemy.orm import Session
-from sqlalchemy import cast, String
 # from app.db.session import db as legacy_db 
 # Mock legacy_db to prevent import error during refactor
 class MockLegacyDB:
@@ -35,88 +33,29 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 logger = logging.getLogger(__name__)
 
 class AgentService:
-    def _safe_json_dict_or_none(self, value: Any) -> Optional[Dict[str, Any]]:
-        if value is None:
-            return {}
-        if isinstance(value, dict):
-            return value
-        if isinstance(value, str):
-            raw = value.strip()
-            if not raw:
-                return None
-            try:
-                parsed = json.loads(raw)
-            except Exception:
-                return None
-            return parsed if isinstance(parsed, dict) else None
-        return None
-
-    def _repair_invalid_user_config_rows(
-        self,
-        session: Session,
-        user_id: int,
-        category: Optional[str] = None,
-        provider: Optional[str] = None,
-    ) -> None:
-        q = session.query(
-            APISetting.id,
-            cast(APISetting.config, String).label("config_raw"),
-        ).filter(APISetting.user_id == user_id)
-        if category:
-            q = q.filter(APISetting.category == category)
-        if provider:
-            q = q.filter(APISetting.provider == provider)
-
-        bad_ids: List[int] = []
-        for row in q.all():
-            if self._safe_json_dict_or_none(row.config_raw) is None:
-                bad_ids.append(row.id)
-
-        if bad_ids:
-            logger.warning(
-                "Repair invalid api_settings.config rows | user_id=%s category=%s provider=%s ids=%s",
-                user_id,
-                category,
-                provider,
-                bad_ids,
-            )
-            session.query(APISetting).filter(APISetting.id.in_(bad_ids)).update(
-                {APISetting.config: {}},
-                synchronize_session=False,
-            )
-            session.commit()
-
-    def _repair_invalid_system_config_rows(self, session: Session, category: Optional[str] = None) -> None:
-        q = session.query(
-            SystemAPISetting.id,
-            cast(SystemAPISetting.config, String).label("config_raw"),
-        )
-        if category:
-            q = q.filter(SystemAPISetting.category == category)
-
-        bad_ids: List[int] = []
-        for row in q.all():
-            if self._safe_json_dict_or_none(row.config_raw) is None:
-                bad_ids.append(row.id)
-
-        if bad_ids:
-            logger.warning(
-                "Repair invalid system_api_settings.config rows | category=%s ids=%s",
-                category,
-                bad_ids,
-            )
-            session.query(SystemAPISetting).filter(SystemAPISetting.id.in_(bad_ids)).update(
-                {SystemAPISetting.config: {}},
-                synchronize_session=False,
-            )
-            session.commit()
-
     def get_api_config(self, provider: str, user_id: int = 1, category: Optional[str] = None) -> Dict[str, Any]:
         """
         Resolves API configuration by:
         1) finding user's active api_settings row in the given category,
         2) using that row's provider+model to match system_api_settings.
         """
+        resolved_category = str(category or "").strip()
+        if not resolved_category:
+            logger.warning("Missing category when resolving API config | user_id=%s", user_id)
+            return {}
+
+        try:
+            return settings_resolution_cache.get_or_load(
+                ("agent_api_config", str(user_id), resolved_category),
+                settings_resolution_cache.user_scope(user_id),
+                lambda: self._resolve_api_config(user_id, resolved_category),
+            )
+        except Exception as e:
+            logger.error(f"Error fetching system settings for {provider}: {e}")
+
+        return {}
+
+    def _resolve_api_config(self, user_id: int, resolved_category: str) -> Dict[str, Any]:
         defaults = {
             "openai": {"base_url": "https://api.openai.com/v1", "model": "gpt-4-turbo-preview"},
             "anthropic": {"base_url": "https://api.anthropic.com", "model": "claude-3-opus-20240229"},
@@ -129,67 +68,55 @@ class AgentService:
             "tencent": {"base_url": "https://hunyuan.tencentcloudapi.com", "model": "hunyuan-vision"},
         }
 
-        try:
-            with SessionLocal() as session:
-                resolved_category = str(category or "").strip()
-                if not resolved_category:
-                    logger.warning("Missing category when resolving API config | user_id=%s", user_id)
-                    return {}
-
-                self._repair_invalid_user_config_rows(session, user_id, category=resolved_category)
-                self._repair_invalid_system_config_rows(session, category=resolved_category)
-
-                active_user_setting = session.query(APISetting).filter(
-                    APISetting.user_id == user_id,
-                    APISetting.category == resolved_category,
-                    APISetting.is_active == True,
-                ).order_by(APISetting.id.desc()).first()
-
-                if not active_user_setting:
-                    logger.warning(
-                        "No active user api setting found | user_id=%s category=%s",
-                        user_id,
-                        resolved_category,
-                    )
-                    return {}
-
-                target_provider = str(active_user_setting.provider or "").strip()
-                target_model = str(active_user_setting.model or "").strip()
-                if not target_provider or not target_model:
-                    logger.warning(
-                        "Active user setting missing provider/model | user_id=%s category=%s setting_id=%s provider=%s model=%s",
-                        user_id,
-                        resolved_category,
-                        active_user_setting.id,
-                        active_user_setting.provider,
-                        active_user_setting.model,
-                    )
-                    return {}
-
-                setting = session.query(SystemAPISetting).filter(
-                    SystemAPISetting.category == resolved_category,
-                    SystemAPISetting.provider == target_provider,
-                    SystemAPISetting.model == target_model,
-                ).order_by(SystemAPISetting.id.desc()).first()
+        with SessionLocal() as session:
+            active_user_setting = session.query(APISetting).filter(
+                APISetting.user_id == user_id,
+                APISetting.category == resolved_category,
+                APISetting.is_active == True,
+            ).order_by(APISetting.id.desc()).first()
 
-                if setting:
-                    return {
-                        "provider": setting.provider,
-                        "api_key": setting.api_key,
-                        "base_url": setting.base_url or defaults.get(target_provider, {}).get("base_url"),
-                        "model": setting.model or defaults.get(target_provider, {}).get("model"),
-                        "config": setting.config or {}
-                    }
+            if not active_user_setting:
                 logger.warning(
-                    "No matching system api setting by provider+model | user_id=%s category=%s provider=%s model=%s",
+                    "No active user api setting found | user_id=%s category=%s",
                     user_id,
                     resolved_category,
-                    target_provider,
-                    target_model,
                 )
-        except Exception as e:
-            logger.error(f"Error fetching system settings for {provider}: {e}")
+                return {}
 
+            target_provider = str(active_user_setting.provider or "").strip()
+            target_model = str(active_user_setting.model or "").strip()
+            if not target_provider or not target_model:
+                logger.warning(
+                    "Active user setting missing provider/model | user_id=%s category=%s setting_id=%s provider=%s model=%s",
+                    user_id,
+                    resolved_category,
+                    active_user_setting.id,
+                    active_user_setting.provider,
+                    active_user_setting.model,
+                )
+                return {}
+
+            setting = session.query(SystemAPISetting).filter(
+                SystemAPISetting.category == resolved_category,
+                SystemAPISetting.provider == target_provider,
+                SystemAPISetting.model == target_model,
+            ).order_by(SystemAPISetting.id.desc()).first()
+
+            if setting:
+                return {
+                    "provider": setting.provider,
+                    "api_key": setting.api_key,
+                    "base_url": setting.base_url or defaults.get(target_provider, {}).get("base_url"),
+                    "model": setting.model or defaults.get(target_provider, {}).get("model"),
+                    "config": setting.config or {}
+                }
+            logger.warning(
+                "No matching system api setting by provider+model | user_id=%s category=%s provider=%s model=%s",
+                user_id,
+                resolved_category,
+                target_provider,
+                target_model,
+            )
         return {}
 
     def get_active_llm_config(self, user_id: int = 1, category: str = "LLM") -> Dict[str, Any]:
@@ -197,108 +124,112 @@ class AgentService:
         Retrieves active API configuration by category by matching
         active user api_settings(provider+model) -> system_api_settings.
         """
+        resolved_category = str(category or "LLM").strip() or "LLM"
         try:
-            with SessionLocal() as session:
-                resolved_category = str(category or "LLM").strip() or "LLM"
-
-                self._repair_invalid_user_config_rows(session, user_id, category=resolved_category)
-                self._repair_invalid_system_config_rows(session, category=resolved_category)
-
-                def _is_endpoint_compatible(cfg: Dict[str, Any]) -> bool:
-                    endpoint = str((cfg or {}).get("endpoint") or "").strip().lower()
-                    if not endpoint:
-                        return True
-                    if resolved_category != "LLM":
-                        return True
-                    if "/chat/completions" in endpoint:
-                        return True
-                    media_tokens = ["/draw", "/video", "image2video", "video-synthesis", "generations/tasks"]
-                    return not any(token in endpoint for token in media_tokens)
-
-                active_user_setting = session.query(APISetting).filter(
-                    APISetting.user_id == user_id,
-                    APISetting.category == resolved_category,
-                    APISetting.is_active == True
-                ).order_by(APISetting.id.desc()).first()
-
-                if not active_user_setting:
-                    logger.warning(
-                        "No active user api setting found | user_id=%s category=%s",
-                        user_id,
-                        resolved_category,
-                    )
-                    return {}
+            return settings_resolution_cache.get_or_load(
+                ("active_llm_config", str(user_id), resolved_category),
+                settings_resolution_cache.user_scope(user_id),
+                lambda: self._resolve_active_llm_config(user_id, resolved_category),
+            )
+        except Exception as e:
+            logger.error(f"Error fetching active API config ({category}): {e}")
 
-                selected: Optional[SystemAPISetting] = None
-                selected_source = "none"
+        return {}
 
-                target_provider = active_user_setting.provider if active_user_setting else None
-                target_model = active_user_setting.model if active_user_setting else None
+    def _resolve_active_llm_config(self, user_id: int, resolved_category: str) -> Dict[str, Any]:
+        with SessionLocal() as session:
+            def _is_endpoint_compatible(cfg: Dict[str, Any]) -> bool:
+                endpoint = str((cfg or {}).get("endpoint") or "").strip().lower()
+                if not endpoint:
+                    return True
+                if resolved_category != "LLM":
+                    return True
+                if "/chat/completions" in endpoint:
+                    return True
+                media_tokens = ["/draw", "/video", "image2video", "video-synthesis", "generations/tasks"]
+                return not any(token in endpoint for token in media_tokens)
+
+            active_user_setting = session.query(APISetting).filter(
+                APISetting.user_id == user_id,
+                APISetting.category == resolved_category,
+                APISetting.is_active == True
+            ).order_by(APISetting.id.desc()).first()
+
+            if not active_user_setting:
+                logger.warning(
+                    "No active user api setting found | user_id=%s category=%s",
+                    user_id,
+                    resolved_category,
+                )
+                return {}
 
-                if target_provider and target_model:
-                    selected = session.query(SystemAPISetting).filter(
-                        SystemAPISetting.category == resolved_category,
-                        SystemAPISetting.provider == target_provider,
-                        SystemAPISetting.model == target_model,
-                    ).order_by(SystemAPISetting.id.desc()).first()
-                    if selected:
-                        selected_source = f"system_by_user_provider_model:{target_provider}/{target_model}->{selected.id}"
+            selected: Optional[SystemAPISetting] = None
+            selected_source = "none"
 
-                if not selected and active_user_setting:
-                    logger.warning(
-                        "No matching system api setting by provider+model | user_id=%s category=%s user_setting_id=%s provider=%s model=%s",
-                        user_id,
-                        resolved_category,
-                        active_user_setting.id,
-                        target_provider,
-                        target_model,
-                    )
+            target_provider = active_user_setting.provider if active_user_setting else None
+            target_model = active_user_setting.model if active_user_setting else None
 
+            if target_provider and target_model:
+                selected = session.query(SystemAPISetting).filter(
+                    SystemAPISetting.category == resolved_category,
+                    SystemAPISetting.provider == target_provider,
+                    SystemAPISetting.model == target_model,
+                ).order_by(SystemAPISetting.id.desc()).first()
                 if selected:
-                    if not _is_endpoint_compatible(selected.config or {}):
-                        logger.warning(
-                            "Skipping incompatible %s setting | user_id=%s setting_id=%s provider=%s model=%s endpoint=%s",
-                            resolved_category,
-                            user_id,
-                            selected.id,
-                            selected.provider,
-                            selected.model,
-                            (selected.config or {}).get("endpoint"),
-                        )
-                        selected = None
+                    selected_source = f"system_by_user_provider_model:{target_provider}/{target_model}->{selected.id}"
 
-                if selected:
-                    from app.api.settings import DEFAULTS
-                    default = DEFAULTS.get(selected.provider, {})
-                    merged_config = dict(selected.config or default.get("config", {}) or {})
-                    merged_config["__resolved_setting_id"] = selected.id
-                    merged_config["__resolved_source"] = selected_source
-                    merged_config["__resolved_category"] = getattr(selected, "category", resolved_category)
-                    merged_config["__selection_source"] = "system_only"
-                    if active_user_setting:
-                        merged_config["__resolved_user_setting_id"] = active_user_setting.id
-
-                    logger.info(
-                        "Resolved active API config | user_id=%s category=%s source=%s selection_source=system_only setting_id=%s provider=%s model=%s endpoint=%s",
-                        user_id,
+            if not selected and active_user_setting:
+                logger.warning(
+                    "No matching system api setting by provider+model | user_id=%s category=%s user_setting_id=%s provider=%s model=%s",
+                    user_id,
+                    resolved_category,
+                    active_user_setting.id,
+                    target_provider,
+                    target_model,
+                )
+
+            if selected:
+                if not _is_endpoint_compatible(selected.config or {}):
+                    logger.warning(
+                        "Skipping incompatible %s setting | user_id=%s setting_id=%s provider=%s model=%s endpoint=%s",
                         resolved_category,
-                        selected_source,
+                        user_id,
                         selected.id,
                         selected.provider,
                         selected.model,
-                        selected.base_url or default.get("base_url"),
+                        (selected.config or {}).get("endpoint"),
                     )
+                    selected = None
+
+            if selected:
+                from app.api.settings import DEFAULTS
+                default = DEFAULTS.get(selected.provider, {})
+                merged_config = dict(selected.config or default.get("config", {}) or {})
+                merged_config["__resolved_setting_id"] = selected.id
+                merged_config["__resolved_source"] = selected_source
+                merged_config["__resolved_category"] = getattr(selected, "category", resolved_category)
+                merged_config["__selection_source"] = "system_only"
+                if active_user_setting:
+                    merged_config["__resolved_user_setting_id"] = active_user_setting.id
+
+                logger.info(
+                    "Resolved active API config | user_id=%s category=%s source=%s selection_source=system_only setting_id=%s provider=%s model=%s endpoint=%s",
+                    user_id,
+                    resolved_category,
+                    selected_source,
+                    selected.id,
+                    selected.provider,
+                    selected.model,
+                    selected.base_url or default.get("base_url"),
+                )
 
-                    return {
-                        "provider": selected.provider,
-                        "api_key": selected.api_key,
-                        "base_url": selected.base_url or default.get("base_url"),
-                        "model": selected.model or default.get("model"),
-                        "config": merged_config
-                    }
-        except Exception as e:
-            logger.error(f"Error fetching active API config ({category}): {e}")
-
+                return {
+                    "provider": selected.provider,
+                    "api_key": selected.api_key,
+                    "base_url": selected.base_url or default.get("base_url"),
+                    "model": selected.model or default.get("model"),
+                    "config": merged_config
+                }
         return {}
 
     async def process_command(self, request: AgentRequest, db: Session, user_id: int) -> AgentResponse:
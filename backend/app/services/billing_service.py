@@ -1,10 +1,10 @@
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 from app.models.all_models import User, PricingRule, TransactionHistory
+from app.services.token_estimator import token_estimator
 from fastapi import HTTPException
 import logging
-import math
-import re
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -32,23 +32,19 @@ class BillingService:
         return out
 
     @staticmethod
-    def _estimate_tokens_from_text(text: str) -> int:
-        if not text:
-            return 0
-
-        # Normalize whitespace; bytes-based heuristic works reasonably across CJK/EN.
-        normalized = re.sub(r"\s+", " ", str(text)).strip()
-        if not normalized:
-            return 0
-
-        # Heuristic: ~4 bytes per token on average.
-        return max(1, int(math.ceil(len(normalized.encode("utf-8")) / 4.0)))
+    def _estimate_tokens_from_text(text: str, provider: str = None, model: str = None) -> int:
+        # Per-script-class character counts; uncalibrated this is the ~4 bytes/token heuristic.
+        return token_estimator.estimate_text_tokens(text, provider, model)
 
     @staticmethod
     def estimate_input_output_tokens_from_messages(
         messages: List[Dict[str, Any]],
-        output_ratio: float = 1.5
-    ) -> Dict[str, int]:
+        output_ratio: float = 1.5,
+        provider: str = None,
+        model: str = None,
+        task_type: str = None,
+        item: str = None,
+    ) -> Dict[str, Any]:
         """
         Estimates token usage based on the *actual system/user prompts* we send.
         Output tokens are estimated as input_tokens * output_ratio.
@@ -56,43 +52,65 @@ class BillingService:
         Notes:
         - Counts only textual parts for multimodal messages.
         - Adds a small per-message overhead to reduce underestimation.
+        - With provider/model (and task_type/item) the calibrated profile from
+          ``token_estimator`` is used, including a learned output ratio for the task;
+          ``output_ratio`` is the fallback. The ratio used is returned as ``output_ratio``.
         """
-        input_tokens = 0
-        overhead_per_message = 4
-
-        for msg in messages or []:
-            input_tokens += overhead_per_message
-            content = msg.get("content")
-
-            if isinstance(content, str):
-                input_tokens += BillingService._estimate_tokens_from_text(content)
-                continue
-
-            # Multimodal / structured content
-            if isinstance(content, list):
-                for part in content:
-                    if not isinstance(part, dict):
-                        continue
-                    # OpenAI: {type: text, text: "..."}
-                    if part.get("type") == "text" and "text" in part:
-                        input_tokens += BillingService._estimate_tokens_from_text(part.get("text"))
-                    # Ark/Doubao style: {type: input_text, text: "..."}
-                    if part.get("type") == "input_text" and "text" in part:
-                        input_tokens += BillingService._estimate_tokens_from_text(part.get("text"))
-                continue
-
-        output_tokens = int(math.ceil(float(input_tokens) * float(output_ratio))) if input_tokens > 0 else 0
-        return {
-            "input_tokens": int(input_tokens),
-            "output_tokens": int(output_tokens),
-            "total_tokens": int(input_tokens + output_tokens)
-        }
+        return token_estimator.estimate_messages(
+            messages,
+            output_ratio=output_ratio,
+            provider=provider,
+            model=model,
+            task_type=task_type,
+            item=item,
+        )
 
     @staticmethod
     def is_token_pricing(db: Session, task_type: str, provider: str = None, model: str = None) -> bool:
         rule = BillingService.get_pricing_rule(db, task_type, provider, model)
         return bool(rule and rule.unit_type in BillingService.TOKEN_UNIT_TYPES)
 
+    @staticmethod
+    def _adjust(db: Session, user_id: int, delta: int) -> Optional[int]:
+        """Atomically moves ``delta`` credits in one ``UPDATE ... SET credits = credits + :delta
+        RETURNING credits``. A debit (``delta < 0``) only applies while the balance covers it.
+        Returns the new balance, or None when nothing was updated. The row stays locked until
+        the caller commits, so concurrent sessions cannot interleave."""
+        stmt = update(User).where(User.id == user_id)
+        if delta < 0:
+            stmt = stmt.where(User.credits >= -delta)
+        balance = db.execute(
+            stmt.values(credits=func.coalesce(User.credits, 0) + delta)
+            .returning(User.credits)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if balance is None:
+            return None
+        # Loaded copies of the user (e.g. current_user) must not flush their stale balance back.
+        user = db.identity_map.get(db.identity_key(User, user_id))
+        if user is not None:
+            db.expire(user, ["credits"])
+        return int(balance)
+
+    @staticmethod
+    def _debit(db: Session, user_id: int, amount: int) -> Optional[int]:
+        """Takes ``amount`` credits if the balance covers it; the new balance, or None."""
+        return BillingService._adjust(db, user_id, -int(amount))
+
+    @staticmethod
+    def _debit_up_to(db: Session, user_id: int, amount: int) -> Tuple[int, int]:
+        """Takes as much of ``amount`` as the balance covers. Returns ``(taken, balance)``."""
+        for _ in range(5):
+            available = int(db.query(User.credits).filter(User.id == user_id).scalar() or 0)
+            take = min(available, int(amount))
+            if take <= 0:
+                return 0, available
+            balance = BillingService._debit(db, user_id, take)
+            if balance is not None:
+                return take, balance
+            # A concurrent debit got there first; look again.
+        return 0, int(db.query(User.credits).filter(User.id == user_id).scalar() or 0)
+
     @staticmethod
     def reserve_credits(
         db: Session,
@@ -114,12 +132,15 @@ class BillingService:
         reserved_cost = BillingService.estimate_cost(db, task_type, provider, model, details=reserve_details)
         BillingService.check_can_proceed(user, reserved_cost)
 
-        user.credits -= reserved_cost
+        balance = BillingService._debit(db, user_id, reserved_cost)
+        if balance is None:
+            db.rollback()
+            raise HTTPException(status_code=402, detail="Insufficient credits during reservation.")
 
         tx = TransactionHistory(
             user_id=user_id,
             amount=-reserved_cost,
-            balance_after=user.credits or 0,
+            balance_after=balance,
             task_type=task_type,
             provider=provider,
             model=model,
@@ -129,7 +150,7 @@ class BillingService:
         db.commit()
         db.refresh(tx)
         logger.info(
-            f"Reserved {reserved_cost} credits from user {user_id} for {task_type}. New Balance: {user.credits}"
+            f"Reserved {reserved_cost} credits from user {user_id} for {task_type}. New Balance: {balance}"
         )
         return tx
 
@@ -148,7 +169,7 @@ class BillingService:
             return tx
 
         reserved_cost = int(abs(tx.amount))
-        user.credits = (user.credits or 0) + reserved_cost
+        balance = BillingService._adjust(db, user.id, reserved_cost)
 
         refund_details = {
             "status": "REFUND",
@@ -161,7 +182,7 @@ class BillingService:
         refund_tx = TransactionHistory(
             user_id=tx.user_id,
             amount=reserved_cost,
-            balance_after=user.credits or 0,
+            balance_after=balance or 0,
             task_type=tx.task_type,
             provider=tx.provider,
             model=tx.model,
@@ -230,11 +251,11 @@ class BillingService:
 
         if delta < 0:
             refund = -delta
-            user.credits = (user.credits or 0) + refund
+            balance = BillingService._adjust(db, user.id, refund)
             settlement_tx = TransactionHistory(
                 user_id=user.id,
                 amount=refund,
-                balance_after=user.credits or 0,
+                balance_after=balance or 0,
                 task_type=reservation_tx.task_type,
                 provider=reservation_tx.provider,
                 model=reservation_tx.model,
@@ -249,13 +270,12 @@ class BillingService:
             db.add(settlement_tx)
         elif delta > 0:
             extra = delta
-            can_deduct = min(int(user.credits or 0), extra)
+            can_deduct, balance = BillingService._debit_up_to(db, user.id, extra)
             if can_deduct > 0:
-                user.credits -= can_deduct
                 settlement_tx = TransactionHistory(
                     user_id=user.id,
                     amount=-can_deduct,
-                    balance_after=user.credits or 0,
+                    balance_after=balance,
                     task_type=reservation_tx.task_type,
                     provider=reservation_tx.provider,
                     model=reservation_tx.model,
@@ -494,23 +514,23 @@ class BillingService:
         """
         Deducts credits from user and logs transaction.
         """
-        # Re-fetch user to lock/ensure latest state
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        if not db.query(User.id).filter(User.id == user_id).first():
             raise HTTPException(status_code=404, detail="User not found")
-            
+
         final_cost = BillingService.estimate_cost(db, task_type, provider, model, details=details)
-        
-        if user.credits < final_cost:
-             raise HTTPException(status_code=402, detail="Insufficient credits during deduction.")
-             
-        user.credits -= final_cost
-        
+
+        # Balance check and debit are one conditional UPDATE, so concurrent deductions
+        # (parallel batch steps in separate sessions) cannot overdraw or lose an update.
+        balance = BillingService._debit(db, user_id, final_cost)
+        if balance is None:
+            db.rollback()
+            raise HTTPException(status_code=402, detail="Insufficient credits during deduction.")
+
         # Log Transaction
         transaction = TransactionHistory(
             user_id=user_id,
             amount=-final_cost,
-            balance_after=user.credits,
+            balance_after=balance,
             task_type=task_type,
             provider=provider,
             model=model,
@@ -520,7 +540,7 @@ class BillingService:
         db.commit()
         db.refresh(transaction)
         
-        logger.info(f"Deducted {final_cost} credits from user {user_id} for {task_type}. New Balance: {user.credits}")
+        logger.info(f"Deducted {final_cost} credits from user {user_id} for {task_type}. New Balance: {balance}")
         return transaction
 
     @staticmethod
@@ -562,4 +582,43 @@ class BillingService:
             logger.error(f"Failed to log transaction failure: {e}")
             db.rollback()
 
+    @staticmethod
+    def log_hedge_overhead(
+        db: Session,
+        user_id: int,
+        task_type: str,
+        provider: str = None,
+        model: str = None,
+        details: dict = None
+    ):
+        """
+        Records the upstream cost of a cancelled hedged request. The user is not charged;
+        the estimated cost is kept in details so hedging overhead can be audited.
+        """
+        try:
+            user = db.query(User).filter(User.id == user_id).first()
+            if not user:
+                logger.error(f"Cannot log hedge overhead for non-existent user {user_id}")
+                return
+
+            hedge_details = details or {}
+            hedge_details["status"] = "HEDGE_OVERHEAD"
+            hedge_details["estimated_cost"] = BillingService.estimate_cost(db, task_type, provider, model)
+
+            transaction = TransactionHistory(
+                user_id=user_id,
+                amount=0,
+                balance_after=user.credits or 0,
+                task_type=task_type,
+                provider=provider,
+                model=model,
+                details=hedge_details
+            )
+            db.add(transaction)
+            db.commit()
+            logger.info(f"Logged hedge overhead for user {user_id}: {provider}/{model} est={hedge_details['estimated_cost']}")
+        except Exception as e:
+            logger.error(f"Failed to log hedge overhead: {e}")
+            db.rollback()
+
 billing_service = BillingService()
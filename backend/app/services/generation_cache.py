@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.all_models import GenerationCacheEntry
+
+logger = logging.getLogger("generation_cache")
+
+
+class GenerationResultCache:
+    """Exact-match cache of finished generations, backed by ``generation_cache`` rows.
+
+    Entries point at media_store digests rather than URLs, so a hit hands out a fresh
+    per-user alias of the stored blob instead of sharing another asset's file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "bypassed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.GENERATION_CACHE_ENABLED)
+
+    def scope_for(self, user_id: Any, project_id: Any = None) -> str:
+        if project_id and str(settings.GENERATION_CACHE_SCOPE).strip().lower() == "project":
+            return f"project:{project_id}"
+        return f"user:{user_id}"
+
+    def _normalize_prompt(self, prompt: Any) -> str:
+        return re.sub(r"\s+", " ", str(prompt or "")).strip()
+
+    def build_key(
+        self,
+        scope: str,
+        category: str,
+        provider: Any,
+        model: Any,
+        prompt: Any,
+        ref_ids: List[str],
+        width: Any = None,
+        height: Any = None,
+        aspect_ratio: Any = None,
+        duration: Any = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        payload = {
+            "scope": scope,
+            "category": category,
+            "provider": str(provider or "").strip().lower(),
+            "model": str(model or "").strip(),
+            "prompt": self._normalize_prompt(prompt),
+            "refs": list(ref_ids or []),
+            "width": int(width) if width else None,
+            "height": int(height) if height else None,
+            "aspect_ratio": str(aspect_ratio or "").strip() or None,
+            "duration": float(duration) if duration else None,
+            "extra": extra or {},
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def count_bypass(self) -> None:
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def lookup(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with SessionLocal() as session:
+            entry = session.query(GenerationCacheEntry).filter(GenerationCacheEntry.cache_key == cache_key).first()
+            if entry is None:
+                with self._lock:
+                    self._stats["misses"] += 1
+                return None
+            if entry.expires_at is not None and entry.expires_at <= now:
+                session.delete(entry)
+                session.commit()
+                with self._lock:
+                    self._stats["expired"] += 1
+                    self._stats["misses"] += 1
+                return None
+            entry.hit_count = int(entry.hit_count or 0) + 1
+            session.commit()
+            found = {
+                "content_digest": entry.content_digest,
+                "content_ext": entry.content_ext,
+                "provider": entry.provider,
+                "model": entry.model,
+                "meta_info": dict(entry.meta_info or {}),
+                "created_at": entry.created_at,
+                "hit_count": entry.hit_count,
+            }
+        with self._lock:
+            self._stats["hits"] += 1
+        return found
+
+    def invalidate(self, cache_key: str) -> None:
+        with SessionLocal() as session:
+            session.query(GenerationCacheEntry).filter(GenerationCacheEntry.cache_key == cache_key).delete()
+            session.commit()
+
+    def store(
+        self,
+        cache_key: str,
+        scope: str,
+        user_id: Any,
+        project_id: Any,
+        category: str,
+        provider: Any,
+        model: Any,
+        content_digest: str,
+        content_ext: str,
+        meta_info: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        expires_at = time.time() + max(60, int(settings.GENERATION_CACHE_TTL_SECONDS))
+        try:
+            with SessionLocal() as session:
+                entry = session.query(GenerationCacheEntry).filter(GenerationCacheEntry.cache_key == cache_key).first()
+                if entry is None:
+                    entry = GenerationCacheEntry(cache_key=cache_key)
+                    session.add(entry)
+                entry.scope = scope
+                entry.user_id = user_id
+                entry.project_id = int(project_id) if project_id else None
+                entry.category = category
+                entry.provider = str(provider or "") or None
+                entry.model = str(model or "") or None
+                entry.content_digest = content_digest
+                entry.content_ext = content_ext
+                entry.meta_info = meta_info or {}
+                entry.hit_count = 0
+                entry.expires_at = expires_at
+                session.commit()
+            with self._lock:
+                self._stats["stores"] += 1
+        except Exception as e:
+            # A concurrent identical generation may have inserted the same key first.
+            logger.warning("generation cache store failed | key=%s error=%s", cache_key[:16], str(e)[:200])
+
+    def purge_expired(self) -> int:
+        with SessionLocal() as session:
+            removed = session.query(GenerationCacheEntry).filter(GenerationCacheEntry.expires_at <= time.time()).delete()
+            session.commit()
+        return int(removed or 0)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "enabled": self.enabled,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+generation_cache = GenerationResultCache()
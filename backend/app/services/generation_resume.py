@@ -0,0 +1,492 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.all_models import APISetting, SystemAPISetting, UpstreamTask
+
+logger = logging.getLogger("generation_resume")
+
+ACTIVE_STATUSES = ("polling", "upstream_done", "finalizing")
+_CLAIM_BATCH = 20
+_PURGE_AFTER_SECONDS = 24 * 3600
+
+
+def api_key_fingerprint(api_key: Any) -> str:
+    return hashlib.sha256(str(api_key or "").encode("utf-8")).hexdigest()
+
+
+class _Generation:
+    __slots__ = ("id", "kind", "context", "record_ids", "timed_out")
+
+    def __init__(self, kind: str, context: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.context = context
+        self.record_ids: List[str] = []
+        self.timed_out = False
+
+
+def _arm_timeout(timeout: Optional[float], on_expire: Callable[[], None]) -> Optional[asyncio.TimerHandle]:
+    """Cancels the current task after ``timeout`` seconds, flagging it first via ``on_expire``."""
+    if not timeout:
+        return None
+    task = asyncio.current_task()
+
+    def _expire() -> None:
+        on_expire()
+        task.cancel()
+
+    return asyncio.get_running_loop().call_later(timeout, _expire)
+
+
+def _timed_out() -> asyncio.TimeoutError:
+    # Like ``asyncio.wait_for``: our own cancel becomes a TimeoutError for the caller.
+    task = asyncio.current_task()
+    if task is not None and hasattr(task, "uncancel"):
+        task.uncancel()
+    return asyncio.TimeoutError()
+
+
+_current: contextvars.ContextVar[Optional[_Generation]] = contextvars.ContextVar("resumable_generation", default=None)
+
+
+class GenerationResumer:
+    """Persists submitted upstream task ids so a restarted worker can finish the generation.
+
+    Endpoints wrap a generation in ``track()``; the polling helpers in media_service call
+    ``record_submitted`` once the provider hands back a task id. Every live record carries a
+    lease that this worker's loop keeps renewing. When a worker dies, its leases lapse and any
+    other worker claims the rows, polls the task to completion and hands it to the registered
+    finalizer (download, asset registration, shot binding, billing) instead of resubmitting.
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._handler: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._last_purge = 0.0
+        self._stats = {
+            "recorded": 0,
+            "completed": 0,
+            "failed": 0,
+            "abandoned": 0,
+            "superseded": 0,
+            "claimed": 0,
+            "resumed_ok": 0,
+            "resumed_failed": 0,
+            "record_errors": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.RESUME_ENABLED)
+
+    @property
+    def lease_seconds(self) -> float:
+        return max(15.0, float(settings.RESUME_LEASE_SECONDS))
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    def _to_dict(self, row: UpstreamTask) -> Dict[str, Any]:
+        return {
+            "id": row.id,
+            "generation_id": row.generation_id,
+            "kind": row.kind,
+            "provider": row.provider,
+            "task_id": row.task_id,
+            "status": row.status,
+            "poll": dict(row.poll or {}),
+            "context": dict(row.context or {}),
+            "result_url": row.result_url,
+            "error": row.error,
+            "owner": row.owner,
+            "resume_attempts": row.resume_attempts or 0,
+            "deadline": row.deadline,
+            "created_at": row.created_at,
+        }
+
+    # -- Recording (called from the request that submitted the task) --
+
+    @asynccontextmanager
+    async def track(self, kind: str, user_id: int, request: Dict[str, Any], timeout: Optional[float] = None, **context):
+        """Marks the enclosed code as one resumable generation for ``user_id``.
+
+        With ``timeout`` the body is cancelled after that many seconds and ``asyncio.TimeoutError``
+        is raised; the caller reports the failure, so its records are abandoned. Any other
+        cancellation (uvicorn cancels in-flight requests on shutdown before the lifespan hook
+        runs, or the client went away) releases the records for another worker to finish.
+        """
+        if not self.enabled:
+            expired: List[bool] = []
+            timer = _arm_timeout(timeout, lambda: expired.append(True))
+            try:
+                yield None
+            except asyncio.CancelledError:
+                if expired:
+                    raise _timed_out() from None
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            return
+        gen = _Generation(kind, {"user_id": user_id, "request": request, **context})
+        token = _current.set(gen)
+        timer = _arm_timeout(timeout, lambda: setattr(gen, "timed_out", True))
+        try:
+            yield gen
+        except asyncio.CancelledError:
+            if gen.timed_out:
+                self._close(gen.record_ids, "abandoned", "request timed out")
+                raise _timed_out() from None
+            released = self._release(gen.record_ids)
+            if released:
+                logger.info("released upstream tasks of a cancelled request | generation=%s count=%s", gen.id, released)
+            raise
+        except BaseException as e:
+            self._close(gen.record_ids, "failed", str(e)[:500])
+            raise
+        else:
+            self._close(gen.record_ids, "completed")
+        finally:
+            if timer is not None:
+                timer.cancel()
+            _current.reset(token)
+
+    def annotate(self, **context) -> None:
+        """Adds finalization context (e.g. ``filename_base``) to the current generation."""
+        gen = _current.get()
+        if gen is not None:
+            gen.context.update({k: v for k, v in context.items() if v is not None})
+
+    def record_submitted(self, provider: str, task_id: Any, poll: Dict[str, Any], timeout_seconds: float) -> Optional[str]:
+        """Persists a freshly submitted upstream task. Returns the record id, or None when untracked."""
+        gen = _current.get()
+        if gen is None or not task_id:
+            return None
+        now = time.time()
+        record_id = uuid.uuid4().hex
+        try:
+            with SessionLocal() as session:
+                session.add(UpstreamTask(
+                    id=record_id,
+                    generation_id=gen.id,
+                    kind=gen.kind,
+                    provider=provider,
+                    task_id=str(task_id),
+                    status="polling",
+                    poll=poll,
+                    context=gen.context,
+                    owner=self.owner,
+                    lease_expires_at=now + self.lease_seconds,
+                    resume_attempts=0,
+                    deadline=now + float(timeout_seconds or 0),
+                    created_at=now,
+                    updated_at=now,
+                ))
+                session.commit()
+        except Exception as e:
+            # Resumability is best effort; never fail the generation over it.
+            self._count("record_errors")
+            logger.warning("could not record upstream task | provider=%s task_id=%s error=%s", provider, task_id, str(e)[:200])
+            return None
+        gen.record_ids.append(record_id)
+        self._count("recorded")
+        return record_id
+
+    def record_polled(self, record_id: Optional[str], outcome: Dict[str, Any]) -> None:
+        """Stores the poll outcome; a finished task keeps its media URL so finalization can skip polling."""
+        if not record_id:
+            return
+        if outcome.get("status") == "done" and outcome.get("url"):
+            self._update(record_id, status="upstream_done", result_url=str(outcome.get("url")))
+        else:
+            self._update(record_id, status="abandoned", error=str(outcome.get("status") or "timeout"))
+
+    def begin_finalize_current(self) -> bool:
+        """Live-path counterpart of ``begin_finalize``: moves the current generation's records to
+        ``finalizing`` before the caller stores, binds and charges. False when another worker has
+        taken the generation over (this one's lease lapsed); that worker finalizes it instead."""
+        gen = _current.get()
+        if gen is None or not gen.record_ids:
+            return True
+        try:
+            with SessionLocal() as session:
+                taken = session.query(UpstreamTask.id).filter(
+                    UpstreamTask.generation_id == gen.id,
+                    UpstreamTask.owner != self.owner,
+                    UpstreamTask.status.in_(ACTIVE_STATUSES + ("completed",)),
+                ).first()
+                if taken is not None:
+                    self._count("superseded")
+                    return False
+                # Records that already failed or timed out stay as they are (e.g. a fallback
+                # provider without a task id produced the result).
+                session.query(UpstreamTask).filter(
+                    UpstreamTask.id.in_(gen.record_ids),
+                    UpstreamTask.owner == self.owner,
+                    UpstreamTask.status.in_(ACTIVE_STATUSES),
+                ).update({"status": "finalizing", "updated_at": time.time()}, synchronize_session=False)
+                session.commit()
+        except Exception as e:
+            # Same as recording: a bookkeeping failure must not fail a finished generation.
+            self._count("record_errors")
+            logger.warning("could not mark generation finalizing | generation=%s error=%s", gen.id, str(e)[:200])
+        return True
+
+    # -- Resuming (called on the worker that claimed an orphaned record) --
+
+    def begin_finalize(self, record: Dict[str, Any], result_url: Optional[str]) -> bool:
+        """Moves a claimed record to ``finalizing``. False when a sibling attempt already won."""
+        with SessionLocal() as session:
+            sibling = session.query(UpstreamTask.id).filter(
+                UpstreamTask.generation_id == record["generation_id"],
+                UpstreamTask.id != record["id"],
+                UpstreamTask.status.in_(("finalizing", "completed")),
+            ).first()
+            if sibling is not None:
+                session.query(UpstreamTask).filter(UpstreamTask.id == record["id"]).update(
+                    {"status": "superseded", "updated_at": time.time()}, synchronize_session=False
+                )
+                session.commit()
+                self._count("superseded")
+                return False
+            claimed = session.query(UpstreamTask).filter(
+                UpstreamTask.id == record["id"],
+                UpstreamTask.owner == self.owner,
+                UpstreamTask.status.in_(ACTIVE_STATUSES),
+            ).update(
+                {"status": "finalizing", "result_url": result_url, "updated_at": time.time()},
+                synchronize_session=False,
+            )
+            session.commit()
+        return bool(claimed)
+
+    def finish(self, record_id: str, status: str, error: Optional[str] = None) -> None:
+        self._update(record_id, status=status, error=error, lease_expires_at=0)
+        if status in self._stats:
+            self._count(status)
+
+    def resolve_api_key(self, fingerprint: Optional[str]) -> Optional[str]:
+        """Finds the configured API key whose sha256 matches ``fingerprint``; raw keys are never stored."""
+        if not fingerprint:
+            return None
+        with SessionLocal() as session:
+            for model in (SystemAPISetting, APISetting):
+                for (api_key,) in session.query(model.api_key).filter(model.api_key.isnot(None)).distinct():
+                    if api_key and api_key_fingerprint(api_key) == fingerprint:
+                        return api_key
+        return None
+
+    # -- Lease bookkeeping --
+
+    def _update(self, record_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        try:
+            with SessionLocal() as session:
+                session.query(UpstreamTask).filter(UpstreamTask.id == record_id).update(fields, synchronize_session=False)
+                session.commit()
+        except Exception as e:
+            self._count("record_errors")
+            logger.warning("could not update upstream task | id=%s error=%s", record_id, str(e)[:200])
+
+    def _close(self, record_ids: List[str], status: str, error: Optional[str] = None) -> None:
+        """Ends the records a live request still holds; ones already past polling, or taken over
+        by another worker, keep their state."""
+        if not record_ids:
+            return
+        try:
+            with SessionLocal() as session:
+                closed = session.query(UpstreamTask).filter(
+                    UpstreamTask.id.in_(record_ids),
+                    UpstreamTask.owner == self.owner,
+                    UpstreamTask.status.in_(ACTIVE_STATUSES),
+                ).update(
+                    {"status": status, "error": error, "lease_expires_at": 0, "updated_at": time.time()},
+                    synchronize_session=False,
+                )
+                session.commit()
+            if closed and status in self._stats:
+                self._count(status, int(closed))
+        except Exception as e:
+            self._count("record_errors")
+            logger.warning("could not close upstream tasks | ids=%s error=%s", record_ids, str(e)[:200])
+
+    def _release(self, record_ids: Optional[List[str]] = None) -> int:
+        """Expires this worker's leases immediately so another worker can claim them."""
+        try:
+            with SessionLocal() as session:
+                query = session.query(UpstreamTask).filter(
+                    UpstreamTask.owner == self.owner,
+                    UpstreamTask.status.in_(ACTIVE_STATUSES),
+                )
+                if record_ids is not None:
+                    if not record_ids:
+                        return 0
+                    query = query.filter(UpstreamTask.id.in_(record_ids))
+                released = query.update({"lease_expires_at": 0, "updated_at": time.time()}, synchronize_session=False)
+                session.commit()
+            return int(released or 0)
+        except Exception as e:
+            logger.warning("could not release upstream task leases: %s", str(e)[:200])
+            return 0
+
+    def heartbeat(self) -> int:
+        now = time.time()
+        with SessionLocal() as session:
+            renewed = session.query(UpstreamTask).filter(
+                UpstreamTask.owner == self.owner,
+                UpstreamTask.status.in_(ACTIVE_STATUSES),
+                UpstreamTask.lease_expires_at > 0,
+            ).update({"lease_expires_at": now + self.lease_seconds}, synchronize_session=False)
+            session.commit()
+        return int(renewed or 0)
+
+    def claim_orphans(self) -> List[Dict[str, Any]]:
+        """Takes over records whose lease lapsed. The conditional update makes each claim exclusive."""
+        now = time.time()
+        max_age = max(60.0, float(settings.RESUME_MAX_AGE_SECONDS))
+        max_attempts = max(1, int(settings.RESUME_MAX_ATTEMPTS))
+        claimed: List[Dict[str, Any]] = []
+        with SessionLocal() as session:
+            rows = session.query(UpstreamTask).filter(
+                UpstreamTask.status.in_(ACTIVE_STATUSES),
+                UpstreamTask.lease_expires_at < now,
+            ).order_by(UpstreamTask.created_at).limit(_CLAIM_BATCH).all()
+            for row in rows:
+                base = session.query(UpstreamTask).filter(
+                    UpstreamTask.id == row.id,
+                    UpstreamTask.owner == row.owner,
+                    UpstreamTask.lease_expires_at == row.lease_expires_at,
+                )
+                if (row.created_at or 0) < now - max_age or (row.resume_attempts or 0) >= max_attempts:
+                    if base.update({"status": "abandoned", "error": "not resumable", "lease_expires_at": 0, "updated_at": now}, synchronize_session=False):
+                        self._count("abandoned")
+                        logger.warning("abandoned upstream task | id=%s provider=%s task_id=%s attempts=%s", row.id, row.provider, row.task_id, row.resume_attempts)
+                    continue
+                won = base.update(
+                    {
+                        "owner": self.owner,
+                        "lease_expires_at": now + self.lease_seconds,
+                        "resume_attempts": (row.resume_attempts or 0) + 1,
+                        "updated_at": now,
+                    },
+                    synchronize_session=False,
+                )
+                if won:
+                    row.owner = self.owner
+                    row.resume_attempts = (row.resume_attempts or 0) + 1
+                    claimed.append(self._to_dict(row))
+            session.commit()
+        if claimed:
+            self._count("claimed", len(claimed))
+        return claimed
+
+    def purge_finished(self) -> int:
+        with SessionLocal() as session:
+            removed = session.query(UpstreamTask).filter(
+                UpstreamTask.status.notin_(ACTIVE_STATUSES),
+                UpstreamTask.updated_at < time.time() - _PURGE_AFTER_SECONDS,
+            ).delete(synchronize_session=False)
+            session.commit()
+        return int(removed or 0)
+
+    # -- Background loop --
+
+    def set_handler(self, handler: Callable[[Dict[str, Any]], Awaitable[Any]]) -> None:
+        """Registers the coroutine that finishes a claimed record (lives with the endpoints)."""
+        self._handler = handler
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running.values()):
+            task.cancel()
+        released = await asyncio.to_thread(self._release)
+        if released:
+            logger.info("released upstream task leases on shutdown | count=%s", released)
+
+    async def _loop(self) -> None:
+        interval = self.lease_seconds / 3
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("resume loop iteration failed: %s", str(e)[:200])
+            await asyncio.sleep(interval)
+
+    async def tick(self) -> None:
+        await asyncio.to_thread(self.heartbeat)
+        if self._handler is not None:
+            for record in await asyncio.to_thread(self.claim_orphans):
+                if record["id"] in self._running:
+                    continue
+                logger.info(
+                    "resuming upstream task | id=%s provider=%s task_id=%s status=%s attempt=%s",
+                    record["id"], record["provider"], record["task_id"], record["status"], record["resume_attempts"],
+                )
+                task = asyncio.create_task(self._resume(record))
+                self._running[record["id"]] = task
+        if time.monotonic() - self._last_purge > 3600:
+            self._last_purge = time.monotonic()
+            removed = await asyncio.to_thread(self.purge_finished)
+            if removed:
+                logger.info("purged finished upstream tasks | removed=%s", removed)
+
+    async def _resume(self, record: Dict[str, Any]) -> None:
+        try:
+            status = await self._handler(record)
+            self._count("resumed_ok" if status == "completed" else "resumed_failed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._count("resumed_failed")
+            logger.exception("resume handler raised | id=%s", record["id"])
+            await asyncio.to_thread(self.finish, record["id"], "failed", str(e)[:500])
+        finally:
+            self._running.pop(record["id"], None)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with SessionLocal() as session:
+            rows = session.query(UpstreamTask.status, UpstreamTask.owner).filter(
+                UpstreamTask.status.in_(ACTIVE_STATUSES)
+            ).all()
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            "enabled": self.enabled,
+            "owner": self.owner,
+            "lease_seconds": self.lease_seconds,
+            "active": len(rows),
+            "active_owned": sum(1 for _, owner in rows if owner == self.owner),
+            "resuming": len(self._running),
+            **counters,
+        }
+
+
+generation_resumer = GenerationResumer()
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import threading
+import time
+import urllib.parse
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple, Union
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger("http_transport")
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except Exception:
+    _HTTP2_AVAILABLE = False
+
+# Connection-level failures that justify retrying the same call on the direct
+# (no proxy) route; mirrors the old requests ProxyError/SSLError/ConnectionError/Timeout handling.
+CONNECT_ERRORS = (httpx.ProxyError, httpx.ConnectError, httpx.TimeoutException)
+# Failures that say the route itself is unusable. A read timeout does not: the request
+# reached the upstream, and replaying a long generation on the other route only doubles it.
+ROUTE_ERRORS = (httpx.ProxyError, httpx.ConnectError, httpx.ConnectTimeout)
+
+TimeoutValue = Union[None, int, float, Tuple[float, float], httpx.Timeout]
+
+
+class HTTPTransport:
+    """Shared keep-alive connection pools for outbound provider traffic.
+
+    Pools are keyed by (pool name, proxy route, TLS verification). Async clients
+    are bound to the event loop that created them because batch jobs run their
+    own loops in worker threads; sync clients are shared process-wide.
+
+    The ``*_with_direct_fallback`` helpers remember, per host, which route (env
+    proxy or direct) last worked and try it first, so a host that only answers
+    directly costs one failed proxy attempt per ``HTTP_ROUTE_MEMORY_SECONDS``
+    instead of one per call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, bool, bool], httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+        self._sync_clients: Dict[Tuple[str, bool, bool], httpx.Client] = {}
+        self._pool_limits: Dict[str, Dict[str, int]] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._routes: Dict[str, Tuple[bool, float]] = {}
+        self._route_fallbacks = 0
+
+    # --- Configuration ---
+
+    def configure_pool(self, pool: str, max_connections: Optional[int] = None, max_keepalive: Optional[int] = None) -> None:
+        """Override limits for one pool. Applies to clients created afterwards."""
+        with self._lock:
+            current = dict(self._pool_limits.get(pool) or {})
+            if max_connections is not None:
+                current["max_connections"] = max(1, int(max_connections))
+            if max_keepalive is not None:
+                current["max_keepalive"] = max(0, int(max_keepalive))
+            self._pool_limits[pool] = current
+
+    def _limits(self, pool: str) -> httpx.Limits:
+        override = self._pool_limits.get(pool) or {}
+        return httpx.Limits(
+            max_connections=override.get("max_connections", settings.HTTP_POOL_MAX_CONNECTIONS),
+            max_keepalive_connections=override.get("max_keepalive", settings.HTTP_POOL_MAX_KEEPALIVE),
+            keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_EXPIRY,
+        )
+
+    def build_timeout(self, timeout: TimeoutValue) -> httpx.Timeout:
+        if isinstance(timeout, httpx.Timeout):
+            return timeout
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(float(read), connect=float(connect))
+        if timeout is None:
+            return httpx.Timeout(None, connect=settings.HTTP_POOL_CONNECT_TIMEOUT)
+        value = float(timeout)
+        return httpx.Timeout(value, connect=min(value, settings.HTTP_POOL_CONNECT_TIMEOUT))
+
+    def _client_kwargs(self, pool: str, use_proxy: bool, verify: bool) -> Dict[str, Any]:
+        return {
+            "limits": self._limits(pool),
+            "timeout": self.build_timeout(60),
+            "verify": verify,
+            "trust_env": use_proxy,
+            "http2": bool(settings.HTTP2_ENABLED and _HTTP2_AVAILABLE),
+            "follow_redirects": True,
+        }
+
+    # --- Clients ---
+
+    def get_async_client(self, pool: str = "default", use_proxy: bool = True, verify: bool = True) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        key = (pool, bool(use_proxy), bool(verify))
+        with self._lock:
+            clients = self._async_clients.get(loop)
+            if clients is None:
+                clients = {}
+                self._async_clients[loop] = clients
+            client = clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(**self._client_kwargs(pool, use_proxy, verify))
+                clients[key] = client
+        return client
+
+    def get_sync_client(self, pool: str = "default", use_proxy: bool = True, verify: bool = True) -> httpx.Client:
+        key = (pool, bool(use_proxy), bool(verify))
+        with self._lock:
+            client = self._sync_clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.Client(**self._client_kwargs(pool, use_proxy, verify))
+                self._sync_clients[key] = client
+        return client
+
+    # --- Requests ---
+
+    def _record(self, pool: str, elapsed_ms: int, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            entry = self._stats.setdefault(pool, {"requests": 0, "errors": 0, "total_ms": 0, "last_error": None})
+            entry["requests"] += 1
+            entry["total_ms"] += elapsed_ms
+            if error is not None:
+                entry["errors"] += 1
+                entry["last_error"] = f"{type(error).__name__}: {str(error)[:200]}"
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        pool: str = "default",
+        use_proxy: bool = True,
+        verify: bool = True,
+        timeout: TimeoutValue = 60,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        client = self.get_async_client(pool, use_proxy=use_proxy, verify=verify)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, timeout=self.build_timeout(timeout), **kwargs)
+        except Exception as e:
+            self._record(pool, int((time.perf_counter() - started) * 1000), e)
+            raise
+        self._record(pool, int((time.perf_counter() - started) * 1000))
+        return response
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    # --- Route memory ---
+
+    def preferred_route(self, url: str) -> bool:
+        """True when the proxy route should be tried first for this URL's host."""
+        host = urllib.parse.urlparse(url).hostname or ""
+        with self._lock:
+            remembered = self._routes.get(host)
+        if remembered is None or time.monotonic() - remembered[1] > settings.HTTP_ROUTE_MEMORY_SECONDS:
+            return True
+        return remembered[0]
+
+    def _remember_route(self, url: str, use_proxy: bool) -> None:
+        host = urllib.parse.urlparse(url).hostname or ""
+        with self._lock:
+            self._routes[host] = (bool(use_proxy), time.monotonic())
+
+    def _route_failed(self, url: str, use_proxy: bool, log_tag: str, error: BaseException) -> None:
+        with self._lock:
+            self._route_fallbacks += 1
+        logger.warning(
+            "[%s] connection failed via %s route (%s), retrying %s | host=%s",
+            log_tag,
+            "proxy" if use_proxy else "direct",
+            str(error)[:80],
+            "direct" if use_proxy else "proxy",
+            urllib.parse.urlparse(url).hostname or "",
+        )
+
+    async def request_with_direct_fallback(
+        self,
+        method: str,
+        url: str,
+        log_tag: str = "http",
+        retry_on: Tuple[type, ...] = CONNECT_ERRORS,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """Send via the host's remembered route (env proxy by default) and retry once on the other on ``retry_on``."""
+        kwargs.pop("use_proxy", None)
+        use_proxy = self.preferred_route(url)
+        try:
+            response = await self.request(method, url, use_proxy=use_proxy, **kwargs)
+        except retry_on as e:
+            self._route_failed(url, use_proxy, log_tag, e)
+            use_proxy = not use_proxy
+            response = await self.request(method, url, use_proxy=use_proxy, **kwargs)
+        self._remember_route(url, use_proxy)
+        return response
+
+    @asynccontextmanager
+    async def stream_with_direct_fallback(
+        self,
+        method: str,
+        url: str,
+        pool: str = "default",
+        log_tag: str = "http",
+        verify: bool = True,
+        timeout: TimeoutValue = 60,
+        **kwargs: Any,
+    ) -> AsyncIterator[httpx.Response]:
+        """Streaming counterpart of ``request_with_direct_fallback``; only falls back before the response starts."""
+        use_proxy = self.preferred_route(url)
+        for attempt in (0, 1):
+            client = self.get_async_client(pool, use_proxy=use_proxy, verify=verify)
+            started = time.perf_counter()
+            try:
+                request = client.build_request(method, url, timeout=self.build_timeout(timeout), **kwargs)
+                response = await client.send(request, stream=True)
+            except ROUTE_ERRORS as e:
+                self._record(pool, int((time.perf_counter() - started) * 1000), e)
+                if attempt:
+                    raise
+                self._route_failed(url, use_proxy, log_tag, e)
+                use_proxy = not use_proxy
+                continue
+            except Exception as e:
+                self._record(pool, int((time.perf_counter() - started) * 1000), e)
+                raise
+            self._record(pool, int((time.perf_counter() - started) * 1000))
+            self._remember_route(url, use_proxy)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+            return
+
+    def request_sync(
+        self,
+        method: str,
+        url: str,
+        pool: str = "default",
+        use_proxy: bool = True,
+        verify: bool = True,
+        timeout: TimeoutValue = 60,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        client = self.get_sync_client(pool, use_proxy=use_proxy, verify=verify)
+        started = time.perf_counter()
+        try:
+            response = client.request(method, url, timeout=self.build_timeout(timeout), **kwargs)
+        except Exception as e:
+            self._record(pool, int((time.perf_counter() - started) * 1000), e)
+            raise
+        self._record(pool, int((time.perf_counter() - started) * 1000))
+        return response
+
+    # --- Lifecycle / Stats ---
+
+    async def close_loop_clients(self) -> None:
+        """Close the pools owned by the current loop.
+
+        Batch jobs call this before their ``asyncio.run`` loop ends; otherwise the
+        loop's clients are only dropped from the weak map, never closed, and their
+        sockets leak until garbage collection.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = list((self._async_clients.pop(loop, None) or {}).values())
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning("failed to close async http client: %s", e)
+
+    async def aclose(self) -> None:
+        """Close the pools owned by the current loop plus the shared sync pools."""
+        await self.close_loop_clients()
+        with self._lock:
+            sync_clients = list(self._sync_clients.values())
+            self._sync_clients.clear()
+        for client in sync_clients:
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning("failed to close sync http client: %s", e)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pools = {}
+            for name, entry in self._stats.items():
+                requests_count = int(entry.get("requests") or 0)
+                pools[name] = {
+                    "requests": requests_count,
+                    "errors": int(entry.get("errors") or 0),
+                    "avg_ms": int(entry.get("total_ms", 0) / requests_count) if requests_count else 0,
+                    "last_error": entry.get("last_error"),
+                }
+            return {
+                "http2": bool(settings.HTTP2_ENABLED and _HTTP2_AVAILABLE),
+                "event_loops": len(self._async_clients),
+                "async_clients": sum(len(v) for v in self._async_clients.values()),
+                "sync_clients": len(self._sync_clients),
+                "pools": pools,
+                "route_fallbacks": self._route_fallbacks,
+                "direct_hosts": sorted(host for host, (use_proxy, _) in self._routes.items() if not use_proxy),
+            }
+
+
+http_transport = HTTPTransport()
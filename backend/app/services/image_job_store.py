@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.all_models import ImageJob
+
+logger = logging.getLogger("image_job_store")
+
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled", "cancelled", "error"}
+_PURGE_INTERVAL_SECONDS = 60.0
+
+
+class ImageJobStore:
+    """Async image generation jobs, backed by ``image_jobs`` rows so every API worker sees them.
+
+    Idempotency keys are reserved by the ``(user_id, idempotency_key)`` unique constraint:
+    the insert either wins or finds the job that did. Finished jobs get ``expires_at`` and
+    are purged on a timer piggybacked on ``create``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._stats = {"created": 0, "deduplicated": 0, "purged": 0}
+
+    @property
+    def ttl_seconds(self) -> int:
+        return max(300, int(settings.IMAGE_JOB_TTL_SECONDS))
+
+    @property
+    def idempotency_ttl_seconds(self) -> int:
+        return max(30, int(settings.IMAGE_SUBMIT_IDEMPOTENCY_TTL_SECONDS))
+
+    def _to_dict(self, row: ImageJob) -> Dict[str, Any]:
+        return {
+            "job_id": row.job_id,
+            "status": row.status,
+            "user_id": row.user_id,
+            "username": row.username,
+            "created_at": row.created_at,
+            "started_at": row.started_at,
+            "finished_at": row.finished_at,
+            "result": row.result,
+            "error": row.error,
+        }
+
+    def create(
+        self,
+        job_id: str,
+        user_id: int,
+        username: Optional[str] = None,
+        request: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Inserts a queued job. Returns ``(job, created)``; ``created`` is False when the
+        idempotency key is still held by an earlier job, which is returned instead."""
+        self.purge_expired_if_due()
+        key = str(idempotency_key or "").strip() or None
+
+        for _ in range(3):
+            now = time.time()
+            with SessionLocal() as session:
+                row = ImageJob(
+                    job_id=job_id,
+                    user_id=user_id,
+                    username=username,
+                    status="queued",
+                    idempotency_key=key,
+                    idempotency_expires_at=now + self.idempotency_ttl_seconds if key else None,
+                    request=request,
+                    created_at=datetime.utcnow().isoformat(),
+                )
+                session.add(row)
+                try:
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+                    if key is None:
+                        raise
+                else:
+                    with self._lock:
+                        self._stats["created"] += 1
+                    return self._to_dict(row), True
+
+                existing = session.query(ImageJob).filter(
+                    ImageJob.user_id == user_id,
+                    ImageJob.idempotency_key == key,
+                ).first()
+                if existing is None:
+                    # Released between our insert and this read; try again.
+                    continue
+                if (existing.idempotency_expires_at or 0) > now:
+                    with self._lock:
+                        self._stats["deduplicated"] += 1
+                    return self._to_dict(existing), False
+
+                # The reservation outlived its TTL: release it (if nobody else did) and retry.
+                session.query(ImageJob).filter(
+                    ImageJob.job_id == existing.job_id,
+                    ImageJob.idempotency_key == key,
+                ).update({"idempotency_key": None, "idempotency_expires_at": None}, synchronize_session=False)
+                session.commit()
+
+        raise RuntimeError(f"could not reserve idempotency key for user {user_id}")
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        with SessionLocal() as session:
+            row = session.query(ImageJob).filter(ImageJob.job_id == job_id).first()
+            if row is None:
+                logger.warning("image job vanished before update | job_id=%s fields=%s", job_id, sorted(fields))
+                return None
+            for name, value in fields.items():
+                if hasattr(ImageJob, name):
+                    setattr(row, name, value)
+            if str(row.status or "").lower() in TERMINAL_STATUSES and row.expires_at is None:
+                row.expires_at = time.time() + self.ttl_seconds
+            session.commit()
+            return self._to_dict(row)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with SessionLocal() as session:
+            row = session.query(ImageJob).filter(ImageJob.job_id == job_id).first()
+            if row is None or (row.expires_at is not None and row.expires_at <= time.time()):
+                return None
+            return self._to_dict(row)
+
+    def purge_expired(self) -> int:
+        with SessionLocal() as session:
+            removed = session.query(ImageJob).filter(ImageJob.expires_at <= time.time()).delete(synchronize_session=False)
+            session.commit()
+        removed = int(removed or 0)
+        with self._lock:
+            self._stats["purged"] += removed
+        return removed
+
+    def purge_expired_if_due(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < _PURGE_INTERVAL_SECONDS:
+                return
+            self._last_purge = now
+        try:
+            removed = self.purge_expired()
+            if removed:
+                logger.info("purged expired image jobs | removed=%s", removed)
+        except Exception as e:
+            logger.warning("image job purge failed: %s", str(e)[:200])
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        live = (ImageJob.expires_at.is_(None)) | (ImageJob.expires_at > now)
+        with SessionLocal() as session:
+            status_counts = {
+                str(status or "unknown").lower(): int(count)
+                for status, count in session.query(ImageJob.status, func.count()).filter(live).group_by(ImageJob.status).all()
+            }
+            oldest, newest = session.query(func.min(ImageJob.created_at), func.max(ImageJob.created_at)).filter(live).one()
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            "backend": "database",
+            "store_items": sum(status_counts.values()),
+            "status_counts": status_counts,
+            "oldest_created_at": oldest,
+            "newest_created_at": newest,
+            "ttl_seconds": self.ttl_seconds,
+            "idempotency_ttl_seconds": self.idempotency_ttl_seconds,
+            **counters,
+        }
+
+
+image_job_store = ImageJobStore()
@@ -0,0 +1,210 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.ref_image_cache import RefImageCache
+
+logger = logging.getLogger("image_preprocess")
+
+_RESAMPLE = getattr(Image, "LANCZOS", Image.BICUBIC)
+
+
+def _transform_image(
+    data: bytes,
+    target: Optional[Tuple[int, int]],
+    max_edge: Optional[int],
+    fmt: str,
+    quality: int,
+) -> Optional[Tuple[bytes, str]]:
+    """Pillow work executed in the worker processes.
+
+    ``target`` crops to the target aspect and resizes to exactly (w, h); otherwise the
+    image is only shrunk so its longest edge fits ``max_edge``. Returns None when the
+    source already fits and can be sent unchanged.
+    """
+    img = Image.open(io.BytesIO(data))
+    src_w, src_h = img.size
+
+    if target is None:
+        if not max_edge or max(src_w, src_h) <= max_edge:
+            return None
+        scale = max_edge / float(max(src_w, src_h))
+        out_w, out_h = max(1, int(src_w * scale)), max(1, int(src_h * scale))
+    else:
+        out_w, out_h = target
+
+    if img.format == "JPEG":
+        # Let libjpeg decode at a reduced scale (1/2, 1/4, 1/8) that still covers the output.
+        img.draft("RGB", (out_w, out_h))
+
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    if fmt == "auto":
+        fmt = "PNG" if has_alpha else "JPEG"
+    img = img.convert("RGBA" if fmt == "PNG" and has_alpha else "RGB")
+
+    if target is not None:
+        target_aspect = out_w / float(out_h)
+        current_aspect = img.width / float(img.height)
+        if abs(current_aspect - target_aspect) > 0.05:
+            if current_aspect > target_aspect:
+                new_w = int(img.height * target_aspect)
+                left = (img.width - new_w) // 2
+                img = img.crop((left, 0, left + new_w, img.height))
+            else:
+                new_h = int(img.width / target_aspect)
+                top = (img.height - new_h) // 2
+                img = img.crop((0, top, img.width, top + new_h))
+
+    if img.size != (out_w, out_h):
+        img = img.resize((out_w, out_h), _RESAMPLE)
+
+    out = io.BytesIO()
+    if fmt == "JPEG":
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue(), "image/jpeg"
+    img.save(out, format="PNG")
+    return out.getvalue(), "image/png"
+
+
+class ImagePreprocessor:
+    """Runs reference-image Pillow work in a process pool and caches the outputs.
+
+    Outputs are cached by (source digest, target aspect/size, max edge, format), so a
+    character sheet reused across an episode is resized once per provider limit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache = RefImageCache(max_bytes=settings.IMAGE_PREPROCESS_CACHE_MAX_BYTES)
+        # (digest, max_edge) pairs already known to fit; sent unchanged.
+        self._fits: Dict[Tuple[str, int], bool] = {}
+        self._stats = {"transforms": 0, "unchanged": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        workers = int(settings.IMAGE_PREPROCESS_WORKERS)
+        if workers <= 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a threaded server process is unsafe.
+                self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _reset_pool(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, data: bytes, target, max_edge, fmt: str) -> Future:
+        args = (data, target, max_edge, fmt, int(settings.IMAGE_PREPROCESS_JPEG_QUALITY))
+        pool = self._executor()
+        if pool is not None:
+            try:
+                return pool.submit(_transform_image, *args)
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.warning("image process pool unavailable, running inline: %s", e)
+                self._reset_pool()
+        future: Future = Future()
+        try:
+            future.set_result(_transform_image(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _cache_key(self, digest: str, target, max_edge, fmt: str) -> str:
+        aspect = f"{target[0]}x{target[1]}" if target else "-"
+        return f"prep:{digest}:{aspect}:{max_edge or '-'}:{fmt}"
+
+    def _finish(self, key: str, digest: str, max_edge, source_len: int, outcome) -> Optional[Tuple[str, str]]:
+        if outcome is None:
+            self._fits[(digest, int(max_edge or 0))] = True
+            with self._lock:
+                self._stats["unchanged"] += 1
+            return None
+        data, mime = outcome
+        b64 = base64.b64encode(data).decode("utf-8")
+        self._cache.put(key, data, mime, b64)
+        with self._lock:
+            self._stats["transforms"] += 1
+            self._stats["bytes_in"] += source_len
+            self._stats["bytes_out"] += len(data)
+        return b64, mime
+
+    def _lookup(self, digest: str, target, max_edge, fmt: str):
+        if target is None and self._fits.get((digest, int(max_edge or 0))):
+            return "fits", None
+        key = self._cache_key(digest, target, max_edge, fmt)
+        cached = self._cache.get(key)
+        if cached:
+            return "hit", cached
+        return key, None
+
+    def transform_sync(self, source_b64: str, source_mime: str, digest: Optional[str] = None, target=None, max_edge=None, fmt: str = "auto") -> Tuple[str, str]:
+        """Blocking variant for sync call sites; returns ``(b64, mime)``, the source when unchanged."""
+        data = None
+        if digest is None:
+            data = base64.b64decode(source_b64)
+            digest = hashlib.sha256(data).hexdigest()
+        state, cached = self._lookup(digest, target, max_edge, fmt)
+        if state == "fits":
+            return source_b64, source_mime
+        if state == "hit":
+            return cached
+        data = data if data is not None else base64.b64decode(source_b64)
+        try:
+            outcome = self._submit(data, target, max_edge, fmt).result(timeout=120)
+        except Exception as e:
+            self._count_error(e)
+            return source_b64, source_mime
+        return self._finish(state, digest, max_edge, len(data), outcome) or (source_b64, source_mime)
+
+    async def transform(self, source_b64: str, source_mime: str, digest: Optional[str] = None, target=None, max_edge=None, fmt: str = "auto") -> Tuple[str, str]:
+        data = None
+        if digest is None:
+            data = base64.b64decode(source_b64)
+            digest = hashlib.sha256(data).hexdigest()
+        state, cached = self._lookup(digest, target, max_edge, fmt)
+        if state == "fits":
+            return source_b64, source_mime
+        if state == "hit":
+            return cached
+        data = data if data is not None else base64.b64decode(source_b64)
+        try:
+            outcome = await asyncio.wait_for(asyncio.wrap_future(self._submit(data, target, max_edge, fmt)), timeout=120)
+        except Exception as e:
+            self._count_error(e)
+            return source_b64, source_mime
+        return self._finish(state, digest, max_edge, len(data), outcome) or (source_b64, source_mime)
+
+    def _count_error(self, error: BaseException) -> None:
+        if isinstance(error, BrokenProcessPool):
+            self._reset_pool()
+        with self._lock:
+            self._stats["errors"] += 1
+        logger.warning("image preprocess failed: %s", str(error)[:200])
+
+    def shutdown(self) -> None:
+        self._reset_pool()
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["workers"] = int(settings.IMAGE_PREPROCESS_WORKERS)
+            stats["pool_started"] = self._pool is not None
+        stats["cache"] = self._cache.snapshot_stats()
+        return stats
+
+
+image_preprocessor = ImagePreprocessor()
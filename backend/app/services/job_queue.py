@@ -0,0 +1,457 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.all_models import BackgroundJob
+
+logger = logging.getLogger("job_queue")
+
+FINISHED_STATUSES = ("succeeded", "failed", "canceled")
+_CLAIM_SCAN = 50
+_RECOVER_BATCH = 50
+_MAX_BACKOFF_SECONDS = 3600.0
+_PURGE_INTERVAL_SECONDS = 3600.0
+
+JobHandler = Callable[[Dict[str, Any]], Any]
+
+
+class JobQueue:
+    """Durable queue for batch work that used to run on ad-hoc threads inside the API process.
+
+    ``enqueue`` writes a ``background_jobs`` row; worker threads claim rows by priority with a
+    conditional update, skipping users already at ``JOB_PER_USER_CONCURRENCY`` running jobs,
+    and run the handler registered for the job's kind. A handler that raises is retried with
+    exponential backoff until ``max_attempts``. Running jobs carry a lease the owning process
+    keeps renewing; when a process dies, any other worker puts its jobs back in the queue.
+
+    Workers run inside the API (``JOB_WORKER_MODE=inprocess``) or in a separate
+    ``python -m app.worker`` process (``external``); either way handlers must tolerate being
+    run again after a crash.
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._handlers: Dict[str, JobHandler] = {}
+        self._max_attempts: Dict[str, int] = {}
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._stats = {
+            "enqueued": 0,
+            "claimed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+            "recovered": 0,
+            "canceled": 0,
+            "released": 0,
+            "errors": 0,
+        }
+
+    @property
+    def in_process(self) -> bool:
+        return str(settings.JOB_WORKER_MODE or "").strip().lower() != "external"
+
+    @property
+    def lease_seconds(self) -> float:
+        return max(15.0, float(settings.JOB_LEASE_SECONDS))
+
+    @property
+    def poll_seconds(self) -> float:
+        return max(0.2, float(settings.JOB_POLL_SECONDS))
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    def _backoff(self, attempts: int) -> float:
+        base = max(1.0, float(settings.JOB_RETRY_BACKOFF_SECONDS))
+        return min(_MAX_BACKOFF_SECONDS, base * (2 ** max(0, int(attempts) - 1)))
+
+    def _to_dict(self, row: BackgroundJob) -> Dict[str, Any]:
+        return {
+            "id": row.id,
+            "kind": row.kind,
+            "user_id": row.user_id,
+            "subject": row.subject,
+            "priority": row.priority or 0,
+            "status": row.status,
+            "payload": dict(row.payload or {}),
+            "attempts": row.attempts or 0,
+            "max_attempts": row.max_attempts or 1,
+            "owner": row.owner,
+            "error": row.error,
+            "created_at": row.created_at,
+        }
+
+    # -- Producers --
+
+    def register(self, kind: str, handler: JobHandler, max_attempts: Optional[int] = None) -> None:
+        """Registers the function that runs jobs of ``kind``; workers only claim registered kinds."""
+        self._handlers[kind] = handler
+        if max_attempts is not None:
+            self._max_attempts[kind] = max(1, int(max_attempts))
+
+    def enqueue(
+        self,
+        kind: str,
+        user_id: Optional[int],
+        payload: Dict[str, Any],
+        subject: Optional[str] = None,
+        priority: int = 0,
+        max_attempts: Optional[int] = None,
+        job_id: Optional[str] = None,
+    ) -> str:
+        """Queues a job and returns its id. Pass ``job_id`` to record it before the job can start."""
+        if max_attempts is None:
+            max_attempts = self._max_attempts.get(kind, int(settings.JOB_MAX_ATTEMPTS))
+        now = time.time()
+        job_id = job_id or uuid.uuid4().hex
+        with SessionLocal() as session:
+            session.add(BackgroundJob(
+                id=job_id,
+                kind=kind,
+                user_id=user_id,
+                subject=subject,
+                priority=int(priority),
+                status="queued",
+                payload=payload,
+                attempts=0,
+                max_attempts=max(1, int(max_attempts)),
+                run_after=now,
+                lease_expires_at=0,
+                created_at=now,
+                updated_at=now,
+            ))
+            session.commit()
+        self._count("enqueued")
+        self._wakeup.set()
+        logger.info("job enqueued | id=%s kind=%s user_id=%s subject=%s priority=%s", job_id, kind, user_id, subject, priority)
+        return job_id
+
+    def cancel_queued(self, kind: str, subject: str) -> int:
+        """Cancels jobs for ``subject`` that no worker has picked up yet."""
+        now = time.time()
+        with SessionLocal() as session:
+            canceled = session.query(BackgroundJob).filter(
+                BackgroundJob.kind == kind,
+                BackgroundJob.subject == subject,
+                BackgroundJob.status == "queued",
+            ).update({"status": "canceled", "finished_at": now, "updated_at": now}, synchronize_session=False)
+            session.commit()
+        if canceled:
+            self._count("canceled", int(canceled))
+        return int(canceled or 0)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with SessionLocal() as session:
+            row = session.query(BackgroundJob).filter(BackgroundJob.id == job_id).first()
+            return self._to_dict(row) if row is not None else None
+
+    # -- Called from inside a handler --
+
+    def current_job(self) -> Optional[Dict[str, Any]]:
+        return getattr(self._local, "job", None)
+
+    def will_retry(self) -> bool:
+        """True when the running job has attempts left, i.e. raising now schedules a retry."""
+        job = self.current_job()
+        return bool(job) and job["attempts"] < job["max_attempts"]
+
+    # -- Claiming and lease bookkeeping --
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        now = time.time()
+        cap = int(settings.JOB_PER_USER_CONCURRENCY)
+        with SessionLocal() as session:
+            busy = set()
+            if cap > 0:
+                # Read before claiming, so concurrent workers can briefly overshoot the cap.
+                running = session.query(BackgroundJob.user_id, func.count(BackgroundJob.id)).filter(
+                    BackgroundJob.status == "running"
+                ).group_by(BackgroundJob.user_id).all()
+                busy = {user_id for user_id, n in running if n >= cap}
+            rows = session.query(BackgroundJob).filter(
+                BackgroundJob.status == "queued",
+                BackgroundJob.kind.in_(kinds),
+                BackgroundJob.run_after <= now,
+            ).order_by(BackgroundJob.priority.desc(), BackgroundJob.created_at).limit(_CLAIM_SCAN).all()
+            for row in rows:
+                if row.user_id in busy:
+                    continue
+                won = session.query(BackgroundJob).filter(
+                    BackgroundJob.id == row.id,
+                    BackgroundJob.status == "queued",
+                ).update(
+                    {
+                        "status": "running",
+                        "owner": self.owner,
+                        "lease_expires_at": now + self.lease_seconds,
+                        "attempts": (row.attempts or 0) + 1,
+                        "started_at": now,
+                        "updated_at": now,
+                    },
+                    synchronize_session=False,
+                )
+                session.commit()
+                if won:
+                    session.refresh(row)
+                    self._count("claimed")
+                    return self._to_dict(row)
+        return None
+
+    def _finish(self, job: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+        """Applies ``fields`` if this worker still owns the job (a lost lease means someone else does)."""
+        fields["updated_at"] = time.time()
+        with SessionLocal() as session:
+            updated = session.query(BackgroundJob).filter(
+                BackgroundJob.id == job["id"],
+                BackgroundJob.owner == self.owner,
+                BackgroundJob.status == "running",
+            ).update(fields, synchronize_session=False)
+            session.commit()
+        return bool(updated)
+
+    def heartbeat(self) -> int:
+        with self._lock:
+            job_ids = list(self._active)
+        if not job_ids:
+            return 0
+        with SessionLocal() as session:
+            renewed = session.query(BackgroundJob).filter(
+                BackgroundJob.id.in_(job_ids),
+                BackgroundJob.owner == self.owner,
+                BackgroundJob.status == "running",
+            ).update({"lease_expires_at": time.time() + self.lease_seconds}, synchronize_session=False)
+            session.commit()
+        return int(renewed or 0)
+
+    def recover_expired(self) -> int:
+        """Requeues (or fails, when out of attempts) running jobs whose worker stopped heartbeating."""
+        now = time.time()
+        recovered = 0
+        with SessionLocal() as session:
+            rows = session.query(BackgroundJob).filter(
+                BackgroundJob.status == "running",
+                BackgroundJob.lease_expires_at < now,
+            ).order_by(BackgroundJob.created_at).limit(_RECOVER_BATCH).all()
+            for row in rows:
+                base = session.query(BackgroundJob).filter(
+                    BackgroundJob.id == row.id,
+                    BackgroundJob.owner == row.owner,
+                    BackgroundJob.lease_expires_at == row.lease_expires_at,
+                )
+                error = f"worker {row.owner} stopped responding"
+                if (row.attempts or 0) >= (row.max_attempts or 1):
+                    fields = {"status": "failed", "error": error, "finished_at": now}
+                else:
+                    fields = {"status": "queued", "error": error, "run_after": now + self._backoff(row.attempts or 1)}
+                if base.update({**fields, "owner": None, "lease_expires_at": 0, "updated_at": now}, synchronize_session=False):
+                    recovered += 1
+                    logger.warning(
+                        "recovered job | id=%s kind=%s owner=%s attempts=%s -> %s",
+                        row.id, row.kind, row.owner, row.attempts, fields["status"],
+                    )
+            session.commit()
+        if recovered:
+            self._count("recovered", recovered)
+            self._wakeup.set()
+        return recovered
+
+    def _release(self) -> int:
+        """Puts this process's running jobs that no thread is executing back in the queue without
+        spending an attempt. Jobs still executing keep their lease: releasing them would let
+        another worker start the same job while this one is still generating (and billing)."""
+        now = time.time()
+        with self._lock:
+            executing = list(self._active)
+        try:
+            with SessionLocal() as session:
+                query = session.query(BackgroundJob).filter(
+                    BackgroundJob.owner == self.owner,
+                    BackgroundJob.status == "running",
+                )
+                if executing:
+                    query = query.filter(~BackgroundJob.id.in_(executing))
+                released = query.update(
+                    {
+                        "status": "queued",
+                        "owner": None,
+                        "lease_expires_at": 0,
+                        "attempts": BackgroundJob.attempts - 1,
+                        "run_after": now,
+                        "updated_at": now,
+                    },
+                    synchronize_session=False,
+                )
+                session.commit()
+            if released:
+                self._count("released", int(released))
+            return int(released or 0)
+        except Exception as e:
+            logger.warning("could not release job leases: %s", str(e)[:200])
+            return 0
+
+    def purge_finished(self) -> int:
+        cutoff = time.time() - max(3600, int(settings.JOB_RETENTION_SECONDS))
+        with SessionLocal() as session:
+            removed = session.query(BackgroundJob).filter(
+                BackgroundJob.status.in_(FINISHED_STATUSES),
+                BackgroundJob.updated_at < cutoff,
+            ).delete(synchronize_session=False)
+            session.commit()
+        return int(removed or 0)
+
+    # -- Execution --
+
+    def _execute(self, job: Dict[str, Any]) -> None:
+        handler = self._handlers[job["kind"]]
+        with self._lock:
+            self._active[job["id"]] = job
+        self._local.job = job
+        started = time.monotonic()
+        logger.info("job started | id=%s kind=%s attempt=%s/%s", job["id"], job["kind"], job["attempts"], job["max_attempts"])
+        try:
+            result = handler(job)
+        except Exception as e:
+            error = str(e)[:2000] or e.__class__.__name__
+            if job["attempts"] < job["max_attempts"]:
+                delay = self._backoff(job["attempts"])
+                fields = {"status": "queued", "error": error, "owner": None, "lease_expires_at": 0, "run_after": time.time() + delay}
+                if self._finish(job, fields):
+                    self._count("retried")
+                logger.warning("job failed, retrying in %.0fs | id=%s kind=%s attempt=%s error=%s", delay, job["id"], job["kind"], job["attempts"], error[:200])
+            else:
+                if self._finish(job, {"status": "failed", "error": error, "lease_expires_at": 0, "finished_at": time.time()}):
+                    self._count("failed")
+                logger.exception("job failed | id=%s kind=%s attempt=%s", job["id"], job["kind"], job["attempts"])
+        else:
+            try:
+                stored = json.loads(json.dumps(result, default=str)) if result is not None else None
+            except (TypeError, ValueError):
+                stored = None
+            if self._finish(job, {"status": "succeeded", "result": stored, "error": None, "lease_expires_at": 0, "finished_at": time.time()}):
+                self._count("succeeded")
+            logger.info("job succeeded | id=%s kind=%s elapsed=%.1fs", job["id"], job["kind"], time.monotonic() - started)
+        finally:
+            self._local.job = None
+            with self._lock:
+                self._active.pop(job["id"], None)
+
+    def _worker_loop(self) -> None:
+        while not self._stop.is_set():
+            job = None
+            try:
+                job = self.claim()
+            except Exception as e:
+                self._count("errors")
+                logger.warning("job claim failed: %s", str(e)[:200])
+            if job is None:
+                if self._wakeup.wait(self.poll_seconds):
+                    self._wakeup.clear()
+                continue
+            try:
+                self._execute(job)
+            except Exception as e:
+                # Bookkeeping failed (e.g. the database went away); the lease will lapse and recovery requeues it.
+                self._count("errors")
+                logger.warning("job bookkeeping failed | id=%s error=%s", job["id"], str(e)[:200])
+
+    def _maintenance_loop(self) -> None:
+        interval = self.lease_seconds / 3
+        while not self._stop.wait(interval):
+            try:
+                self.heartbeat()
+                self.recover_expired()
+                if time.monotonic() - self._last_purge > _PURGE_INTERVAL_SECONDS:
+                    self._last_purge = time.monotonic()
+                    removed = self.purge_finished()
+                    if removed:
+                        logger.info("purged finished jobs | removed=%s", removed)
+            except Exception as e:
+                self._count("errors")
+                logger.warning("job maintenance iteration failed: %s", str(e)[:200])
+
+    def start(self, workers: Optional[int] = None) -> None:
+        if self._threads:
+            return
+        workers = max(1, int(settings.JOB_WORKERS if workers is None else workers))
+        self._stop.clear()
+        try:
+            self.recover_expired()
+        except Exception as e:
+            logger.warning("job recovery on start failed: %s", str(e)[:200])
+        self._threads = [threading.Thread(target=self._maintenance_loop, name="job-maintenance", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info("job workers started | owner=%s workers=%s kinds=%s", self.owner, workers, sorted(self._handlers))
+
+    def stop(self, grace_seconds: Optional[float] = None) -> None:
+        """Stops claiming and waits up to ``grace_seconds`` (default ``JOB_SHUTDOWN_GRACE_SECONDS``)
+        for running jobs. Jobs still running after that are left to their lease: heartbeats stop
+        with this process, and another worker recovers them once the lease lapses."""
+        if not self._threads:
+            return
+        if grace_seconds is None:
+            grace_seconds = float(settings.JOB_SHUTDOWN_GRACE_SECONDS)
+        self._stop.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + max(0.0, grace_seconds)
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._active:
+                    break
+            time.sleep(0.5)
+        with self._lock:
+            unfinished = [j["id"] for j in self._active.values()]
+        if unfinished:
+            logger.warning("jobs still running at shutdown, left to lease expiry | ids=%s", unfinished)
+        released = self._release()
+        if released:
+            logger.info("released orphaned jobs on shutdown | count=%s", released)
+        self._threads = []
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with SessionLocal() as session:
+            rows = session.query(BackgroundJob.kind, BackgroundJob.status, func.count(BackgroundJob.id)).filter(
+                BackgroundJob.status.in_(("queued", "running"))
+            ).group_by(BackgroundJob.kind, BackgroundJob.status).all()
+        by_kind: Dict[str, Dict[str, int]] = {}
+        for kind, status, n in rows:
+            by_kind.setdefault(kind, {})[status] = int(n)
+        with self._lock:
+            counters = dict(self._stats)
+            active = [{"id": j["id"], "kind": j["kind"], "user_id": j["user_id"]} for j in self._active.values()]
+        return {
+            "mode": "inprocess" if self.in_process else "external",
+            "owner": self.owner,
+            "workers": max(0, len(self._threads) - 1),
+            "per_user_concurrency": int(settings.JOB_PER_USER_CONCURRENCY),
+            "kinds": sorted(self._handlers),
+            "pending": by_kind,
+            "active": active,
+            **counters,
+        }
+
+
+job_queue = JobQueue()
@@ -0,0 +1,124 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("llm_response_cache")
+
+
+class LLMResponseCache:
+    """In-process LRU of text-LLM replies for call sites that opt in (``generate_content(cache_ttl=...)``).
+
+    Keys cover provider, endpoint, model, the API key's fingerprint, the normalized
+    messages and the request params, so a reply is only reused for the same credential
+    and an equivalent request. Bounded by ``LLM_RESPONSE_CACHE_MAX_ENTRIES`` and by
+    per-entry TTL; replies longer than ``LLM_RESPONSE_CACHE_MAX_ENTRY_CHARS`` are not kept.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (value, expires_at)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0, "skipped": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return int(settings.LLM_RESPONSE_CACHE_MAX_ENTRIES) > 0
+
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        lines = str(text).replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        return "\n".join(line.rstrip() for line in lines).strip()
+
+    def _normalize_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        normalized = []
+        for msg in messages or []:
+            content = msg.get("content")
+            if isinstance(content, str):
+                content = self._normalize_text(content)
+            elif isinstance(content, list):
+                content = [
+                    {**part, "text": self._normalize_text(part.get("text") or "")}
+                    if isinstance(part, dict) and part.get("type") == "text" else part
+                    for part in content
+                ]
+            normalized.append({"role": msg.get("role"), "content": content})
+        return normalized
+
+    def build_key(
+        self,
+        provider: Any,
+        base_url: Any,
+        model: Any,
+        api_key: Any,
+        messages: List[Dict[str, Any]],
+        params: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        payload = {
+            "provider": str(provider or "").strip().lower(),
+            "base_url": str(base_url or "").strip().rstrip("/"),
+            "model": str(model or "").strip(),
+            "key": hashlib.sha256(str(api_key or "").encode("utf-8")).hexdigest()[:16],
+            "messages": self._normalize_messages(messages),
+            "params": {
+                k: v for k, v in (params or {}).items()
+                if k != "governor" and not str(k).startswith("__")
+            },
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                self._stats["misses"] += 1
+                return None
+            if hit[1] <= now:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return copy.deepcopy(hit[0])
+
+    def put(self, key: str, value: Dict[str, Any], ttl_seconds: float) -> None:
+        if ttl_seconds <= 0 or not self.enabled:
+            return
+        if len(str(value.get("content") or "")) > int(settings.LLM_RESPONSE_CACHE_MAX_ENTRY_CHARS):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return
+        max_entries = int(settings.LLM_RESPONSE_CACHE_MAX_ENTRIES)
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(value), time.monotonic() + float(ttl_seconds))
+            self._entries.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": int(settings.LLM_RESPONSE_CACHE_MAX_ENTRIES),
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+llm_response_cache = LLMResponseCache()
@@ -1,16 +1,23 @@
 
 
-import requests
 import json
 import asyncio
-from typing import Dict, Any, List, Optional
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, AsyncIterator, Callable
 import logging
 import os
 import re
+import httpx
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
 
 from app.core.config import settings
+from app.services.outbound_governor import outbound_governor
+from app.services.http_transport import http_transport, ROUTE_ERRORS
+from app.services.llm_response_cache import llm_response_cache
+from app.services.singleflight import llm_singleflight
+from app.services.token_estimator import messages_features
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +45,12 @@ if not _llm_call_logger.handlers:
 # Some providers (e.g., Ark/Doubao) can take several minutes for large prompts.
 # Default timeout set to 300s, with env override support.
 DEFAULT_LLM_TIMEOUT_SECONDS = int(os.getenv("LLM_TIMEOUT_SECONDS", "300"))
+# Streaming reads may pause between chunks (reasoning models think before the first token).
+STREAM_READ_TIMEOUT_SECONDS = int(os.getenv("LLM_STREAM_READ_TIMEOUT_SECONDS", "120"))
+
+# When set, text-LLM calls made in this context stream from the provider and report
+# {"type": "start" | "delta" | "end", ...} events to the sink. See LLMService.stream_to.
+_stream_sink: contextvars.ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = contextvars.ContextVar("llm_stream_sink", default=None)
 
 SYSTEM_PROMPT = """
 You are an AI assistant for a Storyboard Editor application.
@@ -333,7 +346,7 @@ class LLMService:
             if value is not None:
                 hints.append(f"body.{key}={value}")
 
-        # Header-level hints (case-insensitive in requests headers)
+        # Header-level hints (header mappings are case-insensitive)
         header_keys = [
             "x-ratelimit-limit-tokens",
             "x-ratelimit-remaining-tokens",
@@ -481,11 +494,9 @@ class LLMService:
         
         logger.info(f"Calling Doubao Multimodal: {url} model={model}")
 
-        def _request():
-            return requests.post(url, headers=headers, json=payload, timeout=DEFAULT_LLM_TIMEOUT_SECONDS)
-
         try:
-            response = await asyncio.to_thread(_request)
+            async with outbound_governor.slot("doubao", model, api_key):
+                response = await self._post_json(url, headers, payload, "doubao")
             
             if response.status_code != 200:
                  # Try fallback to standard OpenAI format if 404/400, in case it's a standard model
@@ -624,6 +635,49 @@ class LLMService:
             provider = (extra_config or {}).get("__provider") or config.get("provider") or self._infer_provider(base_url, model)
             raise Exception(self._vendor_failed_message(provider, e))
 
+    @contextmanager
+    def stream_to(self, sink: Callable[[Dict[str, Any]], None]):
+        """Streams every text-LLM call made inside the block, reporting events to ``sink``.
+
+        Callers still get the complete response back, so existing code paths (retries,
+        continuation, parsing) run unchanged while the sink sees tokens as they arrive.
+        """
+        token = _stream_sink.set(sink)
+        try:
+            yield
+        finally:
+            _stream_sink.reset(token)
+
+    async def stream_chat_completion(self, messages: List[Dict], config: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Chunk iterator over ``chat_completion``: yields ``{"type": "delta", "text"}`` events and
+        finally ``{"type": "done", ...}`` carrying the ``chat_completion`` result (finish_reason, usage)."""
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def _run():
+            with self.stream_to(queue.put_nowait):
+                return await self.chat_completion(messages, config)
+
+        task = asyncio.create_task(_run())
+        try:
+            while True:
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    event = getter.result()
+                    if event.get("type") == "delta":
+                        yield event
+                    continue
+                getter.cancel()
+                while not queue.empty():
+                    event = queue.get_nowait()
+                    if event.get("type") == "delta":
+                        yield event
+                yield {"type": "done", **task.result()}
+                return
+        finally:
+            if not task.done():
+                task.cancel()
+
     async def _call_openai_compatible(self, base_url: str, api_key: str, model: str, messages: List[Dict], extra_config: Dict[str, Any] = None) -> Dict[str, Any]:
         full_response = await self._raw_llm_request_full(base_url, api_key, model, messages, extra_config)
         content = self._extract_text_from_response(full_response)
@@ -666,9 +720,14 @@ class LLMService:
             }
 
 
-    async def generate_content(self, user_prompt: str, system_prompt: str, config: Dict[str, Any], image_urls: List[str] = None, video_urls: List[str] = None) -> Dict[str, Any]:
+    async def generate_content(self, user_prompt: str, system_prompt: str, config: Dict[str, Any], image_urls: List[str] = None, video_urls: List[str] = None, cache_ttl: Optional[float] = None, user_id: Optional[int] = None, project_id: Optional[int] = None) -> Dict[str, Any]:
         """
         Generates content (Text or structured) based on prompts and optional multimedia context.
+
+        ``cache_ttl`` (seconds) opts the call into ``llm_response_cache``; a hit returns the
+        stored reply with empty usage and ``cached: True`` so callers can skip billing.
+        Identical calls already in flight for the same user and project on the same credential
+        are coalesced; the later callers get the same reply with empty usage and ``coalesced: True``.
         """
         if not config:
             return {"content": "Error: No LLM configuration found.", "usage": {}}
@@ -729,9 +788,22 @@ class LLMService:
              # If provider is Doubao/Grsai Video, we might need specific payload.
              pass
 
+        request_key = llm_response_cache.build_key(extra_config.get("__provider"), base_url, model, api_key, messages, extra_config)
+        cache_key = None
+        if cache_ttl and llm_response_cache.enabled:
+            cache_key = request_key
+            cached = llm_response_cache.get(cache_key)
+            if cached is not None:
+                return {**cached, "usage": {}, "cached": True}
+
         try:
              # Using the generic call which handles standard messages
-             response = await self._call_openai_compatible(base_url, api_key, model, messages, extra_config)
+             # Scoped like the image path: a shared (system) credential must not coalesce across users.
+             flight_key = json.dumps({"user_id": user_id, "project_id": project_id, "request": request_key}, sort_keys=True)
+             response, shared = await llm_singleflight.do(
+                 flight_key,
+                 lambda: self._call_openai_compatible(base_url, api_key, model, messages, extra_config),
+             )
              
              # Unpack
              content = response.get("reply", "")
@@ -740,6 +812,16 @@ class LLMService:
              if not content and "content" in response:
                  content = response["content"] # fallback if _call_openai_compatible returns typical dict
              
+             if (
+                 cache_key
+                 and isinstance(content, str)
+                 and content.strip()
+                 and not content.lower().startswith("error:")
+                 and not self._is_length_limited_finish_reason(finish_reason)
+             ):
+                 llm_response_cache.put(cache_key, {"content": content, "finish_reason": finish_reason}, cache_ttl)
+             if shared:
+                 return {"content": content, "usage": {}, "finish_reason": finish_reason, "coalesced": True}
              return {"content": content, "usage": usage, "finish_reason": finish_reason}
 
         except Exception as e:
@@ -794,7 +876,7 @@ class LLMService:
             # Merge extra config, but don't overwrite critical fields if not intended
             # For now, just update, but maybe exclude 'model' or 'messages'
             for k, v in extra_config.items():
-                if k not in ["model", "messages", "stream"] and not str(k).startswith("__"):
+                if k not in ["model", "messages", "stream", "governor"] and not str(k).startswith("__"):
                     payload[k] = v
 
         def _to_positive_int(value: Any) -> Optional[int]:
@@ -879,26 +961,12 @@ class LLMService:
             "resolved_setting_id": (extra_config or {}).get("__resolved_setting_id"),
         })
 
-        def _request(bypass_proxy=False):
-            kwargs = {
-                "json": payload,
-                "headers": headers,
-                "timeout": DEFAULT_LLM_TIMEOUT_SECONDS
-            }
-            if bypass_proxy:
-                kwargs["proxies"] = {"http": None, "https": None}
-            return requests.post(url, **kwargs)
-
-        try:
-            response = await asyncio.to_thread(_request, False)
-        except (requests.exceptions.ProxyError, requests.exceptions.SSLError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-            logger.warning(f"Connection failed ({str(e)}). Retrying without proxy...")
-            try:
-                response = await asyncio.to_thread(_request, True)
-            except requests.exceptions.Timeout as e2:
-                raise Exception(self._vendor_failed_message(provider, f"Upstream timeout: {e2}"))
-            except Exception as e2:
-                raise Exception(self._vendor_failed_message(provider, e2))
+        sink = _stream_sink.get() if resolved_category == "LLM" else None
+        async with outbound_governor.slot(provider, model, api_key, (extra_config or {}).get("governor")):
+            if sink is not None:
+                response = await self._stream_request(url, headers, payload, provider, model, sink)
+            else:
+                response = await self._post_json(url, headers, payload, provider, (extra_config or {}).get("__read_timeout"))
         
         if response.status_code != 200:
             provider = (extra_config or {}).get("__provider") or (extra_config or {}).get("provider") or self._infer_provider(base_url, model)
@@ -962,10 +1030,13 @@ class LLMService:
                 "category": resolved_category,
                 "url": url,
                 "model": data.get("model") or model,
+                "requested_model": model,
                 "finish_reason": finish_reason,
                 "output_chars": output_chars,
                 "usage": usage,
                 "prompt_chars": prompt_chars,
+                # Calibration sample for token_estimator (see calibrate_token_estimator.py).
+                "prompt_features": messages_features(messages),
                 "max_tokens": effective_max_tokens,
             })
             if self._is_length_limited_finish_reason(finish_reason):
@@ -1035,6 +1106,100 @@ class LLMService:
         else:
              raise Exception(self._vendor_failed_message(provider, f"Invalid API Response: {data}"))
 
+    async def _post_json(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], provider: str, read_timeout: Optional[float] = None) -> httpx.Response:
+        """POSTs on the shared ``llm`` pool via the host's remembered proxy/direct route.
+
+        Only connect-phase failures switch routes; a read timeout means the upstream
+        has the request, so it is reported instead of replayed on the other route.
+        ``read_timeout`` (``config["__read_timeout"]``) shortens the default for interactive calls.
+        """
+        try:
+            return await http_transport.request_with_direct_fallback(
+                "POST",
+                url,
+                pool="llm",
+                log_tag=f"llm:{provider}",
+                retry_on=ROUTE_ERRORS,
+                json=payload,
+                headers=headers,
+                timeout=(settings.HTTP_POOL_CONNECT_TIMEOUT, float(read_timeout or DEFAULT_LLM_TIMEOUT_SECONDS)),
+            )
+        except httpx.TimeoutException as e:
+            raise Exception(self._vendor_failed_message(provider, f"Upstream timeout: {e}"))
+        except httpx.RequestError as e:
+            raise Exception(self._vendor_failed_message(provider, e))
+
+    async def _stream_request(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], provider: str, model: str, sink: Callable[[Dict[str, Any]], None]) -> "_StreamedResponse":
+        """POSTs with ``stream: true`` and folds the SSE chunks back into a regular completion body."""
+        stream_payload = {**payload, "stream": True}
+        stream_payload.setdefault("stream_options", {"include_usage": True})
+
+        text_parts: List[str] = []
+        finish_reason = None
+        usage: Dict[str, Any] = {}
+        response_model = None
+        sink({"type": "start", "provider": provider, "model": model})
+        try:
+            async with http_transport.stream_with_direct_fallback(
+                "POST",
+                url,
+                pool="llm",
+                log_tag=f"llm:{provider}",
+                json=stream_payload,
+                headers=headers,
+                timeout=(settings.HTTP_POOL_CONNECT_TIMEOUT, STREAM_READ_TIMEOUT_SECONDS),
+            ) as resp:
+                if resp.status_code != 200:
+                    body = (await resp.aread()).decode("utf-8", "replace")
+                    return _StreamedResponse(resp.status_code, body, resp.headers, None)
+                if "text/event-stream" not in resp.headers.get("content-type", ""):
+                    # Provider ignored "stream"; hand back the plain body as a single delta.
+                    body = (await resp.aread()).decode("utf-8", "replace")
+                    data = json.loads(body)
+                    text = self._extract_text_from_response(data)
+                    if text:
+                        sink({"type": "delta", "text": text})
+                    sink({"type": "end", "finish_reason": self._extract_finish_reason_from_response(data), "usage": data.get("usage") or {}})
+                    return _StreamedResponse(resp.status_code, body, resp.headers, data)
+
+                async for line in resp.aiter_lines():
+                    line = line.strip()
+                    if not line.startswith("data:"):
+                        continue
+                    chunk_text = line[5:].strip()
+                    if not chunk_text or chunk_text == "[DONE]":
+                        continue
+                    try:
+                        chunk = json.loads(chunk_text)
+                    except ValueError:
+                        continue
+                    response_model = chunk.get("model") or response_model
+                    if isinstance(chunk.get("usage"), dict):
+                        usage = chunk["usage"]
+                    for choice in chunk.get("choices") or []:
+                        if not isinstance(choice, dict):
+                            continue
+                        delta = (choice.get("delta") or {}).get("content")
+                        if isinstance(delta, str) and delta:
+                            text_parts.append(delta)
+                            sink({"type": "delta", "text": delta})
+                        if choice.get("finish_reason"):
+                            finish_reason = choice.get("finish_reason")
+        except httpx.TimeoutException as e:
+            raise Exception(self._vendor_failed_message(provider, f"Upstream timeout: {e}"))
+        except httpx.RequestError as e:
+            raise Exception(self._vendor_failed_message(provider, e))
+
+        sink({"type": "end", "finish_reason": finish_reason, "usage": usage})
+        data = {
+            "model": response_model or model,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(text_parts)}, "finish_reason": finish_reason}],
+            "usage": usage,
+            "_streamed": True,
+        }
+        return _StreamedResponse(200, "", resp.headers, data)
+
     def _mock_fallback(self, query: str) -> Dict[str, Any]:
         if "analyze" in query.lower():
             return {
@@ -1043,4 +1208,17 @@ class LLMService:
             }
         return {"reply": f"Mock reply to: {query}", "plan": []}
 
+class _StreamedResponse:
+    """The parts of an ``httpx.Response`` that ``_raw_llm_request_full`` reads."""
+
+    def __init__(self, status_code: int, text: str, headers: Any, data: Optional[Dict[str, Any]]):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+        self._data = data
+
+    def json(self) -> Dict[str, Any]:
+        return self._data if self._data is not None else json.loads(self.text)
+
+
 llm_service = LLMService()
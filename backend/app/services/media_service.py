@@ -1,5 +1,5 @@
 
-import requests
+import httpx
 import re
 import urllib3
 import time
@@ -16,13 +16,25 @@ import traceback
 import math
 import ipaddress
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Any, Optional, Union
 
 from app.db.session import SessionLocal
 from app.models.all_models import APISetting, SystemAPISetting
 from app.core.config import settings
-from sqlalchemy import cast, String
+from app.services.http_transport import http_transport, CONNECT_ERRORS
+from app.services.task_poller import task_poller
+from app.services.provider_health import provider_health
+from app.services.ref_image_cache import ref_image_cache
+from app.services.media_store import media_store
+from app.services.generation_cache import generation_cache
+from app.services.image_preprocess import image_preprocessor
+from app.services.outbound_governor import outbound_governor
+from app.services.settings_cache import settings_resolution_cache, SYSTEM_SCOPE
+from app.services.generation_resume import generation_resumer, api_key_fingerprint
+from app.services.task_callbacks import task_callbacks
+from app.services.singleflight import image_singleflight
 
 # Suppress InsecureRequestWarning from urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -35,6 +47,14 @@ class MediaGenerationService:
 # ...
     DOUBAO_MIN_IMAGE_PIXELS = 3_686_400
     SMART_ROUTER_PROVIDER = "smart_router"
+    # Longest edge we send for reference images per provider; larger refs are shrunk before upload.
+    REF_MAX_EDGE = {
+        "doubao": 4096,
+        "grsai": 2048,
+        "vidu": 2048,
+        "wanxiang": 2048,
+        "tencent": 2048,
+    }
 
     def _vendor_label(self, provider: Any) -> str:
         raw = str(provider or "").strip()
@@ -153,52 +173,6 @@ class MediaGenerationService:
             return "21:9"
         return raw
 
-    def _repair_invalid_user_config_rows(self, session, user_id: int, category: Optional[str] = None) -> None:
-        q = session.query(
-            APISetting.id,
-            cast(APISetting.config, String).label("config_raw"),
-        ).filter(APISetting.user_id == user_id)
-        if category:
-            q = q.filter(APISetting.category == category)
-
-        bad_ids: List[int] = []
-        for row in q.all():
-            raw = getattr(row, "config_raw", None)
-            if isinstance(raw, str) and raw.strip() and not self._safe_json_dict(raw):
-                bad_ids.append(row.id)
-
-        if bad_ids:
-            logger.warning("Repair invalid api_settings.config rows in media service | user_id=%s category=%s ids=%s", user_id, category, bad_ids)
-            session.query(APISetting).filter(APISetting.id.in_(bad_ids)).update(
-                {APISetting.config: {}},
-                synchronize_session=False,
-            )
-            session.commit()
-
-    def _repair_invalid_system_config_rows(self, session, category: Optional[str] = None, provider: Optional[str] = None) -> None:
-        q = session.query(
-            SystemAPISetting.id,
-            cast(SystemAPISetting.config, String).label("config_raw"),
-        )
-        if category:
-            q = q.filter(SystemAPISetting.category == category)
-        if provider:
-            q = q.filter(SystemAPISetting.provider == provider)
-
-        bad_ids: List[int] = []
-        for row in q.all():
-            raw = getattr(row, "config_raw", None)
-            if isinstance(raw, str) and raw.strip() and not self._safe_json_dict(raw):
-                bad_ids.append(row.id)
-
-        if bad_ids:
-            logger.warning("Repair invalid system_api_settings.config rows in media service | category=%s provider=%s ids=%s", category, provider, bad_ids)
-            session.query(SystemAPISetting).filter(SystemAPISetting.id.in_(bad_ids)).update(
-                {SystemAPISetting.config: {}},
-                synchronize_session=False,
-            )
-            session.commit()
-
     def _system_setting_query(self, session, provider: str, category: str = None):
         query = session.query(SystemAPISetting).filter(
             SystemAPISetting.provider == provider,
@@ -222,6 +196,22 @@ class MediaGenerationService:
             APISetting.is_active == True,
         ).order_by(APISetting.id.desc()).first()
 
+    def _with_session(self, fn, *args):
+        with SessionLocal() as session:
+            return fn(session, *args)
+
+    def _active_user_provider(self, user_id: int, category: str) -> Optional[str]:
+        def _load():
+            with SessionLocal() as session:
+                active_setting = self._get_active_user_setting(session, user_id, category)
+                return active_setting.provider if active_setting else None
+
+        return settings_resolution_cache.get_or_load(
+            ("active_provider", str(user_id), category),
+            settings_resolution_cache.user_scope(user_id),
+            _load,
+        )
+
     def _normalize_provider_name(self, provider: Optional[str], category: Optional[str] = None) -> str:
         raw = str(provider or "").strip().lower()
         mapping = {
@@ -369,6 +359,156 @@ class MediaGenerationService:
 
         return {"error": f"Unsupported category: {category}"}
 
+    def _record_provider_health(
+        self,
+        provider: str,
+        model: Any,
+        result: Optional[Dict[str, Any]],
+        elapsed_ms: float,
+        ticket: Optional[Dict[str, Any]] = None,
+    ) -> Optional[str]:
+        """Feeds one attempt into the routing health tracker; returns the upstream failure kind, if any."""
+        if result and not result.get("error"):
+            provider_health.record(provider, model, ok=True, latency_ms=elapsed_ms, ticket=ticket)
+            return None
+
+        payload = result or {}
+        error_text = self._flatten_text(payload.get("error")).lower()
+        if self._is_grsai_quota_or_throttle_error(payload):
+            failure = "throttled"
+        elif "timeout" in error_text or "timed out" in error_text:
+            failure = "timeout"
+        elif payload.get("submit_failed"):
+            failure = "submit_failed"
+        else:
+            # Local validation / content errors say nothing about upstream health.
+            return None
+
+        provider_health.record(
+            provider,
+            model,
+            ok=False,
+            latency_ms=elapsed_ms,
+            throttled=failure == "throttled",
+            error=payload.get("error"),
+            ticket=ticket,
+        )
+        return failure
+
+    async def _execute_tracked(
+        self,
+        category: str,
+        provider: str,
+        api_config: Dict[str, Any],
+        exec_kwargs: Dict[str, Any],
+    ):
+        """Runs one provider attempt under the outbound governor and feeds its outcome into the health tracker."""
+        governor_overrides = (api_config.get("config") or {}).get("governor")
+        # Taken before the attempt so a half-open circuit knows whether this is one of its probes.
+        ticket = provider_health.begin(provider, api_config.get("model"))
+        started = time.perf_counter()
+        try:
+            try:
+                # Held through submit and polling (minutes), so it must not take a default concurrency slot.
+                async with outbound_governor.slot(
+                    provider, api_config.get("model"), api_config.get("api_key"), governor_overrides, long_running=True,
+                ):
+                    # Queue time is excluded so routing latency reflects the upstream only.
+                    started = time.perf_counter()
+                    result = await self._execute_generation_by_provider(
+                        category=category,
+                        provider=provider,
+                        api_config=api_config,
+                        **exec_kwargs,
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Provider execution raised | category=%s provider=%s", category, provider)
+                result = {"error": f"{type(e).__name__}: {str(e)[:300]}"}
+            failure = self._record_provider_health(
+                provider,
+                api_config.get("model"),
+                result,
+                (time.perf_counter() - started) * 1000,
+                ticket,
+            )
+        finally:
+            provider_health.end(ticket)
+        return result, failure
+
+    async def _execute_hedged(
+        self,
+        category: str,
+        primary_provider: str,
+        primary_config: Dict[str, Any],
+        hedge_provider: str,
+        hedge_config: Dict[str, Any],
+        delay_seconds: float,
+        exec_kwargs: Dict[str, Any],
+    ):
+        """Runs the primary attempt; past ``delay_seconds`` races the hedge candidate against it.
+
+        The first successful result wins and the other attempt is cancelled. Returns
+        ``(result, provider, config, upstream_failure, hedge_info)``; ``hedge_info`` is None
+        when the primary finished before the hedge fired.
+        """
+        primary = asyncio.create_task(self._execute_tracked(category, primary_provider, primary_config, exec_kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay_seconds)
+        if done:
+            result, failure = primary.result()
+            return result, primary_provider, primary_config, failure, None
+
+        logger.info(
+            "Smart routing hedge fired | category=%s primary=%s/%s hedge=%s/%s delay_ms=%s",
+            category,
+            primary_provider,
+            primary_config.get("model"),
+            hedge_provider,
+            hedge_config.get("model"),
+            int(delay_seconds * 1000),
+        )
+        secondary = asyncio.create_task(self._execute_tracked(category, hedge_provider, hedge_config, exec_kwargs))
+        labels = {
+            primary: ("primary", primary_provider, primary_config),
+            secondary: ("hedge", hedge_provider, hedge_config),
+        }
+        hedge_info: Dict[str, Any] = {"fired": True, "delay_ms": int(delay_seconds * 1000), "winner": None}
+        outcomes: Dict[str, Any] = {}
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    label, provider, config = labels[task]
+                    result, failure = task.result()
+                    outcomes[label] = (result, provider, config, failure)
+                    if result and not result.get("error"):
+                        loser_label, loser_provider, loser_config = next(v for t, v in labels.items() if t is not task)
+                        hedge_info.update({
+                            "winner": label,
+                            "loser": loser_label,
+                            "loser_provider": loser_provider,
+                            "loser_model": loser_config.get("model"),
+                            # The loser was already submitted upstream unless it failed first.
+                            "loser_submitted": loser_label not in outcomes,
+                        })
+                        logger.info(
+                            "Smart routing hedge resolved | category=%s winner=%s provider=%s model=%s",
+                            category,
+                            label,
+                            provider,
+                            config.get("model"),
+                        )
+                        return result, provider, config, failure, hedge_info
+        finally:
+            for task in (primary, secondary):
+                if not task.done():
+                    task.cancel()
+
+        result, provider, config, failure = outcomes.get("primary") or outcomes.get("hedge")
+        return result, provider, config, failure, hedge_info
+
     async def _generate_with_smart_routing(
         self,
         category: str,
@@ -387,10 +527,18 @@ class MediaGenerationService:
         explicit_selection: bool = False,
         allow_priority_fallback_when_explicit: bool = False,
         fallback_candidate_limit: int = 3,
+        hedge: bool = False,
     ) -> Dict[str, Any]:
-        with SessionLocal() as session:
-            smart_enabled = self._is_smart_routing_enabled(session, user_id)
-            candidates = self._get_system_candidates(session, category)
+        smart_enabled = settings_resolution_cache.get_or_load(
+            ("smart_routing_enabled", str(user_id)),
+            settings_resolution_cache.user_scope(user_id),
+            lambda: self._with_session(self._is_smart_routing_enabled, user_id),
+        )
+        candidates = settings_resolution_cache.get_or_load(
+            ("system_candidates", category),
+            SYSTEM_SCOPE,
+            lambda: self._with_session(self._get_system_candidates, category),
+        )
 
         if allow_priority_fallback_when_explicit:
             smart_enabled = True
@@ -428,7 +576,14 @@ class MediaGenerationService:
                     and str(c.get("model") or "") == str(baseline_config.get("model") or "")
                 )
             ],
-            key=lambda x: (x.get("priority", 100), x.get("id", 0)),
+            # Open circuits sink below every healthy candidate; within a priority tier
+            # the observed success rate / latency decides the order.
+            key=lambda x: (
+                provider_health.is_open(x.get("provider"), x.get("model")),
+                x.get("priority", 100),
+                provider_health.rank_key(x.get("provider"), x.get("model")),
+                x.get("id", 0),
+            ),
         )
         if fallback_candidate_limit and fallback_candidate_limit > 0:
             fallback_candidates = fallback_candidates[: int(fallback_candidate_limit)]
@@ -481,8 +636,61 @@ class MediaGenerationService:
 
         final_error: Dict[str, Any] = {"error": "Generation failed"}
         fallback_unlocked = False
+        active_exhausted = False
+        has_fallback = smart_enabled and bool(fallback_candidates)
+
+        if has_fallback and provider_health.is_open(effective_provider, baseline_config.get("model")):
+            logger.info(
+                "Smart routing circuit open, routing to fallback | category=%s user_id=%s provider=%s model=%s",
+                category,
+                user_id,
+                effective_provider,
+                baseline_config.get("model"),
+            )
+            fallback_unlocked = True
+            active_exhausted = True
+
+        hedge_target: Optional[Dict[str, Any]] = None
+        hedge_delay_seconds = 0.0
+        if hedge and category == "Image" and not active_exhausted:
+            hedge_target = next(
+                (c for c in fallback_candidates if not provider_health.is_open(c.get("provider"), c.get("model"))),
+                None,
+            )
+            p90_ms = provider_health.latency_quantile(
+                effective_provider,
+                baseline_config.get("model"),
+                settings.ROUTER_HEDGE_QUANTILE,
+            )
+            if hedge_target is None or p90_ms is None:
+                logger.info(
+                    "Smart routing hedge disabled for request | category=%s user_id=%s provider=%s reason=%s",
+                    category,
+                    user_id,
+                    effective_provider,
+                    "no_healthy_fallback" if hedge_target is None else "insufficient_latency_samples",
+                )
+                hedge_target = None
+            else:
+                hedge_delay_seconds = max(float(settings.ROUTER_HEDGE_MIN_DELAY_SECONDS), p90_ms / 1000.0)
+
+        await self._prefetch_refs(reference_image_url, last_frame_url, keyframes, max_edge=self._ref_max_edge(effective_provider))
+
+        exec_kwargs = {
+            "prompt": prompt,
+            "reference_image_url": reference_image_url,
+            "width": width,
+            "height": height,
+            "aspect_ratio": aspect_ratio,
+            "last_frame_url": last_frame_url,
+            "duration": duration,
+            "keyframes": keyframes,
+        }
 
         for index, attempt in enumerate(deduped_attempts, start=1):
+            if attempt.get("tag") == "active_retry" and active_exhausted:
+                continue
+
             if attempt.get("tag") == "priority_fallback" and not fallback_unlocked:
                 logger.info(
                     "Smart routing skip fallback | category=%s user_id=%s attempt=%s/%s reason=no_explicit_submit_failure",
@@ -498,6 +706,30 @@ class MediaGenerationService:
             if not selected_provider:
                 continue
 
+            if (
+                smart_enabled
+                and attempt.get("tag") != "active_retry"
+                and provider_health.is_open(selected_provider, selected_config.get("model"))
+                and any(
+                    not provider_health.is_open(
+                        self._normalize_provider_name(later.get("provider"), category),
+                        (later.get("config") or {}).get("model"),
+                    )
+                    for later in deduped_attempts[index:]
+                    if later.get("tag") != "active_retry"
+                )
+            ):
+                logger.info(
+                    "Smart routing skip open circuit | category=%s user_id=%s attempt=%s/%s provider=%s model=%s",
+                    category,
+                    user_id,
+                    index,
+                    len(deduped_attempts),
+                    selected_provider,
+                    selected_config.get("model"),
+                )
+                continue
+
             logger.info(
                 "Smart routing attempt | category=%s user_id=%s attempt=%s/%s provider=%s model=%s tag=%s smart_enabled=%s fallback_triggered=%s",
                 category,
@@ -511,19 +743,20 @@ class MediaGenerationService:
                 fallback_unlocked,
             )
 
-            result = await self._execute_generation_by_provider(
-                category=category,
-                provider=selected_provider,
-                prompt=prompt,
-                api_config=selected_config,
-                reference_image_url=reference_image_url,
-                width=width,
-                height=height,
-                aspect_ratio=aspect_ratio,
-                last_frame_url=last_frame_url,
-                duration=duration,
-                keyframes=keyframes,
-            )
+            hedge_info = None
+            if hedge_target is not None and attempt.get("tag") == "active_retry":
+                result, selected_provider, selected_config, upstream_failure, hedge_info = await self._execute_hedged(
+                    category,
+                    selected_provider,
+                    selected_config,
+                    self._normalize_provider_name(hedge_target.get("provider"), category),
+                    dict(hedge_target.get("config") or {}),
+                    hedge_delay_seconds,
+                    exec_kwargs,
+                )
+                hedge_target = None
+            else:
+                result, upstream_failure = await self._execute_tracked(category, selected_provider, selected_config, exec_kwargs)
 
             if result and not result.get("error"):
                 metadata = result.get("metadata") or {}
@@ -547,6 +780,8 @@ class MediaGenerationService:
                     "attempt_tag": attempt.get("tag"),
                     "provider": selected_provider,
                 }
+                if hedge_info:
+                    metadata["smart_routing"]["hedge"] = hedge_info
                 result["metadata"] = metadata
                 return result
 
@@ -555,6 +790,22 @@ class MediaGenerationService:
             fallback_triggered_now = bool((result or {}).get("submit_failed"))
             if has_error and attempt.get("tag") in {"active_retry", "multi_ref_default"}:
                 fallback_triggered_now = True
+            if (
+                has_fallback
+                and attempt.get("tag") == "active_retry"
+                and upstream_failure in {"throttled", "timeout"}
+                and not active_exhausted
+            ):
+                # Retrying a throttled or timing-out upstream only multiplies the wait;
+                # hand the request to the fallback candidates right away.
+                logger.info(
+                    "Smart routing abandon active retries | category=%s user_id=%s provider=%s reason=%s",
+                    category,
+                    user_id,
+                    selected_provider,
+                    upstream_failure,
+                )
+                active_exhausted = True
 
             if fallback_triggered_now:
                 if not fallback_unlocked:
@@ -580,6 +831,23 @@ class MediaGenerationService:
         user_credits: int = 0,
     ) -> Dict[str, Any]:
         """Resolves runtime API configuration by category active user setting -> system provider+model match."""
+        resolved_category = str(category or "").strip()
+        if not resolved_category:
+            logger.warning("Missing category when resolving media API config | user_id=%s", user_id)
+            return {}
+
+        try:
+            return settings_resolution_cache.get_or_load(
+                ("media_api_config", str(user_id), resolved_category),
+                settings_resolution_cache.user_scope(user_id),
+                lambda: self._resolve_api_config(user_id, resolved_category),
+            )
+        except Exception as e:
+            print(f"Error fetching settings for {provider}: {e}")
+
+        return {}
+
+    def _resolve_api_config(self, user_id: int, resolved_category: str) -> Dict[str, Any]:
         defaults = {
             "openai": {"base_url": "https://api.openai.com/v1", "model": "gpt-4-turbo-preview"},
             "anthropic": {"base_url": "https://api.anthropic.com", "model": "claude-3-opus-20240229"},
@@ -593,93 +861,105 @@ class MediaGenerationService:
             "vidu": {"base_url": "https://api.vidu.studio/open/v1/creation/video", "model": "vidu2.0"},
         }
 
-        try:
-            with SessionLocal() as session:
-                resolved_category = str(category or "").strip()
-                if not resolved_category:
-                    logger.warning("Missing category when resolving media API config | user_id=%s", user_id)
-                    return {}
-
-                self._repair_invalid_user_config_rows(session, user_id, category=category)
-                self._repair_invalid_system_config_rows(session, category=category, provider=provider)
-
-                user_setting = self._get_active_user_setting(session, user_id, resolved_category)
-                if not user_setting:
-                    logger.warning(
-                        "No active user api setting found in media service | user_id=%s category=%s",
-                        user_id,
-                        resolved_category,
-                    )
-                    return {}
+        with SessionLocal() as session:
+            user_setting = self._get_active_user_setting(session, user_id, resolved_category)
+            if not user_setting:
+                logger.warning(
+                    "No active user api setting found in media service | user_id=%s category=%s",
+                    user_id,
+                    resolved_category,
+                )
+                return {}
 
-                target_provider = str(user_setting.provider or "").strip()
-                target_model = str(user_setting.model or "").strip()
-                if not target_provider or not target_model:
-                    logger.warning(
-                        "Active user setting missing provider/model in media service | user_id=%s category=%s setting_id=%s provider=%s model=%s",
-                        user_id,
-                        resolved_category,
-                        user_setting.id,
-                        user_setting.provider,
-                        user_setting.model,
-                    )
-                    return {}
+            target_provider = str(user_setting.provider or "").strip()
+            target_model = str(user_setting.model or "").strip()
+            if not target_provider or not target_model:
+                logger.warning(
+                    "Active user setting missing provider/model in media service | user_id=%s category=%s setting_id=%s provider=%s model=%s",
+                    user_id,
+                    resolved_category,
+                    user_setting.id,
+                    user_setting.provider,
+                    user_setting.model,
+                )
+                return {}
 
-                system_setting = session.query(SystemAPISetting).filter(
-                    SystemAPISetting.category == resolved_category,
-                    SystemAPISetting.provider == target_provider,
-                    SystemAPISetting.model == target_model,
-                ).order_by(SystemAPISetting.id.desc()).first()
+            system_setting = session.query(SystemAPISetting).filter(
+                SystemAPISetting.category == resolved_category,
+                SystemAPISetting.provider == target_provider,
+                SystemAPISetting.model == target_model,
+            ).order_by(SystemAPISetting.id.desc()).first()
 
-                resolved_source = f"system_by_user_provider_model:{target_provider}/{target_model}"
+            resolved_source = f"system_by_user_provider_model:{target_provider}/{target_model}"
 
-                if system_setting:
-                    logger.info(
-                        "Resolved media API config | user_id=%s category=%s provider=%s source=%s selection_source=system_only setting_id=%s model=%s endpoint=%s",
-                        user_id,
-                        resolved_category,
-                        target_provider,
-                        resolved_source,
-                        system_setting.id,
-                        system_setting.model,
-                        system_setting.base_url,
-                    )
-                    return {
-                        "provider": system_setting.provider,
-                        "api_key": system_setting.api_key,
-                        "base_url": system_setting.base_url or defaults.get(target_provider, {}).get("base_url"),
-                        "model": system_setting.model or defaults.get(target_provider, {}).get("model"),
-                        "config": {
-                            **(system_setting.config or {}),
-                            "__selection_source": "system_only",
-                            "__resolved_source": resolved_source,
-                            "__resolved_setting_id": system_setting.id,
-                        },
-                    }
-                logger.warning(
-                    "No matching system api setting by provider+model in media service | user_id=%s category=%s provider=%s model=%s",
+            if system_setting:
+                logger.info(
+                    "Resolved media API config | user_id=%s category=%s provider=%s source=%s selection_source=system_only setting_id=%s model=%s endpoint=%s",
                     user_id,
                     resolved_category,
                     target_provider,
-                    target_model,
+                    resolved_source,
+                    system_setting.id,
+                    system_setting.model,
+                    system_setting.base_url,
                 )
-        except Exception as e:
-            print(f"Error fetching settings for {provider}: {e}")
-
+                return {
+                    "provider": system_setting.provider,
+                    "api_key": system_setting.api_key,
+                    "base_url": system_setting.base_url or defaults.get(target_provider, {}).get("base_url"),
+                    "model": system_setting.model or defaults.get(target_provider, {}).get("model"),
+                    "config": {
+                        **(system_setting.config or {}),
+                        "__selection_source": "system_only",
+                        "__resolved_source": resolved_source,
+                        "__resolved_setting_id": system_setting.id,
+                    },
+                }
+            logger.warning(
+                "No matching system api setting by provider+model in media service | user_id=%s category=%s provider=%s model=%s",
+                user_id,
+                resolved_category,
+                target_provider,
+                target_model,
+            )
         return {}
 
-    async def generate_image(self, prompt: str, llm_config: Optional[Dict[str, Any]] = None, reference_image_url: Optional[Union[str, List[str]]] = None, width: int = None, height: int = None, aspect_ratio: str = None, user_id: int = 1, user_credits: int = 0, filename_base: Optional[str] = None, asset_type: Optional[str] = None):
+    async def generate_image(self, prompt: str, llm_config: Optional[Dict[str, Any]] = None, reference_image_url: Optional[Union[str, List[str]]] = None, width: int = None, height: int = None, aspect_ratio: str = None, user_id: int = 1, user_credits: int = 0, filename_base: Optional[str] = None, asset_type: Optional[str] = None, hedge: bool = False, project_id: Optional[int] = None, bypass_cache: bool = False):
+        # Identical requests from the same user already in flight (double clicks, client
+        # retries) share one upstream generation; later callers get metadata.singleflight.
+        flight_key = json.dumps({
+            "user_id": user_id,
+            "project_id": project_id,
+            "provider": (llm_config or {}).get("provider"),
+            "model": (llm_config or {}).get("model"),
+            "prompt": prompt,
+            "refs": reference_image_url,
+            "width": width,
+            "height": height,
+            "aspect_ratio": aspect_ratio,
+            "filename_base": filename_base,
+            "asset_type": asset_type,
+            "bypass_cache": bool(bypass_cache),
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        result, shared = await image_singleflight.do(flight_key, lambda: self._generate_image(
+            prompt, llm_config=llm_config, reference_image_url=reference_image_url, width=width, height=height,
+            aspect_ratio=aspect_ratio, user_id=user_id, user_credits=user_credits, filename_base=filename_base,
+            asset_type=asset_type, hedge=hedge, project_id=project_id, bypass_cache=bypass_cache,
+        ))
+        if shared and isinstance(result, dict) and result.get("url"):
+            result.setdefault("metadata", {})["singleflight"] = {"shared": True}
+        return result
+
+    async def _generate_image(self, prompt: str, llm_config: Optional[Dict[str, Any]] = None, reference_image_url: Optional[Union[str, List[str]]] = None, width: int = None, height: int = None, aspect_ratio: str = None, user_id: int = 1, user_credits: int = 0, filename_base: Optional[str] = None, asset_type: Optional[str] = None, hedge: bool = False, project_id: Optional[int] = None, bypass_cache: bool = False):
         provider = None
         if llm_config and "provider" in llm_config and llm_config["provider"]:
             provider = self._normalize_provider_name(llm_config["provider"], "Image")
 
         if not provider:
             try:
-                with SessionLocal() as session:
-                    self._repair_invalid_user_config_rows(session, user_id, category="Image")
-                    active_setting = self._get_active_user_setting(session, user_id, "Image")
-                    if active_setting and active_setting.provider:
-                        provider = self._normalize_provider_name(active_setting.provider, "Image")
+                active_provider = self._active_user_provider(user_id, "Image")
+                if active_provider:
+                    provider = self._normalize_provider_name(active_provider, "Image")
             except Exception as e:
                 print(f"Error finding active provider: {e}")
 
@@ -694,8 +974,24 @@ class MediaGenerationService:
             user_credits=user_credits,
         )
 
+        generation_resumer.annotate(filename_base=filename_base)
         print(f"[MediaService] Generating Image. Provider: {provider}, Refs Type: {type(reference_image_url)}, Refs: {reference_image_url}, W: {width}, H: {height}, AR: {aspect_ratio}")
 
+        cache_key = cache_scope = None
+        cache_model = (llm_config or {}).get("model") or api_config.get("model")
+        if generation_cache.enabled:
+            cache_key, cache_scope = await self._generation_cache_key(
+                "Image", user_id, project_id, provider, cache_model, prompt,
+                reference_image_url=reference_image_url, width=width, height=height, aspect_ratio=aspect_ratio,
+            )
+            if bypass_cache:
+                # Regenerate, then overwrite the cached entry with the fresh result.
+                generation_cache.count_bypass()
+            else:
+                cached = self._serve_cached_generation(cache_key, user_id, filename_base)
+                if cached:
+                    return cached
+
         result = await self._generate_with_smart_routing(
             category="Image",
             prompt=prompt,
@@ -710,32 +1006,33 @@ class MediaGenerationService:
             explicit_selection=bool((llm_config or {}).get("provider") or (llm_config or {}).get("model")),
             allow_priority_fallback_when_explicit=str(asset_type or "").strip().lower() in {"subject", "entity", "character", "prop", "environment"},
             fallback_candidate_limit=3,
+            hedge=hedge,
         )
 
         # Download 
         if result and "url" in result and result["url"]:
-            result["url"] = await asyncio.to_thread(
-                self._download_and_save,
+            result["url"] = await self._download_and_save(
                 result["url"],
                 filename_base,
                 user_id,
+                metadata=result.setdefault("metadata", {}),
             )
+            if cache_key:
+                self._remember_generation(cache_key, cache_scope, user_id, project_id, "Image", provider, cache_model, result)
         if result and result.get("error"):
             result["error"] = self._vendor_failed_message(provider, result.get("error"))
         return result
 
-    async def generate_video(self, prompt: str, llm_config: Optional[Dict[str, Any]] = None, reference_image_url: Optional[Union[str, List[str]]] = None, last_frame_url: Optional[str] = None, duration: int = 5, aspect_ratio: Optional[str] = None, keyframes: Optional[List[str]] = None, user_id: int = 1, user_credits: int = 0, filename_base: Optional[str] = None):
+    async def generate_video(self, prompt: str, llm_config: Optional[Dict[str, Any]] = None, reference_image_url: Optional[Union[str, List[str]]] = None, last_frame_url: Optional[str] = None, duration: int = 5, aspect_ratio: Optional[str] = None, keyframes: Optional[List[str]] = None, user_id: int = 1, user_credits: int = 0, filename_base: Optional[str] = None, project_id: Optional[int] = None, bypass_cache: bool = False):
         provider = None
         if llm_config and "provider" in llm_config and llm_config["provider"]:
             provider = self._normalize_provider_name(llm_config["provider"], "Video")
 
         if not provider:
             try:
-                with SessionLocal() as session:
-                    self._repair_invalid_user_config_rows(session, user_id, category="Video")
-                    active_setting = self._get_active_user_setting(session, user_id, "Video")
-                    if active_setting and active_setting.provider:
-                        provider = self._normalize_provider_name(active_setting.provider, "Video")
+                active_provider = self._active_user_provider(user_id, "Video")
+                if active_provider:
+                    provider = self._normalize_provider_name(active_provider, "Video")
             except Exception as e:
                 print(f"Error finding active provider: {e}")
 
@@ -750,8 +1047,25 @@ class MediaGenerationService:
             user_credits=user_credits,
         )
 
+        generation_resumer.annotate(filename_base=filename_base)
         print(f"[MediaService] Generating Video. Provider: {provider}, Refs: {reference_image_url}, LastFrame: {last_frame_url}, Ratio: {aspect_ratio}, Keyframes: {len(keyframes) if keyframes else 0}")
 
+        cache_key = cache_scope = None
+        cache_model = (llm_config or {}).get("model") or api_config.get("model")
+        if generation_cache.enabled:
+            cache_key, cache_scope = await self._generation_cache_key(
+                "Video", user_id, project_id, provider, cache_model, prompt,
+                reference_image_url=reference_image_url, aspect_ratio=aspect_ratio, duration=duration,
+                last_frame_url=last_frame_url, keyframes=keyframes,
+            )
+            if bypass_cache:
+                # Regenerate, then overwrite the cached entry with the fresh result.
+                generation_cache.count_bypass()
+            else:
+                cached = self._serve_cached_generation(cache_key, user_id, filename_base)
+                if cached:
+                    return cached
+
         result = await self._generate_with_smart_routing(
             category="Video",
             prompt=prompt,
@@ -769,12 +1083,14 @@ class MediaGenerationService:
 
         # Download 
         if result and "url" in result and result["url"]:
-            result["url"] = await asyncio.to_thread(
-                self._download_and_save,
+            result["url"] = await self._download_and_save(
                 result["url"],
                 filename_base,
                 user_id,
+                metadata=result.setdefault("metadata", {}),
             )
+            if cache_key:
+                self._remember_generation(cache_key, cache_scope, user_id, project_id, "Video", provider, cache_model, result)
         if result and result.get("error"):
             result["error"] = self._vendor_failed_message(provider, result.get("error"))
         
@@ -802,7 +1118,7 @@ class MediaGenerationService:
                 ref_list = ref_image if isinstance(ref_image, list) else [ref_image]
                 ref_list = [r for r in ref_list if r]
                 
-                resolved_refs = self._resolve_ref_list_for_api(ref_list, force_data_uri_for_local=True)
+                resolved_refs = self._resolve_ref_list_for_api(ref_list, force_data_uri_for_local=True, max_edge=self._ref_max_edge("doubao"))
                     
                 if resolved_refs:
                     model_name = model or "doubao-seedream-4-5-251128"
@@ -822,7 +1138,7 @@ class MediaGenerationService:
                             payload["size"] = normalized_size
 
                     url = f"{endpoint.rstrip('/')}/images/generations"
-                    return await self._common_requests_post(url, payload, api_key, "doubao_image_multiref", extra_metadata=base_metadata)
+                    return await self._common_requests_post(url, payload, api_key, "doubao_image_multiref", extra_metadata=base_metadata, pool="doubao")
             
             # Text to Image
             raw_endpoint = tool_conf.get("endpoint") or "https://ark.cn-beijing.volces.com/api/v3"
@@ -835,7 +1151,7 @@ class MediaGenerationService:
                 "watermark": False
             }
             
-            return await self._common_requests_post(url, payload, api_key, "doubao_image", extra_metadata=base_metadata)
+            return await self._common_requests_post(url, payload, api_key, "doubao_image", extra_metadata=base_metadata, pool="doubao")
 
         # Video Generation
         elif gen_type == "video":
@@ -859,8 +1175,8 @@ class MediaGenerationService:
             
             if start_img_url and last_frame_url:
                 # Start + End Frame Mode (Explicit Roles Required)
-                start_ref = self._resolve_ref_for_api(start_img_url, force_data_uri_for_local=True)
-                end_ref = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True)
+                start_ref = self._resolve_ref_for_api(start_img_url, force_data_uri_for_local=True, max_edge=self._ref_max_edge("doubao"))
+                end_ref = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True, max_edge=self._ref_max_edge("doubao"))
                 if not start_ref or not end_ref:
                     return {"error": "Failed to resolve reference image(s) for Doubao video"}
                 content_payload.append({
@@ -875,7 +1191,7 @@ class MediaGenerationService:
                 })
             elif start_img_url:
                 # Start Frame Only - Strict 'first_frame' role required for newer models (1.5 Pro)
-                start_ref = self._resolve_ref_for_api(start_img_url, force_data_uri_for_local=True)
+                start_ref = self._resolve_ref_for_api(start_img_url, force_data_uri_for_local=True, max_edge=self._ref_max_edge("doubao"))
                 if not start_ref:
                     return {"error": "Failed to resolve start reference image for Doubao video"}
                 content_payload.append({
@@ -885,7 +1201,7 @@ class MediaGenerationService:
                 })
             elif last_frame_url:
                 # Last Frame Only (Rare, but use role if strictly End frame)
-                 end_ref = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True)
+                 end_ref = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True, max_edge=self._ref_max_edge("doubao"))
                  if not end_ref:
                     return {"error": "Failed to resolve last reference image for Doubao video"}
                  content_payload.append({
@@ -966,6 +1282,7 @@ class MediaGenerationService:
                 extra_metadata=base_metadata,
                 poll_timeout_seconds=poll_timeout_seconds,
                 poll_interval_seconds=poll_interval_seconds,
+                pool="doubao",
             )
 
         return {"error": "Unknown Type"}
@@ -1009,7 +1326,7 @@ class MediaGenerationService:
             if not start_img_src:
                  return {"error": "Vidu Multi-Frame requires a Start Image (Reference Image)"}
                  
-            start_ref = self._resolve_ref_for_api(start_img_src, force_data_uri_for_local=True)
+            start_ref = self._resolve_ref_for_api(start_img_src, force_data_uri_for_local=True, max_edge=self._ref_max_edge("vidu"))
             if not start_ref: return {"error": "Failed to load Start Image"}
             
             payload["start_image"] = start_ref
@@ -1028,7 +1345,7 @@ class MediaGenerationService:
             
             settings_arr = []
             for kf in keyframes:
-                 resolved_kf = self._resolve_ref_for_api(kf, force_data_uri_for_local=True)
+                 resolved_kf = self._resolve_ref_for_api(kf, force_data_uri_for_local=True, max_edge=self._ref_max_edge("vidu"))
                  if resolved_kf:
                      # Attempt generic structure. 
                      # If backend rejects, we will know.
@@ -1055,11 +1372,11 @@ class MediaGenerationService:
             if ref_image:
                 refs = ref_image if isinstance(ref_image, list) else [ref_image]
                 if refs:
-                    start_ref = self._resolve_ref_for_api(refs[0], force_data_uri_for_local=True)
+                    start_ref = self._resolve_ref_for_api(refs[0], force_data_uri_for_local=True, max_edge=self._ref_max_edge("vidu"))
                     if start_ref: images.append(start_ref)
             
             if last_frame_url:
-                end_ref = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True)
+                end_ref = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True, max_edge=self._ref_max_edge("vidu"))
                 if end_ref:
                      if not images: images.append(end_ref) # Use as start if no start
                      else: images.append(end_ref) # Use as end
@@ -1094,10 +1411,14 @@ class MediaGenerationService:
             "Content-Type": "application/json",
             "Authorization": f"Token {api_key}"
         }
+
+        callback_url = task_callbacks.callback_url("vidu")
+        if callback_url:
+            payload["callback_url"] = callback_url
         
         try:
              # Submit
-             resp = requests.post(endpoint, json=payload, headers=headers, timeout=60)
+             resp = await http_transport.post(endpoint, pool="vidu", json=payload, headers=headers, timeout=60)
              if resp.status_code not in [200, 201]:
                   return {"error": f"Vidu Error {resp.status_code}", "details": resp.text}
              
@@ -1106,22 +1427,28 @@ class MediaGenerationService:
              if not task_id: return {"error": "No Task ID returned", "details": resp.text}
              
              # Poll
-             poll_url = f"{endpoint}/{task_id}"
              print(f"[Vidu] Polling Task {task_id}...")
-             for _ in range(60):
-                  await asyncio.sleep(3)
-                  p_resp = requests.get(poll_url, headers=headers, timeout=30)
-                  if p_resp.status_code == 200:
-                       p_data = p_resp.json()
-                       status = p_data.get("state") or p_data.get("status") 
-                       
-                       if status == "success" or status == "SUCCESS":
-                            vid_url = p_data.get("valid_video_url") or p_data.get("video_url") or p_data.get("url")
-                            if vid_url:
-                                 return {"url": vid_url, "metadata": {"raw": p_data, "provider": "vidu"}}
-                       elif status == "failed" or status == "FAILED":
-                            return {"error": "Vidu Generation Failed", "details": str(p_data)}
-             
+
+             async def _check(tid):
+                  p_resp = await http_transport.get(f"{endpoint}/{tid}", pool="vidu", headers=headers, timeout=30)
+                  if p_resp.status_code != 200:
+                       return {"status": "pending", "error_hint": f"HTTP {p_resp.status_code}"}
+                  return self._vidu_task_outcome(p_resp.json())
+
+             if callback_url:
+                  outcome = await task_poller.wait(
+                       "vidu",
+                       task_id,
+                       task_callbacks.inbox_check("vidu", _check),
+                       timeout_seconds=180,
+                       **task_callbacks.wait_intervals(3),
+                  )
+             else:
+                  outcome = await task_poller.wait("vidu", task_id, _check, timeout_seconds=180, initial_delay=3)
+             if outcome.get("status") == "done":
+                  return {"url": outcome.get("url"), "metadata": {"raw": outcome.get("raw"), "provider": "vidu"}}
+             if outcome.get("status") == "failed":
+                  return {"error": "Vidu Generation Failed", "details": str(outcome.get("raw"))}
              return {"error": "Timeout polling Vidu"}
 
         except Exception as e:
@@ -1173,7 +1500,7 @@ class MediaGenerationService:
                 resolved_refs = []
                 print(f"[Grsai] Processing {len(ref_list)} reference images...")
                 for i, r in enumerate(ref_list):
-                    resolved = self._resolve_ref_for_api(r, force_data_uri_for_local=True)
+                    resolved = self._resolve_ref_for_api(r, force_data_uri_for_local=True, max_edge=self._ref_max_edge("grsai"))
                     if resolved:
                         resolved_refs.append(resolved)
                     else:
@@ -1324,9 +1651,9 @@ class MediaGenerationService:
             if ref_image:
                 if is_veo:
                     # Explicitly process for Veo requirements
-                    payload["firstFrameUrl"] = self._process_veo_image(ref_image, aspect_ratio or "16:9")
+                    payload["firstFrameUrl"] = await self._process_veo_image(ref_image, aspect_ratio or "16:9")
                 else:
-                    val = self._resolve_ref_for_api(ref_image, force_data_uri_for_local=True)
+                    val = self._resolve_ref_for_api(ref_image, force_data_uri_for_local=True, max_edge=self._ref_max_edge("grsai"))
                     if val: payload["url"] = val
             elif is_veo:
                 # Veo: firstFrameUrl is Optional. 
@@ -1347,9 +1674,9 @@ class MediaGenerationService:
             
             if last_frame_url:
                 if is_veo:
-                    payload["lastFrameUrl"] = self._process_veo_image(last_frame_url, aspect_ratio or "16:9")
+                    payload["lastFrameUrl"] = await self._process_veo_image(last_frame_url, aspect_ratio or "16:9")
                 else:
-                    val = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True)
+                    val = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True, max_edge=self._ref_max_edge("grsai"))
                     if val: payload["end_reference_image"] = val
 
             # Veo Clean Prompt Logic
@@ -1410,11 +1737,9 @@ class MediaGenerationService:
     async def _submit_and_poll_grsai_legacy(self, url, payload, api_key, result_url, is_video=False, extra_metadata=None):
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
         
-        # Increased timeout to 300s
-        def _post(): return requests.post(url, json=payload, headers=headers, timeout=300, verify=False)
-        
         try:
-            resp = await asyncio.to_thread(_post)
+            # Increased timeout to 300s
+            resp = await http_transport.post(url, pool="grsai", verify=False, json=payload, headers=headers, timeout=300)
             print(f"[Grsai Legacy] API Returned: {resp.text[:1000]}") # DEBUG USER REQUEST
             if resp.status_code != 200: return {"error": f"Submission Failed {resp.status_code}", "details": resp.text}
             
@@ -1426,20 +1751,22 @@ class MediaGenerationService:
             print(f"[Grsai] Task {task_id} submitted. Polling...")
             
             # Poll
-            for _ in range(60):
-                 await asyncio.sleep(3)
-                 def _poll(): return requests.post(result_url, json={"id": task_id}, headers=headers, timeout=30, verify=False)
-                 p_resp = await asyncio.to_thread(_poll)
-                 
+            async def _check(tid):
+                 p_resp = await http_transport.post(result_url, pool="grsai", verify=False, json={"id": tid}, headers=headers, timeout=30)
                  if p_resp.status_code == 200:
                      p_data = p_resp.json()
                      # Check completion
                      if "data" in p_data and p_data["data"]:
                          final = p_data["data"][0].get("imageUrl" if not is_video else "videoUrl")
                          if final:
-                              metadata = {"raw": p_data}
-                              if extra_metadata: metadata.update(extra_metadata)
-                              return {"url": final, "metadata": metadata}
+                              return {"status": "done", "url": final, "raw": p_data}
+                 return {"status": "pending"}
+
+            outcome = await task_poller.wait("grsai", task_id, _check, timeout_seconds=180, initial_delay=3)
+            if outcome.get("status") == "done":
+                 metadata = {"raw": outcome.get("raw")}
+                 if extra_metadata: metadata.update(extra_metadata)
+                 return {"url": outcome.get("url"), "metadata": metadata}
             return {"error": "Timeout"}
         except Exception as e:
              traceback.print_exc()
@@ -1461,6 +1788,9 @@ class MediaGenerationService:
         version = "2022-12-29"
         region = "ap-shanghai"
         tool_conf = config.get("config", {}) or {}
+        # config.endpoint overrides the API host (e.g. a local stand-in).
+        request_url = str(tool_conf.get("endpoint") or "").strip().rstrip("/") or f"https://{host}"
+        host = request_url.split("://", 1)[-1].split("/", 1)[0]
         
         base_metadata = {"provider": "tencent", "model": "aiart", "prompt": prompt}
 
@@ -1518,10 +1848,7 @@ class MediaGenerationService:
                 "X-TC-Region": region
             }
             
-            def _post():
-                return requests.post(f"https://{host}", data=payload_json, headers=req_headers, timeout=60, verify=False)
-            
-            return await asyncio.to_thread(_post)
+            return await http_transport.post(request_url, pool="tencent", verify=False, content=payload_json, headers=req_headers, timeout=60)
 
         # -- Step 1: Submit Job --
         submit_action = "SubmitTextToImageJob"
@@ -1532,7 +1859,7 @@ class MediaGenerationService:
         if ref_image:
             submit_action = "ImageToImage"
             is_sync = True
-            ref_value = self._resolve_ref_for_api(ref_image, force_data_uri_for_local=False)
+            ref_value = self._resolve_ref_for_api(ref_image, force_data_uri_for_local=False, max_edge=self._ref_max_edge("tencent"))
             if not ref_value:
                 print("Failed to load reference image for Tencent I2I")
                 return {"error": "Failed to load reference image for Tencent I2I"}
@@ -1571,34 +1898,44 @@ class MediaGenerationService:
             job_id = data.get("Response", {}).get("JobId")
             if not job_id: return {"error": "No JobId"}
             
-            for _ in range(60):
-                await asyncio.sleep(2)
-                q_resp = await call_tencent_api("QueryTextToImageJob", {"JobId": job_id})
-                if q_resp.status_code == 200:
-                    q_data = q_resp.json()
-                    resp_inner = q_data.get("Response", {})
-                    status = resp_inner.get("JobStatus") # SUCCESS, FAIL
-                    if status == "SUCCESS":
-                         # Robust extraction for async result
-                         res_img = resp_inner.get("ResultImage")
-                         final_url = None
-                         if isinstance(res_img, list) and len(res_img) > 0:
-                            final_url = res_img[0]
-                         elif isinstance(res_img, str):
-                            final_url = res_img
-                            
-                         meta = {"raw": q_data}
-                         meta.update(base_metadata)
-                         return {"url": final_url, "metadata": meta}
-                    elif status == "FAIL":
-                         return {"error": "Job Failed", "details": resp_inner.get("JobErrorMsg")}
+            async def _check(tid):
+                q_resp = await call_tencent_api("QueryTextToImageJob", {"JobId": tid})
+                if q_resp.status_code != 200:
+                    return {"status": "pending", "error_hint": f"HTTP {q_resp.status_code}"}
+                q_data = q_resp.json()
+                resp_inner = q_data.get("Response", {})
+                status = resp_inner.get("JobStatus") # SUCCESS, FAIL
+                if status == "SUCCESS":
+                    return {"status": "done", "raw": q_data}
+                if status == "FAIL":
+                    return {"status": "failed", "raw": q_data}
+                return {"status": "pending"}
+
+            outcome = await task_poller.wait("tencent", job_id, _check, timeout_seconds=120, initial_delay=2)
+            if outcome.get("status") == "done":
+                q_data = outcome.get("raw") or {}
+                # Robust extraction for async result
+                res_img = q_data.get("Response", {}).get("ResultImage")
+                final_url = None
+                if isinstance(res_img, list) and len(res_img) > 0:
+                    final_url = res_img[0]
+                elif isinstance(res_img, str):
+                    final_url = res_img
+
+                meta = {"raw": q_data}
+                meta.update(base_metadata)
+                return {"url": final_url, "metadata": meta}
+            if outcome.get("status") == "failed":
+                return {"error": "Job Failed", "details": ((outcome.get("raw") or {}).get("Response") or {}).get("JobErrorMsg")}
             return {"error": "Timeout"}
 
     async def _handle_wanxiang_generation(self, gen_type, prompt, config, ref_image=None, last_frame_url=None, duration=5, aspect_ratio=None):
         if gen_type != "video": return {"error": "Wanxiang only supports video"}
         
         api_key = config.get("api_key") or os.getenv("DASHSCOPE_API_KEY")
-        endpoint = "https://dashscope.aliyuncs.com/api/v1/services/aigc/image2video/video-synthesis" 
+        # config.endpoint overrides the DashScope host (e.g. a local stand-in); tasks are polled on the same host.
+        endpoint = str((config.get("config") or {}).get("endpoint") or "").strip().rstrip("/") or "https://dashscope.aliyuncs.com/api/v1/services/aigc/image2video/video-synthesis"
+        tasks_base = endpoint.split("/api/v1/")[0] if "/api/v1/" in endpoint else "https://dashscope.aliyuncs.com"
         model = config.get("model") or "wanx2.1-i2v-plus"
         
         # Auto-correction for KF2V with single image to avoid "video frames must be set" error
@@ -1614,7 +1951,7 @@ class MediaGenerationService:
         # kf2v (KeyFrame) uses first_frame_url/last_frame_url, so we exclude it from is_i2v
         is_i2v = "i2v" in model
         
-        first_img = self._resolve_ref_for_api(ref_image, force_data_uri_for_local=True)
+        first_img = self._resolve_ref_for_api(ref_image, force_data_uri_for_local=True, max_edge=self._ref_max_edge("wanxiang"))
         
         # Validations
         if is_i2v and not first_img:
@@ -1631,7 +1968,7 @@ class MediaGenerationService:
             input_data["first_frame_url"] = first_img
 
         if last_frame_url:
-            last_img = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True)
+            last_img = self._resolve_ref_for_api(last_frame_url, force_data_uri_for_local=True, max_edge=self._ref_max_edge("wanxiang"))
             if last_img:
                 if is_i2v:
                      logger.warning("[Wanxiang] Warning: Model is i2v but last_frame_url provided. Ignoring.")
@@ -1680,10 +2017,8 @@ class MediaGenerationService:
         
         print(f"[Wanxiang] POSTING to {endpoint} with Model {model}")
         
-        def _post(): return requests.post(endpoint, json=payload, headers=headers, timeout=60, verify=False)
-        
         try:
-            resp = await asyncio.to_thread(_post)
+            resp = await http_transport.post(endpoint, pool="wanxiang", verify=False, json=payload, headers=headers, timeout=60)
             
             if resp.status_code != 200: 
                 print(f"[Wanxiang] HTTP {resp.status_code} Error Body: {resp.text}")
@@ -1705,24 +2040,22 @@ class MediaGenerationService:
         task_id = data.get("output", {}).get("task_id")
         if not task_id: return {"error": "No Task ID"}
         
-        task_endpoint = f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id}"
-        
-        for _ in range(120):
-            await asyncio.sleep(2)
-            def _poll(): return requests.get(task_endpoint, headers={"Authorization": f"Bearer {api_key}"}, timeout=30, verify=False)
-            p_resp = await asyncio.to_thread(_poll)
-            
-            if p_resp.status_code == 200:
-                p_data = p_resp.json()
-                status = p_data.get("output", {}).get("task_status")
-                if status == "SUCCEEDED":
-                     meta = {"raw": p_data}
-                     meta.update(base_metadata)
-                     return {"url": p_data.get("output", {}).get("video_url"), "metadata": meta}
-                elif status in ["FAILED", "CANCELED"]:
-                     err_msg = p_data.get("output", {}).get("message")
-                     print(f"[Wanxiang] Task Failed: {err_msg}")
-                     return {"error": "Generation Failed", "details": err_msg}
+        async def _check(tid):
+            p_resp = await http_transport.get(f"{tasks_base}/api/v1/tasks/{tid}", pool="wanxiang", verify=False, headers={"Authorization": f"Bearer {api_key}"}, timeout=30)
+            if p_resp.status_code != 200:
+                return {"status": "pending", "error_hint": f"HTTP {p_resp.status_code}"}
+            return self._wanxiang_task_outcome(p_resp.json())
+
+        outcome = await task_poller.wait("wanxiang", task_id, _check, timeout_seconds=240, initial_delay=2)
+        if outcome.get("status") == "done":
+            p_data = outcome.get("raw") or {}
+            meta = {"raw": p_data}
+            meta.update(base_metadata)
+            return {"url": p_data.get("output", {}).get("video_url"), "metadata": meta}
+        if outcome.get("status") == "failed":
+            err_msg = (outcome.get("raw") or {}).get("output", {}).get("message")
+            print(f"[Wanxiang] Task Failed: {err_msg}")
+            return {"error": "Generation Failed", "details": err_msg}
         return {"error": "Timeout"}
 
     async def _handle_stability_generation(self, gen_type, prompt, config, ref_image=None):
@@ -1745,7 +2078,7 @@ class MediaGenerationService:
 
              if self._is_public_http_url(ref_image):
                  try:
-                     resp = requests.get(ref_image, timeout=30)
+                     resp = await http_transport.get(ref_image, pool="media_fetch", timeout=30)
                      if resp.status_code == 200:
                          ref_bytes = resp.content
                  except Exception:
@@ -1759,8 +2092,7 @@ class MediaGenerationService:
                  files = {"init_image": ("init_image.png", ref_bytes, "image/png")}
                  data = {"text_prompts[0][text]": prompt, "init_image_mode": "IMAGE_STRENGTH", "image_strength": 0.35}
                  
-                 def _post_i2i(): return requests.post(url, headers=headers, files=files, data=data, timeout=60, verify=False)
-                 resp = await asyncio.to_thread(_post_i2i)
+                 resp = await http_transport.post(url, pool="stability", verify=False, headers=headers, files=files, data=data, timeout=60)
              else:
                  return {"error": "Could not load reference image"}
 
@@ -1769,8 +2101,7 @@ class MediaGenerationService:
              url = f"{endpoint}/v1/generation/{model}/text-to-image"
              headers["Content-Type"] = "application/json"
              body = {"text_prompts": [{"text": prompt}], "cfg_scale": 7, "height": 1024, "width": 1024, "samples": 1}
-             def _post_t2i(): return requests.post(url, headers=headers, json=body, timeout=60, verify=False)
-             resp = await asyncio.to_thread(_post_t2i)
+             resp = await http_transport.post(url, pool="stability", verify=False, headers=headers, json=body, timeout=60)
         
         if resp.status_code != 200: return {"error": f"Stability Error {resp.status_code}", "details": resp.text}
         
@@ -1786,45 +2117,28 @@ class MediaGenerationService:
              # Let's save it manually.
              try:
                  img_bytes = base64.b64decode(b64)
-                 filename = f"gen_sd_{uuid.uuid4().hex[:8]}.png"
-                 UPLOAD_DIR = settings.UPLOAD_DIR
-                 if not os.path.isabs(UPLOAD_DIR):
-                     # If relative, make it absolute relative to cwd or backend root to avoid ambiguity
-                     # Assuming cwd is backend root as per main.py execution
-                     UPLOAD_DIR = os.path.abspath(UPLOAD_DIR)
-                 
-                 save_path = os.path.join(UPLOAD_DIR, filename)
-                 os.makedirs(os.path.dirname(save_path), exist_ok=True)
-                 with open(save_path, "wb") as f: f.write(img_bytes)
+                 saved = media_store.store_blob(img_bytes, ".png")
                  
                  meta = {"raw": data}
                  meta.update(base_metadata)
-                 return {"url": f"/uploads/{filename}", "metadata": meta}
+                 meta["content_digest"] = saved["digest"]
+                 return {"url": saved["url"], "metadata": meta}
              except Exception as e:
                  return {"error": f"Failed to save image: {e}"}
         return {"error": "No artifacts"}
 
     # --- Helper to Common Requests ---
-    async def _common_requests_post(self, url, payload, api_key, log_tag, timeout=60, extra_metadata=None):
-        # Async wrap for requests
+    async def _common_requests_post(self, url, payload, api_key, log_tag, timeout=60, extra_metadata=None, pool="default"):
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
         
-        def _post(use_proxy=True):
-            kwargs = {"json": payload, "headers": headers, "timeout": timeout, "verify": False}
-            if not use_proxy:
-                kwargs["proxies"] = {"http": None, "https": None}
-            return requests.post(url, **kwargs)
-        
         try:
-            try:
-                resp = await asyncio.to_thread(_post, True)
-            except (requests.exceptions.ProxyError, requests.exceptions.SSLError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                # Retry without proxy if connection fails (common for domestic APIs vs Global Proxy)
-                print(f"[{log_tag}] Connection Failed with Proxy ({str(e)[:50]}...). Retrying without proxy...")
-                resp = await asyncio.to_thread(_post, False)
+            # Retries without proxy if connection fails (common for domestic APIs vs Global Proxy)
+            resp = await http_transport.request_with_direct_fallback(
+                "POST", url, log_tag=log_tag, pool=pool, verify=False, json=payload, headers=headers, timeout=timeout,
+            )
 
             if resp.status_code == 200:
                 data = resp.json()
@@ -1839,27 +2153,29 @@ class MediaGenerationService:
             else:
                 print(f"[{log_tag}] Error {resp.status_code}: {resp.text}")
                 return {"error": f"API Error {resp.status_code}", "details": resp.text, "submit_failed": True}
-        except requests.exceptions.Timeout as e:
+        except httpx.TimeoutException as e:
             print(f"[{log_tag}] Timeout: {e}")
             return {"error": "Upstream request timeout", "details": str(e), "submit_failed": True}
-        except requests.exceptions.RequestException as e:
+        except httpx.RequestError as e:
             print(f"[{log_tag}] RequestException: {e}")
             return {"error": "Upstream request failed", "details": str(e), "submit_failed": True}
         except Exception as e:
             print(f"[{log_tag}] Exception: {e}")
             return {"error": str(e), "submit_failed": True}
 
-    async def _submit_and_poll_video(self, url, payload, api_key, log_tag, extra_metadata=None, poll_timeout_seconds: int = 600, poll_interval_seconds: int = 2):
+    async def _submit_and_poll_video(self, url, payload, api_key, log_tag, extra_metadata=None, poll_timeout_seconds: int = 600, poll_interval_seconds: int = 2, pool="default"):
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        
-        def _post(): return requests.post(url, json=payload, headers=headers, timeout=60, verify=False)
+        # Ark content generation tasks call back on status changes; polling becomes the safety net.
+        callback_url = task_callbacks.callback_url(pool) if pool == "doubao" else None
+        if callback_url:
+            payload = {**payload, "callback_url": callback_url}
         
         try:
             print(f"[{log_tag}] POST Payload Length: {len(json.dumps(payload))}") 
             try:
-                resp = await asyncio.to_thread(_post)
-            except (requests.exceptions.ProxyError, requests.exceptions.SSLError, requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-                resp = await asyncio.to_thread(_post)
+                resp = await http_transport.post(url, pool=pool, verify=False, json=payload, headers=headers, timeout=60)
+            except CONNECT_ERRORS:
+                resp = await http_transport.post(url, pool=pool, verify=False, json=payload, headers=headers, timeout=60)
             print(f"[{log_tag}] Submission Response: {resp.text[:500]}...") # DEBUG USER REQUEST
             if resp.status_code not in [200, 201]: 
                 print(f"[{log_tag}] Error {resp.status_code}: {resp.text}")
@@ -1872,41 +2188,119 @@ class MediaGenerationService:
             if not task_id: return {"error": "No Task ID", "submit_failed": True}
             
             print(f"[{log_tag}] Task {task_id} submitted. Polling... timeout={poll_timeout_seconds}s interval={poll_interval_seconds}s")
+            record_id = generation_resumer.record_submitted(
+                pool,
+                task_id,
+                {
+                    "protocol": "task_get",
+                    "url": url,
+                    "pool": pool,
+                    "interval": poll_interval_seconds,
+                    "key": api_key_fingerprint(api_key),
+                    "metadata": extra_metadata,
+                },
+                poll_timeout_seconds,
+            )
             
             # Poll
-            max_attempts = max(1, int(poll_timeout_seconds / max(1, poll_interval_seconds)))
-            for _ in range(max_attempts):
-                await asyncio.sleep(poll_interval_seconds)
-                def _poll(): return requests.get(f"{url}/{task_id}", headers=headers, timeout=30, verify=False)
-                try:
-                    p_resp = await asyncio.to_thread(_poll)
-                except requests.exceptions.Timeout:
-                    continue
-                if p_resp.status_code == 200:
-                    p_data = p_resp.json()
-                    print(f"[{log_tag}] Poll Response: {p_data}") # DEBUG USER REQUEST
-                    status = str(p_data.get("status") or p_data.get("state") or "").strip()
-                    status_l = status.lower()
-                    if status_l in ["succeeded", "success", "completed", "done"]:
-                        content = p_data.get("content", {})
-                        video_url = content.get("video_url") or content.get("url")
-                        if not video_url and isinstance(p_data.get("data"), dict):
-                            data_content = p_data.get("data", {}).get("content", {}) or {}
-                            video_url = data_content.get("video_url") or data_content.get("url")
-                        metadata = {"raw": p_data}
-                        if extra_metadata:
-                            metadata.update(extra_metadata)
-                        return {"url": video_url, "metadata": metadata}
-                    elif status_l in ["failed", "error", "canceled", "cancelled"]:
-                        return {"error": "Generation Failed", "details": p_data.get("error")}
+            async def _check(tid):
+                p_resp = await http_transport.get(f"{url}/{tid}", pool=pool, verify=False, headers=headers, timeout=30)
+                if p_resp.status_code != 200:
+                    return {"status": "pending", "error_hint": f"HTTP {p_resp.status_code}"}
+                p_data = p_resp.json()
+                print(f"[{log_tag}] Poll Response: {p_data}") # DEBUG USER REQUEST
+                return self._video_task_outcome(p_data)
+
+            async def _batch_check(task_ids):
+                # Ark task list endpoint accepts repeated filter.task_ids; one call covers every pending task on this key.
+                params = [("page_size", str(len(task_ids)))] + [("filter.task_ids", tid) for tid in task_ids]
+                b_resp = await http_transport.get(url, pool=pool, verify=False, headers=headers, params=params, timeout=30)
+                if b_resp.status_code != 200:
+                    return {}
+                items = (b_resp.json() or {}).get("items") or []
+                return {
+                    str(item.get("id")): self._video_task_outcome(item)
+                    for item in items
+                    if isinstance(item, dict) and item.get("id")
+                }
+
+            wait_kwargs = {"initial_delay": poll_interval_seconds, "min_interval": poll_interval_seconds}
+            if callback_url:
+                _check = task_callbacks.inbox_check(pool, _check)
+                _batch_check = task_callbacks.inbox_batch_check(pool, _batch_check)
+                wait_kwargs = task_callbacks.wait_intervals(poll_interval_seconds)
+            outcome = await task_poller.wait(
+                pool,
+                task_id,
+                _check,
+                timeout_seconds=poll_timeout_seconds,
+                batch_key=(url, hashlib.md5(str(api_key).encode("utf-8")).hexdigest()) if pool == "doubao" else None,
+                batch_check=_batch_check if pool == "doubao" else None,
+                **wait_kwargs,
+            )
+            generation_resumer.record_polled(record_id, outcome)
+            if outcome.get("status") == "done":
+                metadata = {"raw": outcome.get("raw")}
+                if extra_metadata:
+                    metadata.update(extra_metadata)
+                return {"url": outcome.get("url"), "metadata": metadata}
+            if outcome.get("status") == "failed":
+                return {"error": "Generation Failed", "details": (outcome.get("raw") or {}).get("error")}
             return {"error": f"Timeout after {poll_timeout_seconds}s"}
-        except requests.exceptions.Timeout as e:
+        except httpx.TimeoutException as e:
             return {"error": "Upstream request timeout", "details": str(e), "submit_failed": True}
-        except requests.exceptions.RequestException as e:
+        except httpx.RequestError as e:
             return {"error": "Upstream request failed", "details": str(e), "submit_failed": True}
         except Exception as e:
             return {"error": str(e), "submit_failed": True}
 
+    def _vidu_task_outcome(self, p_data: Dict[str, Any]) -> Dict[str, Any]:
+        status = str(p_data.get("state") or p_data.get("status") or "").lower()
+        if status == "success":
+            vid_url = p_data.get("valid_video_url") or p_data.get("video_url") or p_data.get("url")
+            creations = p_data.get("creations")
+            if not vid_url and isinstance(creations, list) and creations and isinstance(creations[0], dict):
+                vid_url = creations[0].get("url")
+            if vid_url:
+                return {"status": "done", "url": vid_url, "raw": p_data}
+        elif status == "failed":
+            return {"status": "failed", "raw": p_data}
+        return {"status": "pending", "progress": p_data.get("progress")}
+
+    def _wanxiang_task_outcome(self, p_data: Dict[str, Any]) -> Dict[str, Any]:
+        status = (p_data.get("output") or {}).get("task_status")
+        if status == "SUCCEEDED":
+            return {"status": "done", "raw": p_data}
+        if status in ["FAILED", "CANCELED"]:
+            return {"status": "failed", "raw": p_data}
+        return {"status": "pending"}
+
+    def task_callback_outcome(self, provider: str, payload: Any):
+        """Maps a provider callback body to ``(task_id, poll outcome)``; ``(None, None)`` if unrecognised."""
+        if not isinstance(payload, dict):
+            return None, None
+        if provider == "doubao":
+            body = payload.get("data") if isinstance(payload.get("data"), dict) and not payload.get("id") else payload
+            return body.get("id") or body.get("task_id"), self._video_task_outcome(body)
+        if provider == "vidu":
+            return payload.get("id") or payload.get("task_id"), self._vidu_task_outcome(payload)
+        if provider == "wanxiang":
+            return (payload.get("output") or {}).get("task_id"), self._wanxiang_task_outcome(payload)
+        return None, None
+
+    def _video_task_outcome(self, p_data: Dict[str, Any]) -> Dict[str, Any]:
+        status_l = str(p_data.get("status") or p_data.get("state") or "").strip().lower()
+        if status_l in ["succeeded", "success", "completed", "done"]:
+            content = p_data.get("content", {}) or {}
+            video_url = content.get("video_url") or content.get("url")
+            if not video_url and isinstance(p_data.get("data"), dict):
+                data_content = p_data.get("data", {}).get("content", {}) or {}
+                video_url = data_content.get("video_url") or data_content.get("url")
+            return {"status": "done", "url": video_url, "raw": p_data}
+        if status_l in ["failed", "error", "canceled", "cancelled"]:
+            return {"status": "failed", "raw": p_data}
+        return {"status": "pending", "progress": p_data.get("progress")}
+
     async def _submit_and_poll_grsai(self, url, payload, api_key, result_url, is_video=False, extra_metadata=None, trace_id: Optional[str] = None):
         headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
         trace_id = trace_id or f"grsai-{uuid.uuid4().hex[:10]}"
@@ -1950,28 +2344,20 @@ class MediaGenerationService:
                 poll_url,
             )
 
-            def _post():
-                return requests.post(submit_url, json=payload, headers=headers, timeout=(15, 120), verify=False)
-
-            def _post_no_proxy():
-                return requests.post(
+            try:
+                submit_started = time.perf_counter()
+                resp = await http_transport.request_with_direct_fallback(
+                    "POST",
                     submit_url,
+                    log_tag=f"Grsai:{trace_id}",
+                    pool="grsai",
+                    verify=False,
                     json=payload,
                     headers=headers,
                     timeout=(15, 120),
-                    verify=False,
-                    proxies={"http": None, "https": None},
                 )
-
-            try:
-                submit_started = time.perf_counter()
-                try:
-                    resp = await asyncio.to_thread(_post)
-                except (requests.exceptions.ProxyError, requests.exceptions.SSLError, requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-                    logger.warning("[GrsaiTrace][%s] submit primary failed, retry without proxy | submit_url=%s", trace_id, submit_url)
-                    resp = await asyncio.to_thread(_post_no_proxy)
                 submit_ms = int((time.perf_counter() - submit_started) * 1000)
-            except requests.exceptions.RequestException as e:
+            except httpx.RequestError as e:
                 last_error = str(e)
                 print(f"[Grsai] Submission network error on {submit_url}: {last_error}")
                 logger.error("[GrsaiTrace][%s] submit network_error | submit_url=%s error=%s", trace_id, submit_url, last_error)
@@ -2048,100 +2434,94 @@ class MediaGenerationService:
 
             print(f"[Grsai] Task {task_id} submitted. Polling via {poll_url}...")
             logger.info("[GrsaiTrace][%s] polling start | task_id=%s poll_url=%s", trace_id, task_id, poll_url)
+            record_id = generation_resumer.record_submitted(
+                "grsai",
+                task_id,
+                {
+                    "protocol": "grsai_result",
+                    "url": poll_url,
+                    "is_video": is_video,
+                    "key": api_key_fingerprint(api_key),
+                    "metadata": extra_metadata,
+                },
+                300,
+            )
 
-            for i in range(100):
-                await asyncio.sleep(3)
-
-                def _poll():
-                    return requests.post(poll_url, json={"id": task_id}, headers=headers, timeout=(10, 30), verify=False)
+            poll_counter = {"n": 0}
 
+            async def _check(tid, poll_url=poll_url):
+                poll_counter["n"] += 1
+                poll_idx = poll_counter["n"]
                 try:
                     poll_started = time.perf_counter()
-                    p_resp = await asyncio.to_thread(_poll)
+                    p_resp = await http_transport.post(poll_url, pool="grsai", verify=False, json={"id": tid}, headers=headers, timeout=(10, 30))
                     poll_ms = int((time.perf_counter() - poll_started) * 1000)
-                except requests.exceptions.Timeout:
-                    logger.warning("[GrsaiTrace][%s] poll timeout | task_id=%s poll_idx=%s", trace_id, task_id, i + 1)
-                    continue
-                except requests.exceptions.RequestException as e:
-                    last_error = str(e)
-                    logger.warning("[GrsaiTrace][%s] poll request_exception | task_id=%s poll_idx=%s error=%s", trace_id, task_id, i + 1, last_error)
-                    if i < 95:
-                        continue
-                    return {"error": "Grsai poll failed", "details": last_error}
-
-                if p_resp.status_code == 200:
-                    try:
-                        p_data = p_resp.json()
-                    except Exception:
-                        continue
-
-                    data_block = p_data.get("data")
-                    status = None
-                    media_url = None
-
-                    if isinstance(data_block, dict):
-                        status = data_block.get("status") or p_data.get("status")
-                        results = data_block.get("results")
-                        if isinstance(results, list) and results:
-                            first_result = results[0] if isinstance(results[0], dict) else {}
-                            media_url = first_result.get("url") or first_result.get("imageUrl") or first_result.get("videoUrl")
-                        if not media_url:
-                            media_url = (
-                                data_block.get("url")
-                                or data_block.get("imageUrl")
-                                or data_block.get("videoUrl")
-                                or data_block.get("result_url")
-                            )
-                    elif isinstance(data_block, list) and data_block:
-                        first_item = data_block[0]
-                        if isinstance(first_item, dict):
-                            status = first_item.get("status") or p_data.get("status")
-                            media_url = (
-                                first_item.get("url")
-                                or first_item.get("imageUrl")
-                                or first_item.get("videoUrl")
-                                or first_item.get("result_url")
-                            )
-
-                    status_l = str(status or "").lower()
-                    if i in {0, 1, 2, 4, 9, 19, 39, 69, 99}:
-                        logger.info(
-                            "[GrsaiTrace][%s] poll response | task_id=%s poll_idx=%s status=%s elapsed_ms=%s has_url=%s",
-                            trace_id,
-                            task_id,
-                            i + 1,
-                            status_l,
-                            poll_ms,
-                            bool(media_url),
-                        )
-                    if status_l in {"succeeded", "success", "completed", "done"} or (not status_l and media_url):
-                        if media_url:
-                            logger.info("[GrsaiTrace][%s] completed | task_id=%s poll_idx=%s media_url=%s", trace_id, task_id, i + 1, media_url)
-                            meta = {"raw": p_data}
-                            if extra_metadata:
-                                meta.update(extra_metadata)
-                            return {"url": media_url, "metadata": meta}
-                    elif status_l in {"failed", "error", "canceled", "cancelled"}:
-                        print(f"[Grsai] Task Failed: {p_data}")
-                        if self._is_grsai_quota_or_throttle_error(p_data):
-                            logger.error("[GrsaiTrace][%s] task throttled_or_quota | task_id=%s poll_idx=%s detail=%s", trace_id, task_id, i + 1, str(p_data)[:1000])
-                            return {
-                                "error": "Veo/Grsai 配额或频率受限",
-                                "details": "任务失败原因为 429 RESOURCE_EXHAUSTED（上传图片或生成请求被限流/额度不足）。请稍后重试或调整账号配额。",
-                            }
-                        logger.error("[GrsaiTrace][%s] task failed | task_id=%s poll_idx=%s detail=%s", trace_id, task_id, i + 1, str(p_data)[:1000])
-                        return {"error": "Generation Failed", "details": p_data}
-                else:
+                except httpx.TimeoutException:
+                    logger.warning("[GrsaiTrace][%s] poll timeout | task_id=%s poll_idx=%s", trace_id, tid, poll_idx)
+                    return {"status": "pending"}
+                except httpx.RequestError as e:
+                    logger.warning("[GrsaiTrace][%s] poll request_exception | task_id=%s poll_idx=%s error=%s", trace_id, tid, poll_idx, str(e))
+                    return {"status": "pending", "error_hint": str(e)}
+
+                if p_resp.status_code != 200:
                     print(f"[Grsai] Poll Failed {p_resp.status_code}: {p_resp.text}")
                     logger.warning(
                         "[GrsaiTrace][%s] poll non_200 | task_id=%s poll_idx=%s status=%s elapsed_ms=%s body_preview=%s",
                         trace_id,
-                        task_id,
-                        i + 1,
+                        tid,
+                        poll_idx,
                         p_resp.status_code,
                         poll_ms,
                         (p_resp.text or "")[:300],
                     )
+                    return {"status": "pending"}
+
+                try:
+                    p_data = p_resp.json()
+                except Exception:
+                    return {"status": "pending"}
+
+                status_l, progress, media_url = self._grsai_poll_fields(p_data)
+                if poll_idx in {1, 2, 3, 5, 10, 20, 40, 70, 100}:
+                    logger.info(
+                        "[GrsaiTrace][%s] poll response | task_id=%s poll_idx=%s status=%s elapsed_ms=%s has_url=%s",
+                        trace_id,
+                        tid,
+                        poll_idx,
+                        status_l,
+                        poll_ms,
+                        bool(media_url),
+                    )
+                if status_l in {"succeeded", "success", "completed", "done"} or (not status_l and media_url):
+                    if media_url:
+                        logger.info("[GrsaiTrace][%s] completed | task_id=%s poll_idx=%s media_url=%s", trace_id, tid, poll_idx, media_url)
+                        return {"status": "done", "url": media_url, "raw": p_data}
+                elif status_l in {"failed", "error", "canceled", "cancelled"}:
+                    print(f"[Grsai] Task Failed: {p_data}")
+                    return {"status": "failed", "raw": p_data, "poll_idx": poll_idx}
+                return {"status": "pending", "progress": progress}
+
+            outcome = await task_poller.wait("grsai", task_id, _check, timeout_seconds=300, initial_delay=3)
+            generation_resumer.record_polled(record_id, outcome)
+            if outcome.get("status") == "done":
+                meta = {"raw": outcome.get("raw")}
+                if extra_metadata:
+                    meta.update(extra_metadata)
+                return {"url": outcome.get("url"), "metadata": meta}
+            if outcome.get("status") == "failed":
+                p_data = outcome.get("raw")
+                if self._is_grsai_quota_or_throttle_error(p_data):
+                    logger.error("[GrsaiTrace][%s] task throttled_or_quota | task_id=%s poll_idx=%s detail=%s", trace_id, task_id, outcome.get("poll_idx"), str(p_data)[:1000])
+                    return {
+                        "error": "Veo/Grsai 配额或频率受限",
+                        "details": "任务失败原因为 429 RESOURCE_EXHAUSTED（上传图片或生成请求被限流/额度不足）。请稍后重试或调整账号配额。",
+                    }
+                logger.error("[GrsaiTrace][%s] task failed | task_id=%s poll_idx=%s detail=%s", trace_id, task_id, outcome.get("poll_idx"), str(p_data)[:1000])
+                return {"error": "Generation Failed", "details": p_data}
+            if outcome.get("last_error"):
+                # Upstream kept refusing poll connections; surface the network error instead of a bare timeout.
+                logger.error("[GrsaiTrace][%s] poll failed | task_id=%s error=%s", trace_id, task_id, outcome.get("last_error"))
+                return {"error": "Grsai poll failed", "details": outcome.get("last_error")}
 
             last_error = "Timeout"
             logger.error("[GrsaiTrace][%s] task timeout | task_id=%s", trace_id, task_id)
@@ -2152,53 +2532,144 @@ class MediaGenerationService:
         logger.error("[GrsaiTrace][%s] all upstream failed | no last_error", trace_id)
         return {"error": "Grsai request failed", "details": "All upstream endpoints failed", "submit_failed": True}
 
-    # -- Helpers --
-    def _download_and_save(self, url: str, filename_base: str = None, user_id: int = 1) -> str:
-        try:
-             UPLOAD_DIR = settings.UPLOAD_DIR
-             USER_DIR = os.path.join(UPLOAD_DIR, str(user_id))
-             
-             if not os.path.isabs(USER_DIR):
-                 USER_DIR = os.path.abspath(USER_DIR)
+    def _grsai_poll_fields(self, p_data: Dict[str, Any]):
+        """Extracts ``(status, progress, media_url)`` from a Grsai result payload."""
+        data_block = p_data.get("data")
+        status = None
+        media_url = None
+        progress = None
+
+        if isinstance(data_block, dict):
+            status = data_block.get("status") or p_data.get("status")
+            progress = data_block.get("progress")
+            results = data_block.get("results")
+            if isinstance(results, list) and results:
+                first_result = results[0] if isinstance(results[0], dict) else {}
+                media_url = first_result.get("url") or first_result.get("imageUrl") or first_result.get("videoUrl")
+            if not media_url:
+                media_url = (
+                    data_block.get("url")
+                    or data_block.get("imageUrl")
+                    or data_block.get("videoUrl")
+                    or data_block.get("result_url")
+                )
+        elif isinstance(data_block, list) and data_block:
+            first_item = data_block[0]
+            if isinstance(first_item, dict):
+                status = first_item.get("status") or p_data.get("status")
+                progress = first_item.get("progress")
+                media_url = (
+                    first_item.get("url")
+                    or first_item.get("imageUrl")
+                    or first_item.get("videoUrl")
+                    or first_item.get("result_url")
+                )
 
-             if not os.path.exists(USER_DIR): os.makedirs(USER_DIR)
+        return str(status or "").lower(), progress, media_url
+
+    async def resume_upstream_task(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Finishes an upstream task recorded by a worker that went away: polls it (unless it
+        already finished) and stores the media. Returns ``{"url", "metadata"}``, ``{"error"}``,
+        or ``{"superseded": True}`` when another attempt of the same generation won."""
+        poll = record.get("poll") or {}
+        context = record.get("context") or {}
+        task_id = record.get("task_id")
+        media_url = record.get("result_url")
+        raw = None
+
+        if not media_url:
+            api_key = await asyncio.to_thread(generation_resumer.resolve_api_key, poll.get("key"))
+            if not api_key:
+                return {"error": "API key for the upstream task is no longer configured"}
+            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+            protocol = poll.get("protocol")
+            poll_url = poll.get("url")
+
+            if protocol == "task_get":
+                pool = poll.get("pool") or "default"
+
+                async def _check(tid):
+                    p_resp = await http_transport.get(f"{poll_url}/{tid}", pool=pool, verify=False, headers=headers, timeout=30)
+                    if p_resp.status_code != 200:
+                        return {"status": "pending", "error_hint": f"HTTP {p_resp.status_code}"}
+                    return self._video_task_outcome(p_resp.json())
+
+                interval = max(1, int(poll.get("interval") or 2))
+            elif protocol == "grsai_result":
+                pool = "grsai"
+
+                async def _check(tid):
+                    try:
+                        p_resp = await http_transport.post(poll_url, pool="grsai", verify=False, json={"id": tid}, headers=headers, timeout=(10, 30))
+                        p_data = p_resp.json() if p_resp.status_code == 200 else None
+                    except (httpx.RequestError, ValueError) as e:
+                        return {"status": "pending", "error_hint": str(e)}
+                    if not isinstance(p_data, dict):
+                        return {"status": "pending"}
+                    status_l, progress, url = self._grsai_poll_fields(p_data)
+                    if url and (status_l in {"succeeded", "success", "completed", "done"} or not status_l):
+                        return {"status": "done", "url": url, "raw": p_data}
+                    if status_l in {"failed", "error", "canceled", "cancelled"}:
+                        return {"status": "failed", "raw": p_data}
+                    return {"status": "pending", "progress": progress}
+
+                interval = 3
+            else:
+                return {"error": f"Unsupported poll protocol: {protocol}"}
+
+            timeout_seconds = max(120, int((record.get("deadline") or 0) - time.time()))
+            outcome = await task_poller.wait(
+                pool,
+                task_id,
+                _check,
+                timeout_seconds=timeout_seconds,
+                initial_delay=0,
+                min_interval=interval,
+            )
+            if outcome.get("status") == "failed":
+                return {"error": "Generation Failed", "details": outcome.get("raw")}
+            if outcome.get("status") != "done" or not outcome.get("url"):
+                return {"error": f"Timeout after {timeout_seconds}s", "details": outcome.get("last_error")}
+            media_url = outcome.get("url")
+            raw = outcome.get("raw")
+
+        if not await asyncio.to_thread(generation_resumer.begin_finalize, record, media_url):
+            return {"superseded": True}
+
+        metadata = {"raw": raw, "resumed": True, "upstream_task_id": task_id}
+        metadata.update(poll.get("metadata") or {})
+        url = await self._download_and_save(
+            media_url,
+            context.get("filename_base"),
+            context.get("user_id") or 1,
+            metadata=metadata,
+        )
+        return {"url": url, "metadata": metadata}
 
+    # -- Helpers --
+    async def _download_and_save(self, url: str, filename_base: str = None, user_id: int = 1, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """Stores a provider result in the media store and returns its per-user URL (or the original URL on failure)."""
+        try:
              if url.startswith("/"): return url
              if "localhost" in url or "127.0.0.1" in url: return url
 
-             response = requests.get(url, stream=True, timeout=600, headers={"User-Agent": "Mozilla/5.0"})
-             if response.status_code == 200:
-                ext = ".png"
-                ct = response.headers.get("Content-Type", "").lower()
-                if "video" in ct or ".mp4" in url: ext = ".mp4"
-                elif "jpeg" in ct: ext = ".jpg"
-                elif "webp" in ct: ext = ".webp"
-                
-                filename = f"gen_{uuid.uuid4().hex[:8]}{ext}"
-                if filename_base: filename = f"{filename_base}_{filename}"
-                    
-                file_path = os.path.join(USER_DIR, filename)
-                with open(file_path, 'wb') as f:
-                    for chunk in response.iter_content(4096): f.write(chunk)
-                
-                relative_path = f"/uploads/{user_id}/{filename}"
-                if settings.RENDER_EXTERNAL_URL:
-                    base = settings.RENDER_EXTERNAL_URL.rstrip('/')
-                    return f"{base}{relative_path}"
-                return relative_path
+             saved = await media_store.download(url, user_id, filename_base=filename_base, timeout=600)
+             if saved:
+                 if metadata is not None:
+                     metadata["content_digest"] = saved["digest"]
+                     metadata["content_size"] = saved["size"]
+                 return saved["url"]
         except Exception as e:
             print(f"Download failed: {e}")
         return url
         
-    def _process_veo_image(self, url_or_path, aspect_ratio):
+    async def _process_veo_image(self, url_or_path, aspect_ratio):
         """Helper to resize/crop images to strictly match Veo aspect ratio requirements"""
         try:
             # Reuse base fetch logic
-            b64_raw = self._get_image_base64_for_api(url_or_path, force_data_uri=False)
-            if not b64_raw: return ""
-            
-            img_data = base64.b64decode(b64_raw)
-            img = Image.open(io.BytesIO(img_data)).convert("RGB")
+            payload = await asyncio.to_thread(self._load_ref_payload, url_or_path)
+            if not payload: return ""
+            b64_raw, mime, digest = payload
             
             # Default target (16:9)
             w, h = 1280, 720
@@ -2215,33 +2686,9 @@ class MediaGenerationService:
             }
             if aspect_ratio in ar_map: w, h = ar_map[aspect_ratio]
             
-            # Resize/Crop logic
-            target_aspect = w / h
-            current_aspect = img.width / img.height
-            
-            # Crop to matching aspect ratio first
-            if abs(current_aspect - target_aspect) > 0.05:
-                if current_aspect > target_aspect:
-                    # Too wide: crop width
-                    new_w = int(img.height * target_aspect)
-                    left = (img.width - new_w) // 2
-                    img = img.crop((left, 0, left + new_w, img.height))
-                else:
-                    # Too tall: crop height
-                    new_h = int(img.width / target_aspect)
-                    top = (img.height - new_h) // 2
-                    img = img.crop((0, top, img.width, top + new_h))
-                    
-            # Resize to target resolution if needed
-            if img.width != w or img.height != h:
-                # Use LANDZOS if available, else standard
-                resample = getattr(Image, 'LANCZOS', Image.BICUBIC)
-                img = img.resize((w, h), resample)
-                
-            out = io.BytesIO()
-            img.save(out, format='PNG')
-            b64_final = base64.b64encode(out.getvalue()).decode('utf-8')
-            return f"data:image/png;base64,{b64_final}"
+            # Center-crop to the target aspect and resize, in the preprocessing pool
+            b64_final, mime = await image_preprocessor.transform(b64_raw, mime, digest, target=(w, h), fmt="PNG")
+            return f"data:{mime};base64,{b64_final}"
             
         except Exception as e:
             print(f"[Veo] Image Process Error: {e}")
@@ -2271,7 +2718,7 @@ class MediaGenerationService:
         except Exception:
             return False
 
-    def _resolve_ref_for_api(self, url_or_path, force_data_uri_for_local=True):
+    def _resolve_ref_for_api(self, url_or_path, force_data_uri_for_local=True, max_edge=None):
         if isinstance(url_or_path, list):
             if not url_or_path:
                 return None
@@ -2285,64 +2732,219 @@ class MediaGenerationService:
         if self._is_public_http_url(raw):
             return raw
 
-        encoded = self._get_image_base64_for_api(raw, force_data_uri=force_data_uri_for_local)
+        encoded = self._get_image_base64_for_api(raw, force_data_uri=force_data_uri_for_local, max_edge=max_edge)
         if not encoded or encoded == raw:
             return None
         return encoded
 
-    def _resolve_ref_list_for_api(self, refs, force_data_uri_for_local=True):
+    def _resolve_ref_list_for_api(self, refs, force_data_uri_for_local=True, max_edge=None):
         source = refs if isinstance(refs, list) else [refs]
-        result = []
-        for item in source:
-            resolved = self._resolve_ref_for_api(item, force_data_uri_for_local=force_data_uri_for_local)
-            if resolved:
-                result.append(resolved)
-        return result
+        if len(self._collect_prefetchable_refs(source)) > 1:
+            # Cold refs are fetched/encoded in parallel; order is preserved by map().
+            workers = max(1, min(len(source), settings.REF_IMAGE_PREFETCH_CONCURRENCY))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                resolved_items = list(pool.map(
+                    lambda item: self._resolve_ref_for_api(item, force_data_uri_for_local=force_data_uri_for_local, max_edge=max_edge),
+                    source,
+                ))
+        else:
+            resolved_items = [self._resolve_ref_for_api(item, force_data_uri_for_local=force_data_uri_for_local, max_edge=max_edge) for item in source]
+        return [r for r in resolved_items if r]
+
+    def _ref_max_edge(self, provider: Optional[str]) -> Optional[int]:
+        if provider in {"stability", "stable diffusion"}:
+            # init images must keep the dimensions the caller chose
+            return None
+        return self.REF_MAX_EDGE.get(str(provider or "").lower(), settings.IMAGE_REF_MAX_EDGE)
 
-    def _get_image_base64_for_api(self, url_or_path, force_data_uri=False):
+    def _collect_prefetchable_refs(self, *sources) -> List[str]:
+        refs: List[str] = []
+        seen = set()
+        for source in sources:
+            items = source if isinstance(source, list) else [source]
+            for item in items:
+                raw = str(item or "").strip()
+                if not raw or raw in seen or raw.startswith("data:"):
+                    continue
+                # Public URLs are usually passed through untouched; only warm refs we will encode.
+                if "/uploads/" not in raw and (not raw.startswith("http") or self._is_public_http_url(raw)):
+                    continue
+                seen.add(raw)
+                refs.append(raw)
+        return refs
+
+    async def _prefetch_refs(self, *sources, max_edge: Optional[int] = None) -> None:
+        """Loads, encodes and (when ``max_edge`` is set) shrinks every local/private ref
+        concurrently so the provider handlers only hit caches."""
+        refs = self._collect_prefetchable_refs(*sources)
+        if not refs or (len(refs) < 2 and not max_edge):
+            return
+        sem = asyncio.Semaphore(max(1, settings.REF_IMAGE_PREFETCH_CONCURRENCY))
+
+        async def _load(ref: str):
+            async with sem:
+                payload = await asyncio.to_thread(self._load_ref_payload, ref)
+            if payload and max_edge:
+                b64, mime, digest = payload
+                await image_preprocessor.transform(b64, mime, digest, max_edge=max_edge)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[_load(r) for r in refs], return_exceptions=True)
+        logger.info("Ref prefetch done | refs=%s elapsed_ms=%s", len(refs), int((time.perf_counter() - started) * 1000))
+
+    def _local_upload_path(self, url_or_path: str) -> str:
+        fname = str(url_or_path).split("/uploads/")[-1]
+        UPLOAD_DIR = settings.UPLOAD_DIR
+        if not os.path.isabs(UPLOAD_DIR):
+            UPLOAD_DIR = os.path.abspath(UPLOAD_DIR)
+
+        # simplified path resolution
+        import urllib.parse
+        # Ensure fname doesn't contain query params for local file check
+        clean_fname = fname.split('?')[0]
+        return os.path.join(UPLOAD_DIR, urllib.parse.unquote(clean_fname))
+
+    async def _ref_identity(self, ref: Any) -> str:
+        """Stable identity of a reference for cache keys: content digest when we can read it."""
+        raw = str(ref or "").strip()
+        if not raw:
+            return ""
+        if raw.startswith("data:"):
+            return "sha256:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        if "/uploads/" in raw:
+            path = self._local_upload_path(raw)
+            try:
+                st = os.stat(path)
+            except OSError:
+                return f"missing:{raw}"
+            key = ref_image_cache.file_key(path, st.st_mtime_ns, st.st_size)
+        elif raw.startswith("http") and not self._is_public_http_url(raw):
+            key = ref_image_cache.url_key(raw)
+        else:
+            return f"url:{raw}"
+        digest = ref_image_cache.digest(key)
+        if digest is None:
+            await asyncio.to_thread(self._get_image_base64_for_api, raw)
+            digest = ref_image_cache.digest(key)
+        return f"sha256:{digest}" if digest else key
+
+    async def _generation_cache_key(
+        self,
+        category: str,
+        user_id: int,
+        project_id: Any,
+        provider: str,
+        model: Any,
+        prompt: str,
+        reference_image_url: Any = None,
+        width: Any = None,
+        height: Any = None,
+        aspect_ratio: Any = None,
+        duration: Any = None,
+        last_frame_url: Any = None,
+        keyframes: Optional[List[str]] = None,
+    ):
+        refs = reference_image_url if isinstance(reference_image_url, list) else ([reference_image_url] if reference_image_url else [])
+        ref_ids = list(await asyncio.gather(*[self._ref_identity(r) for r in refs])) if refs else []
+        extra = {}
+        if last_frame_url:
+            extra["last_frame"] = await self._ref_identity(last_frame_url)
+        if keyframes:
+            extra["keyframes"] = list(await asyncio.gather(*[self._ref_identity(k) for k in keyframes]))
+        scope = generation_cache.scope_for(user_id, project_id)
+        key = generation_cache.build_key(
+            scope, category, provider, model, prompt, ref_ids,
+            width=width, height=height, aspect_ratio=aspect_ratio, duration=duration, extra=extra,
+        )
+        return key, scope
+
+    def _serve_cached_generation(self, cache_key: str, user_id: int, filename_base: Optional[str]) -> Optional[Dict[str, Any]]:
+        cached = generation_cache.lookup(cache_key)
+        if not cached:
+            return None
+        url = media_store.alias_digest(cached["content_digest"], cached["content_ext"], user_id, filename_base=filename_base)
+        if not url:
+            # Blob vanished from disk; forget the entry and regenerate.
+            generation_cache.invalidate(cache_key)
+            return None
+        metadata = dict(cached.get("meta_info") or {})
+        metadata["content_digest"] = cached["content_digest"]
+        metadata["generation_cache"] = {"hit": True, "created_at": cached.get("created_at"), "hit_count": cached.get("hit_count")}
+        logger.info("Generation cache hit | user_id=%s provider=%s model=%s key=%s", user_id, cached.get("provider"), cached.get("model"), cache_key[:16])
+        return {"url": url, "metadata": metadata}
+
+    def _remember_generation(self, cache_key: str, scope: str, user_id: int, project_id: Any, category: str, provider: str, model: Any, result: Dict[str, Any]) -> None:
+        metadata = result.get("metadata") or {}
+        digest = metadata.get("content_digest")
+        url = str(result.get("url") or "")
+        if not digest or "/uploads/" not in url:
+            return
+        ext = os.path.splitext(url.split("?")[0])[1].lower() or ".png"
+        keep = {k: metadata.get(k) for k in ("provider", "model", "duration", "submit_aspect_ratio") if metadata.get(k) is not None}
+        generation_cache.store(cache_key, scope, user_id, project_id, category, provider, model, digest, ext, keep)
+
+    def _load_ref_payload(self, url_or_path):
+        """Returns ``(b64, mime, digest)`` for a local upload or remote URL, via the ref cache."""
+        data = None
+        mime = "image/png"
+        cache_key = None
+        if "/uploads/" in url_or_path:
+             path = self._local_upload_path(url_or_path)
+
+             try:
+                 st = os.stat(path)
+             except OSError:
+                 st = None
+             if st is not None:
+                 cache_key = ref_image_cache.file_key(path, st.st_mtime_ns, st.st_size)
+                 cached = ref_image_cache.get(cache_key)
+                 if cached:
+                     return cached[0], cached[1], ref_image_cache.digest(cache_key)
+                 print(f"[MediaService] Conversion: Processing ref image: {str(url_or_path)[:100]}")
+                 with open(path, "rb") as f: data = f.read()
+                 if path.endswith((".jpg", ".jpeg")): mime = "image/jpeg"
+                 elif path.endswith(".webp"): mime = "image/webp"
+             else:
+                 print(f"[MediaService] Error: Local File Not Found: {path}")
+        elif url_or_path.startswith("http"):
+             cache_key = ref_image_cache.url_key(url_or_path)
+             cached = ref_image_cache.get(cache_key)
+             if cached:
+                 return cached[0], cached[1], ref_image_cache.digest(cache_key)
+             print(f"[MediaService] Conversion: Processing ref image: {str(url_or_path)[:100]}")
+             r = http_transport.request_sync("GET", url_or_path, pool="media_fetch", timeout=30)
+             if r.status_code == 200: 
+                 data = r.content
+                 ct = r.headers.get("Content-Type", "")
+                 if "jpeg" in ct: mime = "image/jpeg"
+                 elif "webp" in ct: mime = "image/webp"
+             else:
+                 print(f"[MediaService] Error: HTTP Download Failed {r.status_code}: {url_or_path}")
+
+        if not data:
+            print(f"[MediaService] Error: No Data retrieved for {url_or_path}")
+            return None
+        b64 = base64.b64encode(data).decode("utf-8")
+        digest = ref_image_cache.put(cache_key, data, mime, b64) if cache_key else hashlib.sha256(data).hexdigest()
+        return b64, mime, digest
+
+    def _get_image_base64_for_api(self, url_or_path, force_data_uri=False, max_edge=None):
         # Helper to get base64 from local or remote
         # NOTE: This only processes ONE image. If list is passed, we take the first.
         # Callers MUST handle lists if they need multiple images.
+        # max_edge: shrink (in the preprocessing pool) so the longest side fits the provider limit.
         if isinstance(url_or_path, list):
              if not url_or_path: return None
              url_or_path = url_or_path[0]
 
         try:
-            print(f"[MediaService] Conversion: Processing ref image: {str(url_or_path)[:100]}")
-            data = None
-            mime = "image/png"
-            if "/uploads/" in url_or_path:
-                 fname = url_or_path.split("/uploads/")[-1]
-                 UPLOAD_DIR = settings.UPLOAD_DIR
-                 if not os.path.isabs(UPLOAD_DIR):
-                     UPLOAD_DIR = os.path.abspath(UPLOAD_DIR)
-
-                 # simplified path resolution
-                 import urllib.parse
-                 # Ensure fname doesn't contain query params for local file check
-                 clean_fname = fname.split('?')[0]
-                 path = os.path.join(UPLOAD_DIR, urllib.parse.unquote(clean_fname))
-                 
-                 if os.path.exists(path):
-                     with open(path, "rb") as f: data = f.read()
-                     if path.endswith(".jpg"): mime = "image/jpeg"
-                 else:
-                     print(f"[MediaService] Error: Local File Not Found: {path}")
-            elif url_or_path.startswith("http"):
-                 r = requests.get(url_or_path, timeout=30)
-                 if r.status_code == 200: 
-                     data = r.content
-                     ct = r.headers.get("Content-Type", "")
-                     if "jpeg" in ct: mime = "image/jpeg"
-                 else:
-                     print(f"[MediaService] Error: HTTP Download Failed {r.status_code}: {url_or_path}")
-            
-            if data:
-                b64 = base64.b64encode(data).decode("utf-8")
+            payload = self._load_ref_payload(url_or_path)
+            if payload:
+                b64, mime, digest = payload
+                if max_edge:
+                    b64, mime = image_preprocessor.transform_sync(b64, mime, digest, max_edge=max_edge)
                 if force_data_uri: return f"data:{mime};base64,{b64}"
                 return b64
-            else:
-                print(f"[MediaService] Error: No Data retrieved for {url_or_path}")
         except Exception as e:
             print(f"[MediaService] Exception in Base64 Conversion: {e}")
         
@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, BinaryIO, Dict, Optional
+
+from app.core.config import settings
+from app.services.http_transport import http_transport
+
+logger = logging.getLogger("media_store")
+
+CAS_DIRNAME = "cas"
+PIN_DIRNAME = "pinned"
+KNOWN_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp4", ".mov", ".webm", ".avi")
+_ALIAS_RE = re.compile(r"(?:^|_)([0-9a-f]{12})_[0-9a-f]{6}(\.[A-Za-z0-9]+)$")
+_HEX2_RE = re.compile(r"^[0-9a-f]{2}$")
+# A blob deduplicated or aliased this recently may be about to gain a link; never drop it.
+_LINK_WINDOW_SECONDS = 60.0
+_SWEEP_INTERVAL_SECONDS = 6 * 3600
+_TMP_MAX_AGE_SECONDS = 24 * 3600
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class MediaStore:
+    """Content-addressed storage for generated and uploaded media under ``UPLOAD_DIR``.
+
+    Every blob lives once at ``cas/<aa>/<bb>/<sha256><ext>``. Per-user files under
+    ``/uploads/<user_id>/`` are hard links to the blob (falling back to a copy when the
+    filesystem refuses links), so existing URLs, static serving and per-asset deletes
+    keep working while identical content occupies disk once. A blob whose link count
+    drops to 1 has no aliases left: ``delete_file`` drops it together with its last alias,
+    and a periodic sweep removes any that are left over (deletes done elsewhere, aliases
+    that fell back to copies). Blobs served by their own URL (``store_blob``) are pinned
+    with a marker under ``cas/pinned/`` and only go when that URL's asset is deleted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent: Dict[str, float] = {}
+        self._last_sweep = 0.0
+        self._sweeping = False
+        self._stats = {
+            "stored": 0,
+            "deduplicated": 0,
+            "bytes_written": 0,
+            "bytes_deduplicated": 0,
+            "link_fallback_copies": 0,
+            "blobs_dropped": 0,
+            "bytes_freed": 0,
+            "sweeps": 0,
+        }
+
+    # --- Layout ---
+
+    @property
+    def root(self) -> str:
+        root = settings.UPLOAD_DIR
+        if not os.path.isabs(root):
+            root = os.path.abspath(root)
+        return root
+
+    def blob_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, CAS_DIRNAME, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def pin_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.root, CAS_DIRNAME, PIN_DIRNAME, f"{digest}{ext}")
+
+    def blob_url(self, digest: str, ext: str) -> str:
+        return self._public_url(f"/uploads/{CAS_DIRNAME}/{digest[:2]}/{digest[2:4]}/{digest}{ext}")
+
+    def find_by_digest(self, digest: str) -> Optional[str]:
+        """Stable blob URL for a digest, or None if the content is not stored."""
+        digest = str(digest or "").strip().lower()
+        if len(digest) != 64:
+            return None
+        for ext in KNOWN_EXTENSIONS:
+            if os.path.exists(self.blob_path(digest, ext)):
+                return self.blob_url(digest, ext)
+        return None
+
+    def _public_url(self, relative_path: str) -> str:
+        if settings.RENDER_EXTERNAL_URL:
+            return f"{settings.RENDER_EXTERNAL_URL.rstrip('/')}{relative_path}"
+        return relative_path
+
+    def _tmp_path(self) -> str:
+        tmp_dir = os.path.join(self.root, CAS_DIRNAME, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+
+    # --- Commit ---
+
+    def _commit(self, tmp_path: str, digest: str, ext: str, size: int) -> str:
+        """Moves a finished temp file into the CAS unless the digest already exists."""
+        final_path = self.blob_path(digest, ext)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        with self._lock:
+            self._recent[final_path] = time.monotonic()
+            if os.path.exists(final_path):
+                os.remove(tmp_path)
+                # Bumps ctime so another process's sweep sees the blob as freshly used.
+                os.utime(final_path)
+                self._stats["deduplicated"] += 1
+                self._stats["bytes_deduplicated"] += size
+            else:
+                os.replace(tmp_path, final_path)
+                self._stats["stored"] += 1
+                self._stats["bytes_written"] += size
+        self.sweep_if_due()
+        return final_path
+
+    def _link_alias(self, blob: str, user_id: Any, filename: str) -> str:
+        user_dir = os.path.join(self.root, str(user_id))
+        os.makedirs(user_dir, exist_ok=True)
+        alias = os.path.join(user_dir, filename)
+        try:
+            os.link(blob, alias)
+        except OSError:
+            shutil.copyfile(blob, alias)
+            with self._lock:
+                self._stats["link_fallback_copies"] += 1
+        return self._public_url(f"/uploads/{user_id}/{filename}")
+
+    def _alias_name(self, digest: str, ext: str, filename_base: Optional[str], prefix: str) -> str:
+        # Each alias is unique so deleting one asset never removes another asset's file.
+        name = f"{prefix}_{digest[:12]}_{uuid.uuid4().hex[:6]}{ext}"
+        if filename_base:
+            name = f"{filename_base}_{name}"
+        return name
+
+    def alias_digest(self, digest: str, ext: str, user_id: Any, filename_base: Optional[str] = None, prefix: str = "gen") -> Optional[str]:
+        """New per-user alias URL for an already stored blob, or None if the blob is gone."""
+        blob = self.blob_path(digest, ext)
+        with self._lock:
+            if not os.path.exists(blob):
+                return None
+            self._recent[blob] = time.monotonic()
+        return self._link_alias(blob, user_id, self._alias_name(digest, ext, filename_base, prefix))
+
+    # --- Ingest ---
+
+    def ingest_stream(
+        self,
+        stream: BinaryIO,
+        ext: str,
+        user_id: Any,
+        filename_base: Optional[str] = None,
+        prefix: str = "upload",
+        max_bytes: Optional[int] = None,
+        chunk_size: int = 1024 * 1024,
+    ) -> Dict[str, Any]:
+        """Copies a file-like object into the store, hashing while streaming.
+
+        Raises ``MediaTooLarge`` past ``max_bytes`` and ``ValueError`` for empty input.
+        """
+        tmp_path = self._tmp_path()
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb", buffering=chunk_size) as out:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise MediaTooLarge(f"File exceeds {max_bytes} bytes")
+                    hasher.update(chunk)
+                    out.write(chunk)
+            if size <= 0:
+                raise ValueError("Empty file")
+            digest = hasher.hexdigest()
+            blob = self._commit(tmp_path, digest, ext, size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        url = self._link_alias(blob, user_id, self._alias_name(digest, ext, filename_base, prefix))
+        return {"url": url, "digest": digest, "size": size, "path": os.path.join(self.root, str(user_id), os.path.basename(url))}
+
+    def store_blob(self, data: bytes, ext: str) -> Dict[str, Any]:
+        """Stores in-memory content and returns its stable digest URL (no per-user alias)."""
+        digest = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.blob_path(digest, ext)):
+            with self._lock:
+                self._stats["deduplicated"] += 1
+                self._stats["bytes_deduplicated"] += len(data)
+        else:
+            tmp_path = self._tmp_path()
+            with open(tmp_path, "wb") as out:
+                out.write(data)
+            self._commit(tmp_path, digest, ext, len(data))
+        # The blob URL is handed out directly, so no alias keeps it alive.
+        pin = self.pin_path(digest, ext)
+        os.makedirs(os.path.dirname(pin), exist_ok=True)
+        open(pin, "ab").close()
+        return {"url": self.blob_url(digest, ext), "digest": digest, "size": len(data)}
+
+    async def download(
+        self,
+        url: str,
+        user_id: Any,
+        filename_base: Optional[str] = None,
+        timeout: float = 600,
+        write_buffer_bytes: int = 4 * 1024 * 1024,
+    ) -> Optional[Dict[str, Any]]:
+        """Streams a remote file into the store; returns None on a non-200 response."""
+        client = http_transport.get_async_client("media_download")
+        tmp_path = self._tmp_path()
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            async with client.stream(
+                "GET",
+                url,
+                timeout=http_transport.build_timeout(timeout),
+                headers={"User-Agent": "Mozilla/5.0"},
+            ) as response:
+                if response.status_code != 200:
+                    logger.warning("media download failed | status=%s url=%s", response.status_code, url[:200])
+                    return None
+                ext = self._ext_for(response.headers.get("Content-Type", ""), url)
+                out = await asyncio.to_thread(open, tmp_path, "wb")
+                try:
+                    buf = bytearray()
+                    async for chunk in response.aiter_bytes(256 * 1024):
+                        hasher.update(chunk)
+                        size += len(chunk)
+                        buf += chunk
+                        if len(buf) >= write_buffer_bytes:
+                            await asyncio.to_thread(out.write, bytes(buf))
+                            buf.clear()
+                    if buf:
+                        await asyncio.to_thread(out.write, bytes(buf))
+                finally:
+                    await asyncio.to_thread(out.close)
+            if size <= 0:
+                os.remove(tmp_path)
+                return None
+            digest = hasher.hexdigest()
+            blob = await asyncio.to_thread(self._commit, tmp_path, digest, ext, size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        alias_url = await asyncio.to_thread(self._link_alias, blob, user_id, self._alias_name(digest, ext, filename_base, "gen"))
+        return {"url": alias_url, "digest": digest, "size": size}
+
+    # --- Deletion and garbage collection ---
+
+    def _blob_for(self, path: str) -> Optional[str]:
+        """The CAS blob behind ``path``: the path itself for a blob, the same inode for an alias."""
+        path = os.path.abspath(path)
+        cas_root = os.path.join(self.root, CAS_DIRNAME) + os.sep
+        if path.startswith(cas_root):
+            return path
+        match = _ALIAS_RE.search(os.path.basename(path))
+        if not match:
+            return None
+        prefix, ext = match.groups()
+        shard = os.path.join(self.root, CAS_DIRNAME, prefix[:2], prefix[2:4])
+        try:
+            candidates = [n for n in os.listdir(shard) if n.startswith(prefix) and n.endswith(ext)]
+        except OSError:
+            return None
+        for name in candidates:
+            blob = os.path.join(shard, name)
+            try:
+                if os.path.samefile(blob, path):
+                    return blob
+            except OSError:
+                continue
+        return None
+
+    def _drop_if_orphaned(self, blob: str, min_age: float = 0.0) -> bool:
+        """Removes ``blob`` when no alias links to it, it is not pinned and not just (re)used."""
+        name = os.path.basename(blob)
+        pin = os.path.join(self.root, CAS_DIRNAME, PIN_DIRNAME, name)
+        with self._lock:
+            used_at = self._recent.get(blob)
+            if used_at is not None and time.monotonic() - used_at < _LINK_WINDOW_SECONDS:
+                return False
+            try:
+                st = os.stat(blob)
+            except FileNotFoundError:
+                return False
+            if st.st_nlink > 1 or os.path.exists(pin):
+                return False
+            if min_age and time.time() - st.st_ctime < min_age:
+                return False
+            os.remove(blob)
+            self._recent.pop(blob, None)
+            self._stats["blobs_dropped"] += 1
+            self._stats["bytes_freed"] += st.st_size
+        return True
+
+    def delete_file(self, path: str) -> bool:
+        """Deletes a stored file; the blob goes too once its last alias (or its pin) is gone."""
+        if not os.path.isfile(path):
+            return False
+        blob = self._blob_for(path)
+        if blob is not None and os.path.abspath(path) == blob:
+            # Deleting the asset that used the blob URL itself: unpin, keep it while aliases remain.
+            pin = os.path.join(self.root, CAS_DIRNAME, PIN_DIRNAME, os.path.basename(blob))
+            if os.path.exists(pin):
+                os.remove(pin)
+        else:
+            os.remove(path)
+        if blob is not None:
+            self._drop_if_orphaned(blob)
+        return True
+
+    def sweep(self) -> int:
+        """Drops blobs left without an alias for ``MEDIA_CAS_ORPHAN_GRACE_SECONDS`` and stale temp files."""
+        cas_root = os.path.join(self.root, CAS_DIRNAME)
+        grace = max(_LINK_WINDOW_SECONDS, float(settings.MEDIA_CAS_ORPHAN_GRACE_SECONDS))
+        dropped = 0
+        now = time.time()
+        tmp_dir = os.path.join(cas_root, "tmp")
+        if os.path.isdir(tmp_dir):
+            for entry in os.scandir(tmp_dir):
+                try:
+                    if entry.is_file() and now - entry.stat().st_mtime > _TMP_MAX_AGE_SECONDS:
+                        os.remove(entry.path)
+                except OSError:
+                    continue
+        if os.path.isdir(cas_root):
+            for first in os.scandir(cas_root):
+                if not (first.is_dir() and _HEX2_RE.match(first.name)):
+                    continue
+                for second in os.scandir(first.path):
+                    if not second.is_dir():
+                        continue
+                    for entry in os.scandir(second.path):
+                        if entry.is_file() and self._drop_if_orphaned(entry.path, min_age=grace):
+                            dropped += 1
+        cutoff = time.monotonic() - _LINK_WINDOW_SECONDS
+        with self._lock:
+            self._recent = {path: at for path, at in self._recent.items() if at >= cutoff}
+            self._stats["sweeps"] += 1
+        return dropped
+
+    def sweep_if_due(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._sweeping or (self._last_sweep and now - self._last_sweep < _SWEEP_INTERVAL_SECONDS):
+                return
+            self._last_sweep = now
+            self._sweeping = True
+        threading.Thread(target=self._run_sweep, name="media-cas-sweep", daemon=True).start()
+
+    def _run_sweep(self) -> None:
+        try:
+            dropped = self.sweep()
+            if dropped:
+                logger.info("swept orphaned media blobs | dropped=%s", dropped)
+        except Exception as e:
+            logger.warning("media blob sweep failed: %s", str(e)[:200])
+        finally:
+            with self._lock:
+                self._sweeping = False
+
+    def _ext_for(self, content_type: str, url: str) -> str:
+        ct = str(content_type or "").lower()
+        if "video" in ct or ".mp4" in url:
+            return ".mp4"
+        if "jpeg" in ct:
+            return ".jpg"
+        if "webp" in ct:
+            return ".webp"
+        return ".png"
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+media_store = MediaStore()
@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("outbound_governor")
+
+
+class _Waiter:
+    __slots__ = ("loop", "future")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future: Optional[asyncio.Future] = None
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _Limiter:
+    """Concurrency slots plus a token bucket for one (provider, model scope, api key)."""
+
+    def __init__(self, key: Tuple[str, str, str], limits: Dict[str, float]):
+        self.key = key
+        self.max_concurrency = 0
+        self.rate = 0.0
+        self.burst = 1.0
+        self.apply_limits(limits)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.inflight = 0
+        self.waiters: Deque[_Waiter] = deque()
+        self.stats = {"acquired": 0, "queued_total": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    def apply_limits(self, limits: Dict[str, float]) -> None:
+        self.max_concurrency = max(0, int(limits.get("max_concurrency") or 0))
+        self.rate = max(0.0, float(limits.get("rate_per_second") or 0))
+        self.burst = max(1.0, float(limits.get("burst") or 1))
+
+    def refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        if self.max_concurrency and self.inflight >= self.max_concurrency:
+            return False
+        if self.rate > 0:
+            self.refill(time.monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        self.inflight += 1
+        return True
+
+    def token_delay(self) -> Optional[float]:
+        """Seconds until the next token, or None when the head is blocked on concurrency."""
+        if self.max_concurrency and self.inflight >= self.max_concurrency:
+            return None
+        if self.rate <= 0:
+            return None
+        return max(0.005, (1 - self.tokens) / self.rate)
+
+
+class OutboundGovernor:
+    """Per-upstream concurrency limits and token-bucket rate limiting for provider calls.
+
+    Limiters are keyed by (provider, model scope, api key fingerprint). Callers over the
+    limit queue FIFO instead of failing; batch jobs run their own event loops in worker
+    threads, so waiters from any loop share one queue and are woken thread-safely.
+
+    Limits resolve from ``GOVERNOR_DEFAULT_*``, then ``GOVERNOR_LIMITS`` (JSON keyed by
+    ``"provider"`` or ``"provider:model"``), then a setting's ``config["governor"]``.
+    Model-specific limits get their own limiter; otherwise all models of a provider key
+    share one.
+
+    Long-running slots (a media generation held through submit and polling) use their own
+    limiters with no default concurrency cap: only an explicit ``max_concurrency`` from
+    ``GOVERNOR_LIMITS`` or the setting bounds them, and then it means concurrent upstream
+    tasks. The rate limit still paces their submissions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limiters: Dict[Tuple[str, str, str], _Limiter] = {}
+        self._limits_raw: Optional[str] = None
+        self._limits_table: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.GOVERNOR_ENABLED)
+
+    def _configured_limits(self) -> Dict[str, Dict[str, Any]]:
+        raw = settings.GOVERNOR_LIMITS or ""
+        if raw != self._limits_raw:
+            table: Dict[str, Dict[str, Any]] = {}
+            try:
+                parsed = json.loads(raw) if raw.strip() else {}
+                if isinstance(parsed, dict):
+                    table = {str(k).strip().lower(): v for k, v in parsed.items() if isinstance(v, dict)}
+            except Exception as e:
+                logger.warning("invalid GOVERNOR_LIMITS ignored: %s", e)
+            self._limits_raw, self._limits_table = raw, table
+        return self._limits_table
+
+    def resolve_limits(
+        self,
+        provider: str,
+        model: str,
+        overrides: Optional[Dict[str, Any]] = None,
+        long_running: bool = False,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Returns ``(model_scope, limits)`` for a call."""
+        limits: Dict[str, Any] = {
+            "max_concurrency": 0 if long_running else settings.GOVERNOR_DEFAULT_MAX_CONCURRENCY,
+            "rate_per_second": settings.GOVERNOR_DEFAULT_RATE_PER_SECOND,
+            "burst": settings.GOVERNOR_DEFAULT_BURST,
+        }
+        scope = "*"
+        table = self._configured_limits()
+        limits.update(table.get(provider) or {})
+        model_limits = table.get(f"{provider}:{model.lower()}") if model else None
+        if model_limits:
+            limits.update(model_limits)
+            scope = model
+        if isinstance(overrides, dict) and overrides:
+            limits.update({k: v for k, v in overrides.items() if k in limits})
+            scope = model or scope
+        if long_running:
+            scope = f"task:{scope}"
+        return scope, limits
+
+    def _limiter(self, provider: Any, model: Any, api_key: Any, overrides: Optional[Dict[str, Any]], long_running: bool = False) -> _Limiter:
+        provider = str(provider or "unknown").strip().lower()
+        model = str(model or "").strip()
+        scope, limits = self.resolve_limits(provider, model, overrides, long_running)
+        key_id = hashlib.sha256(str(api_key or "").encode("utf-8")).hexdigest()[:12] if api_key else "-"
+        key = (provider, scope, key_id)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = _Limiter(key, limits)
+                self._limiters[key] = limiter
+            else:
+                before = (limiter.max_concurrency, limiter.rate, limiter.burst)
+                limiter.apply_limits(limits)
+                if (limiter.max_concurrency, limiter.rate, limiter.burst) != before:
+                    self._wake_head_locked(limiter)
+        return limiter
+
+    def _wake_head_locked(self, limiter: _Limiter) -> None:
+        if limiter.waiters:
+            head = limiter.waiters[0]
+            if head.future is not None:
+                try:
+                    head.loop.call_soon_threadsafe(_wake, head.future)
+                except RuntimeError:
+                    # Waiter's loop already closed; it is dropped when its task unwinds.
+                    pass
+
+    async def _acquire(self, limiter: _Limiter) -> float:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not limiter.waiters and limiter.try_take():
+                limiter.stats["acquired"] += 1
+                return 0.0
+            waiter = _Waiter(loop)
+            limiter.waiters.append(waiter)
+            limiter.stats["queued_total"] += 1
+
+        started = time.monotonic()
+        try:
+            while True:
+                with self._lock:
+                    if limiter.waiters[0] is waiter and limiter.try_take():
+                        limiter.waiters.popleft()
+                        # The next waiter may fit too (spare slots or burst tokens).
+                        self._wake_head_locked(limiter)
+                        break
+                    delay = limiter.token_delay() if limiter.waiters[0] is waiter else None
+                    waiter.future = loop.create_future()
+                await asyncio.wait({waiter.future}, timeout=delay)
+        except BaseException:
+            with self._lock:
+                was_head = bool(limiter.waiters) and limiter.waiters[0] is waiter
+                try:
+                    limiter.waiters.remove(waiter)
+                except ValueError:
+                    pass
+                if was_head:
+                    self._wake_head_locked(limiter)
+            raise
+
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            limiter.stats["acquired"] += 1
+            limiter.stats["wait_ms_total"] += wait_ms
+            limiter.stats["wait_ms_max"] = max(limiter.stats["wait_ms_max"], wait_ms)
+        return wait_ms
+
+    def _release(self, limiter: _Limiter) -> None:
+        with self._lock:
+            limiter.inflight = max(0, limiter.inflight - 1)
+            self._wake_head_locked(limiter)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: Any,
+        model: Any = None,
+        api_key: Any = None,
+        overrides: Optional[Dict[str, Any]] = None,
+        long_running: bool = False,
+    ):
+        """Holds one outbound slot for the duration of the block, queueing if over limit."""
+        if not self.enabled:
+            yield 0.0
+            return
+        limiter = self._limiter(provider, model, api_key, overrides, long_running)
+        wait_ms = await self._acquire(limiter)
+        if wait_ms >= 1000:
+            logger.info("outbound call queued | key=%s wait_ms=%.0f", "/".join(limiter.key), wait_ms)
+        try:
+            yield wait_ms
+        finally:
+            self._release(limiter)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        limiters = []
+        with self._lock:
+            for (provider, scope, key_id), limiter in self._limiters.items():
+                acquired = limiter.stats["acquired"]
+                limiters.append({
+                    "provider": provider,
+                    "model": scope,
+                    "key_id": key_id,
+                    "inflight": limiter.inflight,
+                    "queued": len(limiter.waiters),
+                    "max_concurrency": limiter.max_concurrency,
+                    "rate_per_second": limiter.rate,
+                    "burst": limiter.burst,
+                    "acquired": acquired,
+                    "queued_total": limiter.stats["queued_total"],
+                    "avg_wait_ms": round(limiter.stats["wait_ms_total"] / acquired, 1) if acquired else 0.0,
+                    "max_wait_ms": round(limiter.stats["wait_ms_max"], 1),
+                })
+        return {
+            "enabled": self.enabled,
+            "queued": sum(item["queued"] for item in limiters),
+            "inflight": sum(item["inflight"] for item in limiters),
+            "limiters": limiters,
+        }
+
+
+outbound_governor = OutboundGovernor()
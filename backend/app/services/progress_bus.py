@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from app.core.config import settings
+
+logger = logging.getLogger("progress_bus")
+
+# ``loader(key)`` returns the current ``{channel: status}`` for topic ``"<prefix>:<key>"``.
+TopicLoader = Callable[[str], Dict[str, Dict[str, Any]]]
+
+# (done, total) field pairs the batch status payloads use; the first present pair drives the ETA.
+_PROGRESS_FIELDS = (("completed", "total"), ("processed", "episodes_in_run"))
+
+
+def _fingerprint(data: Dict[str, Any]) -> str:
+    # ``updated_at`` moves on every write; only a change in content is worth a push.
+    return json.dumps({k: v for k, v in data.items() if k != "updated_at"}, sort_keys=True, default=str)
+
+
+def estimate_eta_seconds(data: Dict[str, Any], now: Optional[datetime] = None) -> Optional[float]:
+    """Remaining seconds for a running batch status, extrapolated from its average pace so far."""
+    if not isinstance(data, dict) or not data.get("running"):
+        return None
+    for done_key, total_key in _PROGRESS_FIELDS:
+        if done_key in data and total_key in data:
+            break
+    else:
+        return None
+    try:
+        done = int(data.get(done_key) or 0)
+        total = int(data.get(total_key) or 0)
+        started_at = datetime.fromisoformat(str(data.get("started_at")))
+    except (TypeError, ValueError):
+        return None
+    if done <= 0 or total <= done:
+        return None
+    elapsed = ((now or datetime.utcnow()) - started_at).total_seconds()
+    if elapsed <= 0:
+        return None
+    return round(elapsed * (total - done) / done, 1)
+
+
+class Subscription:
+    """One SSE/WebSocket connection's view of the bus: an event queue bound to its event loop."""
+
+    def __init__(self, bus: "ProgressBus", topics: List[str], loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.bus = bus
+        self.topics = topics
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        # Runs on ``self.loop``. Status events are full snapshots, so losing old ones is harmless.
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+
+class ProgressBus:
+    """Pushes batch status changes and per-item results to connected clients.
+
+    Topics are ``episode:<id>``, ``project:<id>`` and ``image_job:<id>``; each carries one or
+    more channels (``shot_media_batch``, ``episode_scripts``, ...). The persist helpers publish a
+    ``status`` snapshot whenever they write, runners publish ``item`` events as shots, scenes or
+    episodes finish, and subscribers get the latest snapshot of every channel on connect.
+
+    ``publish`` is thread-safe and may be called from job worker threads and their private
+    event loops; delivery hops onto each subscriber's loop. Writes made by another process (an
+    external ``app.worker``, another API replica) are caught by re-reading watched topics
+    through the registered loaders every ``PROGRESS_REFRESH_SECONDS`` - one read per topic,
+    however many clients watch it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._latest: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._fingerprints: Dict[str, Dict[str, str]] = {}
+        self._published_at: Dict[str, float] = {}
+        self._loaders: Dict[str, TopicLoader] = {}
+        self._seq = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stats = {
+            "published": 0,
+            "unchanged": 0,
+            "items": 0,
+            "delivered": 0,
+            "refreshed": 0,
+            "subscribed": 0,
+            "errors": 0,
+        }
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    # -- Publishing --
+
+    def register_loader(self, prefix: str, loader: TopicLoader) -> None:
+        self._loaders[prefix] = loader
+
+    def publish(self, topic: str, channel: str, data: Dict[str, Any]) -> None:
+        """Publishes a ``status`` snapshot for ``channel``; repeats of the last snapshot are dropped."""
+        with self._lock:
+            # Nobody watching: nothing to keep. A later subscriber primes itself from the loader.
+            if topic not in self._subscribers:
+                return
+            self._published_at[topic] = time.time()
+            # Copy: callers keep mutating their status dicts while events wait to be sent.
+            data = json.loads(json.dumps(data, default=str))
+            fingerprint = _fingerprint(data)
+            known = self._fingerprints.setdefault(topic, {})
+            if known.get(channel) == fingerprint:
+                self._stats["unchanged"] += 1
+                return
+            known[channel] = fingerprint
+            event = self._event(topic, channel, "status", data)
+            event["eta_seconds"] = estimate_eta_seconds(data)
+            self._latest.setdefault(topic, {})[channel] = event
+            self._stats["published"] += 1
+        self._deliver(topic, event)
+
+    def publish_item(self, topic: str, channel: str, data: Dict[str, Any]) -> None:
+        """Publishes one finished unit of work (a shot, scene or episode). Not replayed to late subscribers."""
+        with self._lock:
+            if topic not in self._subscribers:
+                return
+            event = self._event(topic, channel, "item", data)
+            self._stats["items"] += 1
+        self._deliver(topic, event)
+
+    def _event(self, topic: str, channel: str, kind: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        self._seq += 1
+        return {"seq": self._seq, "type": kind, "topic": topic, "channel": channel, "ts": time.time(), "data": data}
+
+    def _deliver(self, topic: str, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # The connection's loop is gone; it never got to unsubscribe.
+                self.unsubscribe(sub)
+                continue
+            self._count("delivered")
+
+    # -- Subscribing --
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        """Must be called on the event loop that will read the subscription."""
+        sub = Subscription(
+            self,
+            list(dict.fromkeys(topics)),
+            asyncio.get_running_loop(),
+            max(16, int(settings.PROGRESS_SUBSCRIBER_QUEUE)),
+        )
+        with self._lock:
+            for topic in sub.topics:
+                self._subscribers.setdefault(topic, set()).add(sub)
+                for event in self._latest.get(topic, {}).values():
+                    sub.offer(event)
+            self._stats["subscribed"] += 1
+        self._ensure_refresher()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            for topic in sub.topics:
+                watchers = self._subscribers.get(topic)
+                if watchers is None:
+                    continue
+                watchers.discard(sub)
+                if not watchers:
+                    del self._subscribers[topic]
+                    self._latest.pop(topic, None)
+                    self._fingerprints.pop(topic, None)
+                    self._published_at.pop(topic, None)
+
+    # -- Reading state back from the database --
+
+    def refresh(self, topic: str) -> bool:
+        """Loads ``topic`` through its loader and publishes whatever changed. Blocking (DB read)."""
+        prefix, _, key = topic.partition(":")
+        loader = self._loaders.get(prefix)
+        if loader is None or not key:
+            return False
+        try:
+            channels = loader(key) or {}
+        except Exception as e:
+            self._count("errors")
+            logger.warning("progress refresh failed | topic=%s error=%s", topic, e)
+            return False
+        for channel, data in channels.items():
+            if isinstance(data, dict):
+                self.publish(topic, channel, data)
+        self._count("refreshed")
+        return True
+
+    @property
+    def refresh_seconds(self) -> float:
+        return max(0.0, float(settings.PROGRESS_REFRESH_SECONDS))
+
+    def _ensure_refresher(self) -> None:
+        if self.refresh_seconds <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="progress-refresh", daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.refresh_seconds):
+            cutoff = time.time() - self.refresh_seconds
+            with self._lock:
+                # Topics this process just published for are already current.
+                stale = [t for t in self._subscribers if self._published_at.get(t, 0.0) < cutoff]
+            for topic in stale:
+                if self._stop.is_set():
+                    return
+                self.refresh(topic)
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5.0)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._stats)
+            connections = {id(sub) for subs in self._subscribers.values() for sub in subs}
+            topics = len(self._subscribers)
+        return {
+            "connections": len(connections),
+            "topics": topics,
+            "refresh_seconds": self.refresh_seconds,
+            **counters,
+        }
+
+
+progress_bus = ProgressBus()
@@ -0,0 +1,248 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("provider_health")
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class ProviderHealthTracker:
+    """In-process success/latency tracking and circuit breakers per (provider, model).
+
+    Counters are per worker process; a fresh worker starts with every circuit closed.
+    Every attempt takes a ticket from ``begin`` and hands it back to ``record``. Once the
+    cooldown passes, an open circuit turns half-open and the next
+    ``ROUTER_CIRCUIT_HALF_OPEN_PROBES`` tickets become probes; only a probe's outcome closes
+    or re-opens the circuit. Each opening starts a new epoch, and results from tickets issued
+    in an earlier epoch (requests already in flight when the circuit opened) only update the
+    statistics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def _key(self, provider: Any, model: Any) -> Tuple[str, str]:
+        return (str(provider or "").strip().lower(), str(model or "").strip())
+
+    def _entry(self, key: Tuple[str, str]) -> Dict[str, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = {
+                "samples": 0,
+                "successes": 0,
+                "failures": 0,
+                "throttles": 0,
+                "success_ewma": 1.0,
+                "latency_ewma_ms": None,
+                "latencies": deque(maxlen=max(10, int(settings.ROUTER_LATENCY_WINDOW))),
+                "consecutive_failures": 0,
+                "state": CIRCUIT_CLOSED,
+                "opened_at": None,
+                "open_count": 0,
+                "epoch": 0,
+                "probes": 0,
+                "cooldown_seconds": float(settings.ROUTER_CIRCUIT_COOLDOWN_SECONDS),
+                "last_error": None,
+            }
+            self._entries[key] = entry
+        return entry
+
+    def _refresh_state_locked(self, entry: Dict[str, Any], now: float) -> str:
+        if entry["state"] == CIRCUIT_OPEN and entry["opened_at"] is not None:
+            if now - entry["opened_at"] >= entry["cooldown_seconds"]:
+                entry["state"] = CIRCUIT_HALF_OPEN
+        return entry["state"]
+
+    def _open_locked(self, key: Tuple[str, str], entry: Dict[str, Any], now: float, reason: str) -> None:
+        if entry["state"] == CIRCUIT_OPEN:
+            return
+        if entry["state"] == CIRCUIT_HALF_OPEN:
+            # Probe failed: back off harder before the next probe.
+            entry["cooldown_seconds"] = min(
+                float(settings.ROUTER_CIRCUIT_MAX_COOLDOWN_SECONDS),
+                entry["cooldown_seconds"] * 2.0,
+            )
+        entry["state"] = CIRCUIT_OPEN
+        entry["opened_at"] = now
+        entry["open_count"] += 1
+        entry["epoch"] += 1
+        entry["probes"] = 0
+        logger.warning(
+            "Circuit opened | provider=%s model=%s reason=%s cooldown=%ss consecutive_failures=%s success_ewma=%.2f",
+            key[0],
+            key[1],
+            reason,
+            int(entry["cooldown_seconds"]),
+            entry["consecutive_failures"],
+            entry["success_ewma"],
+        )
+
+    def _probe_limit(self) -> int:
+        return max(1, int(settings.ROUTER_CIRCUIT_HALF_OPEN_PROBES))
+
+    def begin(self, provider: Any, model: Any) -> Dict[str, Any]:
+        """Registers one attempt and returns its ticket for ``record``/``end``."""
+        key = self._key(provider, model)
+        with self._lock:
+            entry = self._entry(key)
+            state = self._refresh_state_locked(entry, time.monotonic())
+            probe = state == CIRCUIT_HALF_OPEN and entry["probes"] < self._probe_limit()
+            if probe:
+                entry["probes"] += 1
+            return {"key": key, "epoch": entry["epoch"], "probe": probe, "ended": False}
+
+    def _end_locked(self, entry: Dict[str, Any], ticket: Dict[str, Any]) -> None:
+        if ticket["ended"]:
+            return
+        ticket["ended"] = True
+        if ticket["probe"] and ticket["epoch"] == entry["epoch"]:
+            entry["probes"] = max(0, entry["probes"] - 1)
+
+    def end(self, ticket: Optional[Dict[str, Any]]) -> None:
+        """Frees the ticket's probe slot when the attempt ended without a ``record`` (cancelled,
+        or an error that says nothing about upstream health). Safe to call after ``record``."""
+        if ticket is None:
+            return
+        with self._lock:
+            entry = self._entries.get(ticket["key"])
+            if entry is not None:
+                self._end_locked(entry, ticket)
+
+    def record(
+        self,
+        provider: Any,
+        model: Any,
+        ok: bool,
+        latency_ms: Optional[float] = None,
+        throttled: bool = False,
+        error: Any = None,
+        ticket: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        key = self._key(provider, model)
+        alpha = float(settings.ROUTER_EWMA_ALPHA)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(key)
+            state = self._refresh_state_locked(entry, now)
+            probe = bool(ticket and ticket["probe"] and ticket["epoch"] == entry["epoch"])
+            stale = ticket is not None and ticket["epoch"] != entry["epoch"]
+            if ticket is not None:
+                self._end_locked(entry, ticket)
+            entry["samples"] += 1
+            entry["success_ewma"] = (1.0 - alpha) * entry["success_ewma"] + alpha * (1.0 if ok else 0.0)
+            if latency_ms is not None and ok:
+                prev = entry["latency_ewma_ms"]
+                entry["latency_ewma_ms"] = float(latency_ms) if prev is None else (1.0 - alpha) * prev + alpha * float(latency_ms)
+                entry["latencies"].append(float(latency_ms))
+
+            if ok:
+                entry["successes"] += 1
+                if stale:
+                    return
+                if state == CIRCUIT_CLOSED:
+                    entry["consecutive_failures"] = 0
+                    return
+                if not probe:
+                    # Not a probe (e.g. a last-resort attempt while open): proves nothing yet.
+                    return
+                logger.info("Circuit closed | provider=%s model=%s", key[0], key[1])
+                entry["consecutive_failures"] = 0
+                entry["state"] = CIRCUIT_CLOSED
+                entry["opened_at"] = None
+                entry["probes"] = 0
+                entry["cooldown_seconds"] = float(settings.ROUTER_CIRCUIT_COOLDOWN_SECONDS)
+                return
+
+            entry["failures"] += 1
+            entry["last_error"] = str(error or "")[:300] or None
+            if throttled:
+                entry["throttles"] += 1
+            if stale:
+                return
+            entry["consecutive_failures"] += 1
+            if state == CIRCUIT_HALF_OPEN:
+                if probe:
+                    self._open_locked(key, entry, now, "half_open_probe_failed")
+            elif throttled:
+                self._open_locked(key, entry, now, "throttled")
+            elif entry["consecutive_failures"] >= int(settings.ROUTER_CIRCUIT_FAILURE_THRESHOLD):
+                self._open_locked(key, entry, now, "consecutive_failures")
+            elif entry["samples"] >= int(settings.ROUTER_MIN_SAMPLES) and entry["success_ewma"] < float(settings.ROUTER_MIN_SUCCESS_RATE):
+                self._open_locked(key, entry, now, "low_success_rate")
+
+    def is_open(self, provider: Any, model: Any) -> bool:
+        """True while the circuit rejects traffic. A half-open circuit admits traffic only while a
+        probe slot is free; the next ``begin`` takes it."""
+        key = self._key(provider, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            state = self._refresh_state_locked(entry, time.monotonic())
+            if state == CIRCUIT_HALF_OPEN:
+                return entry["probes"] >= self._probe_limit()
+            return state == CIRCUIT_OPEN
+
+    def latency_quantile(self, provider: Any, model: Any, q: float = 0.9, min_samples: Optional[int] = None) -> Optional[float]:
+        """Observed success latency quantile in ms, or None until enough samples exist."""
+        key = self._key(provider, model)
+        needed = int(min_samples if min_samples is not None else settings.ROUTER_HEDGE_MIN_SAMPLES)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or len(entry["latencies"]) < max(1, needed):
+                return None
+            ordered = sorted(entry["latencies"])
+        index = min(len(ordered) - 1, max(0, int(math.ceil(q * len(ordered))) - 1))
+        return ordered[index]
+
+    def rank_key(self, provider: Any, model: Any) -> Tuple[int, float]:
+        """Sort key among equal-priority candidates: healthy first, then faster EWMA latency."""
+        key = self._key(provider, model)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return (0, 0.0)
+            state = self._refresh_state_locked(entry, time.monotonic())
+            latency = entry["latency_ewma_ms"] or 0.0
+            penalty = 0 if state == CIRCUIT_CLOSED else 1
+            # Treat a degraded success rate as extra latency so flaky upstreams sink.
+            return (penalty, latency / max(0.05, entry["success_ewma"]))
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            out = {}
+            for (provider, model), entry in self._entries.items():
+                state = self._refresh_state_locked(entry, now)
+                out[f"{provider}/{model}"] = {
+                    "state": state,
+                    "samples": entry["samples"],
+                    "successes": entry["successes"],
+                    "failures": entry["failures"],
+                    "throttles": entry["throttles"],
+                    "success_ewma": round(entry["success_ewma"], 3),
+                    "latency_ewma_ms": int(entry["latency_ewma_ms"]) if entry["latency_ewma_ms"] is not None else None,
+                    "latency_samples": len(entry["latencies"]),
+                    "consecutive_failures": entry["consecutive_failures"],
+                    "open_count": entry["open_count"],
+                    "probes_in_flight": entry["probes"],
+                    "reopen_in_seconds": (
+                        max(0, int(entry["cooldown_seconds"] - (now - entry["opened_at"])))
+                        if state == CIRCUIT_OPEN and entry["opened_at"] is not None
+                        else 0
+                    ),
+                    "last_error": entry["last_error"],
+                }
+            return out
+
+
+provider_health = ProviderHealthTracker()
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("ref_image_cache")
+
+
+class RefImageCache:
+    """Byte-budgeted LRU of base64-encoded reference images, keyed by content digest.
+
+    Lookup keys ("file:<path>:<mtime_ns>:<size>" or "url:<url>") map onto digests, so
+    the same image reached through different paths/URLs is encoded and stored once.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, url_ttl_seconds: Optional[float] = None):
+        self._lock = threading.Lock()
+        self._max_bytes = int(max_bytes if max_bytes is not None else settings.REF_IMAGE_CACHE_MAX_BYTES)
+        self._url_ttl = float(url_ttl_seconds if url_ttl_seconds is not None else settings.REF_IMAGE_CACHE_URL_TTL_SECONDS)
+        # digest -> {"b64", "mime", "size", "keys"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # lookup key -> (digest, expires_at or None)
+        self._index: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "dedup_stores": 0, "evictions": 0}
+
+    @staticmethod
+    def file_key(path: str, mtime_ns: int, size: int) -> str:
+        return f"file:{path}:{mtime_ns}:{size}"
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        return f"url:{url}"
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        """Returns ``(b64, mime)`` for a lookup key, or None."""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._index.get(key)
+            if hit is None:
+                self._stats["misses"] += 1
+                return None
+            digest, expires_at = hit
+            entry = self._entries.get(digest)
+            if entry is None or (expires_at is not None and now >= expires_at):
+                self._index.pop(key, None)
+                if entry is not None:
+                    entry["keys"].discard(key)
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._stats["hits"] += 1
+            return entry["b64"], entry["mime"]
+
+    def digest(self, key: str) -> Optional[str]:
+        """Content digest behind a lookup key, without touching LRU order or hit counters."""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._index.get(key)
+            if hit is None:
+                return None
+            digest, expires_at = hit
+            if digest not in self._entries or (expires_at is not None and now >= expires_at):
+                return None
+            return digest
+
+    def put(self, key: str, data: bytes, mime: str, b64: str) -> str:
+        """Stores an encoded payload under its content digest and returns the digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        size = len(b64)
+        expires_at = time.monotonic() + self._url_ttl if key.startswith("url:") else None
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                if size > self._max_bytes:
+                    return digest
+                entry = {"b64": b64, "mime": mime, "size": size, "keys": set()}
+                self._entries[digest] = entry
+                self._bytes += size
+                self._stats["stores"] += 1
+            else:
+                self._stats["dedup_stores"] += 1
+            entry["keys"].add(key)
+            self._index[key] = (digest, expires_at)
+            self._entries.move_to_end(digest)
+            self._evict_locked()
+        return digest
+
+    def _evict_locked(self) -> None:
+        while self._bytes > self._max_bytes and self._entries:
+            digest, entry = self._entries.popitem(last=False)
+            self._bytes -= entry["size"]
+            for key in entry["keys"]:
+                current = self._index.get(key)
+                if current and current[0] == digest:
+                    self._index.pop(key, None)
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._bytes = 0
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "keys": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+ref_image_cache = RefImageCache()
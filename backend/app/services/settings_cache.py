@@ -0,0 +1,79 @@
+import copy
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("settings_cache")
+
+SYSTEM_SCOPE = "system"
+
+
+class SettingsResolutionCache:
+    """In-process cache of resolved API settings (per user + category, and system candidate lists).
+
+    Write paths in ``app/api/settings.py`` call ``invalidate_user`` / ``invalidate_system``
+    after committing; ``SETTINGS_CACHE_TTL_SECONDS`` bounds staleness for writes made by
+    other worker processes. Values are deep-copied on the way out because callers mutate
+    the returned configs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, scope)
+        self._entries: Dict[Hashable, Tuple[Any, float, Any]] = {}
+        # Bumped by every invalidation; loads that straddle one are not stored.
+        self._version = 0
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def user_scope(user_id: Any) -> Tuple[str, str]:
+        return ("user", str(user_id))
+
+    def get_or_load(self, key: Hashable, scope: Any, loader: Callable[[], Any]) -> Any:
+        ttl = float(settings.SETTINGS_CACHE_TTL_SECONDS)
+        if ttl <= 0:
+            return loader()
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and hit[1] > now:
+                self._stats["hits"] += 1
+                return copy.deepcopy(hit[0])
+            self._stats["misses"] += 1
+            version = self._version
+        value = loader()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (copy.deepcopy(value), time.monotonic() + ttl, scope)
+        return value
+
+    def invalidate_user(self, user_id: Any) -> None:
+        scope = self.user_scope(user_id)
+        with self._lock:
+            self._version += 1
+            self._stats["invalidations"] += 1
+            for key in [k for k, entry in self._entries.items() if entry[2] == scope]:
+                del self._entries[key]
+
+    def invalidate_system(self) -> None:
+        # User resolutions point at system rows, so a system write drops everything.
+        with self._lock:
+            self._version += 1
+            self._stats["invalidations"] += 1
+            self._entries.clear()
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "ttl_seconds": float(settings.SETTINGS_CACHE_TTL_SECONDS),
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+settings_resolution_cache = SettingsResolutionCache()
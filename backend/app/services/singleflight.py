@@ -0,0 +1,96 @@
+import asyncio
+import copy
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("singleflight")
+
+
+class _LeaderCancelled(Exception):
+    """The leading call was cancelled; waiting followers run the call themselves."""
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: the first caller runs, later ones wait for its result.
+
+    Keys are per event loop, since batch jobs run their own loops in worker threads.
+    Followers get a deep copy of the leader's result (or its exception). If the leader
+    is cancelled (client went away), one follower takes over instead of failing, and a
+    cancelled follower never cancels the shared call.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Future] = {}
+        self._stats = {"leaders": 0, "followers": 0, "takeovers": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.SINGLEFLIGHT_ENABLED)
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Runs ``fn`` unless an identical call is in flight. Returns ``(result, shared)``."""
+        if not self.enabled or key is None:
+            return await fn(), False
+        loop = asyncio.get_running_loop()
+        slot = (loop, key)
+        while True:
+            with self._lock:
+                future = self._calls.get(slot)
+                leader = future is None
+                if leader:
+                    future = loop.create_future()
+                    self._calls[slot] = future
+            if leader:
+                break
+            self._count("followers")
+            try:
+                return copy.deepcopy(await asyncio.shield(future)), True
+            except _LeaderCancelled:
+                self._count("takeovers")
+                continue
+
+        self._count("leaders")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._settle(slot, future, exception=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._settle(slot, future, exception=e)
+            raise
+        self._settle(slot, future, result=copy.deepcopy(result))
+        return result, False
+
+    def _settle(self, slot, future: asyncio.Future, result: Any = None, exception: BaseException = None) -> None:
+        with self._lock:
+            if self._calls.get(slot) is future:
+                del self._calls[slot]
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+            # Mark retrieved so a call without followers doesn't log "exception never retrieved".
+            future.exception()
+        else:
+            future.set_result(result)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._calls),
+                **self._stats,
+            }
+
+
+llm_singleflight = SingleFlight("llm")
+image_singleflight = SingleFlight("image")
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.all_models import UpstreamCallback
+from app.services.task_poller import CheckFn, BatchCheckFn, TERMINAL_STATUSES, task_poller
+
+logger = logging.getLogger("task_callbacks")
+
+_PURGE_INTERVAL_SECONDS = 600.0
+
+
+class TaskCallbackHub:
+    """Turns provider completion callbacks into early polls of the tasks ``task_poller`` waits on.
+
+    Each submit advertises its own ``callback_url(provider)``, signed over a fresh nonce, so
+    a URL seen by one provider task is useless for forging anything else. A callback is only
+    a wake-up: ``deliver`` records that the task reported a terminal status and makes local
+    waiters poll now; waiters on other workers see the record through ``inbox_check``. The
+    result itself (status, media URL) always comes from the provider's own task API, never
+    from the callback body. With callbacks on, upstream polls otherwise only run every
+    ``TASK_CALLBACK_SAFETY_POLL_SECONDS`` as a safety net.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._received: Dict[Tuple[str, str], float] = {}
+        self._stats = {
+            "received": 0,
+            "rejected": 0,
+            "ignored": 0,
+            "woke_local": 0,
+            "inbox_hits": 0,
+            "safety_polls": 0,
+            "inbox_waits": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(str(settings.TASK_CALLBACK_BASE_URL or "").strip())
+
+    @property
+    def safety_poll_seconds(self) -> float:
+        return max(5.0, float(settings.TASK_CALLBACK_SAFETY_POLL_SECONDS))
+
+    @property
+    def inbox_poll_seconds(self) -> float:
+        return max(1.0, min(self.safety_poll_seconds, float(settings.TASK_CALLBACK_INBOX_POLL_SECONDS)))
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    # -- URLs and authentication --
+
+    def token(self, provider: str, nonce: str) -> str:
+        return hmac.new(
+            settings.SECRET_KEY.encode("utf-8"),
+            f"task-callback:{provider}:{nonce}".encode("utf-8"),
+            hashlib.sha256,
+        ).hexdigest()[:32]
+
+    def verify(self, provider: str, nonce: str, token: str) -> bool:
+        if not nonce:
+            return False
+        return hmac.compare_digest(self.token(provider, nonce), str(token or ""))
+
+    def callback_url(self, provider: str) -> Optional[str]:
+        """A fresh public URL for one submit to call on completion, or None when callbacks are off."""
+        if not self.enabled:
+            return None
+        base = str(settings.TASK_CALLBACK_BASE_URL).rstrip("/")
+        nonce = secrets.token_urlsafe(12)
+        return f"{base}{settings.API_V1_STR}/callbacks/tasks/{provider}/{nonce}/{self.token(provider, nonce)}"
+
+    def wait_intervals(self, initial_delay: float) -> Dict[str, float]:
+        """``task_poller.wait`` kwargs for a task that will be called back: look at the inbox often,
+        ``inbox_check`` decides when that is worth an upstream poll."""
+        interval = self.inbox_poll_seconds
+        return {"initial_delay": initial_delay, "min_interval": interval, "max_interval": interval}
+
+    # -- Delivery --
+
+    def deliver(self, provider: str, task_id: Any, status: Optional[str]) -> bool:
+        """Records that a task claims a terminal status and makes its waiters poll now.
+
+        Nothing from the callback body besides the task id and status is kept: whoever is
+        waiting confirms with the provider. False for non-terminal updates.
+        """
+        if not task_id or status not in TERMINAL_STATUSES:
+            self._count("ignored")
+            return False
+        task_id = str(task_id)
+        self._count("received")
+        with self._lock:
+            self._received[(provider, task_id)] = time.time()
+        try:
+            self._store(provider, task_id, status)
+        except Exception as e:
+            # Local waiters can still be woken; remote ones fall back to polling.
+            logger.warning("could not store task callback | provider=%s task_id=%s error=%s", provider, task_id, str(e)[:200])
+        woke = task_poller.notify(provider, task_id)
+        if woke:
+            self._count("woke_local", woke)
+        logger.info("task callback | provider=%s task_id=%s status=%s woke_local=%s", provider, task_id, status, woke)
+        self.purge_expired_if_due()
+        return True
+
+    def reject(self) -> None:
+        self._count("rejected")
+
+    def _store(self, provider: str, task_id: str, status: str) -> None:
+        now = time.time()
+        outcome = {"status": status}
+        with SessionLocal() as session:
+            session.add(UpstreamCallback(provider=provider, task_id=task_id, status=status, outcome=outcome, received_at=now))
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                # Providers retry deliveries; keep the latest.
+                session.rollback()
+            session.query(UpstreamCallback).filter(
+                UpstreamCallback.provider == provider,
+                UpstreamCallback.task_id == task_id,
+            ).update({"status": status, "outcome": outcome, "received_at": now}, synchronize_session=False)
+            session.commit()
+
+    def lookup(self, provider: str, task_ids: List[str]) -> Dict[str, float]:
+        """``{task_id: received_at}`` of the latest callback for each task, from any worker."""
+        if not task_ids:
+            return {}
+        task_ids = [str(t) for t in task_ids]
+        with self._lock:
+            found = {tid: self._received[(provider, tid)] for tid in task_ids if (provider, tid) in self._received}
+        try:
+            with SessionLocal() as session:
+                rows = session.query(UpstreamCallback.task_id, UpstreamCallback.received_at).filter(
+                    UpstreamCallback.provider == provider,
+                    UpstreamCallback.task_id.in_(task_ids),
+                ).all()
+        except Exception as e:
+            logger.warning("task callback lookup failed | provider=%s error=%s", provider, str(e)[:200])
+            rows = []
+        for task_id, received_at in rows:
+            found[task_id] = max(found.get(task_id, 0.0), float(received_at or 0.0))
+        return found
+
+    # -- Poll wrappers --
+
+    def _due_for_upstream(self, tid: str, found: Dict[str, float], polled_at: Dict[str, float], now: float) -> bool:
+        last = polled_at.get(tid)
+        if last is None or now - last >= self.safety_poll_seconds:
+            self._count("safety_polls")
+            return True
+        if found.get(tid, 0.0) >= last:
+            # Called back since our last look: confirm with the provider.
+            self._count("inbox_hits")
+            return True
+        self._count("inbox_waits")
+        return False
+
+    def inbox_check(self, provider: str, check: CheckFn) -> CheckFn:
+        """Wraps a poll check so it only reaches the provider when a callback (stored by any
+        worker) says the task finished, or every ``safety_poll_seconds`` regardless."""
+        polled_at: Dict[str, float] = {}
+
+        async def _check(tid):
+            found = await asyncio.to_thread(self.lookup, provider, [tid])
+            now = time.time()
+            if not self._due_for_upstream(tid, found, polled_at, now):
+                return {"status": "pending"}
+            polled_at[tid] = now
+            return await check(tid)
+
+        return _check
+
+    def inbox_batch_check(self, provider: str, batch_check: BatchCheckFn) -> BatchCheckFn:
+        polled_at: Dict[str, float] = {}
+
+        async def _batch_check(task_ids):
+            found = await asyncio.to_thread(self.lookup, provider, list(task_ids))
+            now = time.time()
+            due = [tid for tid in task_ids if self._due_for_upstream(tid, found, polled_at, now)]
+            outcomes = {tid: {"status": "pending"} for tid in task_ids if tid not in due}
+            if due:
+                polled = await batch_check(due) or {}
+                # Tasks the batch left out fall back to single checks, which must still poll.
+                for tid in polled:
+                    polled_at[tid] = now
+                outcomes.update(polled)
+            return outcomes
+
+        return _batch_check
+
+    # -- Housekeeping --
+
+    def purge_expired(self) -> int:
+        cutoff = time.time() - max(600, int(settings.TASK_CALLBACK_RETENTION_SECONDS))
+        with self._lock:
+            self._received = {key: at for key, at in self._received.items() if at >= cutoff}
+        with SessionLocal() as session:
+            removed = session.query(UpstreamCallback).filter(UpstreamCallback.received_at < cutoff).delete(synchronize_session=False)
+            session.commit()
+        return int(removed or 0)
+
+    def purge_expired_if_due(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < _PURGE_INTERVAL_SECONDS:
+                return
+            self._last_purge = now
+        try:
+            removed = self.purge_expired()
+            if removed:
+                logger.info("purged task callbacks | removed=%s", removed)
+        except Exception as e:
+            logger.warning("task callback purge failed: %s", str(e)[:200])
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            "enabled": self.enabled,
+            "safety_poll_seconds": self.safety_poll_seconds,
+            "inbox_poll_seconds": self.inbox_poll_seconds,
+            **counters,
+        }
+
+
+task_callbacks = TaskCallbackHub()
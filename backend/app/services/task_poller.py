@@ -0,0 +1,378 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("task_poller")
+
+# A check returns {"status": "pending" | "done" | "failed", ...}. Optional keys:
+# "progress" (0-1 or 0-100) and "eta_seconds" steer the adaptive backoff;
+# anything else is handed back to the waiter untouched.
+CheckFn = Callable[[str], Awaitable[Dict[str, Any]]]
+BatchCheckFn = Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]]
+
+TERMINAL_STATUSES = {"done", "failed"}
+
+
+class _PollEntry:
+    __slots__ = (
+        "provider", "task_id", "check", "batch_key", "batch_check", "future",
+        "started", "deadline", "interval", "min_interval", "max_interval",
+        "attempts", "last_error", "due", "checking", "poked",
+    )
+
+    def __init__(self, provider, task_id, check, batch_key, batch_check, future, started, deadline, interval, min_interval, max_interval):
+        self.provider = provider
+        self.task_id = task_id
+        self.check = check
+        self.batch_key = batch_key
+        self.batch_check = batch_check
+        self.future = future
+        self.started = started
+        self.deadline = deadline
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.attempts = 0
+        self.last_error = None
+        self.due = None
+        self.checking = False
+        self.poked = False
+
+
+class _LoopScheduler:
+    """Owns every pending upstream task registered on one event loop."""
+
+    def __init__(self, poller: "TaskPoller", loop: asyncio.AbstractEventLoop):
+        self._poller = poller
+        self._loop = loop
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._checks = asyncio.Semaphore(max(1, settings.POLLER_MAX_CONCURRENT_CHECKS))
+        self._inflight_tasks = set()
+        self.entries: Dict[Any, _PollEntry] = {}
+
+    def add(self, entry: _PollEntry) -> None:
+        self.entries[(entry.provider, entry.task_id, id(entry))] = entry
+        self._schedule(entry, entry.interval)
+
+    def _schedule(self, entry: _PollEntry, delay: float) -> None:
+        due = min(self._loop.time() + max(0.0, delay), entry.deadline)
+        entry.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), entry))
+        self._wake.set()
+        if self._runner is None or self._runner.done():
+            self._runner = self._loop.create_task(self._run())
+            self._runner.add_done_callback(self._on_runner_done)
+
+    def _on_runner_done(self, task: asyncio.Task) -> None:
+        # The runner ends once nothing is pending (or when the loop shuts down and cancels
+        # it). Unregister then: this scheduler references its loop, so as a value in the
+        # poller's WeakKeyDictionary it would otherwise keep both alive forever. The next
+        # ``wait`` on this loop starts a fresh scheduler.
+        if self._runner is task:
+            self._runner = None
+            self._poller._forget(self._loop, self)
+
+    def poke(self, provider: str, task_id: str) -> None:
+        """Checks a task now instead of at its next due time (provider callbacks). Runs on this loop.
+
+        The waiter is only ever resolved by its own check, so an out-of-band signal can make
+        us poll early but cannot decide the outcome.
+        """
+        for entry in [e for e in self.entries.values() if e.provider == provider and e.task_id == task_id]:
+            if entry.future.done():
+                continue
+            if entry.checking:
+                # A check is already running; look again as soon as it returns.
+                entry.poked = True
+            else:
+                # The old heap item goes stale: it no longer matches ``entry.due``.
+                self._schedule(entry, 0.0)
+
+    def _finish(self, entry: _PollEntry, outcome: Dict[str, Any]) -> None:
+        self.entries.pop((entry.provider, entry.task_id, id(entry)), None)
+        if not entry.future.done():
+            entry.future.set_result(outcome)
+        self._poller._count(outcome.get("status") or "failed")
+
+    async def _run(self) -> None:
+        while self._heap or self._inflight_tasks:
+            if not self._heap:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            now = self._loop.time()
+            due_at = self._heap[0][0]
+            if due_at > now:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=due_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due: List[_PollEntry] = []
+            while self._heap and self._heap[0][0] <= now:
+                due_at, _, entry = heapq.heappop(self._heap)
+                if due_at != entry.due:
+                    # Superseded by a reschedule (see ``poke``).
+                    continue
+                if entry.future.done():
+                    # Waiter was cancelled (e.g. hedged loser); drop silently.
+                    self.entries.pop((entry.provider, entry.task_id, id(entry)), None)
+                    continue
+                if now >= entry.deadline:
+                    self._finish(entry, {"status": "timeout", "last_error": entry.last_error, "attempts": entry.attempts})
+                    continue
+                entry.due = None
+                entry.checking = True
+                due.append(entry)
+
+            groups: Dict[Any, List[_PollEntry]] = {}
+            for entry in due:
+                if entry.batch_key is not None and entry.batch_check is not None:
+                    groups.setdefault(("batch", entry.provider, entry.batch_key), []).append(entry)
+                else:
+                    groups.setdefault(("single", id(entry)), []).append(entry)
+
+            for group in groups.values():
+                task = self._loop.create_task(self._check_group(group))
+                self._inflight_tasks.add(task)
+                task.add_done_callback(self._on_group_done)
+
+            # Yield so freshly spawned checks start before we evaluate the heap again.
+            await asyncio.sleep(0)
+
+    async def _check_group(self, group: List[_PollEntry]) -> None:
+        outcomes: Dict[str, Dict[str, Any]] = {}
+        async with self._checks:
+            if len(group) > 1:
+                try:
+                    outcomes = await group[0].batch_check([e.task_id for e in group]) or {}
+                    self._poller._count_check(group[0].provider, batched=len(group))
+                except Exception as e:
+                    logger.warning("batch poll failed, falling back to single checks | provider=%s size=%s error=%s", group[0].provider, len(group), str(e)[:200])
+                    outcomes = {}
+
+            pending_single = [e for e in group if e.task_id not in outcomes]
+            if pending_single:
+                results = await asyncio.gather(*[self._check_one(e) for e in pending_single], return_exceptions=True)
+                for entry, result in zip(pending_single, results):
+                    if isinstance(result, BaseException):
+                        entry.last_error = f"{type(result).__name__}: {str(result)[:200]}"
+                        continue
+                    outcomes[entry.task_id] = result
+
+        for entry in group:
+            entry.attempts += 1
+            entry.checking = False
+            if entry.future.done():
+                self.entries.pop((entry.provider, entry.task_id, id(entry)), None)
+                continue
+            outcome = outcomes.get(entry.task_id) or {"status": "pending"}
+            if outcome.get("error_hint"):
+                entry.last_error = outcome.get("error_hint")
+            if outcome.get("status") in TERMINAL_STATUSES:
+                outcome.setdefault("attempts", entry.attempts)
+                self._finish(entry, outcome)
+                continue
+            delay = self._next_delay(entry, outcome)
+            if entry.poked:
+                entry.poked = False
+                delay = 0.0
+            self._schedule(entry, delay)
+
+    def _on_group_done(self, task: asyncio.Task) -> None:
+        self._inflight_tasks.discard(task)
+        self._wake.set()
+
+    async def _check_one(self, entry: _PollEntry) -> Dict[str, Any]:
+        self._poller._count_check(entry.provider)
+        return await entry.check(entry.task_id)
+
+    def _next_delay(self, entry: _PollEntry, outcome: Dict[str, Any]) -> float:
+        elapsed = max(0.0, self._loop.time() - entry.started)
+        delay = None
+
+        eta = outcome.get("eta_seconds")
+        try:
+            eta = float(eta) if eta is not None else None
+        except Exception:
+            eta = None
+        if eta is not None and eta > 0:
+            # Wake at half the remaining estimate; converge as the ETA shrinks.
+            delay = eta / 2.0
+
+        if delay is None:
+            progress = outcome.get("progress")
+            try:
+                progress = float(progress) if progress is not None else None
+            except Exception:
+                progress = None
+            if progress is not None and progress > 1.0:
+                progress = progress / 100.0
+            if progress is not None and 0.0 < progress < 1.0 and elapsed > 0:
+                remaining = elapsed * (1.0 - progress) / progress
+                delay = remaining / 2.0
+
+        if delay is None:
+            delay = entry.interval * settings.POLLER_BACKOFF_FACTOR
+
+        delay = max(entry.min_interval, min(entry.max_interval, delay))
+        entry.interval = delay
+        return delay
+
+
+class TaskPoller:
+    """Multiplexes status polling for long-running upstream generation tasks.
+
+    Handlers submit upstream work themselves, then call ``wait`` with a check
+    function. One scheduler per event loop wakes due tasks, batches checks that
+    share a ``batch_key`` and resolves the waiter once a terminal status arrives.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopScheduler]" = weakref.WeakKeyDictionary()
+        self._stats: Dict[str, int] = {
+            "registered": 0,
+            "done": 0,
+            "failed": 0,
+            "timeout": 0,
+            "checks": 0,
+            "batched_checks": 0,
+            "batched_tasks": 0,
+            "notified": 0,
+        }
+        self._checks_by_provider: Dict[str, int] = {}
+
+    def _scheduler(self) -> _LoopScheduler:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            scheduler = self._schedulers.get(loop)
+            if scheduler is None:
+                scheduler = _LoopScheduler(self, loop)
+                self._schedulers[loop] = scheduler
+        return scheduler
+
+    def _forget(self, loop: asyncio.AbstractEventLoop, scheduler: _LoopScheduler) -> None:
+        with self._lock:
+            if self._schedulers.get(loop) is scheduler:
+                del self._schedulers[loop]
+
+    def _count(self, status: str) -> None:
+        with self._lock:
+            key = status if status in self._stats else "failed"
+            self._stats[key] += 1
+
+    def _count_check(self, provider: str, batched: int = 0) -> None:
+        with self._lock:
+            self._stats["checks"] += 1
+            if batched:
+                self._stats["batched_checks"] += 1
+                self._stats["batched_tasks"] += batched
+            self._checks_by_provider[provider] = self._checks_by_provider.get(provider, 0) + 1
+
+    async def wait(
+        self,
+        provider: str,
+        task_id: str,
+        check: CheckFn,
+        timeout_seconds: float = 600,
+        initial_delay: Optional[float] = None,
+        min_interval: Optional[float] = None,
+        max_interval: Optional[float] = None,
+        batch_key: Optional[Hashable] = None,
+        batch_check: Optional[BatchCheckFn] = None,
+    ) -> Dict[str, Any]:
+        """Block until the upstream task reaches a terminal status or times out.
+
+        Returns the terminal check outcome, or ``{"status": "timeout", "last_error": ...}``.
+        """
+        scheduler = self._scheduler()
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        min_iv = float(min_interval if min_interval is not None else settings.POLLER_MIN_INTERVAL_SECONDS)
+        max_iv = float(max_interval if max_interval is not None else settings.POLLER_MAX_INTERVAL_SECONDS)
+        first = float(initial_delay if initial_delay is not None else min_iv)
+        entry = _PollEntry(
+            provider=str(provider or "unknown"),
+            task_id=str(task_id),
+            check=check,
+            batch_key=batch_key,
+            batch_check=batch_check,
+            future=loop.create_future(),
+            started=now,
+            deadline=now + max(1.0, float(timeout_seconds)),
+            interval=max(0.0, first),
+            min_interval=max(0.1, min_iv),
+            max_interval=max(min_iv, max_iv),
+        )
+        with self._lock:
+            self._stats["registered"] += 1
+        scheduler.add(entry)
+        started = time.perf_counter()
+        try:
+            return await entry.future
+        finally:
+            if not entry.future.done():
+                entry.future.cancel()
+            logger.debug(
+                "poll finished | provider=%s task_id=%s attempts=%s elapsed_ms=%s",
+                entry.provider,
+                entry.task_id,
+                entry.attempts,
+                int((time.perf_counter() - started) * 1000),
+            )
+
+    def notify(self, provider: str, task_id: str) -> int:
+        """Polls a task right away because something out of band (a callback) says it changed.
+
+        Safe to call from any thread or loop. Returns the number of event loops that were
+        waiting on the task in this process (0 when it is polled elsewhere or not at all).
+        """
+        provider = str(provider or "unknown")
+        task_id = str(task_id)
+        with self._lock:
+            targets = [
+                scheduler
+                for scheduler in list(self._schedulers.values())
+                if any(e.provider == provider and e.task_id == task_id and not e.future.done() for e in list(scheduler.entries.values()))
+            ]
+            self._stats["notified"] += len(targets)
+        for scheduler in targets:
+            try:
+                scheduler._loop.call_soon_threadsafe(scheduler.poke, provider, task_id)
+            except RuntimeError:
+                # Loop closed between the scan and the hand-off; its waiter is gone anyway.
+                pass
+        return len(targets)
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending_by_provider: Dict[str, int] = {}
+            for scheduler in list(self._schedulers.values()):
+                for entry in list(scheduler.entries.values()):
+                    if entry.future.done():
+                        continue
+                    pending_by_provider[entry.provider] = pending_by_provider.get(entry.provider, 0) + 1
+            return {
+                **self._stats,
+                "pending": sum(pending_by_provider.values()),
+                "pending_by_provider": pending_by_provider,
+                "checks_by_provider": dict(self._checks_by_provider),
+                "event_loops": len(self._schedulers),
+            }
+
+
+task_poller = TaskPoller()
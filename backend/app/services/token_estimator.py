@@ -0,0 +1,260 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger("token_estimator")
+
+# Script classes by UTF-8 sequence length: ASCII, 2-byte (Latin ext., Cyrillic, Greek,
+# Arabic...), 3-byte (CJK, kana, Hangul...), 4-byte (emoji, rare ideographs).
+SCRIPT_CLASSES = ("ascii", "two_byte", "three_byte", "four_byte")
+
+# Tokens per character that reproduce the historical "~4 bytes per token" heuristic.
+DEFAULT_TOKENS_PER_CHAR = {"ascii": 0.25, "two_byte": 0.5, "three_byte": 0.75, "four_byte": 1.0}
+DEFAULT_MESSAGE_OVERHEAD = 4.0
+
+# UTF-8 lead-byte ranges per class. Continuation bytes (0x80-0xBF) are skipped, so each
+# character is counted once.
+_LEAD_BYTE_BOUNDS = ((0x00, 0x80), (0xC0, 0xE0), (0xE0, 0xF0), (0xF0, 0x100))
+
+
+def script_counts(text: Any) -> np.ndarray:
+    """Characters per script class (whitespace runs collapsed), as a length-4 int array."""
+    if not text:
+        return np.zeros(len(SCRIPT_CLASSES), dtype=np.int64)
+    # str.split() uses the same whitespace set as re's \s, at a fraction of the cost.
+    normalized = " ".join(str(text).split())
+    if not normalized:
+        return np.zeros(len(SCRIPT_CLASSES), dtype=np.int64)
+    histogram = np.bincount(np.frombuffer(normalized.encode("utf-8"), dtype=np.uint8), minlength=256)
+    return np.array([histogram[lo:hi].sum() for lo, hi in _LEAD_BYTE_BOUNDS], dtype=np.int64)
+
+
+def message_texts(messages: List[Dict[str, Any]]) -> Iterable[Tuple[int, Any]]:
+    """Yields ``(message_index, text)`` for every textual part the estimator counts."""
+    for index, msg in enumerate(messages or []):
+        content = (msg or {}).get("content")
+        if isinstance(content, str):
+            yield index, content
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") in ("text", "input_text") and "text" in part:
+                    yield index, part.get("text")
+
+
+def messages_features(messages: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Feature row used both for scoring and for calibration samples in ``llm_calls.log``."""
+    totals = np.zeros(len(SCRIPT_CLASSES), dtype=np.int64)
+    for _, text in message_texts(messages):
+        totals += script_counts(text)
+    features = {name: int(totals[i]) for i, name in enumerate(SCRIPT_CLASSES)}
+    features["messages"] = len(messages or [])
+    return features
+
+
+class TokenEstimator:
+    """Prompt/output token estimates for credit reservations, calibrated per provider/model.
+
+    The calibration file (``TOKEN_CALIBRATION_PATH``, written offline by
+    ``calibrate_token_estimator.py``) holds per-profile tokens-per-character for each
+    script class, a per-message overhead and output ratios by task. Profiles resolve
+    ``provider:model`` -> ``provider`` -> ``*``; anything missing falls back to the
+    historical bytes/4 heuristic and the caller's output ratio. The file is re-read
+    when its mtime changes (checked at most every ``_RELOAD_CHECK_SECONDS``).
+    """
+
+    _RELOAD_CHECK_SECONDS = 60.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._loaded_mtime: Optional[float] = None
+        self._last_check = 0.0
+        self._stats = {"estimates": 0, "calibrated": 0, "reloads": 0}
+
+    @property
+    def path(self) -> str:
+        return str(settings.TOKEN_CALIBRATION_PATH or "")
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_check < self._RELOAD_CHECK_SECONDS:
+                return
+            self._last_check = now
+        self.reload()
+
+    def reload(self) -> bool:
+        path = self.path
+        try:
+            mtime = os.path.getmtime(path) if path else None
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime == self._loaded_mtime:
+                return False
+        profiles: Dict[str, Dict[str, Any]] = {}
+        if mtime is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    profiles = dict((json.load(f) or {}).get("profiles") or {})
+            except Exception as e:
+                logger.warning("could not load token calibration %s: %s", path, str(e)[:200])
+                return False
+        with self._lock:
+            self._profiles = profiles
+            self._loaded_mtime = mtime
+            self._stats["reloads"] += 1
+        logger.info("token calibration loaded | path=%s profiles=%s", path, len(profiles))
+        return True
+
+    @staticmethod
+    def profile_key(provider: Any = None, model: Any = None) -> str:
+        provider = str(provider or "").strip().lower()
+        model = str(model or "").strip()
+        if provider and model:
+            return f"{provider}:{model}"
+        return provider or "*"
+
+    def _profile(self, provider: Any, model: Any) -> Tuple[Optional[str], Dict[str, Any]]:
+        self._maybe_reload()
+        candidates = [self.profile_key(provider, model), self.profile_key(provider), "*"]
+        with self._lock:
+            for key in candidates:
+                if key in self._profiles:
+                    return key, self._profiles[key]
+        return None, {}
+
+    def _coefficients(self, profile: Dict[str, Any]) -> Tuple[np.ndarray, float]:
+        per_char = {**DEFAULT_TOKENS_PER_CHAR, **(profile.get("tokens_per_char") or {})}
+        coef = np.array([float(per_char[name]) for name in SCRIPT_CLASSES], dtype=np.float64)
+        overhead = float(profile.get("message_overhead", DEFAULT_MESSAGE_OVERHEAD))
+        return coef, overhead
+
+    def estimate_text_tokens(self, text: Any, provider: Any = None, model: Any = None) -> int:
+        counts = script_counts(text)
+        if not counts.any():
+            return 0
+        _, profile = self._profile(provider, model)
+        coef, _ = self._coefficients(profile)
+        return max(1, int(math.ceil(float(counts @ coef))))
+
+    def output_ratio(self, provider: Any, model: Any, task_type: Optional[str], item: Optional[str], default: float) -> float:
+        _, profile = self._profile(provider, model)
+        ratios = profile.get("output_ratio") or {}
+        for key in (f"{task_type}:{item}" if task_type and item else None, task_type):
+            if key and key in ratios:
+                return float(ratios[key])
+        return float(default)
+
+    def estimate_messages(
+        self,
+        messages: List[Dict[str, Any]],
+        output_ratio: float = 1.5,
+        provider: Any = None,
+        model: Any = None,
+        task_type: Optional[str] = None,
+        item: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        profile_key, profile = self._profile(provider, model)
+        coef, overhead = self._coefficients(profile)
+
+        # One histogram row per text part, scored with a single matrix-vector product;
+        # each part is rounded up on its own, as the per-text heuristic always did.
+        rows = [script_counts(text) for _, text in message_texts(messages)]
+        input_tokens = float(len(messages or [])) * overhead
+        if rows:
+            counts = np.vstack(rows)
+            part_tokens = np.maximum(np.ceil(counts @ coef), 1.0)
+            input_tokens += float(part_tokens[counts.any(axis=1)].sum())
+        input_tokens = int(math.ceil(input_tokens))
+
+        ratio = self.output_ratio(provider, model, task_type, item, output_ratio)
+        output_tokens = int(math.ceil(float(input_tokens) * ratio)) if input_tokens > 0 else 0
+        with self._lock:
+            self._stats["estimates"] += 1
+            if profile_key:
+                self._stats["calibrated"] += 1
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "output_ratio": ratio,
+            "calibration_profile": profile_key,
+            "estimation_method": "calibrated" if profile_key else "prompt_tokens_ratio",
+        }
+
+    def snapshot_stats(self) -> Dict[str, Any]:
+        self._maybe_reload()
+        with self._lock:
+            return {
+                "path": self.path,
+                "loaded": self._loaded_mtime is not None,
+                "profiles": sorted(self._profiles),
+                **self._stats,
+            }
+
+
+def fit_profile(samples: List[Dict[str, Any]], min_samples: int = 20) -> Optional[Dict[str, Any]]:
+    """Least-squares fit of prompt tokens on per-class character counts plus message count.
+
+    ``samples`` are ``messages_features`` rows with ``prompt_tokens``. Classes that never
+    occur keep their defaults; a negative coefficient is pinned to its default and the
+    rest refit, so the result stays a usable (non-negative) estimator.
+    """
+    samples = [s for s in samples if int(s.get("prompt_tokens") or 0) > 0]
+    if len(samples) < min_samples:
+        return None
+    names = list(SCRIPT_CLASSES) + ["messages"]
+    defaults = np.array([DEFAULT_TOKENS_PER_CHAR[n] for n in SCRIPT_CLASSES] + [DEFAULT_MESSAGE_OVERHEAD])
+    X = np.array([[float(s.get(n) or 0) for n in names] for s in samples], dtype=np.float64)
+    y = np.array([float(s["prompt_tokens"]) for s in samples], dtype=np.float64)
+
+    free = X.any(axis=0)
+    coef = defaults.copy()
+    while free.any():
+        pinned = ~free
+        target = y - X[:, pinned] @ coef[pinned]
+        solution, *_ = np.linalg.lstsq(X[:, free], target, rcond=None)
+        coef[free] = solution
+        negative = free & (coef < 0)
+        if not negative.any():
+            break
+        coef[negative] = defaults[negative]
+        free &= ~negative
+
+    predicted = X @ coef
+    rel_err = np.abs(predicted - y) / np.maximum(y, 1.0)
+    return {
+        "tokens_per_char": {n: round(float(coef[i]), 5) for i, n in enumerate(SCRIPT_CLASSES)},
+        "message_overhead": round(float(coef[-1]), 3),
+        "samples": len(samples),
+        "median_abs_rel_error": round(float(np.median(rel_err)), 4),
+    }
+
+
+def fit_output_ratios(rows: List[Tuple[str, float, float]], quantile: float = 0.75, min_samples: int = 10) -> Dict[str, float]:
+    """Output/input ratio per task key from ``(task_key, input_tokens, output_tokens)`` rows.
+
+    Uses an upper quantile rather than the mean: the reservation should usually cover
+    the call, and settlement refunds the difference.
+    """
+    by_task: Dict[str, List[float]] = {}
+    for task_key, input_tokens, output_tokens in rows:
+        if input_tokens > 0 and output_tokens >= 0:
+            by_task.setdefault(task_key, []).append(float(output_tokens) / float(input_tokens))
+    return {
+        task_key: round(float(np.quantile(np.array(values), quantile)), 4)
+        for task_key, values in by_task.items()
+        if len(values) >= min_samples
+    }
+
+
+token_estimator = TokenEstimator()
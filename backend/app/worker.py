@@ -0,0 +1,48 @@
+"""Standalone worker for the background job queue (``JOB_WORKER_MODE=external``).
+
+Runs the same handlers the API registers, against the same ``DATABASE_URL``, so batch
+throughput scales with the number of worker processes instead of API latency. Several
+workers (on one host or many) can share the queue; jobs left running by a worker that
+died are picked up by the others once their lease lapses.
+
+Run from ``backend/``::
+
+    python -m app.worker --workers 8
+"""
+import argparse
+import logging
+import signal
+import threading
+
+from app.core.config import settings
+from app.db.session import engine
+from app.models.all_models import Base
+from app.api import endpoints  # noqa: F401  (registers the job handlers)
+from app.services.job_queue import job_queue
+
+logger = logging.getLogger("job_worker")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=settings.JOB_WORKERS, help="worker threads")
+    parser.add_argument("--grace", type=float, default=settings.JOB_LEASE_SECONDS, help="seconds to let running jobs finish on SIGTERM")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    Base.metadata.create_all(bind=engine)
+
+    stopping = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopping.set())
+
+    job_queue.start(workers=args.workers)
+    logger.info("worker running | owner=%s workers=%s", job_queue.owner, args.workers)
+    stopping.wait()
+    logger.info("worker stopping | grace=%ss", args.grace)
+    job_queue.stop(grace_seconds=args.grace)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
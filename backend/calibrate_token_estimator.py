@@ -0,0 +1,145 @@
+"""Refits the token estimator used for credit reservations from recorded usage.
+
+Prompt-side coefficients come from ``LLM_RESPONSE_SUMMARY`` lines in ``logs/llm_calls.log*``
+(``prompt_features`` vs. the provider's ``usage.prompt_tokens``); output ratios come from
+settled ``transaction_history`` rows. The result is written to ``TOKEN_CALIBRATION_PATH``,
+which running workers pick up within a minute.
+
+Usage (from backend/):
+    python calibrate_token_estimator.py                    # logs + DATABASE_URL
+    python calibrate_token_estimator.py --no-db --dry-run  # logs only, print the result
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.core.config import settings
+from app.services.token_estimator import TokenEstimator, fit_output_ratios, fit_profile
+
+_SUMMARY_TAG = "LLM_RESPONSE_SUMMARY "
+_SKIP_STATUSES = {"RESERVED", "CANCELLED", "CANCELED", "REFUND", "CHARGE", "FAILED"}
+
+
+def _profile_keys(provider: Any, model: Any) -> List[str]:
+    keys = [TokenEstimator.profile_key(provider, model), TokenEstimator.profile_key(provider), "*"]
+    return list(dict.fromkeys(keys))
+
+
+def read_log_samples(paths: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+    samples: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                idx = line.find(_SUMMARY_TAG)
+                if idx < 0:
+                    continue
+                try:
+                    entry = json.loads(line[idx + len(_SUMMARY_TAG):])
+                except ValueError:
+                    continue
+                features = entry.get("prompt_features")
+                usage = entry.get("usage") or {}
+                prompt_tokens = usage.get("prompt_tokens") or usage.get("input_tokens")
+                if not isinstance(features, dict) or not prompt_tokens:
+                    continue
+                sample = {**features, "prompt_tokens": int(prompt_tokens)}
+                model = entry.get("requested_model") or entry.get("model")
+                for key in _profile_keys(entry.get("provider"), model):
+                    samples[key].append(sample)
+    return samples
+
+
+def read_transaction_rows() -> Dict[str, List[Tuple[str, float, float]]]:
+    from app.db.session import SessionLocal
+    from app.models.all_models import TransactionHistory
+
+    rows: Dict[str, List[Tuple[str, float, float]]] = defaultdict(list)
+    with SessionLocal() as session:
+        query = session.query(
+            TransactionHistory.task_type,
+            TransactionHistory.provider,
+            TransactionHistory.model,
+            TransactionHistory.details,
+        )
+        for task_type, provider, model, details in query.yield_per(1000):
+            details = details if isinstance(details, dict) else {}
+            if "actual_input_tokens" in details:
+                input_tokens = details.get("actual_input_tokens")
+                output_tokens = details.get("actual_output_tokens")
+            elif (
+                "input_tokens" in details
+                and str(details.get("status") or "").upper() not in _SKIP_STATUSES
+                and details.get("billing_mode") != "RESERVE"
+            ):
+                input_tokens = details.get("input_tokens")
+                output_tokens = details.get("output_tokens")
+            else:
+                continue
+            try:
+                input_tokens, output_tokens = float(input_tokens or 0), float(output_tokens or 0)
+            except (TypeError, ValueError):
+                continue
+            item = details.get("item")
+            task_keys = [task_type] + ([f"{task_type}:{item}"] if item else [])
+            for key in _profile_keys(provider, model):
+                for task_key in task_keys:
+                    rows[key].append((task_key, input_tokens, output_tokens))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logs", default=os.path.join(str(settings.BASE_DIR), "logs", "llm_calls.log*"), help="glob of llm call logs")
+    parser.add_argument("--no-db", action="store_true", help="skip transaction history (no output ratios)")
+    parser.add_argument("--min-samples", type=int, default=20, help="prompt samples needed to fit a profile")
+    parser.add_argument("--min-task-samples", type=int, default=10, help="transactions needed for a task output ratio")
+    parser.add_argument("--output-quantile", type=float, default=0.75, help="quantile of output/input used as the reserved ratio")
+    parser.add_argument("--output", default=settings.TOKEN_CALIBRATION_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="print instead of writing")
+    args = parser.parse_args(argv)
+
+    log_paths = sorted(glob.glob(args.logs))
+    samples = read_log_samples(log_paths)
+    task_rows = {} if args.no_db else read_transaction_rows()
+
+    profiles: Dict[str, Dict[str, Any]] = {}
+    for key in sorted(set(samples) | set(task_rows)):
+        profile = fit_profile(samples.get(key, []), min_samples=args.min_samples) or {}
+        ratios = fit_output_ratios(task_rows.get(key, []), quantile=args.output_quantile, min_samples=args.min_task_samples)
+        if ratios:
+            profile["output_ratio"] = ratios
+        if profile:
+            profiles[key] = profile
+
+    result = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "sources": {
+            "logs": log_paths,
+            "prompt_samples": len(samples.get("*", [])),
+            "transactions": len([r for r in task_rows.get("*", []) if ":" not in r[0]]),
+        },
+        "profiles": profiles,
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.dry_run:
+        print(text)
+        return 0
+
+    tmp_path = f"{args.output}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, args.output)
+    print(f"wrote {len(profiles)} profiles to {args.output}")
+    for key, profile in profiles.items():
+        err = profile.get("median_abs_rel_error")
+        print(f"  {key}: samples={profile.get('samples', 0)} median_rel_err={err} tasks={sorted(profile.get('output_ratio', {}))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,621 @@
+"""End-to-end benchmark for the generation pipeline.
+
+Boots the API in-process against a scratch database, starts ``loadtest.fake_upstream``
+as a subprocess, seeds a project (episode, scenes, shots, entities with reference
+images) and drives the real endpoints over HTTP:
+
+    image_sync     POST /generate/image
+    image_submit   POST /generate/image/submit, polling /generate/image/jobs/{id}
+    batch_media    POST /episodes/{id}/shots/batch-media/start, polling .../status
+    scene_shots    POST /scenes/{id}/ai_generate_shots
+
+Each scenario reports throughput, p50/p95/p99 latency, thread count, DB pool checkouts
+and RSS sampled while it ran. The report is JSON so runs can be diffed; ``--baseline``
+adds the relative change of throughput and p95 against an earlier report.
+
+Run from ``backend/``::
+
+    python -m loadtest.benchmark --shots 300 --requests 200 --concurrency 16 --output bench.json
+
+The fake upstream advertises ``--fake-host`` (127.0.0.2 by default) because downloads
+from localhost/127.0.0.1 are skipped; use a LAN address on systems without 127/8 aliases.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("image_sync", "image_submit", "batch_media", "scene_shots")
+
+SHOT_TABLE_HEADERS = ["Shot ID", "Shot Name", "Start Frame", "End Frame", "Video Content", "Duration (s)", "Associated Entities"]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+def latency_summary(values_ms: List[float]) -> Dict[str, float]:
+    if not values_ms:
+        return {"count": 0}
+    return {
+        "count": len(values_ms),
+        "mean": round(sum(values_ms) / len(values_ms), 1),
+        "p50": round(percentile(values_ms, 0.50), 1),
+        "p95": round(percentile(values_ms, 0.95), 1),
+        "p99": round(percentile(values_ms, 0.99), 1),
+        "max": round(max(values_ms), 1),
+    }
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return int(peak) if sys.platform == "darwin" else int(peak) * 1024
+
+
+class ResourceSampler(threading.Thread):
+    """Samples thread count, DB pool checkouts and RSS of this process in the background."""
+
+    def __init__(self, engine, interval: float = 0.2):
+        super().__init__(name="bench-sampler", daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._samples: List[Dict[str, float]] = []
+
+    def _sample(self) -> Dict[str, float]:
+        pool = self.engine.pool
+        checked_out = pool.checkedout() if hasattr(pool, "checkedout") else 0
+        return {"threads": threading.active_count(), "db_checked_out": checked_out, "rss": _rss_bytes() or 0}
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            sample = self._sample()
+            with self._lock:
+                self._samples.append(sample)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def window_start(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def window(self, start: int) -> Dict[str, Any]:
+        with self._lock:
+            samples = self._samples[start:] or [self._sample()]
+        pool = self.engine.pool
+        return {
+            "threads_peak": max(s["threads"] for s in samples),
+            "threads_mean": round(sum(s["threads"] for s in samples) / len(samples), 1),
+            "db_pool_checked_out_peak": max(s["db_checked_out"] for s in samples),
+            "db_pool_size": pool.size() if hasattr(pool, "size") else None,
+            "rss_peak_mb": round(max(s["rss"] for s in samples) / (1024 * 1024), 1),
+            "samples": len(samples),
+        }
+
+
+class ScenarioRecorder:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies_ms: List[float] = []
+        self.status_counts: Dict[str, int] = {}
+        self.errors: List[str] = []
+        self.extra: Dict[str, Any] = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, latency_ms: float, status: str, error: Optional[str] = None) -> None:
+        self.latencies_ms.append(latency_ms)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if error and len(self.errors) < 20:
+            self.errors.append(error[:300])
+
+    def report(self, units: Optional[int] = None) -> Dict[str, Any]:
+        duration = (self.finished or time.perf_counter()) - self.started
+        ok = self.status_counts.get("ok", 0)
+        done = units if units is not None else ok
+        return {
+            "requests": sum(self.status_counts.values()),
+            "ok": ok,
+            "status_counts": dict(sorted(self.status_counts.items())),
+            "duration_s": round(duration, 3),
+            "throughput_per_s": round(done / duration, 3) if duration > 0 else 0.0,
+            "latency_ms": latency_summary(self.latencies_ms),
+            "errors": self.errors,
+            **self.extra,
+        }
+
+
+def _shot_table_reply(rows: int) -> str:
+    lines = ["| " + " | ".join(SHOT_TABLE_HEADERS) + " |", "|" + "---|" * len(SHOT_TABLE_HEADERS)]
+    for i in range(1, rows + 1):
+        lines.append(
+            f"| {i} | Shot {i} | [Character 1] stands at the window | [Character 1] turns around "
+            f"| Slow push-in as the light shifts | 5 | Character 1 |"
+        )
+    return "\n".join(lines)
+
+
+def build_fake_profile(args) -> Dict[str, Any]:
+    profile: Dict[str, Any] = {}
+    if args.fake_profile:
+        with open(args.fake_profile, "r", encoding="utf-8") as fh:
+            profile = json.load(fh)
+    chat = profile.setdefault("chat", {})
+    # An empty match applies to every prompt; the scene shot parser needs a Markdown table.
+    chat.setdefault("replies", [{"match": "", "content": _shot_table_reply(args.shots_per_reply)}])
+    return profile
+
+
+def start_fake_upstream(args, workdir: Path) -> subprocess.Popen:
+    profile_path = workdir / "fake_profile.json"
+    profile_path.write_text(json.dumps(build_fake_profile(args), ensure_ascii=False), encoding="utf-8")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(BACKEND_DIR), env.get("PYTHONPATH")]))
+    cmd = [
+        sys.executable, "-m", "loadtest.fake_upstream",
+        "--host", args.fake_host,
+        "--port", str(args.fake_port),
+        "--profile", str(profile_path),
+    ]
+    if args.seed is not None:
+        cmd += ["--seed", str(args.seed)]
+    return subprocess.Popen(cmd, cwd=str(BACKEND_DIR), env=env)
+
+
+def wait_for_http(url: str, timeout: float = 30.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def seed_database(args, public_url: str) -> Dict[str, Any]:
+    """Creates the benchmark user, API selections and project. Returns ids and tokens."""
+    from datetime import timedelta
+
+    from app.api.endpoints import create_access_token
+    from app.db.session import SessionLocal
+    from app.models.all_models import APISetting, Entity, Episode, Project, Scene, Shot, SystemAPISetting, User
+    from loadtest.fake_upstream import seed_settings
+
+    rng = random.Random(args.seed)
+    with SessionLocal() as session:
+        user = User(
+            username="bench",
+            email="bench@example.com",
+            hashed_password="!",
+            is_active=True,
+            account_status=1,
+            email_verified=True,
+            is_authorized=True,
+            credits=10 ** 9,
+        )
+        session.add(user)
+        session.flush()
+
+        selections = [
+            ("Image", "grsai", "bench-image"),
+            ("Video", "doubao", "bench-video"),
+            ("LLM", "openai", "bench-llm"),
+        ]
+        for category, provider, model in selections:
+            session.add(SystemAPISetting(name=f"Bench {category}", category=category, provider=provider, model=model, api_key="fake-key", config={}, is_active=True))
+            session.add(APISetting(user_id=user.id, name=f"Bench {category}", category=category, provider=provider, model=model, api_key="", config={}, is_active=True))
+
+        project = Project(title="Benchmark Project", owner_id=user.id, global_info={"overall_genre": "drama", "color_tone": "warm"})
+        session.add(project)
+        session.flush()
+        episode = Episode(
+            project_id=project.id,
+            title="Episode 1",
+            episode_info={"e_global_info": {"tech_params": {"visual_standard": {"aspect_ratio": "16:9", "h_resolution": 1280, "v_resolution": 720}}}},
+            script_content="Benchmark script.",
+        )
+        session.add(episode)
+        session.flush()
+
+        entity_types = ["character", "environment", "prop"]
+        entities = []
+        for i in range(args.entities):
+            kind = entity_types[i % len(entity_types)]
+            entities.append(Entity(
+                project_id=project.id,
+                name=f"{kind.title()} {i + 1}",
+                type=kind,
+                description=f"Benchmark {kind} {i + 1}",
+                image_url=f"{public_url}/__fake/media/entity-{i + 1}.png",
+            ))
+        session.add_all(entities)
+
+        scenes = []
+        for i in range(args.scenes):
+            scenes.append(Scene(
+                episode_id=episode.id,
+                scene_no=str(i + 1),
+                scene_name=f"Scene {i + 1}",
+                original_script_text=f"Scene {i + 1}: the characters meet again. " * 8,
+                environment_name=entities[1].name if len(entities) > 1 else "",
+                linked_characters=", ".join(e.name for e in entities if e.type == "character"),
+            ))
+        session.add_all(scenes)
+        session.flush()
+
+        shots = []
+        for i in range(args.shots):
+            scene = scenes[i % len(scenes)]
+            refs = rng.sample(entities, k=min(len(entities), 2)) if entities else []
+            names = ", ".join(e.name for e in refs)
+            shots.append(Shot(
+                scene_id=scene.id,
+                project_id=project.id,
+                episode_id=episode.id,
+                shot_id=f"{scene.scene_no}-{i // len(scenes) + 1}",
+                shot_name=f"Shot {i + 1}",
+                start_frame=f"[{refs[0].name if refs else 'Someone'}] looks out of the window, morning light",
+                end_frame=f"[{refs[0].name if refs else 'Someone'}] turns towards the door",
+                video_content="Slow dolly-in, subject turns around",
+                duration="5",
+                associated_entities=names,
+            ))
+        session.add_all(shots)
+        session.commit()
+
+        entity_urls = [e.image_url for e in entities]
+        ids = {
+            "user_id": user.id,
+            "project_id": project.id,
+            "episode_id": episode.id,
+            "scene_ids": [s.id for s in scenes],
+            "shot_ids": [s.id for s in shots],
+            "entity_image_urls": entity_urls,
+        }
+
+    # Every system row (including the seeded defaults smart routing may fall back to) points at the fake.
+    ids["settings_redirected"] = seed_settings(public_url)
+    expires = timedelta(days=1)
+    ids["token"] = create_access_token({"sub": "bench"}, expires)
+    ids["admin_token"] = create_access_token({"sub": "ylsystem"}, expires)
+    return ids
+
+
+def start_api_server(host: str, port: int):
+    import uvicorn
+
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, name="bench-api", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+async def _drive(total: int, concurrency: int, one: Callable[[int], Awaitable[None]]) -> None:
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _guarded(i: int) -> None:
+        async with sem:
+            await one(i)
+
+    await asyncio.gather(*[_guarded(i) for i in range(total)])
+
+
+def _image_request(ctx: Dict[str, Any], rng: random.Random, i: int) -> Dict[str, Any]:
+    urls = ctx["entity_image_urls"]
+    refs = rng.sample(urls, k=min(len(urls), rng.randint(1, 3))) if urls else None
+    shot_id = ctx["shot_ids"][i % len(ctx["shot_ids"])]
+    return {
+        "prompt": f"Benchmark frame {i}: a quiet street at dawn, cinematic lighting",
+        "ref_image_url": refs,
+        "project_id": ctx["project_id"],
+        "shot_id": shot_id,
+        "asset_type": "start_frame",
+    }
+
+
+def _status_of(resp) -> str:
+    return "ok" if resp.status_code < 400 else f"http_{resp.status_code}"
+
+
+async def run_image_sync(client, ctx, args, rec: ScenarioRecorder) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+
+    async def _one(i: int) -> None:
+        started = time.perf_counter()
+        try:
+            resp = await client.post("/generate/image", json=_image_request(ctx, rng, i))
+            rec.record((time.perf_counter() - started) * 1000, _status_of(resp), None if resp.status_code < 400 else resp.text)
+        except Exception as e:
+            rec.record((time.perf_counter() - started) * 1000, type(e).__name__, str(e))
+
+    await _drive(args.requests, args.concurrency, _one)
+    rec.finished = time.perf_counter()
+    return rec.report()
+
+
+async def run_image_submit(client, ctx, args, rec: ScenarioRecorder) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    submit_ms: List[float] = []
+
+    async def _one(i: int) -> None:
+        started = time.perf_counter()
+        try:
+            resp = await client.post("/generate/image/submit", json=_image_request(ctx, rng, i))
+            submit_ms.append((time.perf_counter() - started) * 1000)
+            if resp.status_code >= 400:
+                rec.record((time.perf_counter() - started) * 1000, _status_of(resp), resp.text)
+                return
+            job_id = resp.json()["job_id"]
+            deadline = time.monotonic() + args.timeout
+            while True:
+                await asyncio.sleep(args.poll_interval)
+                poll = await client.get(f"/generate/image/jobs/{job_id}")
+                job = poll.json() if poll.status_code == 200 else {}
+                status = job.get("status")
+                if status in {"succeeded", "failed"}:
+                    rec.record((time.perf_counter() - started) * 1000, "ok" if status == "succeeded" else "job_failed", job.get("error"))
+                    return
+                if time.monotonic() > deadline:
+                    rec.record((time.perf_counter() - started) * 1000, "timeout", f"job {job_id} still {status}")
+                    return
+        except Exception as e:
+            rec.record((time.perf_counter() - started) * 1000, type(e).__name__, str(e))
+
+    await _drive(args.requests, args.concurrency, _one)
+    rec.finished = time.perf_counter()
+    rec.extra["submit_latency_ms"] = latency_summary(submit_ms)
+    return rec.report()
+
+
+async def run_batch_media(client, ctx, args, rec: ScenarioRecorder) -> Dict[str, Any]:
+    episode_id = ctx["episode_id"]
+    started = time.perf_counter()
+    resp = await client.post(
+        f"/episodes/{episode_id}/shots/batch-media/start",
+        json={"mode": args.batch_mode, "overwrite_existing": True},
+    )
+    if resp.status_code >= 400:
+        rec.record((time.perf_counter() - started) * 1000, _status_of(resp), resp.text)
+        rec.finished = time.perf_counter()
+        return rec.report()
+
+    # The status endpoint only exposes counters, so per-shot latency is the gap between completions.
+    last_completed, last_at = 0, started
+    status: Dict[str, Any] = {}
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(args.poll_interval)
+        poll = await client.get(f"/episodes/{episode_id}/shots/batch-media/status")
+        if poll.status_code != 200:
+            continue
+        status = poll.json()
+        completed = int(status.get("completed") or 0)
+        if completed > last_completed:
+            now = time.perf_counter()
+            gap_ms = (now - last_at) * 1000 / (completed - last_completed)
+            for _ in range(completed - last_completed):
+                rec.latencies_ms.append(gap_ms)
+            last_completed, last_at = completed, now
+        if not status.get("running"):
+            break
+    rec.finished = time.perf_counter()
+    rec.status_counts = {"ok": int(status.get("success") or 0), "failed": int(status.get("failed") or 0)}
+    if status.get("running"):
+        rec.status_counts["timeout"] = int(status.get("total") or 0) - last_completed
+    rec.errors = [str(e)[:300] for e in (status.get("errors") or [])[:20]]
+    rec.extra["mode"] = args.batch_mode
+    rec.extra["shots_total"] = int(status.get("total") or len(ctx["shot_ids"]))
+    return rec.report(units=last_completed)
+
+
+async def run_scene_shots(client, ctx, args, rec: ScenarioRecorder) -> Dict[str, Any]:
+    scene_ids = ctx["scene_ids"]
+
+    async def _one(i: int) -> None:
+        started = time.perf_counter()
+        try:
+            resp = await client.post(f"/scenes/{scene_ids[i % len(scene_ids)]}/ai_generate_shots")
+            rec.record((time.perf_counter() - started) * 1000, _status_of(resp), None if resp.status_code < 400 else resp.text)
+        except Exception as e:
+            rec.record((time.perf_counter() - started) * 1000, type(e).__name__, str(e))
+
+    await _drive(min(args.requests, len(scene_ids)) if args.scene_requests is None else args.scene_requests, args.concurrency, _one)
+    rec.finished = time.perf_counter()
+    return rec.report()
+
+
+RUNNERS = {
+    "image_sync": run_image_sync,
+    "image_submit": run_image_submit,
+    "batch_media": run_batch_media,
+    "scene_shots": run_scene_shots,
+}
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """Relative change per scenario; positive throughput and negative p95 are improvements."""
+    out: Dict[str, Any] = {}
+    for name, result in (current.get("scenarios") or {}).items():
+        before = (baseline.get("scenarios") or {}).get(name)
+        if not before:
+            continue
+
+        def _delta(now: Optional[float], then: Optional[float]) -> Optional[float]:
+            if not now or not then:
+                return None
+            return round((now - then) / then, 4)
+
+        out[name] = {
+            "throughput_change": _delta(result.get("throughput_per_s"), before.get("throughput_per_s")),
+            "p95_change": _delta((result.get("latency_ms") or {}).get("p95"), (before.get("latency_ms") or {}).get("p95")),
+            "rss_peak_change": _delta((result.get("resources") or {}).get("rss_peak_mb"), (before.get("resources") or {}).get("rss_peak_mb")),
+        }
+    return out
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=str(BACKEND_DIR), stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+async def run_scenarios(args, ctx: Dict[str, Any], sampler: ResourceSampler) -> Dict[str, Any]:
+    import httpx
+
+    results: Dict[str, Any] = {}
+    base_url = f"http://{args.api_host}:{args.api_port}/api/v1"
+    limits = httpx.Limits(max_connections=args.concurrency * 2 + 4, max_keepalive_connections=args.concurrency * 2 + 4)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {ctx['token']}"}, limits=limits, timeout=timeout) as client:
+        for name in args.scenarios:
+            print(f"[bench] running {name}", file=sys.stderr)
+            window = sampler.window_start()
+            result = await RUNNERS[name](client, ctx, args, ScenarioRecorder(name))
+            result["resources"] = sampler.window(window)
+            results[name] = result
+            print(
+                f"[bench] {name}: {result['ok']}/{result['requests']} ok, "
+                f"{result['throughput_per_s']}/s, p95={result['latency_ms'].get('p95')}ms",
+                file=sys.stderr,
+            )
+        runtime = await client.get("/admin/runtime-stats", headers={"Authorization": f"Bearer {ctx['admin_token']}"})
+    return {"scenarios": results, "runtime_stats": runtime.json() if runtime.status_code == 200 else None}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the generation pipeline against a fake upstream")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--scenes", type=int, default=20)
+    parser.add_argument("--shots", type=int, default=200)
+    parser.add_argument("--entities", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=100, help="requests per image scenario")
+    parser.add_argument("--scene-requests", type=int, default=None, help="ai_generate_shots calls (default: one per scene, capped by --requests)")
+    parser.add_argument("--shots-per-reply", type=int, default=12, help="rows in the fake LLM shot table")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-mode", default="keyframes", choices=["keyframes", "videos"])
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--timeout", type=float, default=600, help="per-request / per-batch timeout in seconds")
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=18000)
+    parser.add_argument("--fake-host", default="127.0.0.2")
+    parser.add_argument("--fake-port", type=int, default=19100)
+    parser.add_argument("--callbacks", action="store_true", help="have the fake call back on Ark/Vidu task completion (polling becomes the safety net)")
+    parser.add_argument("--fake-profile", default="", help="fake upstream profile JSON (see loadtest.fake_upstream)")
+    parser.add_argument("--database-url", default="", help="defaults to a SQLite file in the work dir")
+    parser.add_argument("--workdir", default="", help="scratch directory for the DB and uploads (default: temp, removed afterwards)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default="", help="earlier report to compare against")
+    parser.add_argument("--output", default="", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in RUNNERS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    output_path = Path(args.output).resolve() if args.output else None
+    baseline_path = Path(args.baseline).resolve() if args.baseline else None
+    keep_workdir = bool(args.workdir)
+    workdir = Path(args.workdir).resolve() if args.workdir else Path(tempfile.mkdtemp(prefix="aistory-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    # Settings are read at import time: point the app at the scratch DB and upload dir first.
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / 'bench.db'}"
+    os.environ["TASK_CALLBACK_BASE_URL"] = f"http://{args.api_host}:{args.api_port}" if args.callbacks else ""
+    os.chdir(workdir)
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+
+    public_url = f"http://{args.fake_host}:{args.fake_port}"
+    fake = start_fake_upstream(args, workdir)
+    server = None
+    try:
+        wait_for_http(f"{public_url}/__fake/stats")
+        server, _ = start_api_server(args.api_host, args.api_port)
+        from app.db.session import engine
+
+        ctx = seed_database(args, public_url)
+        sampler = ResourceSampler(engine)
+        sampler.start()
+        started_at = time.time()
+        report = asyncio.run(run_scenarios(args, ctx, sampler))
+        sampler.stop()
+
+        import httpx
+
+        report["upstream"] = httpx.get(f"{public_url}/__fake/stats", timeout=10).json()
+        report["process"] = {"peak_rss_mb": round(_peak_rss_bytes() / (1024 * 1024), 1), "threads_at_exit": threading.active_count()}
+        report["meta"] = {
+            "started_at": started_at,
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "dataset": {"scenes": args.scenes, "shots": args.shots, "entities": args.entities},
+            "args": {k: v for k, v in vars(args).items() if k not in {"output", "baseline", "workdir"}},
+        }
+        if baseline_path:
+            with open(baseline_path, "r", encoding="utf-8") as fh:
+                report["comparison"] = compare_reports(report, json.load(fh))
+    finally:
+        if server is not None:
+            server.should_exit = True
+        fake.terminate()
+        try:
+            fake.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            fake.kill()
+        os.chdir(BACKEND_DIR)
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output_path:
+        output_path.write_text(text, encoding="utf-8")
+        print(f"[bench] report written to {output_path}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,639 @@
+"""Local stand-in for the generation upstreams, for offline load testing.
+
+Speaks enough of each provider protocol for ``MediaGenerationService`` and ``LLMService``
+to run their real code paths (submit, poll, batch poll, download) against it:
+
+    Doubao/Ark   /ark/api/v3/images/generations, /ark/api/v3/contents/generations/tasks[/{id}],
+                 /ark/api/v3/chat/completions, /ark/api/v3/responses
+    Grsai        /grsai/v1/draw/{completions|nano-banana}, /grsai/v1/video/{kind},
+                 /grsai/v1/draw/result, /grsai/v1/chat/completions
+    Wanxiang     /dashscope/api/v1/services/aigc/image2video/video-synthesis, /dashscope/api/v1/tasks/{id}
+    Vidu         /vidu/open/v1/creation[/{id}]
+    Tencent      /tencent (X-TC-Action: SubmitTextToImageJob | QueryTextToImageJob | ImageToImage)
+    OpenAI chat  /openai/v1/chat/completions (``stream: true`` answers with SSE)
+
+Latency, generation time, error/throttle/failure rates come from a profile (JSON) with
+per-provider overrides; see ``DEFAULT_PROFILE``. Durations are seconds and may be a
+number or ``{"dist": "lognormal", "median": m, "sigma": s}`` / ``{"dist": "uniform",
+"min": a, "max": b}``.
+
+Run from ``backend/``::
+
+    python -m loadtest.fake_upstream --port 9100 --public-url http://127.0.0.2:9100 --seed-settings
+
+``--seed-settings`` points the system API settings in ``DATABASE_URL`` at this server
+(``base_url`` and ``config.endpoint``); it rewrites rows, so only use it on a scratch DB.
+``_download_and_save`` skips URLs on ``localhost``/``127.0.0.1``, so advertise another
+address via ``--public-url`` (127.0.0.2 on Linux, or a LAN IP) to exercise downloads.
+
+Ark and Vidu submits that carry a ``callback_url`` are called back (POST of the task
+view) once the task finishes, unless the profile sets ``callbacks: false``;
+``callback_drop_rate`` loses a share of them to exercise the polling safety net.
+
+``GET /__fake/stats`` returns per-provider counters, ``POST /__fake/profile`` replaces the
+profile at runtime and ``POST /__fake/reset`` clears counters and tasks.
+"""
+import argparse
+import asyncio
+import copy
+import io
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+logger = logging.getLogger("fake_upstream")
+
+DEFAULT_PROFILE: Dict[str, Any] = {
+    # Per-request handling latency (submit, poll, sync calls before their own work).
+    "latency": {"dist": "lognormal", "median": 0.15, "sigma": 0.5},
+    # Time until an async task finishes, or the duration of a sync image call.
+    "image_seconds": {"dist": "lognormal", "median": 6, "sigma": 0.4},
+    "video_seconds": {"dist": "lognormal", "median": 25, "sigma": 0.4},
+    "error_rate": 0.0,          # submit answered with HTTP 500
+    "throttle_rate": 0.0,       # submit answered with the provider's throttle response
+    "task_failure_rate": 0.0,   # accepted tasks that end in a failed state
+    "callbacks": True,          # honour callback_url on Ark / Vidu task submits
+    "callback_drop_rate": 0.0,  # share of callbacks never sent
+    "image_size": [1024, 1024],
+    "video_bytes": 512 * 1024,
+    "chat": {
+        "latency": {"dist": "lognormal", "median": 1.5, "sigma": 0.5},
+        "tokens_per_second": 60,
+        "completion_tokens": 300,
+        # [{"match": "substring of the last user message", "content": "reply"}]; first match wins.
+        "replies": [],
+    },
+    "providers": {},
+}
+
+
+def _deep_merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    merged = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _deep_merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def sample_seconds(spec: Any, rng: random.Random) -> float:
+    if spec is None:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return max(0.0, float(spec))
+    dist = str(spec.get("dist") or "constant").lower()
+    if dist == "lognormal":
+        median = float(spec.get("median") or 0)
+        if median <= 0:
+            return 0.0
+        return rng.lognormvariate(math.log(median), float(spec.get("sigma") or 0))
+    if dist == "uniform":
+        return rng.uniform(float(spec.get("min") or 0), float(spec.get("max") or 0))
+    if dist == "exponential":
+        mean = float(spec.get("mean") or 0)
+        return rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+    return max(0.0, float(spec.get("value") or 0))
+
+
+class FakeUpstream:
+    """In-memory task table, counters and media for the stand-in server."""
+
+    def __init__(self, profile: Optional[Dict[str, Any]] = None, public_url: str = "", seed: Optional[int] = None):
+        self._lock = threading.Lock()
+        self.public_url = public_url.rstrip("/")
+        self.rng = random.Random(seed)
+        self.set_profile(profile or {})
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.stats: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._png_cache: Dict[str, bytes] = {}
+        self._callback_tasks = set()
+
+    def set_profile(self, profile: Dict[str, Any]) -> None:
+        self.profile = _deep_merge(DEFAULT_PROFILE, profile)
+
+    def provider_profile(self, provider: str) -> Dict[str, Any]:
+        return _deep_merge({k: v for k, v in self.profile.items() if k != "providers"}, self.profile["providers"].get(provider) or {})
+
+    def count(self, provider: str, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[provider][key] += n
+
+    def reset(self) -> None:
+        with self._lock:
+            self.tasks.clear()
+            self.stats.clear()
+
+    async def delay(self, provider: str, key: str = "latency") -> None:
+        seconds = sample_seconds(self.provider_profile(provider).get(key), self.rng)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def roll_submit(self, provider: str) -> Optional[str]:
+        """Returns "throttle" / "error" when this submit should fail, else None."""
+        prof = self.provider_profile(provider)
+        roll = self.rng.random()
+        if roll < float(prof.get("throttle_rate") or 0):
+            self.count(provider, "throttled")
+            return "throttle"
+        if roll < float(prof.get("throttle_rate") or 0) + float(prof.get("error_rate") or 0):
+            self.count(provider, "errors")
+            return "error"
+        return None
+
+    # --- Tasks ---
+
+    def create_task(self, provider: str, kind: str, payload: Any = None) -> Dict[str, Any]:
+        prof = self.provider_profile(provider)
+        now = time.time()
+        duration = sample_seconds(prof.get(f"{kind}_seconds"), self.rng)
+        task_id = f"{provider[:3]}-{uuid.uuid4().hex[:16]}"
+        task = {
+            "id": task_id,
+            "provider": provider,
+            "kind": kind,
+            "created_at": now,
+            "ready_at": now + duration,
+            "fail": self.rng.random() < float(prof.get("task_failure_rate") or 0),
+            "url": self.media_url(kind, task_id),
+        }
+        with self._lock:
+            self.tasks[task_id] = task
+            self.stats[provider]["tasks_created"] += 1
+        return task
+
+    def task_state(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Returns ``{"state": queued|running|succeeded|failed, "progress": 0-100, "task": ...}``."""
+        with self._lock:
+            task = self.tasks.get(task_id)
+        if task is None:
+            return None
+        now = time.time()
+        span = max(0.001, task["ready_at"] - task["created_at"])
+        progress = min(100, int(100 * (now - task["created_at"]) / span))
+        if now >= task["ready_at"]:
+            state = "failed" if task["fail"] else "succeeded"
+            if not task.get("finished"):
+                task["finished"] = True
+                self.count(task["provider"], "tasks_failed" if task["fail"] else "tasks_succeeded")
+            progress = 100
+        elif progress < 10:
+            state = "queued"
+        else:
+            state = "running"
+        return {"state": state, "progress": progress, "task": task}
+
+    def schedule_callback(self, task: Dict[str, Any], payload: Any, view: Callable[[str], Optional[Dict[str, Any]]]) -> None:
+        """POSTs ``view(task_id)`` to the submit's ``callback_url`` once the task is finished."""
+        url = payload.get("callback_url") if isinstance(payload, dict) else None
+        prof = self.provider_profile(task["provider"])
+        if not url or not prof.get("callbacks", True):
+            return
+        if self.rng.random() < float(prof.get("callback_drop_rate") or 0):
+            self.count(task["provider"], "callbacks_dropped")
+            return
+
+        async def _send():
+            import httpx
+
+            await asyncio.sleep(max(0.0, task["ready_at"] - time.time()))
+            try:
+                async with httpx.AsyncClient(timeout=10) as client:
+                    resp = await client.post(url, json=view(task["id"]))
+                self.count(task["provider"], "callbacks_sent" if resp.status_code < 400 else "callbacks_rejected")
+            except Exception as e:
+                self.count(task["provider"], "callbacks_failed")
+                logger.warning("callback to %s failed: %s", url, e)
+
+        pending = asyncio.get_running_loop().create_task(_send())
+        self._callback_tasks.add(pending)
+        pending.add_done_callback(self._callback_tasks.discard)
+
+    # --- Media ---
+
+    def media_url(self, kind: str, name: str) -> str:
+        ext = "mp4" if kind == "video" else "png"
+        return f"{self.public_url}/__fake/media/{name}.{ext}"
+
+    def png_bytes(self, name: str) -> bytes:
+        cached = self._png_cache.get(name)
+        if cached is not None:
+            return cached
+        from PIL import Image
+
+        w, h = self.profile.get("image_size") or [1024, 1024]
+        seed = int(uuid.uuid5(uuid.NAMESPACE_URL, name).int % (1 << 24))
+        img = Image.new("RGB", (int(w), int(h)), ((seed >> 16) & 255, (seed >> 8) & 255, seed & 255))
+        out = io.BytesIO()
+        img.save(out, format="PNG")
+        data = out.getvalue()
+        if len(self._png_cache) < 4096:
+            self._png_cache[name] = data
+        return data
+
+    def video_bytes(self, name: str) -> bytes:
+        size = max(64, int(self.profile.get("video_bytes") or 0))
+        header = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom"
+        body = (name.encode("utf-8") * (size // max(1, len(name)) + 1))[: size - len(header)]
+        return header + body
+
+    # --- Chat ---
+
+    def chat_reply(self, provider: str, messages: List[Dict[str, Any]]) -> str:
+        chat = self.provider_profile(provider).get("chat") or {}
+        last_user = ""
+        for message in reversed(messages or []):
+            if message.get("role") == "user":
+                content = message.get("content")
+                if isinstance(content, list):
+                    content = " ".join(str(part.get("text") or "") for part in content if isinstance(part, dict))
+                last_user = str(content or "")
+                break
+        for rule in chat.get("replies") or []:
+            if str(rule.get("match") or "") in last_user:
+                content = rule.get("content")
+                return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+        words = max(1, int(chat.get("completion_tokens") or 1))
+        return " ".join(f"token{i % 97}" for i in range(words))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = sum(1 for t in self.tasks.values() if not t.get("finished"))
+            return {
+                "providers": {name: dict(counters) for name, counters in self.stats.items()},
+                "tasks_total": len(self.tasks),
+                "tasks_pending": pending,
+            }
+
+
+def create_app(upstream: FakeUpstream) -> FastAPI:
+    app = FastAPI(title="fake-upstream")
+
+    def _throttle(provider: str) -> Response:
+        bodies = {
+            "grsai": {"code": 429, "msg": "RESOURCE_EXHAUSTED: too many requests"},
+            "doubao": {"error": {"code": "RateLimitExceeded.EndpointRPMExceeded", "message": "Too Many Requests"}},
+            "wanxiang": {"code": "Throttling.RateQuota", "message": "Requests rate limit exceeded"},
+            "vidu": {"err_code": "TooManyRequests", "message": "too many requests"},
+            "openai": {"error": {"type": "rate_limit_exceeded", "message": "Rate limit reached (429)"}},
+        }
+        return JSONResponse(bodies.get(provider, {"error": "throttled"}), status_code=429)
+
+    def _error(provider: str) -> Response:
+        return JSONResponse({"error": {"code": "InternalServiceError", "message": f"fake {provider} failure"}}, status_code=500)
+
+    async def _gate(provider: str, route: str) -> Optional[Response]:
+        upstream.count(provider, f"requests.{route}")
+        await upstream.delay(provider)
+        outcome = upstream.roll_submit(provider)
+        if outcome == "throttle":
+            return _throttle(provider)
+        if outcome == "error":
+            return _error(provider)
+        return None
+
+    # --- Doubao / Ark ---
+
+    @app.post("/ark/api/v3/images/generations")
+    async def ark_images(request: Request):
+        failed = await _gate("doubao", "images")
+        if failed:
+            return failed
+        await upstream.delay("doubao", "image_seconds")
+        name = f"ark-{uuid.uuid4().hex[:16]}"
+        upstream.count("doubao", "images_generated")
+        return {"created": int(time.time()), "data": [{"url": upstream.media_url("image", name), "size": "1024x1024"}]}
+
+    def _ark_task_view(task_id: str) -> Optional[Dict[str, Any]]:
+        state = upstream.task_state(task_id)
+        if state is None:
+            return None
+        item = {"id": task_id, "model": "fake-seedance", "status": state["state"], "created_at": int(state["task"]["created_at"])}
+        if state["state"] == "succeeded":
+            item["content"] = {"video_url": state["task"]["url"]}
+        elif state["state"] == "failed":
+            item["error"] = {"code": "InternalError", "message": "fake task failure"}
+        return item
+
+    @app.post("/ark/api/v3/contents/generations/tasks")
+    async def ark_submit_task(request: Request):
+        failed = await _gate("doubao", "video_submit")
+        if failed:
+            return failed
+        payload = await request.json()
+        task = upstream.create_task("doubao", "video", payload)
+        upstream.schedule_callback(task, payload, _ark_task_view)
+        return {"id": task["id"]}
+
+    @app.get("/ark/api/v3/contents/generations/tasks/{task_id}")
+    async def ark_get_task(task_id: str):
+        upstream.count("doubao", "requests.video_poll")
+        await upstream.delay("doubao")
+        item = _ark_task_view(task_id)
+        if item is None:
+            return JSONResponse({"error": {"code": "NotFound", "message": "task not found"}}, status_code=404)
+        return item
+
+    @app.get("/ark/api/v3/contents/generations/tasks")
+    async def ark_list_tasks(request: Request):
+        upstream.count("doubao", "requests.video_batch_poll")
+        await upstream.delay("doubao")
+        ids = request.query_params.getlist("filter.task_ids")
+        items = [item for item in (_ark_task_view(tid) for tid in ids) if item]
+        return {"items": items, "total": len(items)}
+
+    # --- Grsai ---
+
+    async def _grsai_submit(request: Request, kind: str):
+        failed = await _gate("grsai", f"{kind}_submit")
+        if failed:
+            return failed
+        task = upstream.create_task("grsai", kind, await request.json())
+        return {"code": 0, "msg": "success", "data": {"id": task["id"]}}
+
+    @app.post("/grsai/v1/draw/result")
+    async def grsai_result(request: Request):
+        upstream.count("grsai", "requests.poll")
+        await upstream.delay("grsai")
+        body = await request.json()
+        state = upstream.task_state(str(body.get("id") or ""))
+        if state is None:
+            return {"code": -22, "msg": "task not found", "data": None}
+        status = {"queued": "running", "running": "running"}.get(state["state"], state["state"])
+        data = {"id": state["task"]["id"], "status": status, "progress": state["progress"], "results": []}
+        if status == "succeeded":
+            data["results"] = [{"url": state["task"]["url"]}]
+        elif status == "failed":
+            data["failure_reason"] = "error"
+            data["error"] = "fake task failure"
+        return {"code": 0, "msg": "success", "data": data}
+
+    @app.post("/grsai/v1/draw/{variant}")
+    async def grsai_draw(variant: str, request: Request):
+        return await _grsai_submit(request, "image")
+
+    @app.post("/grsai/v1/video/{variant}")
+    async def grsai_video(variant: str, request: Request):
+        return await _grsai_submit(request, "video")
+
+    # --- Wanxiang (DashScope) ---
+
+    @app.post("/dashscope/api/v1/services/aigc/image2video/video-synthesis")
+    async def dashscope_submit(request: Request):
+        failed = await _gate("wanxiang", "video_submit")
+        if failed:
+            return failed
+        task = upstream.create_task("wanxiang", "video", await request.json())
+        return {"request_id": uuid.uuid4().hex, "output": {"task_id": task["id"], "task_status": "PENDING"}}
+
+    @app.get("/dashscope/api/v1/tasks/{task_id}")
+    async def dashscope_task(task_id: str):
+        upstream.count("wanxiang", "requests.video_poll")
+        await upstream.delay("wanxiang")
+        state = upstream.task_state(task_id)
+        if state is None:
+            return JSONResponse({"code": "NotFound", "message": "task not found"}, status_code=404)
+        status = {"queued": "PENDING", "running": "RUNNING", "succeeded": "SUCCEEDED", "failed": "FAILED"}[state["state"]]
+        output = {"task_id": task_id, "task_status": status}
+        if status == "SUCCEEDED":
+            output["video_url"] = state["task"]["url"]
+        elif status == "FAILED":
+            output["message"] = "fake task failure"
+        return {"request_id": uuid.uuid4().hex, "output": output}
+
+    # --- Vidu ---
+
+    @app.post("/vidu/open/v1/creation")
+    async def vidu_submit(request: Request):
+        failed = await _gate("vidu", "video_submit")
+        if failed:
+            return failed
+        payload = await request.json()
+        task = upstream.create_task("vidu", "video", payload)
+        upstream.schedule_callback(task, payload, _vidu_task_view)
+        return {"id": task["id"], "state": "created"}
+
+    def _vidu_task_view(task_id: str) -> Optional[Dict[str, Any]]:
+        state = upstream.task_state(task_id)
+        if state is None:
+            return None
+        status = {"queued": "queueing", "running": "processing", "succeeded": "success", "failed": "failed"}[state["state"]]
+        body = {"id": task_id, "state": status, "progress": state["progress"]}
+        if status == "success":
+            body["video_url"] = state["task"]["url"]
+        return body
+
+    @app.get("/vidu/open/v1/creation/{task_id}")
+    async def vidu_task(task_id: str):
+        upstream.count("vidu", "requests.video_poll")
+        await upstream.delay("vidu")
+        body = _vidu_task_view(task_id)
+        if body is None:
+            return JSONResponse({"err_code": "TaskNotFound"}, status_code=404)
+        return body
+
+    # --- Tencent (TC3 signed; signature not verified) ---
+
+    @app.post("/tencent")
+    async def tencent(request: Request):
+        action = request.headers.get("X-TC-Action") or ""
+        body = await request.json()
+        request_id = uuid.uuid4().hex
+        if action == "QueryTextToImageJob":
+            upstream.count("tencent", "requests.poll")
+            await upstream.delay("tencent")
+            state = upstream.task_state(str(body.get("JobId") or ""))
+            if state is None:
+                return {"Response": {"Error": {"Code": "ResourceNotFound", "Message": "job not found"}, "RequestId": request_id}}
+            status = {"queued": "WAIT", "running": "RUN", "succeeded": "SUCCESS", "failed": "FAIL"}[state["state"]]
+            resp = {"JobStatus": status, "RequestId": request_id}
+            if status == "SUCCESS":
+                resp["ResultImage"] = [state["task"]["url"]]
+            elif status == "FAIL":
+                resp["JobErrorMsg"] = "fake task failure"
+            return {"Response": resp}
+
+        upstream.count("tencent", f"requests.{action or 'unknown'}")
+        await upstream.delay("tencent")
+        outcome = upstream.roll_submit("tencent")
+        if outcome == "throttle":
+            return {"Response": {"Error": {"Code": "RequestLimitExceeded", "Message": "request limit exceeded"}, "RequestId": request_id}}
+        if outcome == "error":
+            return {"Response": {"Error": {"Code": "InternalError", "Message": "fake tencent failure"}, "RequestId": request_id}}
+        if action == "ImageToImage":
+            await upstream.delay("tencent", "image_seconds")
+            return {"Response": {"ResultImage": upstream.media_url("image", f"tc-{uuid.uuid4().hex[:16]}"), "RequestId": request_id}}
+        task = upstream.create_task("tencent", "image", body)
+        return {"Response": {"JobId": task["id"], "RequestId": request_id}}
+
+    # --- OpenAI-compatible chat ---
+
+    async def _chat(provider: str, request: Request):
+        failed = await _gate(provider, "chat")
+        if failed:
+            return failed
+        body = await request.json()
+        messages = body.get("messages") or body.get("input") or []
+        content = upstream.chat_reply(provider, messages)
+        chat = upstream.provider_profile(provider).get("chat") or {}
+        completion_tokens = max(1, len(content) // 4)
+        prompt_tokens = max(1, len(json.dumps(messages, ensure_ascii=False)) // 4)
+        model = body.get("model") or "fake-chat"
+        chat_id = f"chatcmpl-{uuid.uuid4().hex[:20]}"
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        tokens_per_second = float(chat.get("tokens_per_second") or 0)
+        first_token = sample_seconds(chat.get("latency"), upstream.rng)
+
+        if body.get("stream"):
+            async def _events():
+                await asyncio.sleep(first_token)
+                step = 16
+                for i in range(0, len(content), step):
+                    piece = content[i:i + step]
+                    chunk = {"id": chat_id, "object": "chat.completion.chunk", "model": model, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    if tokens_per_second > 0:
+                        await asyncio.sleep(max(1, len(piece) // 4) / tokens_per_second)
+                final = {"id": chat_id, "object": "chat.completion.chunk", "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+                yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+                upstream.count(provider, "chat_completed")
+
+            return StreamingResponse(_events(), media_type="text/event-stream")
+
+        generation = first_token + (completion_tokens / tokens_per_second if tokens_per_second > 0 else 0)
+        await asyncio.sleep(generation)
+        upstream.count(provider, "chat_completed")
+        return {
+            "id": chat_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    @app.post("/openai/v1/chat/completions")
+    async def openai_chat(request: Request):
+        return await _chat("openai", request)
+
+    @app.post("/ark/api/v3/chat/completions")
+    async def ark_chat(request: Request):
+        return await _chat("doubao", request)
+
+    @app.post("/ark/api/v3/responses")
+    async def ark_responses(request: Request):
+        return await _chat("doubao", request)
+
+    @app.post("/grsai/v1/chat/completions")
+    async def grsai_chat(request: Request):
+        return await _chat("grsai", request)
+
+    # --- Media + control ---
+
+    @app.get("/__fake/media/{filename}")
+    async def media(filename: str):
+        name, _, ext = filename.rpartition(".")
+        if ext == "mp4":
+            return Response(upstream.video_bytes(name), media_type="video/mp4")
+        data = await asyncio.to_thread(upstream.png_bytes, name)
+        return Response(data, media_type="image/png")
+
+    @app.get("/__fake/stats")
+    async def stats():
+        return upstream.snapshot()
+
+    @app.post("/__fake/profile")
+    async def set_profile(request: Request):
+        upstream.set_profile(await request.json())
+        return {"ok": True, "profile": upstream.profile}
+
+    @app.post("/__fake/reset")
+    async def reset():
+        upstream.reset()
+        return {"ok": True}
+
+    return app
+
+
+# Where each provider expects the server, relative to its public URL.
+PROVIDER_ROUTES = {
+    "doubao": {"base_url": "/ark/api/v3", "endpoint": "/ark/api/v3"},
+    "ark": {"base_url": "/ark/api/v3", "endpoint": "/ark/api/v3"},
+    "grsai": {"base_url": "/grsai", "endpoint": None},
+    "wanxiang": {"base_url": "/dashscope", "endpoint": "/dashscope/api/v1/services/aigc/image2video/video-synthesis"},
+    "vidu": {"base_url": "/vidu", "endpoint": None},
+    "tencent": {"base_url": "/tencent", "endpoint": "/tencent"},
+    "openai": {"base_url": "/openai/v1", "endpoint": None},
+}
+
+
+def seed_settings(public_url: str) -> int:
+    """Points every matching system API setting at this server. Returns the number of rows changed."""
+    from app.db.session import SessionLocal
+    from app.models.all_models import SystemAPISetting
+
+    public_url = public_url.rstrip("/")
+    changed = 0
+    with SessionLocal() as session:
+        for row in session.query(SystemAPISetting).all():
+            provider = str(row.provider or "").strip().lower()
+            routes = PROVIDER_ROUTES.get(provider)
+            if routes is None and str(row.category or "") in {"LLM", "Vision"}:
+                routes = PROVIDER_ROUTES["openai"]
+            if routes is None:
+                continue
+            config = dict(row.config or {})
+            if row.category in {"Image", "Video"} and provider == "doubao":
+                config["endpoint"] = f"{public_url}{routes['endpoint']}" + ("/contents/generations/tasks" if row.category == "Video" else "")
+            elif routes["endpoint"]:
+                config["endpoint"] = f"{public_url}{routes['endpoint']}"
+            else:
+                config.pop("endpoint", None)
+            config.pop("endpointMap", None)
+            row.base_url = f"{public_url}{routes['base_url']}"
+            row.config = config
+            if not (row.api_key or "").strip():
+                row.api_key = "fake-id:fake-secret" if provider == "tencent" else "fake-key"
+            changed += 1
+        session.commit()
+    return changed
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local fake generation upstream for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--public-url", default="", help="URL clients should use for results (default http://HOST:PORT)")
+    parser.add_argument("--profile", default="", help="JSON profile file merged over DEFAULT_PROFILE")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible runs")
+    parser.add_argument("--seed-settings", action="store_true", help="point system API settings in DATABASE_URL at this server")
+    args = parser.parse_args(argv)
+
+    profile: Dict[str, Any] = {}
+    if args.profile:
+        with open(args.profile, "r", encoding="utf-8") as fh:
+            profile = json.load(fh)
+    public_url = args.public_url or f"http://{args.host}:{args.port}"
+
+    if args.seed_settings:
+        print(f"Pointed {seed_settings(public_url)} system API settings at {public_url}")
+
+    import uvicorn
+
+    upstream = FakeUpstream(profile, public_url=public_url, seed=args.seed)
+    uvicorn.run(create_app(upstream), host=args.host, port=args.port, log_level=os.getenv("FAKE_UPSTREAM_LOG_LEVEL", "warning"))
+
+
+if __name__ == "__main__":
+    main()
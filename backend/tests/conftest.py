@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point the app at a throwaway SQLite database before anything imports app.core.config.
+_DB_DIR = tempfile.mkdtemp(prefix="aistory-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.session import SessionLocal, engine  # noqa: E402
+from app.models.all_models import Base  # noqa: E402
+
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def _empty_tables():
+    yield
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+class FakeClock:
+    """Stands in for a module's ``time``: real clocks shifted by ``advance``."""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def advance(self, seconds):
+        self.offset += seconds
+
+    def monotonic(self):
+        import time
+        return time.monotonic() + self.offset
+
+    def time(self):
+        import time
+        return time.time() + self.offset
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.db.session import SessionLocal
+from app.models.all_models import PricingRule, TransactionHistory, User
+from app.services.billing_service import billing_service
+
+
+@pytest.fixture
+def user(db):
+    user = User(username="payer", email="payer@example.com", hashed_password="x", credits=100)
+    db.add(user)
+    db.add(PricingRule(task_type="llm_chat", cost=10, unit_type="per_call", is_active=True))
+    db.commit()
+    return user
+
+
+def _credits(db, user_id):
+    db.expire_all()
+    return db.query(User.credits).filter(User.id == user_id).scalar()
+
+
+def test_debit_returns_the_new_balance(db, user):
+    assert billing_service._debit(db, user.id, 30) == 70
+    db.commit()
+    assert _credits(db, user.id) == 70
+
+
+def test_debit_refuses_to_overdraw(db, user):
+    assert billing_service._debit(db, user.id, 101) is None
+    db.commit()
+    assert _credits(db, user.id) == 100
+
+
+def test_debit_does_not_let_a_stale_loaded_user_flush_its_balance(db, user):
+    assert user.credits == 100
+    billing_service._debit(db, user.id, 40)
+    db.add(user)
+    db.commit()
+    assert _credits(db, user.id) == 60
+
+
+def test_deduct_without_enough_credits_raises_402(db, user):
+    db.query(User).filter(User.id == user.id).update({"credits": 5})
+    db.commit()
+
+    with pytest.raises(HTTPException) as excinfo:
+        billing_service.deduct_credits(db, user.id, "llm_chat")
+    assert excinfo.value.status_code == 402
+    assert _credits(db, user.id) == 5
+    assert db.query(TransactionHistory).count() == 0
+
+
+def test_concurrent_deductions_never_overdraw(db, user):
+    db.query(User).filter(User.id == user.id).update({"credits": 150})
+    db.commit()
+    outcomes = []
+    start = threading.Barrier(20)
+
+    def deduct():
+        with SessionLocal() as session:
+            start.wait()
+            try:
+                tx = billing_service.deduct_credits(session, user.id, "llm_chat")
+                outcomes.append(tx.balance_after)
+            except HTTPException as e:
+                outcomes.append(e.status_code)
+
+    threads = [threading.Thread(target=deduct) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    balances = sorted(o for o in outcomes if o != 402)
+    assert balances == list(range(0, 150, 10))
+    assert outcomes.count(402) == 5
+    assert _credits(db, user.id) == 0
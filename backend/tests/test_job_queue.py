@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+from app.core.config import settings
+from app.models.all_models import BackgroundJob
+from app.services.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_PER_USER_CONCURRENCY", 0)
+    monkeypatch.setattr(settings, "JOB_RETRY_BACKOFF_SECONDS", 10)
+    queue = JobQueue()
+    queue.register("work", lambda job: None)
+    return queue
+
+
+def _row(db, job_id):
+    db.expire_all()
+    return db.query(BackgroundJob).filter(BackgroundJob.id == job_id).first()
+
+
+def test_claim_takes_the_highest_priority_job_once(queue, db):
+    low = queue.enqueue("work", 1, {}, priority=0)
+    high = queue.enqueue("work", 1, {}, priority=5)
+    queue.enqueue("unregistered", 1, {}, priority=9)
+
+    job = queue.claim()
+    assert job["id"] == high
+    assert job["attempts"] == 1
+    assert job["owner"] == queue.owner
+    row = _row(db, high)
+    assert row.status == "running"
+    assert row.lease_expires_at > time.time()
+
+    assert queue.claim()["id"] == low
+    assert queue.claim() is None
+
+
+def test_claim_respects_the_per_user_cap(queue, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_PER_USER_CONCURRENCY", 1)
+    queue.enqueue("work", 1, {}, priority=5)
+    queue.enqueue("work", 1, {}, priority=5)
+    other = queue.enqueue("work", 2, {})
+
+    assert queue.claim()["user_id"] == 1
+    assert queue.claim()["id"] == other
+    assert queue.claim() is None
+
+
+def test_expired_lease_is_requeued_by_another_worker(queue, db):
+    job_id = queue.enqueue("work", 1, {}, max_attempts=2)
+    queue.claim()
+    db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update({"lease_expires_at": time.time() - 1})
+    db.commit()
+
+    survivor = JobQueue()
+    assert survivor.recover_expired() == 1
+    row = _row(db, job_id)
+    assert row.status == "queued"
+    assert row.owner is None
+    assert row.run_after > time.time()
+    assert "stopped responding" in row.error
+
+
+def test_expired_lease_out_of_attempts_fails_the_job(queue, db):
+    job_id = queue.enqueue("work", 1, {}, max_attempts=1)
+    queue.claim()
+    db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update({"lease_expires_at": time.time() - 1})
+    db.commit()
+
+    assert JobQueue().recover_expired() == 1
+    assert _row(db, job_id).status == "failed"
+
+
+def test_heartbeat_keeps_an_executing_job_from_being_recovered(queue, db):
+    job_id = queue.enqueue("work", 1, {})
+    job = queue.claim()
+    queue._active[job_id] = job
+    db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update({"lease_expires_at": time.time() - 1})
+    db.commit()
+
+    assert queue.heartbeat() == 1
+    assert JobQueue().recover_expired() == 0
+    assert _row(db, job_id).status == "running"
+
+
+def test_failing_handler_is_retried_with_backoff(queue, db):
+    seen = []
+
+    def handler(job):
+        seen.append(queue.will_retry())
+        raise RuntimeError("upstream down")
+
+    queue.register("flaky", handler)
+    job_id = queue.enqueue("flaky", 1, {}, max_attempts=2)
+
+    queue._execute(queue.claim())
+    row = _row(db, job_id)
+    assert row.status == "queued"
+    assert row.run_after > time.time() + 5
+    assert row.error == "upstream down"
+
+    db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update({"run_after": 0})
+    db.commit()
+    queue._execute(queue.claim())
+    assert _row(db, job_id).status == "failed"
+    assert seen == [True, False]
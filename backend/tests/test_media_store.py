@@ -0,0 +1,82 @@
+import io
+import os
+
+import pytest
+
+from app.core.config import settings
+from app.services import media_store as media_store_module
+from app.services.media_store import MediaStore
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path, clock):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "RENDER_EXTERNAL_URL", "")
+    monkeypatch.setattr(settings, "MEDIA_CAS_ORPHAN_GRACE_SECONDS", 3600.0)
+    monkeypatch.setattr(media_store_module, "time", clock)
+    store = MediaStore()
+    # Keep the background sweep from starting on the first ingest.
+    store._last_sweep = clock.monotonic()
+    return store
+
+
+def _ingest(store, data=b"frame-bytes", user_id=7):
+    return store.ingest_stream(io.BytesIO(data), ".png", user_id)
+
+
+def _blob(store, stored):
+    return store.blob_path(stored["digest"], ".png")
+
+
+def test_identical_content_is_stored_once(store):
+    first = _ingest(store, user_id=1)
+    second = _ingest(store, user_id=2)
+    assert first["path"] != second["path"]
+    assert os.path.samefile(first["path"], second["path"])
+    assert os.stat(_blob(store, first)).st_nlink == 3
+    assert store.snapshot_stats()["deduplicated"] == 1
+
+
+def test_deleting_the_last_alias_drops_the_blob(store, clock):
+    first = _ingest(store, user_id=1)
+    second = _ingest(store, user_id=2)
+    clock.advance(61)
+
+    assert store.delete_file(first["path"])
+    assert os.path.exists(_blob(store, first))
+    assert store.delete_file(second["path"])
+    assert not os.path.exists(_blob(store, first))
+
+
+def test_blob_reused_within_the_link_window_survives_its_alias_delete(store, clock):
+    stored = _ingest(store)
+    store.delete_file(stored["path"])
+    assert os.path.exists(_blob(store, stored))
+
+    # Left for the sweep, which also waits out the orphan grace period.
+    clock.advance(120)
+    assert store.sweep() == 0
+    assert os.path.exists(_blob(store, stored))
+    clock.advance(3600)
+    assert store.sweep() == 1
+    assert not os.path.exists(_blob(store, stored))
+
+
+def test_sweep_keeps_linked_and_pinned_blobs(store, clock):
+    linked = _ingest(store)
+    pinned = store.store_blob(b"served-by-digest-url", ".png")
+    clock.advance(7200)
+
+    assert store.sweep() == 0
+    assert os.path.exists(_blob(store, linked))
+    assert os.path.exists(store.blob_path(pinned["digest"], ".png"))
+
+
+def test_deleting_a_pinned_blob_unpins_and_drops_it(store, clock):
+    pinned = store.store_blob(b"served-by-digest-url", ".png")
+    blob = store.blob_path(pinned["digest"], ".png")
+    clock.advance(61)
+
+    assert store.delete_file(blob)
+    assert not os.path.exists(store.pin_path(pinned["digest"], ".png"))
+    assert not os.path.exists(blob)
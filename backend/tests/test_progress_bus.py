@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services.progress_bus import ProgressBus
+
+
+@pytest.fixture
+def bus(monkeypatch):
+    monkeypatch.setattr(settings, "PROGRESS_REFRESH_SECONDS", 0)
+    monkeypatch.setattr(settings, "PROGRESS_SUBSCRIBER_QUEUE", 16)
+    return ProgressBus()
+
+
+async def _settle():
+    # Deliveries hop onto the subscriber's loop with call_soon_threadsafe.
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def _drain(sub):
+    events = []
+    while not sub.queue.empty():
+        events.append(sub.queue.get_nowait())
+    return events
+
+
+def test_status_fans_out_to_every_subscriber_of_the_topic(bus):
+    async def scenario():
+        first = bus.subscribe(["episode:1"])
+        second = bus.subscribe(["episode:1", "project:9"])
+        elsewhere = bus.subscribe(["episode:2"])
+        bus.publish("episode:1", "shot_media_batch", {"running": True, "completed": 1, "total": 4})
+        await _settle()
+        return _drain(first), _drain(second), _drain(elsewhere)
+
+    first, second, elsewhere = asyncio.run(scenario())
+    assert [e["data"]["completed"] for e in first] == [1]
+    assert [e["data"]["completed"] for e in second] == [1]
+    assert elsewhere == []
+
+
+def test_unchanged_and_unwatched_snapshots_are_not_sent(bus):
+    async def scenario():
+        bus.publish("episode:1", "shot_media_batch", {"completed": 0})
+        sub = bus.subscribe(["episode:1"])
+        bus.publish("episode:1", "shot_media_batch", {"completed": 1, "updated_at": "a"})
+        bus.publish("episode:1", "shot_media_batch", {"completed": 1, "updated_at": "b"})
+        await _settle()
+        return _drain(sub)
+
+    events = asyncio.run(scenario())
+    assert [e["data"]["completed"] for e in events] == [1]
+    assert bus.snapshot_stats()["unchanged"] == 1
+
+
+def test_late_subscriber_gets_the_latest_snapshot(bus):
+    async def scenario():
+        watcher = bus.subscribe(["episode:1"])
+        bus.publish("episode:1", "ai_shots_batch", {"completed": 2})
+        bus.publish_item("episode:1", "ai_shots_batch", {"scene_id": 5})
+        late = bus.subscribe(["episode:1"])
+        await _settle()
+        _drain(watcher)
+        return _drain(late)
+
+    events = asyncio.run(scenario())
+    assert [(e["type"], e["data"]) for e in events] == [("status", {"completed": 2})]
+
+
+def test_full_queue_drops_the_oldest_events(bus):
+    async def scenario():
+        sub = bus.subscribe(["episode:1"])
+        for n in range(20):
+            bus.publish_item("episode:1", "shot_media_batch", {"n": n})
+        await _settle()
+        return sub, _drain(sub)
+
+    sub, events = asyncio.run(scenario())
+    assert sub.dropped == 4
+    assert [e["data"]["n"] for e in events] == list(range(4, 20))
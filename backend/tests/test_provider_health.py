@@ -0,0 +1,88 @@
+import pytest
+
+from app.core.config import settings
+from app.services import provider_health as provider_health_module
+from app.services.provider_health import CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, ProviderHealthTracker
+
+
+@pytest.fixture
+def tracker(monkeypatch, clock):
+    monkeypatch.setattr(provider_health_module, "time", clock)
+    monkeypatch.setattr(settings, "ROUTER_CIRCUIT_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(settings, "ROUTER_CIRCUIT_COOLDOWN_SECONDS", 30.0)
+    monkeypatch.setattr(settings, "ROUTER_CIRCUIT_MAX_COOLDOWN_SECONDS", 300.0)
+    monkeypatch.setattr(settings, "ROUTER_CIRCUIT_HALF_OPEN_PROBES", 2)
+    return ProviderHealthTracker()
+
+
+def _state(tracker):
+    return tracker.snapshot()["p/m"]
+
+
+def _trip(tracker):
+    for _ in range(2):
+        tracker.record("p", "m", ok=False, error="boom", ticket=tracker.begin("p", "m"))
+    assert _state(tracker)["state"] == CIRCUIT_OPEN
+
+
+def test_half_open_admits_only_the_probe_limit(tracker, clock):
+    _trip(tracker)
+    assert tracker.is_open("p", "m")
+    clock.advance(31)
+    assert not tracker.is_open("p", "m")
+
+    tickets = [tracker.begin("p", "m") for _ in range(3)]
+    assert [t["probe"] for t in tickets] == [True, True, False]
+    assert tracker.is_open("p", "m")
+
+    # A probe that ends without a verdict hands its slot back.
+    tracker.end(tickets[0])
+    tracker.end(tickets[0])
+    assert not tracker.is_open("p", "m")
+    assert _state(tracker)["probes_in_flight"] == 1
+
+
+def test_probe_success_closes_the_circuit(tracker, clock):
+    _trip(tracker)
+    clock.advance(31)
+    probe = tracker.begin("p", "m")
+    bystander = tracker.begin("p", "m")
+    other = tracker.begin("p", "m")
+    assert not other["probe"]
+
+    tracker.record("p", "m", ok=True, latency_ms=100, ticket=other)
+    assert _state(tracker)["state"] == CIRCUIT_HALF_OPEN
+
+    tracker.record("p", "m", ok=True, latency_ms=100, ticket=probe)
+    assert _state(tracker)["state"] == CIRCUIT_CLOSED
+    tracker.end(bystander)
+    assert _state(tracker)["probes_in_flight"] == 0
+
+
+def test_probe_failure_reopens_with_longer_cooldown(tracker, clock):
+    _trip(tracker)
+    clock.advance(31)
+    tracker.record("p", "m", ok=False, error="still down", ticket=tracker.begin("p", "m"))
+
+    state = _state(tracker)
+    assert state["state"] == CIRCUIT_OPEN
+    assert state["open_count"] == 2
+    assert 59 <= state["reopen_in_seconds"] <= 60
+    clock.advance(31)
+    assert tracker.is_open("p", "m")
+
+
+def test_results_from_before_the_circuit_opened_are_ignored(tracker, clock):
+    in_flight = tracker.begin("p", "m")
+    _trip(tracker)
+    clock.advance(31)
+
+    tracker.record("p", "m", ok=True, latency_ms=50, ticket=in_flight)
+    assert _state(tracker)["state"] == CIRCUIT_HALF_OPEN
+
+    probe = tracker.begin("p", "m")
+    assert probe["probe"]
+    late_failure = tracker.begin("p", "m")
+    tracker.record("p", "m", ok=True, ticket=probe)
+    tracker.record("p", "m", ok=False, error="late", ticket=late_failure)
+    assert _state(tracker)["state"] == CIRCUIT_CLOSED
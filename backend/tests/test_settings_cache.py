@@ -0,0 +1,84 @@
+import pytest
+
+from app.api.settings import update_setting
+from app.core.config import settings
+from app.models.all_models import User
+from app.schemas.settings import APISettingUpdate
+from app.services.settings_cache import SYSTEM_SCOPE, SettingsResolutionCache, settings_resolution_cache
+
+
+@pytest.fixture(autouse=True)
+def _ttl(monkeypatch):
+    monkeypatch.setattr(settings, "SETTINGS_CACHE_TTL_SECONDS", 60.0)
+
+
+def _load(cache, key, scope, value):
+    calls = []
+
+    def loader():
+        calls.append(key)
+        return value
+
+    return cache.get_or_load(key, scope, loader), calls
+
+
+def test_hits_return_copies():
+    cache = SettingsResolutionCache()
+    scope = cache.user_scope(1)
+    first, calls = _load(cache, "k", scope, {"model": "a"})
+    first["model"] = "mutated"
+    second, calls = _load(cache, "k", scope, {"model": "b"})
+    assert second == {"model": "a"}
+    assert calls == []
+
+
+def test_invalidate_user_drops_only_that_user():
+    cache = SettingsResolutionCache()
+    _load(cache, "u1", cache.user_scope(1), "one")
+    _load(cache, "u2", cache.user_scope(2), "two")
+
+    cache.invalidate_user(1)
+
+    assert _load(cache, "u1", cache.user_scope(1), "one-new")[0] == "one-new"
+    assert _load(cache, "u2", cache.user_scope(2), "two-new")[0] == "two"
+
+
+def test_invalidate_system_drops_everything():
+    cache = SettingsResolutionCache()
+    _load(cache, "u1", cache.user_scope(1), "one")
+    _load(cache, "sys", SYSTEM_SCOPE, "candidates")
+
+    cache.invalidate_system()
+
+    assert _load(cache, "u1", cache.user_scope(1), "one-new")[0] == "one-new"
+    assert _load(cache, "sys", SYSTEM_SCOPE, "candidates-new")[0] == "candidates-new"
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    cache = SettingsResolutionCache()
+    scope = cache.user_scope(1)
+
+    def loader():
+        # A write lands while the old configuration is being read.
+        cache.invalidate_user(1)
+        return "stale"
+
+    assert cache.get_or_load("k", scope, loader) == "stale"
+    assert _load(cache, "k", scope, "fresh")[0] == "fresh"
+
+
+def test_saving_a_setting_invalidates_the_users_resolutions(db):
+    user = User(username="writer", email="writer@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    key = ("active_llm_config", str(user.id), "LLM")
+    scope = settings_resolution_cache.user_scope(user.id)
+    _load(settings_resolution_cache, key, scope, {"model": "old"})
+
+    update_setting(
+        APISettingUpdate(provider="openai", category="LLM", model="gpt-4o", api_key="sk-test", is_active=True),
+        db=db,
+        current_user=user,
+    )
+
+    assert _load(settings_resolution_cache, key, scope, {"model": "gpt-4o"})[0] == {"model": "gpt-4o"}
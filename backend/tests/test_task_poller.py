@@ -0,0 +1,105 @@
+import asyncio
+
+from app.core.config import settings
+from app.services.task_poller import TaskPoller, _LoopScheduler, _PollEntry
+
+
+def _entry(loop, interval=1.0, min_interval=0.5, max_interval=30.0):
+    now = loop.time()
+    return _PollEntry(
+        provider="p", task_id="t", check=None, batch_key=None, batch_check=None,
+        future=loop.create_future(), started=now - 10.0, deadline=now + 600,
+        interval=interval, min_interval=min_interval, max_interval=max_interval,
+    )
+
+
+def test_backoff_grows_geometrically_up_to_max(monkeypatch):
+    monkeypatch.setattr(settings, "POLLER_BACKOFF_FACTOR", 2.0)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        scheduler = _LoopScheduler(TaskPoller(), loop)
+        entry = _entry(loop, interval=1.0, max_interval=5.0)
+        return [scheduler._next_delay(entry, {"status": "pending"}) for _ in range(4)]
+
+    assert asyncio.run(scenario()) == [2.0, 4.0, 5.0, 5.0]
+
+
+def test_backoff_follows_eta_and_progress_hints(monkeypatch):
+    monkeypatch.setattr(settings, "POLLER_BACKOFF_FACTOR", 2.0)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        scheduler = _LoopScheduler(TaskPoller(), loop)
+        eta = scheduler._next_delay(_entry(loop), {"status": "pending", "eta_seconds": 12})
+        # 10s elapsed at 25%: about 30s left, wake at half of that.
+        progress = scheduler._next_delay(_entry(loop), {"status": "pending", "progress": 25})
+        floor = scheduler._next_delay(_entry(loop), {"status": "pending", "eta_seconds": 0.2})
+        return eta, progress, floor
+
+    eta, progress, floor = asyncio.run(scenario())
+    assert eta == 6.0
+    assert 14.9 < progress < 15.1
+    assert floor == 0.5
+
+
+def test_tasks_sharing_a_batch_key_are_checked_together():
+    poller = TaskPoller()
+    batches = []
+
+    async def single_check(task_id):
+        raise AssertionError("batched tasks must not be checked one by one")
+
+    async def batch_check(task_ids):
+        batches.append(sorted(task_ids))
+        return {task_id: {"status": "done", "url": f"u-{task_id}"} for task_id in task_ids}
+
+    async def scenario():
+        return await asyncio.gather(*(
+            poller.wait("p", task_id, single_check, initial_delay=0, batch_key="k", batch_check=batch_check)
+            for task_id in ("a", "b", "c")
+        ))
+
+    results = asyncio.run(scenario())
+    assert batches == [["a", "b", "c"]]
+    assert [r["url"] for r in results] == ["u-a", "u-b", "u-c"]
+    stats = poller.snapshot_stats()
+    assert stats["batched_checks"] == 1
+    assert stats["batched_tasks"] == 3
+    assert stats["done"] == 3
+
+
+def test_failed_batch_check_falls_back_to_single_checks():
+    poller = TaskPoller()
+    singles = []
+
+    async def single_check(task_id):
+        singles.append(task_id)
+        return {"status": "done"}
+
+    async def batch_check(task_ids):
+        raise RuntimeError("batch endpoint down")
+
+    async def scenario():
+        return await asyncio.gather(*(
+            poller.wait("p", task_id, single_check, initial_delay=0, batch_key="k", batch_check=batch_check)
+            for task_id in ("a", "b")
+        ))
+
+    results = asyncio.run(scenario())
+    assert sorted(singles) == ["a", "b"]
+    assert all(r["status"] == "done" for r in results)
+
+
+def test_pending_task_is_polled_again_until_terminal(monkeypatch):
+    monkeypatch.setattr(settings, "POLLER_BACKOFF_FACTOR", 1.0)
+    poller = TaskPoller()
+    seen = []
+
+    async def check(task_id):
+        seen.append(task_id)
+        return {"status": "done" if len(seen) == 3 else "pending"}
+
+    result = asyncio.run(poller.wait("p", "t", check, initial_delay=0, min_interval=0.1, max_interval=0.1))
+    assert result == {"status": "done", "attempts": 3}
+    assert poller.snapshot_stats()["event_loops"] == 0
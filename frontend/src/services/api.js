@@ -418,6 +418,97 @@ export const generateEpisodeScenes = async (episodeId, payload) => {
     return response.data;
 }
 
+// Progress push: one EventSource on /progress/stream carries batch status for the episodes and
+// projects the Editor is watching. While it is live, the status getters below answer from it
+// instead of hitting the API on every 1.5s poll; whenever it is down they fall back to HTTP.
+const PROGRESS_MAX_TOPICS = 8;
+const PROGRESS_RETRY_MS = 30 * 1000;
+const progressStream = {
+    source: null,
+    live: false,
+    topics: [],
+    snapshots: new Map(),
+    openedAt: 0,
+};
+
+const buildProgressStreamUrl = (topics) => {
+    const params = new URLSearchParams({ topics: topics.join(',') });
+    const token = localStorage.getItem('token');
+    if (token) params.set('token', token);
+    return `${API_URL}/progress/stream?${params.toString()}`;
+};
+
+const openProgressStream = () => {
+    if (progressStream.source) progressStream.source.close();
+    progressStream.source = null;
+    progressStream.live = false;
+    progressStream.snapshots.clear();
+    progressStream.openedAt = Date.now();
+    if (typeof EventSource === 'undefined' || progressStream.topics.length === 0) return;
+
+    const source = new EventSource(buildProgressStreamUrl(progressStream.topics));
+    source.addEventListener('status', (event) => {
+        try {
+            const payload = JSON.parse(event.data);
+            progressStream.snapshots.set(`${payload.topic}/${payload.channel}`, payload.data);
+            progressStream.live = true;
+        } catch (e) {
+            // Malformed event: keep the last good snapshot.
+        }
+    });
+    source.onerror = () => {
+        // EventSource reconnects by itself and the server resends current state on connect;
+        // until then the getters go back to HTTP.
+        progressStream.live = false;
+        progressStream.snapshots.clear();
+    };
+    progressStream.source = source;
+};
+
+const watchProgressTopic = (topic) => {
+    const index = progressStream.topics.indexOf(topic);
+    if (index >= 0) progressStream.topics.splice(index, 1);
+    progressStream.topics.push(topic);
+    if (index < 0 && progressStream.topics.length > PROGRESS_MAX_TOPICS) progressStream.topics.shift();
+    // Reconnect for a new topic, or (not too often) once the browser gave up on the stream,
+    // e.g. after a 401.
+    const closed = !progressStream.source || progressStream.source.readyState === 2;
+    if (index < 0 || (closed && Date.now() - progressStream.openedAt > PROGRESS_RETRY_MS)) openProgressStream();
+};
+
+const readProgressStatus = (topic, channel) => {
+    watchProgressTopic(topic);
+    if (!progressStream.live) return null;
+    const snapshot = progressStream.snapshots.get(`${topic}/${channel}`);
+    return snapshot ? { ...snapshot } : null;
+};
+
+// Resolves with the first status payload of topic/channel that satisfies isDone
+// on a dedicated stream, or with null on timeout; rejects if the stream fails so callers can
+// fall back to polling.
+const waitForProgressStatus = (topic, channel, isDone, timeoutMs) => new Promise((resolve, reject) => {
+    if (typeof EventSource === 'undefined') {
+        reject(new Error('EventSource unavailable'));
+        return;
+    }
+    const source = new EventSource(buildProgressStreamUrl([topic]));
+    const finish = (fn, value) => {
+        clearTimeout(timer);
+        source.close();
+        fn(value);
+    };
+    const timer = setTimeout(() => finish(resolve, null), timeoutMs);
+    source.addEventListener('status', (event) => {
+        try {
+            const payload = JSON.parse(event.data);
+            if (payload.channel === channel && isDone(payload.data || {})) finish(resolve, payload.data);
+        } catch (e) {
+            // Ignore malformed events.
+        }
+    });
+    source.onerror = () => finish(reject, new Error('progress stream failed'));
+});
+
 // Project Script Generator (Episodes -> Script drafts)
 export const generateProjectEpisodeScripts = async (projectId, payload) => {
     const response = await api.post(
@@ -429,6 +520,8 @@ export const generateProjectEpisodeScripts = async (projectId, payload) => {
 }
 
 export const getProjectEpisodeScriptsStatus = async (projectId) => {
+    const pushed = readProgressStatus(`project:${projectId}`, 'episode_scripts');
+    if (pushed) return pushed;
     const response = await api.get(`/projects/${projectId}/script_generator/episodes/scripts/status`);
     return response.data;
 }
@@ -444,6 +537,8 @@ export const startSceneAiShotsBatch = async (episodeId, payload = {}) => {
 }
 
 export const getSceneAiShotsBatchStatus = async (episodeId) => {
+    const pushed = readProgressStatus(`episode:${episodeId}`, 'ai_shots_batch');
+    if (pushed) return pushed;
     const response = await api.get(`/episodes/${episodeId}/scenes/ai_shots/batch/status`);
     return response.data;
 }
@@ -459,6 +554,8 @@ export const startEpisodeScenesGeneration = async (episodeId, payload) => {
 }
 
 export const getEpisodeScenesGenerationStatus = async (episodeId) => {
+    const pushed = readProgressStatus(`episode:${episodeId}`, 'scene_generation');
+    if (pushed) return pushed;
     const response = await api.get(`/episodes/${episodeId}/script_generator/scenes/status`);
     return response.data;
 }
@@ -474,6 +571,8 @@ export const startShotMediaBatch = async (episodeId, payload) => {
 }
 
 export const getShotMediaBatchStatus = async (episodeId) => {
+    const pushed = readProgressStatus(`episode:${episodeId}`, 'shot_media_batch');
+    if (pushed) return pushed;
     const response = await api.get(`/episodes/${episodeId}/shots/batch-media/status`);
     return response.data;
 }
@@ -619,8 +718,27 @@ const downloadMediaToLocal = async (url, fallbackName) => {
     URL.revokeObjectURL(objectUrl);
 };
 
+const isImageJobFinished = (job) => ['succeeded', 'failed'].includes(String(job?.status || '').toLowerCase());
+
 const pollImageJobUntilDone = async (jobId, { timeoutMs = 10 * 60 * 1000, pollIntervalMs = 2000 } = {}) => {
     const start = Date.now();
+    let pushed;
+    try {
+        // One pushed result instead of a poll every couple of seconds.
+        pushed = await waitForProgressStatus(`image_job:${jobId}`, 'image_job', isImageJobFinished, timeoutMs);
+    } catch (e) {
+        pushed = undefined;
+    }
+    if (pushed === null) {
+        throw new Error('Image generation timed out while polling job status');
+    }
+    if (pushed) {
+        if (String(pushed.status).toLowerCase() === 'succeeded') {
+            return pushed.result || {};
+        }
+        throw new Error(pushed.error || 'Image generation job failed');
+    }
+
     while (Date.now() - start < timeoutMs) {
         const response = await api.get(`/generate/image/jobs/${jobId}`);
         const data = response?.data || {};